@@ -0,0 +1,358 @@
+"""Streaming of the mirrored songs and playlists into a tar or zip archive, for devices provisioned with a bundle.
+
+Songs are read with large buffers and written straight into the archive stream, nothing is staged on disk. The
+archive is written to a file, or to the standard output to be piped.
+"""
+
+import io
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from .copy_engine import CopyJob, CopyReport
+from .destination_profiles import PathIndex
+from .inventory import DirectoryInventory
+from .mirror_options import MirrorOptions
+from .mirror_playlists_utils import (
+    get_all_playlist_files,
+    get_copy_jobs,
+    get_destination_path_of_playlist_file,
+    get_new_content_of_playlist_file,
+    is_folder_existing,
+    parse_and_select_playlists,
+)
+from .playlist_formats import SongInfo
+from .playlist_writer import get_data_of_playlist
+from .run_report import RunReport
+from .song_resolver import create_song_resolver
+from .transcoding import transcode_copy_jobs
+
+TAR = "tar"
+ZIP = "zip"
+ARCHIVE_FORMATS = (TAR, ZIP)
+# archive path standing for the standard output
+STANDARD_OUTPUT = Path("-")
+ARCHIVE_BUFFER_SIZE = 1024 * 1024
+# oldest modification time a zip member can hold
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class BoundedReader(io.RawIOBase):
+    """Reader of exactly a given number of bytes of a file, whatever the file becomes while it is read.
+
+    The size of an archive member is written before its content, a file growing while archived is cut at that size,
+    a file shrinking is padded with zeros, so that the archive stays readable.
+    """
+
+    def __init__(self, file: BinaryIO, size: int):
+        """Read a file up to a size.
+
+        Args:
+            file (BinaryIO): file read from its current position
+            size (int): number of bytes read
+        """
+        super().__init__()
+        self.file = file
+        self.remaining_bytes = size
+        self.padded_bytes = 0
+
+    def readable(self) -> bool:
+        """Tell the reader can be read.
+
+        Returns:
+            bool: always True
+        """
+        return True
+
+    def readinto(self, buffer: bytearray) -> int:
+        """Read the next bytes into a buffer, padded with zeros once the file ended.
+
+        Args:
+            buffer (bytearray): buffer filled from its start
+        Returns:
+            int: number of bytes read, 0 once the given number of bytes was read
+        """
+        size = min(len(buffer), self.remaining_bytes)
+        data = self.file.read(size)
+        self.padded_bytes += size - len(data)
+        buffer[:size] = data + bytes(size - len(data))
+        self.remaining_bytes -= size
+        return size
+
+
+class ArchiveWriter:
+    """Writer of a tar or zip stream, adding members one after the other without seeking.
+
+    Members are copied through a buffer of ARCHIVE_BUFFER_SIZE bytes, whatever their size. Songs are stored without
+    compression, as they are already compressed.
+    """
+
+    def __init__(self, stream: BinaryIO, archive_format: str = TAR):
+        """Start the archive on a stream.
+
+        Args:
+            stream (BinaryIO): stream the archive is written to, it may not be seekable
+            archive_format (str): format of the archive, see ARCHIVE_FORMATS
+        Raises:
+            ValueError: if the archive format is unknown
+        """
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format {archive_format}")
+        self.tar_file: Optional[tarfile.TarFile] = None
+        self.zip_file: Optional[zipfile.ZipFile] = None
+        if archive_format == TAR:
+            self.tar_file = tarfile.open(  # pylint: disable=(consider-using-with)
+                fileobj=stream,
+                mode="w|",
+                bufsize=ARCHIVE_BUFFER_SIZE,
+                format=tarfile.PAX_FORMAT,
+                copybufsize=ARCHIVE_BUFFER_SIZE,
+            )
+        else:
+            self.zip_file = zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED)  # pylint: disable=(consider-using-with)
+
+    def __enter__(self) -> "ArchiveWriter":
+        """Enter the context.
+
+        Returns:
+            ArchiveWriter: this writer
+        """
+        return self
+
+    def __exit__(self, *_) -> None:
+        """End the archive when leaving the context."""
+        self.close()
+
+    def close(self) -> None:
+        """Write the end of the archive, the stream itself is left open."""
+        if self.tar_file is not None:
+            self.tar_file.close()
+        if self.zip_file is not None:
+            self.zip_file.close()
+
+    def add_member(self, name: str, file: BinaryIO, size: int, mtime: float) -> int:
+        """Copy a member into the archive, exactly of the given size.
+
+        Args:
+            name (str): POSIX path of the member in the archive
+            file (BinaryIO): content of the member, read from its current position
+            size (int): number of bytes of the member
+            mtime (float): modification time of the member
+        Returns:
+            int: number of bytes read from the file, fewer than the size if the file ended first and the member was
+                padded with zeros
+        """
+        reader = BoundedReader(file, size)
+        if self.tar_file is not None:
+            member = tarfile.TarInfo(name)
+            member.size = size
+            member.mtime = int(mtime)
+            member.mode = 0o644
+            self.tar_file.addfile(member, reader)
+            # a tar stream keeps every member it wrote, it only needs them to be read again
+            self.tar_file.members.clear()
+        if self.zip_file is not None:
+            member = zipfile.ZipInfo(name, max(time.localtime(mtime)[:6], ZIP_EPOCH))
+            member.file_size = size
+            member.external_attr = 0o644 << 16
+            with self.zip_file.open(member, "w") as member_file:
+                shutil.copyfileobj(reader, member_file, ARCHIVE_BUFFER_SIZE)
+        return size - reader.padded_bytes
+
+    def add_file(self, file: BinaryIO, name: str) -> Tuple[int, int]:
+        """Copy an opened file into the archive, with the size and modification time it has when added.
+
+        Args:
+            file (BinaryIO): file opened in binary mode
+            name (str): POSIX path of the member in the archive
+        Returns:
+            Tuple[int, int]: number of bytes of the member, and number of bytes read from the file, fewer if the file
+                shrank while archived
+        """
+        file_stat = os.fstat(file.fileno())
+        return file_stat.st_size, self.add_member(name, file, file_stat.st_size, file_stat.st_mtime)
+
+    def add_data(self, data: bytes, name: str) -> None:
+        """Add a member of a content in memory, as a playlist, modified now.
+
+        Args:
+            data (bytes): content of the member
+            name (str): POSIX path of the member in the archive
+        """
+        self.add_member(name, io.BytesIO(data), len(data), time.time())
+
+
+@contextmanager
+def open_archive_stream(archive_file_path: Path) -> Iterator[BinaryIO]:
+    """Open the stream an archive is written to.
+
+    An archive file is written under a temporary name and renamed once complete.
+    Args:
+        archive_file_path (Path): path of the archive file, STANDARD_OUTPUT for the standard output
+    Yields:
+        BinaryIO: stream to write the archive to
+    """
+    if archive_file_path == STANDARD_OUTPUT:
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+        return
+    partial_file_path = archive_file_path.with_name(f"{archive_file_path.name}.partial")
+    try:
+        with open(partial_file_path, "wb") as archive_file:
+            yield archive_file
+        os.replace(partial_file_path, archive_file_path)
+    except BaseException:
+        partial_file_path.unlink(missing_ok=True)
+        raise
+
+
+def add_songs_to_archive(archive: ArchiveWriter, copy_jobs: List[CopyJob], options: MirrorOptions) -> CopyReport:
+    """Add the songs to the archive one after the other, transcoding lossless songs first when enabled.
+
+    Songs that cannot be opened or shrink while archived are reported as failures, the archive goes on with the next
+    song. A song that shrank is left in the archive padded with zeros.
+    Args:
+        archive (ArchiveWriter): archive the songs are added to
+        copy_jobs (List[CopyJob]): source song path and path of the song in the archive
+        options (MirrorOptions): options of the mirror
+    Returns:
+        CopyReport: songs and bytes added to the archive, and songs that could not be added
+    """
+    runnable_copy_jobs, failures = transcode_copy_jobs(copy_jobs, options.transcode)
+    report = CopyReport(failures=failures)
+    start_time = time.monotonic()
+    for source_song_path, destination_song_path in runnable_copy_jobs:
+        song_start_time = time.monotonic()
+        try:
+            song_file = open(source_song_path, "rb")  # pylint: disable=(consider-using-with)
+        except OSError as error:
+            logging.error("Failed to archive %s: %s", str(source_song_path), error)
+            report.failures[destination_song_path] = str(error)
+            continue
+        with song_file:
+            copied_bytes, read_bytes = archive.add_file(song_file, destination_song_path.as_posix())
+        if read_bytes < copied_bytes:
+            logging.error("Failed to archive %s: it shrank while archived", str(source_song_path))
+            report.failures[destination_song_path] = f"Shrank by {copied_bytes - read_bytes} bytes while archived"
+            continue
+        logging.debug("Archived: %s", str(source_song_path))
+        report.add_copy_result(destination_song_path, copied_bytes, time.monotonic() - song_start_time)
+    report.elapsed_seconds = time.monotonic() - start_time
+    return report
+
+
+def add_playlists_to_archive(
+    archive: ArchiveWriter,
+    playlists: Dict[Path, List[Path]],
+    music_root_folder_path: Path,
+    options: MirrorOptions,
+    song_info: Dict[Path, SongInfo],
+    path_index: PathIndex,
+) -> None:
+    """Add the mirrored version of every playlist to the archive.
+
+    Args:
+        archive (ArchiveWriter): archive the playlists are added to
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        options (MirrorOptions): options of the mirror
+        song_info (Dict[Path, SongInfo]): metadata of each song, written as #EXTINF lines
+        path_index (PathIndex): playlists and songs are archived with the paths mapped by the index
+    """
+    for playlist_file, list_of_song_path in playlists.items():
+        new_content = get_new_content_of_playlist_file(
+            playlist_file, list_of_song_path, options.transcode, song_info, path_index
+        )
+        archived_playlist_path = get_destination_path_of_playlist_file(
+            music_root_folder_path, playlist_file, Path(), path_index
+        )
+        archive.add_data(get_data_of_playlist(new_content), archived_playlist_path.as_posix())
+
+
+def parse_playlists_to_archive(
+    report: RunReport,
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    song_info: Dict[Path, SongInfo],
+    options: MirrorOptions,
+) -> Dict[Path, List[Path]]:
+    """Discover and parse the playlists, then select the songs fitting in the capacity.
+
+    Missing songs are resolved when enabled. Every playlist is parsed, the sync state of destination folders is
+    neither read nor written.
+    Args:
+        report (RunReport): report of the run, completed with the discovery and parse phases
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        song_info (Dict[Path, SongInfo]): metadata of each song, completed from the parsed playlists
+        options (MirrorOptions): options of the mirror
+    Returns:
+        Dict[Path, List[Path]]: resolved list of song path for each playlist file
+    """
+    inventory = DirectoryInventory()
+    resolver = create_song_resolver(music_root_folder_path, options)
+    with report.measure_phase("discovery") as phase:
+        playlist_files = get_all_playlist_files(playlist_root_folder_path, inventory)
+        phase.items = len(playlist_files)
+    with report.measure_phase("parse") as phase:
+        playlists, _ = parse_and_select_playlists(report, playlist_files, inventory, None, song_info, resolver, options)
+        phase.items = len(playlists)
+    return playlists
+
+
+def mirror_all_playlist_to_archive(
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    archive_file_path: Path,
+    options: Optional[MirrorOptions] = None,
+    archive_format: str = TAR,
+) -> RunReport:
+    """Mirror all playlists and their songs into an archive, laid out as a mirrored destination folder.
+
+    Every song is archived, options about the content of a destination folder (sync state, comparison, pruning, link
+    mode, engine) do not apply.
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        archive_file_path (Path): path of the archive file, STANDARD_OUTPUT for the standard output
+        options (Optional[MirrorOptions]): options of the mirror, default options if None
+        archive_format (str): format of the archive, see ARCHIVE_FORMATS
+    Returns:
+        RunReport: wall time of each phase, and report of the songs added to the archive
+    Raises:
+        FileNotFoundError: if the music folder or the playlist root does not exist.
+    """
+    if options is None:
+        options = MirrorOptions()
+    for folder_path in (music_root_folder_path, playlist_root_folder_path):
+        if not is_folder_existing(folder_path):
+            raise FileNotFoundError(f"Folder not existing {folder_path}")
+    report = RunReport()
+    song_info: Dict[Path, SongInfo] = {}
+    # the mapping of the paths is not kept, every song is archived with its mapped path again
+    path_index = PathIndex(
+        music_root_folder_path,
+        options.destination_profile,
+        transcoded_suffixes=options.get_transcoded_suffixes(),
+    )
+    playlists = parse_playlists_to_archive(
+        report, music_root_folder_path, playlist_root_folder_path, song_info, options
+    )
+    copy_jobs = get_copy_jobs(playlists, music_root_folder_path, Path(), options.transcode, path_index)
+    with open_archive_stream(archive_file_path) as stream, ArchiveWriter(stream, archive_format) as archive:
+        with report.measure_phase("copy") as phase:
+            report.copy_report = add_songs_to_archive(archive, copy_jobs, options)
+            phase.items = report.copy_report.copied_files
+        report.copy_report.log_summary()
+        with report.measure_phase("write") as phase:
+            add_playlists_to_archive(archive, playlists, music_root_folder_path, options, song_info, path_index)
+            phase.items = len(playlists)
+    report.log_summary()
+    return report
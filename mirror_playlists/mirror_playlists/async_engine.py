@@ -0,0 +1,288 @@
+"""Asyncio engine overlapping the blocking operations of a mirror run, for destinations with a high latency.
+
+Each blocking operation (comparison, folder creation, copy, write) is offloaded to a thread pool, so that a slow
+operation on a network share only holds its own slot instead of a whole copy job.
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .change_detection import DigestCache, is_destination_up_to_date
+from .copy_engine import (
+    PROGRESS_INTERVAL_SECONDS,
+    CopyJob,
+    CopyJournal,
+    CopyReport,
+    copy_file_atomically,
+    get_uncommitted_copy_jobs,
+)
+from .inventory import DirectoryInventory
+from .mirror_options import MirrorOptions
+from .scheduling import BandwidthLimiter, create_bandwidth_limiter, order_copy_jobs
+
+STAT = "stat"
+MKDIR = "mkdir"
+COPY = "copy"
+WRITE = "write"
+
+
+class BlockingRunner:
+    """Run blocking calls in a thread pool, with a limit of calls in flight for each operation type."""
+
+    def __init__(self, executor: ThreadPoolExecutor, limits: Dict[str, int]):
+        """Create the semaphores of the operation types.
+
+        Args:
+            executor (ThreadPoolExecutor): thread pool running the calls, large enough for every limit
+            limits (Dict[str, int]): maximum number of calls in flight of each operation type
+        """
+        self.executor = executor
+        self.semaphores = {operation: asyncio.Semaphore(limit) for operation, limit in limits.items()}
+
+    async def run(self, operation: str, function: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking call once a slot of its operation type is free.
+
+        Args:
+            operation (str): type of the operation
+            function (Callable[..., Any]): blocking function
+            *args (Any): arguments of the function
+        Returns:
+            Any: result of the function
+        """
+        async with self.semaphores[operation]:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def run_timed(self, operation: str, function: Callable[..., Any], *args: Any) -> Tuple[Any, float]:
+        """Run a blocking call once a slot of its operation type is free, and measure its duration.
+
+        Args:
+            operation (str): type of the operation
+            function (Callable[..., Any]): blocking function
+            *args (Any): arguments of the function
+        Returns:
+            Tuple[Any, float]: result of the function and seconds it took, not waiting for the slot
+        """
+
+        def timed_function() -> Tuple[Any, float]:
+            """Run the function in the thread pool and measure its duration."""
+            start_time = time.perf_counter()
+            result = function(*args)
+            return result, time.perf_counter() - start_time
+
+        return await self.run(operation, timed_function)
+
+
+def copy_song_file(
+    source_song_path: Path, destination_song_path: Path, link_mode: str, limiter: Optional[BandwidthLimiter] = None
+) -> int:
+    """Copy a song atomically and get its size on destination.
+
+    Args:
+        source_song_path (Path): Path to the source song file.
+        destination_song_path (Path): Path to the destination song file.
+        link_mode (str): how the file is transferred, see LINK_MODES
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes copied per second, no limit if None
+    Returns:
+        int: number of copied bytes
+    """
+    copy_file_atomically(source_song_path, destination_song_path, link_mode, limiter)
+    logging.debug("New file %s copied on mirror side", str(destination_song_path))
+    return destination_song_path.stat().st_size
+
+
+async def prepare_folder(
+    runner: BlockingRunner,
+    folder: Path,
+    inventory: Optional[DirectoryInventory],
+    device_semaphores: Dict[int, asyncio.Semaphore],
+    jobs_per_destination: Optional[int],
+) -> Optional[asyncio.Semaphore]:
+    """Create a destination folder if needed, and get the semaphore of its device.
+
+    Args:
+        runner (BlockingRunner): runner of the blocking calls
+        folder (Path): destination folder
+        inventory (Optional[DirectoryInventory]): inventory of the destination, folders it knows are not created
+        device_semaphores (Dict[int, asyncio.Semaphore]): semaphore of each device, completed with the device
+        jobs_per_destination (Optional[int]): maximum number of concurrent copies to a single device
+    Returns:
+        Optional[asyncio.Semaphore]: semaphore of the device of the folder, None if there is no per device limit
+    """
+    if inventory is None or not inventory.has_folder(folder):
+        await runner.run(MKDIR, functools.partial(folder.mkdir, parents=True, exist_ok=True))
+    if jobs_per_destination is None:
+        return None
+    device = (await runner.run(STAT, os.stat, folder)).st_dev
+    return device_semaphores.setdefault(device, asyncio.Semaphore(jobs_per_destination))
+
+
+async def mirror_song(
+    runner: BlockingRunner,
+    copy_job: CopyJob,
+    folder_task: "asyncio.Task[Optional[asyncio.Semaphore]]",
+    options: MirrorOptions,
+    digest_cache: DigestCache,
+    journal: Optional[CopyJournal],
+    inventory: Optional[DirectoryInventory],
+    limiter: Optional[BandwidthLimiter] = None,
+) -> Tuple[Optional[int], float]:
+    """Copy a song if it changed, once its destination folder exists.
+
+    Args:
+        runner (BlockingRunner): runner of the blocking calls
+        copy_job (CopyJob): source and destination song path
+        folder_task (asyncio.Task[Optional[asyncio.Semaphore]]): creation of the destination folder, shared by the
+            songs of the folder, giving the semaphore of its device
+        options (MirrorOptions): comparison strategy and link mode
+        digest_cache (DigestCache): cache of digests, only used by the hash comparison
+        journal (Optional[CopyJournal]): journal the song is committed to once up to date on destination
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes copied per second, no limit if None
+    Returns:
+        Tuple[Optional[int], float]: number of copied bytes, None if the file is already up to date on mirror side,
+            and seconds spent comparing and copying, not waiting for a free slot
+    """
+    device_semaphore = await folder_task
+    is_up_to_date, seconds = await runner.run_timed(
+        STAT, is_destination_up_to_date, *copy_job, options.sync.comparison, digest_cache, inventory
+    )
+    copied_bytes = None
+    if is_up_to_date:
+        logging.debug("File %s already exist on mirror side", str(copy_job[1]))
+    else:
+        async with device_semaphore or contextlib.nullcontext():
+            copied_bytes, copy_seconds = await runner.run_timed(
+                COPY, copy_song_file, *copy_job, options.scheduling.link_mode, limiter
+            )
+        seconds += copy_seconds
+    if journal is not None:
+        await runner.run(WRITE, journal.commit, copy_job[1])
+    return copied_bytes, seconds
+
+
+async def collect_copy_tasks(
+    tasks: "List[Tuple[Path, asyncio.Task[Tuple[Optional[int], float]]]]", report: CopyReport
+) -> None:
+    """Wait for every copy and account its result, logging the progress at most every PROGRESS_INTERVAL_SECONDS.
+
+    Args:
+        tasks (List[Tuple[Path, asyncio.Task[Tuple[Optional[int], float]]]]): destination song path and pending
+            result of each copy
+        report (CopyReport): report of the copy phase
+    """
+    last_progress_time = time.monotonic()
+    for done_jobs, (destination_song_path, task) in enumerate(tasks, start=1):
+        try:
+            report.add_copy_result(destination_song_path, *await task)
+        except OSError as error:
+            report.failures[destination_song_path] = str(error)
+        if time.monotonic() - last_progress_time >= PROGRESS_INTERVAL_SECONDS:
+            last_progress_time = time.monotonic()
+            logging.info("Examined %d of %d songs, copied %d bytes", done_jobs, len(tasks), report.copied_bytes)
+
+
+async def mirror_songs(
+    copy_jobs: List[CopyJob],
+    options: MirrorOptions,
+    digest_cache: DigestCache,
+    journal: Optional[CopyJournal],
+    inventory: Optional[DirectoryInventory],
+) -> CopyReport:
+    """Copy all songs that are not up to date, overlapping folder creations, comparisons and copies.
+
+    Songs are dispatched in the copy order of the options, and copied within their bandwidth limit.
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        options (MirrorOptions): number of songs copied at the same time, per device limit, comparison strategy and
+            limits of the other operations in flight
+        digest_cache (DigestCache): cache of digests, only used by the hash comparison
+        journal (Optional[CopyJournal]): journal of committed songs, to resume an interrupted copy phase
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files, and
+            telling which destination folders already exist
+    Returns:
+        CopyReport: aggregated result of the copy
+    """
+    start_time = time.monotonic()
+    report, copy_jobs = get_uncommitted_copy_jobs(copy_jobs, options, journal)
+    copy_jobs = order_copy_jobs(copy_jobs, options.scheduling.copy_order, inventory)
+    limiter = create_bandwidth_limiter(options.scheduling.bandwidth_limit)
+    limits = {
+        STAT: options.scheduling.in_flight.stats,
+        MKDIR: options.scheduling.in_flight.mkdirs,
+        COPY: options.scheduling.jobs,
+        WRITE: options.scheduling.in_flight.writes,
+    }
+    with ThreadPoolExecutor(max_workers=sum(limits.values())) as executor:
+        runner = BlockingRunner(executor, limits)
+        device_semaphores: Dict[int, asyncio.Semaphore] = {}
+        folder_tasks = {
+            folder: asyncio.create_task(
+                prepare_folder(runner, folder, inventory, device_semaphores, options.scheduling.jobs_per_destination)
+            )
+            for folder in sorted({destination.parent for _, destination in copy_jobs})
+        }
+        tasks = [
+            (
+                job[1],
+                asyncio.create_task(
+                    mirror_song(
+                        runner, job, folder_tasks[job[1].parent], options, digest_cache, journal, inventory, limiter
+                    )
+                ),
+            )
+            for job in copy_jobs
+        ]
+        await collect_copy_tasks(tasks, report)
+    report.elapsed_seconds = time.monotonic() - start_time
+    return report
+
+
+def copy_all_songs_async(
+    copy_jobs: List[CopyJob],
+    options: MirrorOptions,
+    digest_cache: Optional[DigestCache] = None,
+    journal: Optional[CopyJournal] = None,
+    inventory: Optional[DirectoryInventory] = None,
+) -> CopyReport:
+    """Copy all songs that are not up to date with the asyncio engine, with the same result as copy_all_songs.
+
+    A failure on one file does not abort the others, it is collected in the returned report.
+    Songs committed in the journal by an interrupted copy phase are skipped without being examined.
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        options (MirrorOptions): number of songs copied at the same time, per device limit, comparison strategy and
+            limits of the other operations in flight
+        digest_cache (Optional[DigestCache]): cache of digests, only used by the hash comparison
+        journal (Optional[CopyJournal]): journal of committed songs, to resume an interrupted copy phase
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files, and
+            telling which destination folders already exist
+    Returns:
+        CopyReport: aggregated result of the copy
+    """
+    return asyncio.run(mirror_songs(copy_jobs, options, digest_cache or DigestCache(), journal, inventory))
+
+
+def run_concurrently(calls: List[Tuple[Callable[..., Any], Tuple[Any, ...]]], limit: int) -> List[Any]:
+    """Run blocking calls from an event loop, with at most limit calls in flight.
+
+    Args:
+        calls (List[Tuple[Callable[..., Any], Tuple[Any, ...]]]): function and arguments of each call
+        limit (int): maximum number of calls in flight
+    Returns:
+        List[Any]: result of each call, in the same order
+    """
+
+    async def run_all() -> List[Any]:
+        """Run every call and gather their results."""
+        with ThreadPoolExecutor(max_workers=limit) as executor:
+            runner = BlockingRunner(executor, {WRITE: limit})
+            return await asyncio.gather(*(runner.run(WRITE, function, *args) for function, args in calls))
+
+    return asyncio.run(run_all())
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""Benchmark of the mirror phases on a synthetic music library."""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from .copy_engine import copy_all_songs
+from .inventory import DirectoryInventory
+from .main import positive_int
+from .mirror_options import CopyScheduling, MirrorOptions
+from .mirror_playlists_utils import (
+    get_all_playlist_files,
+    get_copy_jobs,
+    get_new_content_of_playlist_file,
+    parse_all_playlists,
+    parse_playlist,
+    write_all_playlists,
+)
+from .scheduling import COPY_ORDERS, LOCALITY
+
+
+@dataclass
+class LibraryShape:
+    """Shape of the songs of a synthetic music library.
+
+    Attributes:
+        artists (int): number of artists
+        albums_per_artist (int): number of albums of each artist
+        tracks_per_album (int): number of tracks of each album
+        depth (int): number of nested folders above the artist folders and below the playlist root
+        track_size (int): size in bytes of each song file
+    """
+
+    artists: int = 20
+    albums_per_artist: int = 3
+    tracks_per_album: int = 10
+    depth: int = 2
+    track_size: int = 64 * 1024
+
+
+@dataclass
+class PlaylistShape:
+    """Shape of the playlists of a synthetic music library.
+
+    Attributes:
+        playlists (int): number of playlists
+        tracks_per_playlist (int): number of entries of each playlist
+        overlap (float): fraction of the entries of each playlist drawn from a pool of songs shared by all playlists
+        missing (float): fraction of the entries of each playlist referencing a song that does not exist
+        seed (int): seed of the random choice of the playlist entries
+    """
+
+    playlists: int = 20
+    tracks_per_playlist: int = 50
+    overlap: float = 0.5
+    missing: float = 0.05
+    seed: int = 0
+
+
+def generate_songs(music_root_folder_path: Path, nested_folders: Path, shape: LibraryShape) -> List[Path]:
+    """Generate the song files of a synthetic music library.
+
+    Args:
+        music_root_folder_path (Path): root folder of the music library
+        nested_folders (Path): folders above the artist folders
+        shape (LibraryShape): shape of the library
+    Returns:
+        List[Path]: path of the song files
+    """
+    song_paths = []
+    content = bytes(shape.track_size)
+    for artist in range(shape.artists):
+        for album in range(shape.albums_per_artist):
+            album_folder = music_root_folder_path / nested_folders / f"Artist {artist:04d}" / f"Album {album:02d}"
+            album_folder.mkdir(parents=True)
+            for track in range(shape.tracks_per_album):
+                song_paths.append(album_folder / f"{track:02d} Track.mp3")
+                song_paths[-1].write_bytes(content)
+    return song_paths
+
+
+def generate_library(root_folder_path: Path, shape: LibraryShape, playlist_shape: PlaylistShape) -> Tuple[Path, Path]:
+    """Generate a synthetic music library and its playlists.
+
+    Playlists reference songs with paths relative to the playlist file.
+    Args:
+        root_folder_path (Path): folder in which the library is generated
+        shape (LibraryShape): shape of the songs of the library
+        playlist_shape (PlaylistShape): shape of the playlists
+    Returns:
+        Tuple[Path, Path]: music root folder and playlist root folder
+    """
+    music_root_folder_path = root_folder_path / "Music"
+    nested_folders = Path(*[f"level {level}" for level in range(shape.depth)])
+    song_paths = generate_songs(music_root_folder_path, nested_folders, shape)
+    generator = random.Random(playlist_shape.seed)
+    shared_songs = generator.sample(song_paths, min(len(song_paths), playlist_shape.tracks_per_playlist))
+    playlist_root_folder_path = music_root_folder_path / "Playlists"
+    (playlist_root_folder_path / nested_folders).mkdir(parents=True)
+    for playlist in range(playlist_shape.playlists):
+        lines = []
+        for entry in range(playlist_shape.tracks_per_playlist):
+            draw = generator.random()
+            if draw < playlist_shape.missing:
+                song_path = music_root_folder_path / "Missing" / f"{playlist:04d} {entry:04d}.mp3"
+            elif draw < playlist_shape.missing + playlist_shape.overlap:
+                song_path = generator.choice(shared_songs)
+            else:
+                song_path = generator.choice(song_paths)
+            lines.append("../" * (shape.depth + 1) + song_path.relative_to(music_root_folder_path).as_posix())
+        (playlist_root_folder_path / nested_folders / f"Playlist {playlist:04d}.m3u").write_text(
+            "\n".join(lines) + "\n", encoding="utf-8"
+        )
+    return music_root_folder_path, playlist_root_folder_path
+
+
+def time_phase(results: Dict[str, Dict[str, float]], name: str, phase: Callable[[], Any]) -> Any:
+    """Run a phase and record its duration.
+
+    Args:
+        results (Dict[str, Dict[str, float]]): results of each phase, the duration is recorded under name
+        name (str): name of the phase
+        phase (Callable[[], Any]): phase to run
+    Returns:
+        Any: result of the phase
+    """
+    start_time = time.perf_counter()
+    result = phase()
+    results[name] = {"seconds": time.perf_counter() - start_time}
+    return result
+
+
+def measure_memory(function: Callable[[], Any]) -> int:
+    """Measure the memory allocated by a function and still held by its result.
+
+    Args:
+        function (Callable[[], Any]): function to measure
+    Returns:
+        int: bytes held once the function returned
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        held_bytes, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return held_bytes
+
+
+def measure_playlist_memory(playlist_files: List[Path]) -> Dict[str, float]:
+    """Measure the memory held by the parsed playlists, with song paths shared by all playlists or not.
+
+    Playlists parsed one by one hold a Path object for each entry, as they did before song paths were interned.
+    Args:
+        playlist_files (List[Path]): path to all playlist files
+    Returns:
+        Dict[str, float]: bytes held with shared and with separate song paths, and the fraction saved by sharing
+    """
+    inventory = DirectoryInventory()
+    # folders are listed before the measures, the inventory is not part of the playlists
+    parse_all_playlists(playlist_files, inventory)
+    shared_bytes = measure_memory(lambda: parse_all_playlists(playlist_files, inventory))
+    separate_bytes = measure_memory(
+        lambda: {playlist_file: parse_playlist(playlist_file, inventory) for playlist_file in playlist_files}
+    )
+    return {
+        "shared_paths_bytes": shared_bytes,
+        "separate_paths_bytes": separate_bytes,
+        "reduction": 1 - shared_bytes / max(separate_bytes, 1),
+    }
+
+
+def run_phases(
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    destination_folder_path: Path,
+    jobs: int,
+    copy_order: str = LOCALITY,
+) -> Dict[str, Dict[str, float]]:
+    """Run and time each phase of a mirror to an empty destination.
+
+    Args:
+        music_root_folder_path (Path): root folder of the music library
+        playlist_root_folder_path (Path): root folder of the playlist files
+        destination_folder_path (Path): empty destination folder
+        jobs (int): number of songs copied concurrently
+        copy_order (str): order of the copies, see COPY_ORDERS
+    Returns:
+        Dict[str, Dict[str, float]]: duration in seconds and number of processed items of each phase
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    inventory = DirectoryInventory()
+    playlist_files = time_phase(
+        results, "discovery", lambda: get_all_playlist_files(playlist_root_folder_path, inventory)
+    )
+    playlists = time_phase(results, "parsing", lambda: parse_all_playlists(playlist_files, inventory))
+
+    def rewrite_paths() -> List[Any]:
+        """Compute the destination of every song and the new content of every playlist."""
+        for playlist_file, songs in playlists.items():
+            get_new_content_of_playlist_file(playlist_file, songs)
+        return get_copy_jobs(playlists, music_root_folder_path, destination_folder_path)
+
+    copy_jobs = time_phase(results, "path_rewriting", rewrite_paths)
+    copy_report = time_phase(
+        results,
+        "copying",
+        lambda: copy_all_songs(copy_jobs, MirrorOptions(scheduling=CopyScheduling(jobs=jobs, copy_order=copy_order))),
+    )
+    time_phase(
+        results,
+        "playlist_writing",
+        lambda: write_all_playlists(playlists, music_root_folder_path, destination_folder_path),
+    )
+    entries = sum(len(songs) for songs in playlists.values())
+    results["discovery"]["items"] = len(playlist_files)
+    results["parsing"]["items"] = entries
+    results["path_rewriting"]["items"] = entries
+    results["copying"].update(items=copy_report.copied_files, bytes=copy_report.copied_bytes)
+    results["playlist_writing"]["items"] = len(playlists)
+    return results
+
+
+def run_benchmark(
+    root_folder_path: Path,
+    shape: LibraryShape,
+    playlist_shape: PlaylistShape,
+    jobs: int = 4,
+    repeat: int = 1,
+    copy_order: str = LOCALITY,
+) -> Dict[str, Any]:
+    """Generate a library and time the mirror phases, keeping the fastest of several runs of each phase.
+
+    Every run mirrors to a new empty destination. The memory held by the parsed playlists is measured once.
+    Args:
+        root_folder_path (Path): folder in which the library and the destinations are generated
+        shape (LibraryShape): shape of the songs of the library
+        playlist_shape (PlaylistShape): shape of the playlists
+        jobs (int): number of songs copied concurrently
+        repeat (int): number of runs
+        copy_order (str): order of the copies, see COPY_ORDERS
+    Returns:
+        Dict[str, Any]: shape of the library, duration, number of items and throughput of each phase, and memory held
+            by the parsed playlists
+    """
+    music_root_folder_path, playlist_root_folder_path = generate_library(root_folder_path, shape, playlist_shape)
+    runs = [
+        run_phases(
+            music_root_folder_path, playlist_root_folder_path, root_folder_path / f"mirror {run}", jobs, copy_order
+        )
+        for run in range(repeat)
+    ]
+    phases = {}
+    for phase in runs[0]:
+        fastest = min((run[phase] for run in runs), key=lambda result: result["seconds"])
+        phases[phase] = dict(fastest)
+        seconds = max(fastest["seconds"], 1e-9)
+        phases[phase]["items_per_second"] = fastest["items"] / seconds
+        if "bytes" in fastest:
+            phases[phase]["bytes_per_second"] = fastest["bytes"] / seconds
+    return {
+        "python": sys.version.split()[0],
+        "shape": {**asdict(shape), **asdict(playlist_shape)},
+        "jobs": jobs,
+        "repeat": repeat,
+        "copy_order": copy_order,
+        "phases": phases,
+        "memory": measure_playlist_memory(get_all_playlist_files(playlist_root_folder_path)),
+    }
+
+
+def main():
+    """Implement main function of the benchmark."""
+    parser = argparse.ArgumentParser(description="Time the mirror phases on a synthetic music library")
+    defaults = {**asdict(LibraryShape()), **asdict(PlaylistShape())}
+    for name, value in defaults.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value, help=f"Default {value}")
+    parser.add_argument(
+        "-j", "--jobs", help="number of songs copied concurrently. Default is 4", type=positive_int, default=4
+    )
+    parser.add_argument(
+        "--repeat", help="number of runs, the fastest is kept. Default is 1", type=positive_int, default=1
+    )
+    parser.add_argument(
+        "--copy-order",
+        help="order of the copies, to compare their throughput. Default is locality",
+        choices=COPY_ORDERS,
+        default=LOCALITY,
+    )
+    parser.add_argument(
+        "--root", help="folder in which the library is generated, a tmpfs is best. Default is a temporary folder"
+    )
+    parser.add_argument("-o", "--output", help="JSON result file. Default is the standard output")
+    args = parser.parse_args()
+    shape = LibraryShape(**{name: getattr(args, name) for name in asdict(LibraryShape())})
+    playlist_shape = PlaylistShape(**{name: getattr(args, name) for name in asdict(PlaylistShape())})
+    # logging every copied file and every missing entry would be measured as part of the phases
+    logging.getLogger().setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory(dir=args.root) as root_folder:
+        result = run_benchmark(Path(root_folder), shape, playlist_shape, args.jobs, args.repeat, args.copy_order)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2), encoding="utf-8")
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()  # pragma nocover
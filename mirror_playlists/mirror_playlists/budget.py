@@ -0,0 +1,109 @@
+"""Selection of the songs to mirror when the destination has a fixed capacity.
+
+Songs are ranked by priority, then selected in a single pass over their precomputed sizes, skipping the songs that
+no longer fit so that smaller songs of lower priority can still fill the remaining capacity.
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Set, Tuple
+
+
+@dataclass
+class BudgetReport:
+    """Songs selected to fit in the capacity of the destination, and songs left out."""
+
+    capacity_bytes: int = 0
+    selected_songs: int = 0
+    selected_bytes: int = 0
+    left_out_songs: List[Path] = field(default_factory=list)
+    left_out_bytes: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the report to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: capacity, count and bytes of the selected songs, and the songs left out
+        """
+        return {
+            "capacity_bytes": self.capacity_bytes,
+            "selected_songs": self.selected_songs,
+            "selected_bytes": self.selected_bytes,
+            "left_out_songs": list(map(str, self.left_out_songs)),
+            "left_out_bytes": self.left_out_bytes,
+        }
+
+    def log_summary(self) -> None:
+        """Log the summary of the selection, listing every song left out."""
+        for song_path in self.left_out_songs:
+            logging.debug("Left out %s", str(song_path))
+        logging.info(
+            "Selected %d songs, %d of %d bytes, left out %d songs, %d bytes",
+            self.selected_songs,
+            self.selected_bytes,
+            self.capacity_bytes,
+            len(self.left_out_songs),
+            self.left_out_bytes,
+        )
+
+
+def rank_songs(playlists: Dict[Path, List[Path]], song_stats: Dict[Path, os.stat_result]) -> List[Path]:
+    """Rank the songs of the playlists, highest priority first.
+
+    Songs referenced by more playlists come first, then songs of the first playlists, playlists being given in
+    priority order, then the most recently modified songs. Remaining ties keep the order of first appearance.
+    Args:
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file, in priority order
+        song_stats (Dict[Path, os.stat_result]): stat of each song
+    Returns:
+        List[Path]: unique song path, highest priority first
+    """
+    playlist_counts: Dict[Path, int] = {}
+    first_playlists: Dict[Path, int] = {}
+    for playlist_index, songs in enumerate(playlists.values()):
+        for song_path in set(songs):
+            playlist_counts[song_path] = playlist_counts.get(song_path, 0) + 1
+            first_playlists.setdefault(song_path, playlist_index)
+    unique_songs = list(dict.fromkeys(song_path for songs in playlists.values() for song_path in songs))
+    return sorted(
+        unique_songs,
+        key=lambda song_path: (
+            -playlist_counts[song_path],
+            first_playlists[song_path],
+            -song_stats[song_path].st_mtime,
+        ),
+    )
+
+
+def select_songs_within_budget(
+    playlists: Dict[Path, List[Path]], song_stats: Dict[Path, os.stat_result], capacity_bytes: int
+) -> Tuple[Dict[Path, List[Path]], BudgetReport]:
+    """Select the highest priority songs fitting in the capacity, and remove the other songs from the playlists.
+
+    Sizes are read from the given stats, no file is statted again. Songs that will be transcoded are counted with
+    their source size.
+    Args:
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file, in priority order
+        song_stats (Dict[Path, os.stat_result]): stat of each song
+        capacity_bytes (int): maximum total size of the selected songs
+    Returns:
+        Tuple[Dict[Path, List[Path]], BudgetReport]: playlists with the selected songs only, and the songs left out
+    """
+    report = BudgetReport(capacity_bytes)
+    selected_songs: Set[Path] = set()
+    for song_path in rank_songs(playlists, song_stats):
+        size = song_stats[song_path].st_size
+        if report.selected_bytes + size <= capacity_bytes:
+            selected_songs.add(song_path)
+            report.selected_bytes += size
+        else:
+            report.left_out_songs.append(song_path)
+            report.left_out_bytes += size
+    report.selected_songs = len(selected_songs)
+    selected_playlists = {
+        playlist_file: [song_path for song_path in songs if song_path in selected_songs]
+        for playlist_file, songs in playlists.items()
+    }
+    return selected_playlists, report
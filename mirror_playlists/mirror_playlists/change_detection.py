@@ -0,0 +1,163 @@
+"""Strategies deciding whether a mirrored song is up to date with its source."""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from .inventory import DirectoryInventory
+
+EXISTS = "exists"
+SIZE_MTIME = "size-mtime"
+HASH = "hash"
+COMPARISON_STRATEGIES = (EXISTS, SIZE_MTIME, HASH)
+
+DIGEST_CHUNK_SIZE = 1024 * 1024
+# FAT file systems store modification times with a two seconds resolution
+MTIME_TOLERANCE_NS = 2_000_000_000
+
+
+def compute_file_digest(file_path: Path) -> str:
+    """Compute the digest of a file, reading it chunk by chunk.
+
+    Args:
+        file_path (Path): path of the file
+    Returns:
+        str: hexadecimal digest of the file content
+    """
+    digest = hashlib.blake2b()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(DIGEST_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_content_digest(content: bytes) -> str:
+    """Compute the digest of a content in memory, as the digest of a file of that content.
+
+    Args:
+        content (bytes): content to digest
+    Returns:
+        str: hexadecimal digest of the content
+    """
+    return hashlib.blake2b(content).hexdigest()
+
+
+class DigestCache:
+    """Thread safe cache of file digests, invalidated when the size or the modification time of a file change."""
+
+    def __init__(self, digests: Iterable[Tuple[str, int, int, str]] = ()):
+        """Create the cache.
+
+        Args:
+            digests (Iterable[Tuple[str, int, int, str]]): path, size, modification time and digest of known files
+        """
+        self.digests: Dict[str, Tuple[int, int, str]] = {
+            path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in digests
+        }
+        self.new_digests: Dict[str, Tuple[int, int, str]] = {}
+        self.lock = threading.Lock()
+
+    def get_digest(self, file_path: Path, file_stat: os.stat_result) -> str:
+        """Get the digest of a file, computing it only if the file changed since it was last computed.
+
+        Args:
+            file_path (Path): path of the file
+            file_stat (os.stat_result): current stat of the file
+        Returns:
+            str: hexadecimal digest of the file content
+        """
+        with self.lock:
+            cached = self.digests.get(str(file_path))
+        if cached is not None and cached[:2] == (file_stat.st_size, file_stat.st_mtime_ns):
+            return cached[2]
+        digest = compute_file_digest(file_path)
+        with self.lock:
+            self.digests[str(file_path)] = (file_stat.st_size, file_stat.st_mtime_ns, digest)
+            self.new_digests[str(file_path)] = self.digests[str(file_path)]
+        return digest
+
+    def set_digest(self, file_path: Path, file_stat: os.stat_result, digest: str) -> None:
+        """Record the digest of a file that was just written, so that it is not computed again.
+
+        Args:
+            file_path (Path): path of the file
+            file_stat (os.stat_result): stat of the file once written
+            digest (str): hexadecimal digest of the written content
+        """
+        with self.lock:
+            self.digests[str(file_path)] = (file_stat.st_size, file_stat.st_mtime_ns, digest)
+            self.new_digests[str(file_path)] = self.digests[str(file_path)]
+
+    def get_new_digests(self) -> Iterable[Tuple[str, int, int, str]]:
+        """Get the digests computed since the cache was created.
+
+        Returns:
+            Iterable[Tuple[str, int, int, str]]: path, size, modification time and digest of newly hashed files
+        """
+        with self.lock:
+            return [(path, size, mtime_ns, digest) for path, (size, mtime_ns, digest) in self.new_digests.items()]
+
+
+def get_file_stat(file_path: Path, inventory: Optional[DirectoryInventory] = None) -> Optional[os.stat_result]:
+    """Get the stat of a file, from the inventory if given.
+
+    Args:
+        file_path (Path): path of the file
+        inventory (Optional[DirectoryInventory]): inventory of the folders
+    Returns:
+        Optional[os.stat_result]: stat of the file, None if the file does not exist
+    """
+    if inventory is not None:
+        return inventory.stat(file_path)
+    try:
+        return file_path.stat()
+    except FileNotFoundError:
+        return None
+
+
+def is_destination_up_to_date(
+    source_song_path: Path,
+    destination_song_path: Path,
+    comparison: str = EXISTS,
+    digest_cache: Optional[DigestCache] = None,
+    inventory: Optional[DirectoryInventory] = None,
+) -> bool:
+    """Return true if the destination song does not need to be copied again.
+
+    Comparison strategies:
+        exists: the destination file exists
+        size-mtime: the destination file has the size and (within two seconds) the modification time of the source
+        hash: the destination file has the size and the content digest of the source
+    Args:
+        source_song_path (Path): Path to the source song file.
+        destination_song_path (Path): Path to the destination song file.
+        comparison (str): one of COMPARISON_STRATEGIES
+        digest_cache (Optional[DigestCache]): cache of digests, only used by the hash comparison
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+    Returns:
+        bool: True if the destination is up to date
+    Raises:
+        ValueError: if the comparison strategy is unknown
+        FileNotFoundError: if the source song does not exist
+    """
+    if comparison not in COMPARISON_STRATEGIES:
+        raise ValueError(f"Unknown comparison strategy {comparison}")
+    destination_stat = get_file_stat(destination_song_path, inventory)
+    if destination_stat is None:
+        return False
+    if comparison == EXISTS:
+        return True
+    source_stat = get_file_stat(source_song_path, inventory)
+    if source_stat is None:
+        raise FileNotFoundError(f"Song file {source_song_path} does not exist")
+    if source_stat.st_size != destination_stat.st_size:
+        return False
+    if comparison == SIZE_MTIME:
+        return abs(source_stat.st_mtime_ns - destination_stat.st_mtime_ns) <= MTIME_TOLERANCE_NS
+    if digest_cache is None:
+        digest_cache = DigestCache()
+    return digest_cache.get_digest(source_song_path, source_stat) == digest_cache.get_digest(
+        destination_song_path, destination_stat
+    )
@@ -0,0 +1,564 @@
+"""Concurrent copy of song files to the mirror destination."""
+
+import heapq
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+from .change_detection import EXISTS, DigestCache, is_destination_up_to_date
+from .inventory import DirectoryInventory
+from .mirror_options import MirrorOptions
+from .scheduling import BandwidthLimiter, create_bandwidth_limiter, order_copy_jobs
+from .transfer import COPY, transfer_file
+
+CopyJob = Tuple[Path, Path]
+
+JOURNAL_FILE_NAME = ".mirror_playlists.journal"
+PARTIAL_FILE_SUFFIX = ".partial"
+SLOWEST_FILES_COUNT = 10
+PROGRESS_INTERVAL_SECONDS = 5.0
+TEE_BUFFER_SIZE = 1024 * 1024
+
+
+@dataclass
+class CopyReport:
+    """Aggregated result of a copy phase."""
+
+    copied_files: int = 0
+    skipped_files: int = 0
+    copied_bytes: int = 0
+    elapsed_seconds: float = 0.0
+    failures: Dict[Path, str] = field(default_factory=dict)
+    # min heap of the SLOWEST_FILES_COUNT longest (seconds, destination song path)
+    slowest_files: List[Tuple[float, Path]] = field(default_factory=list)
+
+    def throughput(self) -> float:
+        """Return the copy throughput.
+
+        Returns:
+            float: copied bytes per second
+        """
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return self.copied_bytes / self.elapsed_seconds
+
+    def file_throughput(self) -> float:
+        """Return the number of songs examined per second, copied or already up to date.
+
+        Returns:
+            float: examined songs per second
+        """
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return (self.copied_files + self.skipped_files) / self.elapsed_seconds
+
+    def add_copy_result(self, destination_song_path: Path, copied_bytes: Optional[int], seconds: float = 0.0) -> None:
+        """Account the result of a single song copy.
+
+        Args:
+            destination_song_path (Path): path of the destination song file
+            copied_bytes (Optional[int]): number of copied bytes, None if the song was already up to date
+            seconds (float): time spent comparing and copying the song
+        """
+        if copied_bytes is None:
+            self.skipped_files += 1
+        else:
+            self.copied_files += 1
+            self.copied_bytes += copied_bytes
+        if len(self.slowest_files) < SLOWEST_FILES_COUNT:
+            heapq.heappush(self.slowest_files, (seconds, destination_song_path))
+        elif seconds > self.slowest_files[0][0]:
+            heapq.heapreplace(self.slowest_files, (seconds, destination_song_path))
+
+    def get_slowest_files(self) -> List[Tuple[float, Path]]:
+        """Get the songs that took the longest to compare and copy.
+
+        Returns:
+            List[Tuple[float, Path]]: seconds and destination song path, slowest first
+        """
+        return sorted(self.slowest_files, reverse=True)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the report to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: counts, bytes, throughput, failures and slowest songs of the copy
+        """
+        return {
+            "copied_files": self.copied_files,
+            "skipped_files": self.skipped_files,
+            "failed_files": len(self.failures),
+            "copied_bytes": self.copied_bytes,
+            "seconds": self.elapsed_seconds,
+            "bytes_per_second": self.throughput(),
+            "files_per_second": self.file_throughput(),
+            "failures": {str(path): error for path, error in self.failures.items()},
+            "slowest_files": [{"path": str(path), "seconds": seconds} for seconds, path in self.get_slowest_files()],
+        }
+
+    def log_summary(self) -> None:
+        """Log the summary of the copy phase, including every failure."""
+        logging.info(
+            "Copied %d files (%d bytes) in %.2f s (%.2f MiB/s), %d already on mirror side, %d failed",
+            self.copied_files,
+            self.copied_bytes,
+            self.elapsed_seconds,
+            self.throughput() / (1024 * 1024),
+            self.skipped_files,
+            len(self.failures),
+        )
+        for destination_song_path, error in self.failures.items():
+            logging.error("Failed to copy %s: %s", str(destination_song_path), error)
+
+
+class CopyJournal:
+    """Append only record of the songs committed on destination by a copy phase that did not finish.
+
+    A restarted copy phase skips the committed songs without examining them again. The journal file is removed once
+    a copy phase finishes.
+    """
+
+    def __init__(self, journal_path: Path):
+        """Load the songs committed by an interrupted copy phase, if any.
+
+        Args:
+            journal_path (Path): path of the journal file
+        """
+        self.journal_path = journal_path
+        self.committed_songs = set()
+        if journal_path.exists():
+            with open(journal_path, "r", encoding="utf-8") as journal_file:
+                self.committed_songs = {Path(line.rstrip("\n")) for line in journal_file if line.strip()}
+            logging.info("Resuming interrupted copy, %d songs already committed", len(self.committed_songs))
+        self.journal_file = None
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "CopyJournal":
+        """Open the journal for appending.
+
+        Returns:
+            CopyJournal: this journal
+        """
+        self.journal_file = open(self.journal_path, "a", encoding="utf-8")  # pylint: disable=(consider-using-with)
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        """Close the journal, and remove it if the copy phase finished without exception."""
+        self.journal_file.close()
+        if exception_info[0] is None:
+            self.journal_path.unlink()
+
+    def is_committed(self, destination_song_path: Path) -> bool:
+        """Return true if the song was committed by the interrupted copy phase.
+
+        Args:
+            destination_song_path (Path): path of the destination song file
+        Returns:
+            bool: True if the song is committed
+        """
+        return destination_song_path in self.committed_songs
+
+    def commit(self, destination_song_path: Path) -> None:
+        """Record a song as committed on destination.
+
+        Args:
+            destination_song_path (Path): path of the destination song file
+        """
+        with self.lock:
+            self.journal_file.write(f"{destination_song_path}\n")
+            self.journal_file.flush()
+
+
+def get_partial_file_path(destination_song_path: Path) -> Path:
+    """Get the temporary path a song or playlist is written to before being renamed to its destination path.
+
+    Args:
+        destination_song_path (Path): path of the destination song or playlist file
+    Returns:
+        Path: hidden path, next to the destination file
+    """
+    return destination_song_path.with_name(f".{destination_song_path.name}{PARTIAL_FILE_SUFFIX}")
+
+
+def copy_file_atomically(
+    source_song_path: Path,
+    destination_song_path: Path,
+    link_mode: str = COPY,
+    limiter: Optional[BandwidthLimiter] = None,
+) -> None:
+    """Copy (or link) a file to a temporary path and rename it to its destination once complete.
+
+    An interrupted copy never leaves a truncated file under the destination path.
+    Args:
+        source_song_path (Path): Path to the source song file.
+        destination_song_path (Path): Path to the destination song file.
+        link_mode (str): how the file is transferred, see LINK_MODES
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes copied per second, no limit if None
+    """
+    partial_file_path = get_partial_file_path(destination_song_path)
+    try:
+        transfer_file(source_song_path, partial_file_path, link_mode, limiter)
+        os.replace(partial_file_path, destination_song_path)
+    except BaseException:
+        partial_file_path.unlink(missing_ok=True)
+        raise
+
+
+def tee_file_atomically(
+    source_song_path: Path, destination_song_paths: List[Path], limiter: Optional[BandwidthLimiter] = None
+) -> Dict[Path, Union[int, OSError]]:
+    """Copy a file to several destinations, reading it once, each copy is renamed to its destination once complete.
+
+    A destination that cannot be written is dropped without interrupting the copy to the others.
+    Args:
+        source_song_path (Path): Path to the source song file.
+        destination_song_paths (List[Path]): Path to the destination song files.
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes read per second, no limit if None
+    Returns:
+        Dict[Path, Union[int, OSError]]: number of copied bytes, or error, of each destination
+    """
+    results: Dict[Path, Union[int, OSError]] = {}
+    partial_files: Dict[Path, BinaryIO] = {}
+    try:
+        with open(source_song_path, "rb") as source_file:
+            for destination_song_path in destination_song_paths:
+                try:
+                    # pylint: disable=(consider-using-with)
+                    partial_files[destination_song_path] = open(get_partial_file_path(destination_song_path), "wb")
+                except OSError as error:
+                    results[destination_song_path] = error
+            while partial_files:
+                chunk = source_file.read(TEE_BUFFER_SIZE)
+                if not chunk:
+                    break
+                if limiter is not None:
+                    limiter.consume(len(chunk))
+                for destination_song_path, partial_file in list(partial_files.items()):
+                    try:
+                        partial_file.write(chunk)
+                    except OSError as error:
+                        results[destination_song_path] = error
+                        partial_file.close()
+                        get_partial_file_path(destination_song_path).unlink(missing_ok=True)
+                        del partial_files[destination_song_path]
+        for destination_song_path, partial_file in partial_files.items():
+            partial_file_path = get_partial_file_path(destination_song_path)
+            try:
+                partial_file.close()
+                shutil.copystat(source_song_path, partial_file_path)
+                os.replace(partial_file_path, destination_song_path)
+                results[destination_song_path] = destination_song_path.stat().st_size
+            except OSError as error:
+                results[destination_song_path] = error
+                partial_file_path.unlink(missing_ok=True)
+    except BaseException:
+        for destination_song_path, partial_file in partial_files.items():
+            partial_file.close()
+            get_partial_file_path(destination_song_path).unlink(missing_ok=True)
+        raise
+    return results
+
+
+def create_parent_folders(
+    destination_song_paths: Iterable[Path], inventory: Optional[DirectoryInventory] = None
+) -> Dict[Path, str]:
+    """Create the parent folders of all destination song paths, once per folder.
+
+    Args:
+        destination_song_paths (Iterable[Path]): path of the destination song files
+        inventory (Optional[DirectoryInventory]): inventory of the destination, folders it knows are not created
+    Returns:
+        Dict[Path, str]: error message for each folder that could not be created
+    """
+    failed_folders = {}
+    for folder in sorted({path.parent for path in destination_song_paths}):
+        if inventory is not None and inventory.has_folder(folder):
+            continue
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+        except OSError as error:
+            failed_folders[folder] = str(error)
+    return failed_folders
+
+
+def create_parent_folders_of_copy_jobs(
+    copy_jobs: List[CopyJob], report: CopyReport, inventory: Optional[DirectoryInventory] = None
+) -> List[CopyJob]:
+    """Create the parent folders of all destination song paths, once per folder.
+
+    Jobs whose parent folder could not be created are recorded as failures in the report.
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        report (CopyReport): report of the copy phase
+        inventory (Optional[DirectoryInventory]): inventory of the destination, folders it knows are not created
+    Returns:
+        List[CopyJob]: jobs whose parent folder exists
+    """
+    failed_folders = create_parent_folders((destination for _, destination in copy_jobs), inventory)
+    runnable_jobs = []
+    for copy_job in copy_jobs:
+        if copy_job[1].parent in failed_folders:
+            report.failures[copy_job[1]] = failed_folders[copy_job[1].parent]
+        else:
+            runnable_jobs.append(copy_job)
+    return runnable_jobs
+
+
+def copy_song_file_if_changed(
+    source_song_path: Path,
+    destination_song_path: Path,
+    comparison: str = EXISTS,
+    digest_cache: Optional[DigestCache] = None,
+    inventory: Optional[DirectoryInventory] = None,
+    link_mode: str = COPY,
+    limiter: Optional[BandwidthLimiter] = None,
+) -> Optional[int]:
+    """Copy source_song_path into destination_song_path if destination_song_path is not up to date.
+
+    The parent folder of destination_song_path must already exist.
+    Args:
+        source_song_path (Path): Path to the source song file.
+        destination_song_path (Path): Path to the destination song file.
+        comparison (str): strategy deciding whether the destination is up to date, see COMPARISON_STRATEGIES
+        digest_cache (Optional[DigestCache]): cache of digests, only used by the hash comparison
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+        link_mode (str): how the file is transferred, see LINK_MODES
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes copied per second, no limit if None
+    Returns:
+        Optional[int]: number of copied bytes, None if the file is already up to date on mirror side
+    """
+    if is_destination_up_to_date(source_song_path, destination_song_path, comparison, digest_cache, inventory):
+        logging.debug("File %s already exist on mirror side", str(destination_song_path))
+        return None
+    copy_file_atomically(source_song_path, destination_song_path, link_mode, limiter)
+    logging.debug("New file %s copied on mirror side", str(destination_song_path))
+    return destination_song_path.stat().st_size
+
+
+def tee_song_file_if_changed(
+    source_song_path: Path,
+    destination_song_paths: List[Path],
+    comparison: str,
+    digest_cache: Optional[DigestCache],
+    inventory: Optional[DirectoryInventory],
+    link_mode: str = COPY,
+    limiter: Optional[BandwidthLimiter] = None,
+) -> Dict[Path, Union[Tuple[Optional[int], float], OSError]]:
+    """Copy source_song_path into every destination song path that is not up to date, reading the source once.
+
+    Parent folders of the destination song paths must already exist. Songs are only read once with the copy link
+    mode, other link modes transfer the song to each destination in turn.
+    Args:
+        source_song_path (Path): Path to the source song file.
+        destination_song_paths (List[Path]): Path to the destination song files.
+        comparison (str): strategy deciding whether a destination is up to date, see COMPARISON_STRATEGIES
+        digest_cache (Optional[DigestCache]): cache of digests, only used by the hash comparison
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+        link_mode (str): how the file is transferred, see LINK_MODES
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes copied per second, no limit if None
+    Returns:
+        Dict[Path, Union[Tuple[Optional[int], float], OSError]]: for each destination, number of copied bytes (None
+            if it was already up to date) and seconds spent comparing and copying, or error
+    """
+    start_time = time.perf_counter()
+    results: Dict[Path, Union[Tuple[Optional[int], float], OSError]] = {}
+    changed_destinations = []
+    for destination_song_path in destination_song_paths:
+        try:
+            if is_destination_up_to_date(source_song_path, destination_song_path, comparison, digest_cache, inventory):
+                results[destination_song_path] = (None, time.perf_counter() - start_time)
+            else:
+                changed_destinations.append(destination_song_path)
+        except OSError as error:
+            results[destination_song_path] = error
+    copy_results: Dict[Path, Union[int, OSError]] = {}
+    if link_mode == COPY:
+        try:
+            copy_results = tee_file_atomically(source_song_path, changed_destinations, limiter)
+        except OSError as error:
+            copy_results = dict.fromkeys(changed_destinations, error)
+    else:
+        for destination_song_path in changed_destinations:
+            try:
+                copy_file_atomically(source_song_path, destination_song_path, link_mode, limiter)
+                copy_results[destination_song_path] = destination_song_path.stat().st_size
+            except OSError as error:
+                copy_results[destination_song_path] = error
+    seconds = time.perf_counter() - start_time
+    for destination_song_path, copy_result in copy_results.items():
+        logging.debug("New file %s copied on mirror side", str(destination_song_path))
+        results[destination_song_path] = copy_result if isinstance(copy_result, OSError) else (copy_result, seconds)
+    return results
+
+
+def get_device_semaphores(
+    destination_song_paths: Iterable[Path], jobs_per_destination: int
+) -> Dict[Path, threading.BoundedSemaphore]:
+    """Get a semaphore limiting the number of concurrent copies for each destination device.
+
+    Args:
+        destination_song_paths (Iterable[Path]): path of the destination song files, parent folders must exist
+        jobs_per_destination (int): maximum number of concurrent copies to a single device
+    Returns:
+        Dict[Path, threading.BoundedSemaphore]: semaphore of the device of each destination folder
+    """
+    semaphore_of_device: Dict[int, threading.BoundedSemaphore] = {}
+    semaphore_of_folder = {}
+    for folder in {path.parent for path in destination_song_paths}:
+        device = os.stat(folder).st_dev
+        if device not in semaphore_of_device:
+            semaphore_of_device[device] = threading.BoundedSemaphore(jobs_per_destination)
+        semaphore_of_folder[folder] = semaphore_of_device[device]
+    return semaphore_of_folder
+
+
+def copy_song_file_with_device_limit(
+    copy_job: CopyJob,
+    semaphore: Optional[threading.BoundedSemaphore],
+    comparison: str,
+    digest_cache: Optional[DigestCache],
+    journal: Optional[CopyJournal],
+    inventory: Optional[DirectoryInventory],
+    link_mode: str = COPY,
+    limiter: Optional[BandwidthLimiter] = None,
+) -> Tuple[Optional[int], float]:
+    """Copy a song if it changed, waiting for a free slot on its destination device first.
+
+    Args:
+        copy_job (CopyJob): source and destination song path
+        semaphore (Optional[threading.BoundedSemaphore]): semaphore of the destination device, no limit if None
+        comparison (str): strategy deciding whether the destination is up to date, see COMPARISON_STRATEGIES
+        digest_cache (Optional[DigestCache]): cache of digests, only used by the hash comparison
+        journal (Optional[CopyJournal]): journal the song is committed to once up to date on destination
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+        link_mode (str): how the file is transferred, see LINK_MODES
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes copied per second, no limit if None
+    Returns:
+        Tuple[Optional[int], float]: number of copied bytes, None if the file is already up to date on mirror side,
+            and seconds spent comparing and copying, not waiting for the device
+    """
+    if semaphore is None:
+        start_time = time.perf_counter()
+        copied_bytes = copy_song_file_if_changed(*copy_job, comparison, digest_cache, inventory, link_mode, limiter)
+    else:
+        with semaphore:
+            start_time = time.perf_counter()
+            copied_bytes = copy_song_file_if_changed(*copy_job, comparison, digest_cache, inventory, link_mode, limiter)
+    seconds = time.perf_counter() - start_time
+    if journal is not None:
+        journal.commit(copy_job[1])
+    return copied_bytes, seconds
+
+
+def collect_copy_results(futures: List[Tuple[Path, Future]], report: CopyReport) -> None:
+    """Wait for every copy and account its result, logging the progress at most every PROGRESS_INTERVAL_SECONDS.
+
+    Args:
+        futures (List[Tuple[Path, Future]]): destination song path and pending result of each copy
+        report (CopyReport): report of the copy phase
+    """
+    last_progress_time = time.monotonic()
+    for done_jobs, (destination_song_path, future) in enumerate(futures, start=1):
+        try:
+            report.add_copy_result(destination_song_path, *future.result())
+        except OSError as error:
+            report.failures[destination_song_path] = str(error)
+        if time.monotonic() - last_progress_time >= PROGRESS_INTERVAL_SECONDS:
+            last_progress_time = time.monotonic()
+            logging.info("Examined %d of %d songs, copied %d bytes", done_jobs, len(futures), report.copied_bytes)
+
+
+def get_uncommitted_copy_jobs(
+    copy_jobs: List[CopyJob], options: MirrorOptions, journal: Optional[CopyJournal]
+) -> Tuple[CopyReport, List[CopyJob]]:
+    """Start the report of a copy phase, skipping the songs committed in the journal by an interrupted copy phase.
+
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        options (MirrorOptions): number of copy jobs and per device limit, checked
+        journal (Optional[CopyJournal]): journal of committed songs, to resume an interrupted copy phase
+    Returns:
+        Tuple[CopyReport, List[CopyJob]]: report counting the committed songs as skipped, and the other jobs
+    Raises:
+        ValueError: if jobs or jobs_per_destination is lower than 1
+    """
+    scheduling = options.scheduling
+    if scheduling.jobs < 1 or (scheduling.jobs_per_destination is not None and scheduling.jobs_per_destination < 1):
+        raise ValueError(
+            f"Number of copy jobs must be at least 1, got {scheduling.jobs} and {scheduling.jobs_per_destination}"
+        )
+    report = CopyReport()
+    if journal is not None:
+        uncommitted_jobs = [job for job in copy_jobs if not journal.is_committed(job[1])]
+        report.skipped_files += len(copy_jobs) - len(uncommitted_jobs)
+        copy_jobs = uncommitted_jobs
+    return report, copy_jobs
+
+
+def copy_all_songs(
+    copy_jobs: List[CopyJob],
+    options: MirrorOptions,
+    digest_cache: Optional[DigestCache] = None,
+    journal: Optional[CopyJournal] = None,
+    inventory: Optional[DirectoryInventory] = None,
+) -> CopyReport:
+    """Copy all songs that are not up to date concurrently with a bounded thread pool.
+
+    Parent folders are created once per folder before any copy starts. Songs are dispatched in the copy order of the
+    options, and copied within their bandwidth limit.
+    A failure on one file does not abort the others, it is collected in the returned report.
+    Songs committed in the journal by an interrupted copy phase are skipped without being examined.
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        options (MirrorOptions): number of copy threads, per device limit, comparison strategy, copy order and
+            bandwidth limit
+        digest_cache (Optional[DigestCache]): cache of digests, only used by the hash comparison
+        journal (Optional[CopyJournal]): journal of committed songs, to resume an interrupted copy phase
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files, and
+            telling which destination folders already exist
+    Returns:
+        CopyReport: aggregated result of the copy
+    Raises:
+        ValueError: if jobs or jobs_per_destination is lower than 1, or the copy order is unknown
+    """
+    if digest_cache is None:
+        digest_cache = DigestCache()
+    start_time = time.monotonic()
+    report, copy_jobs = get_uncommitted_copy_jobs(copy_jobs, options, journal)
+    runnable_jobs = order_copy_jobs(
+        create_parent_folders_of_copy_jobs(copy_jobs, report, inventory), options.scheduling.copy_order, inventory
+    )
+    limiter = create_bandwidth_limiter(options.scheduling.bandwidth_limit)
+    semaphores = {}
+    if options.scheduling.jobs_per_destination is not None:
+        semaphores = get_device_semaphores(
+            (destination for _, destination in runnable_jobs), options.scheduling.jobs_per_destination
+        )
+
+    with ThreadPoolExecutor(max_workers=options.scheduling.jobs) as executor:
+        futures = [
+            (
+                job[1],
+                executor.submit(
+                    copy_song_file_with_device_limit,
+                    job,
+                    semaphores.get(job[1].parent),
+                    options.sync.comparison,
+                    digest_cache,
+                    journal,
+                    inventory,
+                    options.scheduling.link_mode,
+                    limiter,
+                ),
+            )
+            for job in runnable_jobs
+        ]
+        collect_copy_results(futures, report)
+    report.elapsed_seconds = time.monotonic() - start_time
+    return report
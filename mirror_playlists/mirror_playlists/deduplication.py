@@ -0,0 +1,234 @@
+"""Deduplication of the songs found at several paths of the library, such as a compilation and its original album.
+
+Songs are grouped by size first, only songs of the same size are digested, with digests cached in the sync state. The
+content of duplicates is mirrored once: the other paths are hard links to the first copy on destination, or, on file
+systems without hard links, playlists reference the first copy instead.
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .change_detection import DigestCache, get_file_stat
+from .copy_engine import (
+    CopyJob,
+    CopyReport,
+    copy_file_atomically,
+    create_parent_folders_of_copy_jobs,
+)
+from .destination_profiles import POSIX
+from .inventory import DirectoryInventory
+from .mirror_options import MirrorOptions
+from .planning import MirrorPlan, PlannedFile
+from .playlist_formats import SongInfo
+from .sync_state import SyncState
+from .transfer import HARDLINK
+
+
+@dataclass
+class DeduplicationReport:
+    """Songs whose content is identical to another song of the playlists, mirrored once."""
+
+    # original song of each duplicate song
+    duplicates: Dict[Path, Path] = field(default_factory=dict)
+    duplicate_bytes: int = 0
+    # playlists reference the original songs instead of hard links to them
+    rewritten: bool = False
+    linked_files: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the report to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: original of each duplicate song, bytes not copied again and how duplicates are mirrored
+        """
+        return {
+            "duplicates": {str(duplicate): str(original) for duplicate, original in self.duplicates.items()},
+            "duplicate_bytes": self.duplicate_bytes,
+            "rewritten": self.rewritten,
+            "linked_files": self.linked_files,
+        }
+
+    def log_summary(self) -> None:
+        """Log the summary of the deduplication, listing every duplicate song."""
+        for duplicate, original in self.duplicates.items():
+            logging.debug("Duplicate %s of %s", str(duplicate), str(original))
+        logging.info(
+            "Found %d duplicate songs, %d bytes mirrored once, %s",
+            len(self.duplicates),
+            self.duplicate_bytes,
+            "referenced by the playlists" if self.rewritten else "as hard links",
+        )
+
+
+def find_duplicate_songs(
+    song_paths: Iterable[Path], inventory: DirectoryInventory, digest_cache: DigestCache
+) -> Tuple[Dict[Path, Path], int]:
+    """Find the songs whose content is identical to a song coming before them.
+
+    Only songs sharing their size with another song are digested.
+    Args:
+        song_paths (Iterable[Path]): path of the songs, in the order of the playlists
+        inventory (DirectoryInventory): inventory answering the stat of the songs
+        digest_cache (DigestCache): cache of digests, completed with the digests computed
+    Returns:
+        Tuple[Dict[Path, Path], int]: original song of each duplicate song, and total size of the duplicate songs
+    """
+    songs_of_size: Dict[int, List[Tuple[Path, os.stat_result]]] = {}
+    for song_path in song_paths:
+        song_stat = inventory.stat(song_path)
+        if song_stat is not None:
+            songs_of_size.setdefault(song_stat.st_size, []).append((song_path, song_stat))
+    duplicates = {}
+    duplicate_bytes = 0
+    for size, songs in songs_of_size.items():
+        if len(songs) < 2:
+            continue
+        original_of_digest: Dict[str, Path] = {}
+        for song_path, song_stat in songs:
+            try:
+                digest = digest_cache.get_digest(song_path, song_stat)
+            except OSError as error:
+                logging.warning("Cannot digest %s: %s", str(song_path), error)
+                continue
+            original = original_of_digest.setdefault(digest, song_path)
+            if original != song_path:
+                duplicates[song_path] = original
+                duplicate_bytes += size
+    return duplicates, duplicate_bytes
+
+
+def deduplicate_playlists(
+    report: DeduplicationReport,
+    playlists: Dict[Path, List[Path]],
+    inventory: DirectoryInventory,
+    sync_state: Optional[SyncState],
+    song_info: Dict[Path, SongInfo],
+    options: MirrorOptions,
+) -> Dict[Path, List[Path]]:
+    """Find the duplicate songs of the playlists, replacing them with their original where hard links are not possible.
+
+    Destinations of a FAT or exFAT profile cannot hold hard links: the playlists reference the original songs, which
+    get the metadata of their duplicates when they have none.
+    Args:
+        report (DeduplicationReport): report completed with the duplicate songs
+        playlists (Dict[Path, List[Path]]): resolved list of existing song path for each playlist file
+        inventory (DirectoryInventory): inventory of the source folders
+        sync_state (Optional[SyncState]): state caching the digests of the songs between runs
+        song_info (Dict[Path, SongInfo]): metadata of each song, completed for the original songs
+        options (MirrorOptions): options of the mirror
+    Returns:
+        Dict[Path, List[Path]]: playlists referencing the original songs, unchanged when duplicates are linked
+    """
+    digest_cache = DigestCache() if sync_state is None else DigestCache(sync_state.get_digests())
+    songs = dict.fromkeys(song_path for songs in playlists.values() for song_path in songs)
+    report.duplicates, report.duplicate_bytes = find_duplicate_songs(songs, inventory, digest_cache)
+    if sync_state is not None:
+        sync_state.set_digests(digest_cache.get_new_digests())
+    report.rewritten = options.destination_profile != POSIX
+    report.log_summary()
+    if not report.rewritten:
+        return playlists
+    for duplicate, original in report.duplicates.items():
+        if duplicate in song_info:
+            song_info.setdefault(original, song_info[duplicate])
+    return {
+        playlist_file: [report.duplicates.get(song_path, song_path) for song_path in songs]
+        for playlist_file, songs in playlists.items()
+    }
+
+
+def get_copy_jobs_of_originals(copy_jobs: List[CopyJob], report: Optional[DeduplicationReport]) -> List[CopyJob]:
+    """Get the copy jobs of the songs that are not linked to another song.
+
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        report (Optional[DeduplicationReport]): duplicate songs, every song is copied if None
+    Returns:
+        List[CopyJob]: copy jobs without the duplicate songs to link
+    """
+    if report is None or report.rewritten:
+        return copy_jobs
+    return [copy_job for copy_job in copy_jobs if copy_job[0] not in report.duplicates]
+
+
+def link_duplicate_songs(
+    copy_jobs: List[CopyJob],
+    report: Optional[DeduplicationReport],
+    copy_report: CopyReport,
+    inventory: Optional[DirectoryInventory] = None,
+) -> None:
+    """Hard link the destination of every duplicate song to the copy of its original song.
+
+    Duplicates already linked to their original are skipped. A duplicate is copied from its original on destination
+    where hard links are not supported, and fails when its original could not be copied.
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path, duplicate songs included
+        report (Optional[DeduplicationReport]): duplicate songs, nothing is linked if None
+        copy_report (CopyReport): report of the copy phase, completed with the linked songs
+        inventory (Optional[DirectoryInventory]): inventory answering stat of destination files
+    """
+    if report is None or report.rewritten:
+        return
+    destinations = dict(copy_jobs)
+    link_jobs = [
+        (destinations[original], destinations[duplicate])
+        for duplicate, original in report.duplicates.items()
+        if duplicate in destinations
+    ]
+    for original_destination, duplicate_destination in create_parent_folders_of_copy_jobs(
+        link_jobs, copy_report, inventory
+    ):
+        if original_destination in copy_report.failures:
+            copy_report.failures[duplicate_destination] = copy_report.failures[original_destination]
+            continue
+        try:
+            original_stat = os.stat(original_destination)
+            duplicate_stat = get_file_stat(duplicate_destination, inventory)
+            if duplicate_stat is not None and os.path.samestat(original_stat, duplicate_stat):
+                copy_report.add_copy_result(duplicate_destination, None)
+                continue
+            copy_file_atomically(original_destination, duplicate_destination, HARDLINK)
+        except OSError as error:
+            copy_report.failures[duplicate_destination] = str(error)
+            continue
+        logging.debug("Linked %s to %s", str(duplicate_destination), str(original_destination))
+        report.linked_files += 1
+
+
+def plan_linked_songs(
+    plan: MirrorPlan,
+    copy_jobs: List[CopyJob],
+    report: Optional[DeduplicationReport],
+    inventory: Optional[DirectoryInventory] = None,
+) -> None:
+    """Plan the hard link of every duplicate song to the copy of its original, as link_duplicate_songs would.
+
+    Duplicates are planned with no bytes, as a link takes no space on destination. The plan of the copy phase is
+    computed with the changed copy jobs of the original songs only, so it skips every duplicate song.
+    Args:
+        plan (MirrorPlan): plan of the run, completed with the duplicate songs
+        copy_jobs (List[CopyJob]): pairs of source and destination song path, duplicate songs included
+        report (Optional[DeduplicationReport]): duplicate songs, nothing is linked if None
+        inventory (Optional[DirectoryInventory]): inventory answering stat of destination files
+    """
+    if report is None or report.rewritten:
+        return
+    destinations = dict(copy_jobs)
+    plan.skipped_songs = [copy_job for copy_job in plan.skipped_songs if copy_job[0] not in report.duplicates]
+    link_jobs = [
+        (duplicate, destinations[original], destinations[duplicate])
+        for duplicate, original in report.duplicates.items()
+        if duplicate in destinations
+    ]
+    for duplicate, original_destination, duplicate_destination in link_jobs:
+        duplicate_stat = get_file_stat(duplicate_destination, inventory)
+        original_stat = get_file_stat(original_destination, inventory)
+        if duplicate_stat is None:
+            plan.copied_songs.append(PlannedFile(duplicate_destination, 0, source=duplicate))
+        elif original_stat is not None and os.path.samestat(original_stat, duplicate_stat):
+            plan.skipped_songs.append((duplicate, duplicate_destination))
+        else:
+            plan.updated_songs.append(PlannedFile(duplicate_destination, 0, duplicate_stat.st_size, source=duplicate))
@@ -0,0 +1,298 @@
+"""Destination profiles mapping source paths to paths that are legal on the destination file system.
+
+FAT32 and exFAT reject some characters, limit the length of names and do not distinguish case, so that two source
+paths may map to the same destination file. FAT32 also limits the length of whole paths. The mapping of every source
+path is recorded in an index, persisted on destination, so that a song keeps its destination name from one run to the
+next.
+"""
+
+import json
+import logging
+import os
+import re
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, Optional
+
+POSIX = "posix"
+FAT = "fat"
+EXFAT = "exfat"
+DESTINATION_PROFILES = (POSIX, FAT, EXFAT)
+PATH_INDEX_FILE_NAME = ".mirror_playlists.paths.json"
+# characters FAT32 and exFAT reject in names, with the control characters
+INVALID_CHARACTERS = re.compile(r'[\x00-\x1f"*:<>?\\|\x7f]')
+RESERVED_NAMES = {"CON", "PRN", "AUX", "NUL"} | {
+    f"{device}{index}" for device in ("COM", "LPT") for index in range(1, 10)
+}
+# both file systems store names as at most 255 UTF-16 code units
+MAX_NAME_LENGTH = 255
+# longer suffixes are not kept when a name is truncated
+MAX_SUFFIX_LENGTH = 16
+# FAT32 devices limit a path below the volume root to 255 UTF-16 code units, exFAT does not
+MAX_FAT_PATH_LENGTH = 255
+# names are not truncated below this length to fit a path of a deep folder
+MIN_NAME_LENGTH = 32
+
+
+def get_name_length(name: str) -> int:
+    """Get the length of a name as stored by FAT32 and exFAT.
+
+    Args:
+        name (str): file or folder name
+    Returns:
+        int: number of UTF-16 code units
+    """
+    return len(name.encode("utf-16-le")) // 2
+
+
+def truncate_name(name: str, max_length: int) -> str:
+    """Truncate a name to a maximum length, keeping its suffix.
+
+    Args:
+        name (str): file or folder name
+        max_length (int): maximum number of UTF-16 code units
+    Returns:
+        str: name, shortened before its suffix if too long
+    """
+    if get_name_length(name) <= max_length:
+        return name
+    suffix = PurePosixPath(name).suffix
+    if len(suffix) > MAX_SUFFIX_LENGTH:
+        suffix = ""
+    stem = name[: len(name) - len(suffix)]
+    while stem and get_name_length(stem + suffix) > max_length:
+        stem = stem[:-1]
+    return stem.rstrip(". ") + suffix
+
+
+def sanitize_name(name: str) -> str:
+    """Get a name that FAT32 and exFAT accept.
+
+    Invalid characters are replaced with an underscore, trailing dots and spaces are removed, reserved device names
+    are prefixed with an underscore, and the name is truncated to MAX_NAME_LENGTH.
+    Args:
+        name (str): file or folder name
+    Returns:
+        str: legal name
+    """
+    name = INVALID_CHARACTERS.sub("_", name).rstrip(". ") or "_"
+    if name.split(".")[0].upper() in RESERVED_NAMES:
+        name = f"_{name}"
+    return truncate_name(name, MAX_NAME_LENGTH)
+
+
+def add_counter(name: str, counter: int, max_length: int = MAX_NAME_LENGTH) -> str:
+    """Add a counter to a name before its suffix, to make it unique.
+
+    Args:
+        name (str): file name
+        counter (int): counter
+        max_length (int): maximum number of UTF-16 code units
+    Returns:
+        str: name with the counter, as "name (2).mp3", no longer than max_length
+    """
+    path = PurePosixPath(name)
+    counter_text = f" ({counter}){path.suffix}"
+    return truncate_name(path.stem, max_length - get_name_length(counter_text)) + counter_text
+
+
+class PathIndex:
+    """Collision free mapping of source paths below the music root to paths legal on destination.
+
+    Source paths are mapped relative to the music root, mapped paths are returned below the music root as well, so
+    that they can replace source paths when computing destination paths and relative paths between playlists and
+    songs. With the posix profile, paths are not changed. Mapped paths do not collide once transcoded songs get their
+    new suffix, which is not part of the mapped path.
+    """
+
+    def __init__(
+        self,
+        music_root_folder_path: Path,
+        profile: str = POSIX,
+        mappings: Optional[Dict[str, str]] = None,
+        transcoded_suffixes: Optional[Dict[str, str]] = None,
+    ):
+        """Create the index.
+
+        Args:
+            music_root_folder_path (Path): root folder of the music repository to be mirror
+            profile (str): destination profile, see DESTINATION_PROFILES
+            mappings (Optional[Dict[str, str]]): destination path of already mapped source paths, relative to the
+                music root, with POSIX separators
+            transcoded_suffixes (Optional[Dict[str, str]]): suffix of the transcoded songs by lower case suffix of
+                their source, nothing is transcoded if None
+        Raises:
+            ValueError: if the profile is unknown
+        """
+        if profile not in DESTINATION_PROFILES:
+            raise ValueError(f"Unknown destination profile {profile}")
+        self.music_root_folder_path = music_root_folder_path
+        self.profile = profile
+        self.transcoded_suffixes = transcoded_suffixes or {}
+        self.mappings: Dict[str, str] = {}
+        # source path owning each final destination path, and spelling of each destination folder, by case folded path
+        self.owners: Dict[str, str] = {}
+        self.folders: Dict[str, str] = {}
+        self.changed = False
+        for source, destination in (mappings or {}).items():
+            # a mapping colliding with another one once transcoded is mapped again
+            if self.get_owner_key(PurePosixPath(destination)) in self.owners:
+                self.changed = True
+                continue
+            self.add_mapping(source, PurePosixPath(destination))
+
+    def get_final_name(self, name: str) -> str:
+        """Get the name a file has on destination, with the suffix of the transcoded songs if it is transcoded.
+
+        Args:
+            name (str): mapped file name
+        Returns:
+            str: name written on destination
+        """
+        suffix = PurePosixPath(name).suffix
+        return name[: len(name) - len(suffix)] + self.transcoded_suffixes.get(suffix.lower(), suffix)
+
+    def get_owner_key(self, destination: PurePosixPath) -> str:
+        """Get the key of a mapped path in the owners, the final destination path ignoring case.
+
+        Args:
+            destination (PurePosixPath): destination path relative to the music root
+        Returns:
+            str: case folded final destination path
+        """
+        return str(destination.with_name(self.get_final_name(destination.name))).casefold()
+
+    def get_max_name_length(self, folder: PurePosixPath, name: str) -> int:
+        """Get the maximum length of a mapped file name, so that its final name fits in the profile limits.
+
+        Args:
+            folder (PurePosixPath): destination folder relative to the music root
+            name (str): mapped file name
+        Returns:
+            int: maximum number of UTF-16 code units of the mapped name
+        """
+        max_length = MAX_NAME_LENGTH
+        if self.profile == FAT:
+            folder_length = 0 if folder == PurePosixPath() else get_name_length(str(folder)) + 1
+            max_length = max(min(max_length, MAX_FAT_PATH_LENGTH - folder_length), MIN_NAME_LENGTH)
+        return max_length - get_name_length(self.get_final_name(name)) + get_name_length(name)
+
+    def add_mapping(self, source: str, destination: PurePosixPath) -> None:
+        """Record the destination of a source path.
+
+        Args:
+            source (str): source path relative to the music root, with POSIX separators
+            destination (PurePosixPath): destination path relative to the music root
+        """
+        self.mappings[source] = str(destination)
+        self.owners[self.get_owner_key(destination)] = source
+        for folder in destination.parents:
+            self.folders.setdefault(str(folder).casefold(), str(folder))
+
+    def map_folder(self, folder: PurePosixPath) -> PurePosixPath:
+        """Get the destination of a folder, with the spelling of the first mapped folder differing only by case.
+
+        Args:
+            folder (PurePosixPath): source folder relative to the music root
+        Returns:
+            PurePosixPath: destination folder relative to the music root
+        """
+        mapped_folder = PurePosixPath()
+        for part in folder.parts:
+            mapped_folder = mapped_folder / sanitize_name(part)
+            mapped_folder = PurePosixPath(self.folders.get(str(mapped_folder).casefold(), str(mapped_folder)))
+        return mapped_folder
+
+    def map_path(self, path: Path) -> Path:
+        """Get the path that replaces a source path on destination.
+
+        Args:
+            path (Path): path of a song or playlist below the music root
+        Returns:
+            Path: legal path below the music root, unique ignoring case, the same for every call and every run
+        """
+        if self.profile == POSIX:
+            return path
+        source = path.relative_to(self.music_root_folder_path).as_posix()
+        destination = self.mappings.get(source)
+        if destination is None:
+            source_path = PurePosixPath(source)
+            folder = self.map_folder(source_path.parent)
+            name = sanitize_name(source_path.name)
+            max_length = self.get_max_name_length(folder, name)
+            name = truncate_name(name, max_length)
+            candidate = folder / name
+            counter = 2
+            while self.get_owner_key(candidate) in self.owners or str(candidate).casefold() in self.folders:
+                candidate = folder / add_counter(name, counter, max_length)
+                counter += 1
+            self.add_mapping(source, candidate)
+            self.changed = True
+            destination = str(candidate)
+            if destination != source:
+                logging.debug("Song %s is mirrored as %s", source, destination)
+        return self.music_root_folder_path / destination
+
+    def save(self, destination_folder_path: Path) -> None:
+        """Write the index on destination if new paths were mapped.
+
+        Args:
+            destination_folder_path (Path): destination where we should mirror files
+        """
+        if not self.changed:
+            return
+        index_file_path = destination_folder_path / PATH_INDEX_FILE_NAME
+        partial_file_path = index_file_path.with_name(f"{PATH_INDEX_FILE_NAME}.partial")
+        with open(partial_file_path, "w", encoding="utf-8") as index_file:
+            json.dump(self.mappings, index_file, indent=0, ensure_ascii=False, sort_keys=True)
+        os.replace(partial_file_path, index_file_path)
+        self.changed = False
+
+
+def load_path_index(
+    music_root_folder_path: Path,
+    destination_folder_path: Path,
+    profile: str = POSIX,
+    transcoded_suffixes: Optional[Dict[str, str]] = None,
+) -> PathIndex:
+    """Load the index of the paths mapped on destination by previous runs.
+
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        destination_folder_path (Path): destination where we should mirror files
+        profile (str): destination profile, see DESTINATION_PROFILES
+        transcoded_suffixes (Optional[Dict[str, str]]): suffix of the transcoded songs by lower case suffix of their
+            source, nothing is transcoded if None
+    Returns:
+        PathIndex: index with the mappings of previous runs, empty with the posix profile or without previous run
+    """
+    mappings = None
+    index_file_path = destination_folder_path / PATH_INDEX_FILE_NAME
+    if profile != POSIX and index_file_path.exists():
+        with open(index_file_path, "r", encoding="utf-8") as index_file:
+            mappings = json.load(index_file)
+    return PathIndex(music_root_folder_path, profile, mappings, transcoded_suffixes)
+
+
+def load_path_indexes(
+    music_root_folder_path: Path,
+    destination_folder_paths: Iterable[Path],
+    profile: str = POSIX,
+    transcoded_suffixes: Optional[Dict[str, str]] = None,
+) -> Dict[Path, PathIndex]:
+    """Load the index of the paths mapped on each destination by previous runs.
+
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        destination_folder_paths (Iterable[Path]): destinations where we should mirror files
+        profile (str): destination profile, see DESTINATION_PROFILES
+        transcoded_suffixes (Optional[Dict[str, str]]): suffix of the transcoded songs by lower case suffix of their
+            source, nothing is transcoded if None
+    Returns:
+        Dict[Path, PathIndex]: index of each destination folder
+    """
+    return {
+        destination_folder_path: load_path_index(
+            music_root_folder_path, destination_folder_path, profile, transcoded_suffixes
+        )
+        for destination_folder_path in destination_folder_paths
+    }
@@ -0,0 +1,548 @@
+"""Mirror of the playlists to several destinations in a single run, reading each source song once.
+
+Discovery and parsing run once for all destinations. Each song is then read once and written to every destination
+where it is not up to date, while each destination keeps its own journal, report and failures.
+"""
+
+import contextlib
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import replace
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from .change_detection import EXISTS, DigestCache
+from .copy_engine import (
+    JOURNAL_FILE_NAME,
+    PROGRESS_INTERVAL_SECONDS,
+    CopyJob,
+    CopyJournal,
+    CopyReport,
+    create_parent_folders_of_copy_jobs,
+    get_uncommitted_copy_jobs,
+    tee_song_file_if_changed,
+)
+from .destination_profiles import PathIndex, load_path_indexes
+from .inventory import DirectoryInventory
+from .mirror_options import MirrorOptions
+from .mirror_playlists_utils import (
+    check_mirror_folders,
+    get_all_playlist_files,
+    get_copy_jobs,
+    parse_and_select_playlists,
+    plan_mirror,
+    write_playlists_and_prune,
+)
+from .playlist_formats import SongInfo
+from .run_report import PhaseMetrics, RunReport
+from .scheduling import BandwidthLimiter, create_bandwidth_limiter, order_copy_jobs
+from .song_copy import get_changed_copy_jobs
+from .song_resolver import create_song_resolver
+from .sync_state import SyncState, open_sync_state
+from .transcoding import transcode_copy_jobs
+
+# destination folder and destination song path of a song
+SongTarget = Tuple[Path, Path]
+TeeResult = Dict[Path, Union[Tuple[Optional[int], float], OSError]]
+
+
+def copy_song_to_destinations(
+    source_song_path: Path,
+    targets: List[SongTarget],
+    options: MirrorOptions,
+    digest_cache: DigestCache,
+    journals: Dict[Path, CopyJournal],
+    inventory: Optional[DirectoryInventory],
+    limiter: Optional[BandwidthLimiter] = None,
+) -> TeeResult:
+    """Copy a song to every destination where it is not up to date, and commit it to the journal of each destination.
+
+    Args:
+        source_song_path (Path): Path to the source song file.
+        targets (List[SongTarget]): destination folder and destination song path of each copy
+        options (MirrorOptions): comparison strategy and link mode
+        digest_cache (DigestCache): cache of digests, only used by the hash comparison
+        journals (Dict[Path, CopyJournal]): journal of each destination folder
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes read per second, no limit if None
+    Returns:
+        TeeResult: for each destination song path, number of copied bytes (None if it was already up to date) and
+            seconds spent comparing and copying, or error
+    """
+    results = tee_song_file_if_changed(
+        source_song_path,
+        [destination_song_path for _, destination_song_path in targets],
+        options.sync.comparison,
+        digest_cache,
+        inventory,
+        options.scheduling.link_mode,
+        limiter,
+    )
+    for destination_folder_path, destination_song_path in targets:
+        if isinstance(results[destination_song_path], OSError):
+            continue
+        try:
+            journals[destination_folder_path].commit(destination_song_path)
+        except OSError as error:
+            results[destination_song_path] = error
+    return results
+
+
+def collect_fan_out_results(
+    futures: List[Tuple[List[SongTarget], "Future[TeeResult]"]], reports: Dict[Path, CopyReport]
+) -> None:
+    """Wait for every song and account its result in the report of each destination.
+
+    The progress of each destination is logged at most every PROGRESS_INTERVAL_SECONDS.
+    Args:
+        futures (List[Tuple[List[SongTarget], Future[TeeResult]]]): targets and pending results of each song
+        reports (Dict[Path, CopyReport]): report of the copy phase of each destination folder
+    """
+    total_jobs = dict.fromkeys(reports, 0)
+    for targets, _ in futures:
+        for destination_folder_path, _ in targets:
+            total_jobs[destination_folder_path] += 1
+    done_jobs = dict.fromkeys(reports, 0)
+    last_progress_time = time.monotonic()
+    for targets, future in futures:
+        results = future.result()
+        for destination_folder_path, destination_song_path in targets:
+            result = results[destination_song_path]
+            if isinstance(result, OSError):
+                reports[destination_folder_path].failures[destination_song_path] = str(result)
+            else:
+                reports[destination_folder_path].add_copy_result(destination_song_path, *result)
+            done_jobs[destination_folder_path] += 1
+        if time.monotonic() - last_progress_time >= PROGRESS_INTERVAL_SECONDS:
+            last_progress_time = time.monotonic()
+            for destination_folder_path, report in reports.items():
+                logging.info(
+                    "%s: examined %d of %d songs, copied %d bytes",
+                    str(destination_folder_path),
+                    done_jobs[destination_folder_path],
+                    total_jobs[destination_folder_path],
+                    report.copied_bytes,
+                )
+
+
+def get_targets_of_songs(
+    copy_jobs: Dict[Path, List[CopyJob]],
+    options: MirrorOptions,
+    journals: Dict[Path, CopyJournal],
+    inventory: Optional[DirectoryInventory],
+) -> Tuple[Dict[Path, CopyReport], Dict[Path, List[SongTarget]]]:
+    """Group the copy jobs of all destinations by source song, once their parent folders are created.
+
+    Source songs are ordered by the copy order of the options.
+    Args:
+        copy_jobs (Dict[Path, List[CopyJob]]): pairs of source and destination song path of each destination folder
+        options (MirrorOptions): number of copy jobs, checked, and copy order
+        journals (Dict[Path, CopyJournal]): journal of committed songs of each destination folder
+        inventory (Optional[DirectoryInventory]): inventory of the destination, folders it knows are not created, and
+            of the source folders
+    Returns:
+        Tuple[Dict[Path, CopyReport], Dict[Path, List[SongTarget]]]: report of each destination folder, counting the
+            committed songs as skipped and the songs whose folder could not be created as failed, and targets of
+            each source song
+    """
+    reports = {}
+    targets_of_songs: Dict[Path, List[SongTarget]] = {}
+    for destination_folder_path, destination_copy_jobs in copy_jobs.items():
+        report, uncommitted_jobs = get_uncommitted_copy_jobs(
+            destination_copy_jobs, options, journals[destination_folder_path]
+        )
+        reports[destination_folder_path] = report
+        for source, destination in create_parent_folders_of_copy_jobs(uncommitted_jobs, report, inventory):
+            targets_of_songs.setdefault(source, []).append((destination_folder_path, destination))
+    ordered_copy_jobs = order_copy_jobs(
+        [(source, targets[0][1]) for source, targets in targets_of_songs.items()],
+        options.scheduling.copy_order,
+        inventory,
+    )
+    return reports, {source: targets_of_songs[source] for source, _ in ordered_copy_jobs}
+
+
+def copy_all_songs_to_destinations(
+    copy_jobs: Dict[Path, List[CopyJob]],
+    options: MirrorOptions,
+    digest_cache: DigestCache,
+    journals: Dict[Path, CopyJournal],
+    inventory: Optional[DirectoryInventory] = None,
+) -> Dict[Path, CopyReport]:
+    """Copy all songs that are not up to date to their destinations concurrently with a bounded thread pool.
+
+    Each copy job of the pool reads one source song and writes it to every destination that needs it.
+    A failure on one destination does not abort the others, it is collected in the report of the destination.
+    Args:
+        copy_jobs (Dict[Path, List[CopyJob]]): pairs of source and destination song path of each destination folder
+        options (MirrorOptions): number of copy threads, comparison strategy, link mode, copy order and bandwidth
+            limit
+        digest_cache (DigestCache): cache of digests, only used by the hash comparison
+        journals (Dict[Path, CopyJournal]): journal of committed songs of each destination folder
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files, and
+            telling which destination folders already exist
+    Returns:
+        Dict[Path, CopyReport]: aggregated result of the copy to each destination folder
+    """
+    start_time = time.monotonic()
+    reports, targets_of_songs = get_targets_of_songs(copy_jobs, options, journals, inventory)
+    limiter = create_bandwidth_limiter(options.scheduling.bandwidth_limit)
+    with ThreadPoolExecutor(max_workers=options.scheduling.jobs) as executor:
+        futures = [
+            (
+                targets,
+                executor.submit(
+                    copy_song_to_destinations, source, targets, options, digest_cache, journals, inventory, limiter
+                ),
+            )
+            for source, targets in targets_of_songs.items()
+        ]
+        collect_fan_out_results(futures, reports)
+    for report in reports.values():
+        report.elapsed_seconds = time.monotonic() - start_time
+    return reports
+
+
+def copy_songs_to_destinations(
+    copy_jobs: Dict[Path, List[CopyJob]],
+    song_stats: Dict[Path, os.stat_result],
+    sync_state: Optional[SyncState],
+    options: MirrorOptions,
+    inventory: DirectoryInventory,
+) -> Dict[Path, CopyReport]:
+    """Copy the songs that are not up to date on each destination, transcoding lossless songs first when enabled.
+
+    With a sync state, only the songs whose source changed since they were last mirrored to a destination are
+    examined, and the mirrored songs are recorded per destination.
+    Args:
+        copy_jobs (Dict[Path, List[CopyJob]]): pairs of source and destination song path of each destination folder
+        song_stats (Dict[Path, os.stat_result]): stat of each source song, only used with a sync state
+        sync_state (Optional[SyncState]): state of previous runs
+        options (MirrorOptions): options of the copy
+        inventory (DirectoryInventory): inventory of the source and destination folders
+    Returns:
+        Dict[Path, CopyReport]: aggregated result of the copy to each destination folder
+    """
+    digest_cache = DigestCache() if sync_state is None else DigestCache(sync_state.get_digests())
+    changed_copy_jobs = {}
+    runnable_copy_jobs = {}
+    transcode_failures = {}
+    for destination_folder_path, destination_copy_jobs in copy_jobs.items():
+        changed_copy_jobs[destination_folder_path] = get_changed_copy_jobs(
+            destination_copy_jobs, song_stats, sync_state, inventory
+        )
+        # transcoded songs are cached by source digest, so each song is encoded once for all destinations
+        runnable_copy_jobs[destination_folder_path], transcode_failures[destination_folder_path] = transcode_copy_jobs(
+            changed_copy_jobs[destination_folder_path],
+            options.transcode,
+            digest_cache,
+            options.sync.comparison == EXISTS,
+            inventory,
+        )
+    with contextlib.ExitStack() as stack:
+        journals = {
+            destination_folder_path: stack.enter_context(CopyJournal(destination_folder_path / JOURNAL_FILE_NAME))
+            for destination_folder_path in copy_jobs
+        }
+        copy_reports = copy_all_songs_to_destinations(runnable_copy_jobs, options, digest_cache, journals, inventory)
+    for destination_folder_path, copy_report in copy_reports.items():
+        copy_report.failures.update(transcode_failures[destination_folder_path])
+        if sync_state is not None:
+            copy_report.skipped_files += len(copy_jobs[destination_folder_path]) - len(
+                changed_copy_jobs[destination_folder_path]
+            )
+            sync_state.set_songs_mirrored(
+                (source, destination, song_stats[source])
+                for source, destination in changed_copy_jobs[destination_folder_path]
+                if destination not in copy_report.failures
+            )
+    if sync_state is not None:
+        sync_state.set_digests(digest_cache.get_new_digests())
+    return copy_reports
+
+
+def parse_playlists_once(
+    report: RunReport,
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    inventory: DirectoryInventory,
+    sync_state: Optional[SyncState],
+    song_info: Dict[Path, SongInfo],
+    options: MirrorOptions,
+) -> Tuple[Dict[Path, List[Path]], Dict[Path, os.stat_result]]:
+    """Discover and parse the playlists once for all destinations, then select the songs fitting in the capacity.
+
+    Missing songs are resolved when enabled.
+    Args:
+        report (RunReport): report shared by all destinations, completed with the discovery and parse phases, the
+            relocated and missing songs, and the songs selected and left out
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        inventory (DirectoryInventory): inventory of the source folders
+        sync_state (Optional[SyncState]): state of previous runs, unchanged playlists are not parsed again
+        song_info (Dict[Path, SongInfo]): metadata of each song, completed from the parsed playlists
+        options (MirrorOptions): options of the mirror
+    Returns:
+        Tuple[Dict[Path, List[Path]], Dict[Path, os.stat_result]]: resolved list of song path for each playlist file,
+            and stat of each source song with a sync state
+    """
+    with report.measure_phase("discovery") as phase:
+        playlist_files = get_all_playlist_files(playlist_root_folder_path, inventory)
+        phase.items = len(playlist_files)
+    resolver = create_song_resolver(music_root_folder_path, options)
+    with report.measure_phase("parse") as phase:
+        playlists, song_stats = parse_and_select_playlists(
+            report, playlist_files, inventory, sync_state, song_info, resolver, options
+        )
+        phase.items = len(playlists)
+    return playlists, song_stats
+
+
+def get_copy_jobs_of_destinations(
+    reports: Dict[Path, RunReport],
+    playlists: Dict[Path, List[Path]],
+    music_root_folder_path: Path,
+    inventory: DirectoryInventory,
+    options: MirrorOptions,
+    scan_destinations: bool,
+    path_indexes: Dict[Path, PathIndex],
+) -> Dict[Path, List[CopyJob]]:
+    """Get the copy jobs of each destination, listing the destination folders first when there is no sync state.
+
+    Args:
+        reports (Dict[Path, RunReport]): report of each destination folder, completed with the stat and jobs phases
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        inventory (DirectoryInventory): inventory of the source and destination folders
+        options (MirrorOptions): options of the mirror
+        scan_destinations (bool): list the destination folders in the inventory
+        path_indexes (Dict[Path, PathIndex]): index mapping the paths of songs on each destination folder
+    Returns:
+        Dict[Path, List[CopyJob]]: pairs of source and destination song path of each destination folder
+    """
+    copy_jobs = {}
+    for destination_folder_path, report in reports.items():
+        if scan_destinations:
+            with report.measure_phase("stat") as phase:
+                inventory.scan_tree(destination_folder_path)
+                phase.items = len(inventory.get_folders_below(destination_folder_path))
+        with report.measure_phase("jobs") as phase:
+            copy_jobs[destination_folder_path] = get_copy_jobs(
+                playlists,
+                music_root_folder_path,
+                destination_folder_path,
+                options.transcode,
+                path_indexes[destination_folder_path],
+            )
+            phase.items = len(copy_jobs[destination_folder_path])
+    return copy_jobs
+
+
+def plan_destinations(
+    reports: Dict[Path, RunReport],
+    playlists: Dict[Path, List[Path]],
+    copy_jobs: Dict[Path, List[CopyJob]],
+    song_stats: Dict[Path, os.stat_result],
+    sync_state: Optional[SyncState],
+    music_root_folder_path: Path,
+    inventory: DirectoryInventory,
+    options: MirrorOptions,
+    song_info: Dict[Path, SongInfo],
+    path_indexes: Dict[Path, PathIndex],
+) -> None:
+    """Plan the run on each destination, without writing anything.
+
+    Args:
+        reports (Dict[Path, RunReport]): report of each destination folder, completed with its plan
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        copy_jobs (Dict[Path, List[CopyJob]]): pairs of source and destination song path of each destination folder
+        song_stats (Dict[Path, os.stat_result]): stat of each source song, only used with a sync state
+        sync_state (Optional[SyncState]): state of previous runs
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        inventory (DirectoryInventory): inventory of the source and destination folders
+        options (MirrorOptions): options of the mirror
+        song_info (Dict[Path, SongInfo]): metadata of each song, written as #EXTINF lines
+        path_indexes (Dict[Path, PathIndex]): index mapping the paths of playlists and songs on each destination folder
+    """
+    for destination_folder_path, report in reports.items():
+        changed_copy_jobs = copy_jobs[destination_folder_path]
+        digest_cache = DigestCache()
+        if sync_state is not None:
+            changed_copy_jobs = get_changed_copy_jobs(changed_copy_jobs, song_stats, sync_state, inventory)
+            digest_cache = DigestCache(sync_state.get_digests())
+        with report.measure_phase("plan"):
+            report.plan = plan_mirror(
+                playlists,
+                copy_jobs[destination_folder_path],
+                changed_copy_jobs,
+                digest_cache,
+                music_root_folder_path,
+                destination_folder_path,
+                inventory=inventory,
+                options=options,
+                song_info=song_info,
+                path_index=path_indexes[destination_folder_path],
+            )
+
+
+def copy_destinations(
+    shared_report: RunReport,
+    reports: Dict[Path, RunReport],
+    copy_jobs: Dict[Path, List[CopyJob]],
+    song_stats: Dict[Path, os.stat_result],
+    sync_state: Optional[SyncState],
+    options: MirrorOptions,
+    inventory: DirectoryInventory,
+) -> None:
+    """Copy the songs to every destination, measuring the copy phase once for all of them.
+
+    Args:
+        shared_report (RunReport): report of the phases shared by all destinations, completed with the copy phase
+        reports (Dict[Path, RunReport]): report of each destination folder, completed with its copy report
+        copy_jobs (Dict[Path, List[CopyJob]]): pairs of source and destination song path of each destination folder
+        song_stats (Dict[Path, os.stat_result]): stat of each source song, only used with a sync state
+        sync_state (Optional[SyncState]): state of previous runs
+        options (MirrorOptions): options of the mirror
+        inventory (DirectoryInventory): inventory of the source and destination folders
+    """
+    with shared_report.measure_phase("copy") as phase:
+        copy_reports = copy_songs_to_destinations(copy_jobs, song_stats, sync_state, options, inventory)
+    for destination_folder_path, report in reports.items():
+        report.copy_report = copy_reports[destination_folder_path]
+        report.phases["copy"] = PhaseMetrics(phase.seconds, report.copy_report.copied_files)
+
+
+def write_destinations(
+    reports: Dict[Path, RunReport],
+    playlists: Dict[Path, List[Path]],
+    copy_jobs: Dict[Path, List[CopyJob]],
+    sync_state: Optional[SyncState],
+    music_root_folder_path: Path,
+    inventory: DirectoryInventory,
+    options: MirrorOptions,
+    song_info: Dict[Path, SongInfo],
+    path_indexes: Dict[Path, PathIndex],
+) -> None:
+    """Write the playlists on each destination and prune them, once the songs are copied.
+
+    Args:
+        reports (Dict[Path, RunReport]): report of each destination folder with its copy report, completed with the
+            write and prune phases
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        copy_jobs (Dict[Path, List[CopyJob]]): pairs of source and destination song path of each destination folder
+        sync_state (Optional[SyncState]): state recording the digests of the playlist files between runs, and
+            forgetting the pruned songs
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        inventory (DirectoryInventory): inventory of the source and destination folders
+        options (MirrorOptions): options of the mirror
+        song_info (Dict[Path, SongInfo]): metadata of each song, written as #EXTINF lines
+        path_indexes (Dict[Path, PathIndex]): index mapping the paths of playlists and songs on each destination folder
+    """
+    for destination_folder_path, report in reports.items():
+        logging.info("Destination %s:", str(destination_folder_path))
+        report.copy_report.log_summary()
+        write_playlists_and_prune(
+            report,
+            playlists,
+            copy_jobs[destination_folder_path],
+            music_root_folder_path,
+            destination_folder_path,
+            inventory=inventory,
+            options=options,
+            song_info=song_info,
+            path_index=path_indexes[destination_folder_path],
+            sync_state=sync_state,
+        )
+        report.log_summary()
+
+
+def check_destination_folders(
+    music_root_folder_path: Path, playlist_root_folder_path: Path, destination_folder_paths: List[Path]
+) -> None:
+    """Check that the folders of a mirror run exist and that every destination is writable.
+
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        destination_folder_paths (List[Path]): destinations where we should mirror files
+    """
+    for destination_folder_path in destination_folder_paths:
+        check_mirror_folders(music_root_folder_path, playlist_root_folder_path, destination_folder_path)
+
+
+def mirror_all_playlist_to_destinations(
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    destination_folder_paths: List[Path],
+    options: Optional[MirrorOptions] = None,
+) -> Dict[Path, RunReport]:
+    """Mirror all playlist and there content to each of the given destinations, reading each song once.
+
+    The result on each destination is the same as with mirror_all_playlist. The copy phase uses the thread pool
+    engine, jobs_per_destination does not apply since every copy job writes to all destinations.
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        destination_folder_paths (List[Path]): destinations where we should mirror files
+        options (Optional[MirrorOptions]): options of the mirror, default options if None
+    Returns:
+        Dict[Path, RunReport]: report of each destination, the discovery, parse and copy phases are measured once
+            for all of them
+    Raises:
+        FileNotFoundError: if the music folder or the playlist root or a destination folder does not exist.
+        PermissionError: if no write permission to a destination.
+    """
+    if options is None:
+        options = MirrorOptions()
+    check_destination_folders(music_root_folder_path, playlist_root_folder_path, destination_folder_paths)
+    path_indexes = load_path_indexes(
+        music_root_folder_path, destination_folder_paths, options.destination_profile, options.get_transcoded_suffixes()
+    )
+
+    shared_report = RunReport()
+    inventory = DirectoryInventory()
+    song_info: Dict[Path, SongInfo] = {}
+    with open_sync_state(options.sync.state_file_path, options.dry_run) as sync_state:
+        playlists, song_stats = parse_playlists_once(
+            shared_report, music_root_folder_path, playlist_root_folder_path, inventory, sync_state, song_info, options
+        )
+        reports = {
+            destination_folder_path: RunReport(
+                {name: replace(metrics) for name, metrics in shared_report.phases.items()},
+                budget_report=shared_report.budget_report,
+                resolver_report=shared_report.resolver_report,
+            )
+            for destination_folder_path in destination_folder_paths
+        }
+        copy_jobs = get_copy_jobs_of_destinations(
+            reports, playlists, music_root_folder_path, inventory, options, sync_state is None, path_indexes
+        )
+        if options.dry_run:
+            plan_destinations(
+                reports,
+                playlists,
+                copy_jobs,
+                song_stats,
+                sync_state,
+                music_root_folder_path,
+                inventory,
+                options,
+                song_info,
+                path_indexes,
+            )
+            return reports
+        copy_destinations(shared_report, reports, copy_jobs, song_stats, sync_state, options, inventory)
+        write_destinations(
+            reports,
+            playlists,
+            copy_jobs,
+            sync_state,
+            music_root_folder_path,
+            inventory,
+            options,
+            song_info,
+            path_indexes,
+        )
+    return reports
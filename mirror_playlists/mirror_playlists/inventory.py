@@ -0,0 +1,143 @@
+"""In-memory index of files, built by listing each directory at most once."""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+class DirectoryInventory:
+    """Index of the files of the directories listed with os.scandir.
+
+    Directories are listed either eagerly, a whole tree at once, or lazily the first time a file inside them is
+    looked up. Every later existence or stat question about a file of a listed directory is answered from memory, so
+    that songs sharing a directory cost a single directory listing instead of one lookup per song.
+    File names are matched exactly, as stored in the directory.
+    """
+
+    def __init__(self):
+        """Create an empty inventory."""
+        self.folders: Dict[Path, Optional[Dict[str, os.DirEntry]]] = {}
+        self.lock = threading.Lock()
+
+    def list_folder(self, folder: Path) -> Optional[Dict[str, os.DirEntry]]:
+        """List the entries of a folder, only the first time it is requested.
+
+        Args:
+            folder (Path): path of the folder
+        Returns:
+            Optional[Dict[str, os.DirEntry]]: entries of the folder by name, None if the folder does not exist
+        """
+        with self.lock:
+            if folder not in self.folders:
+                try:
+                    with os.scandir(folder) as entries:
+                        self.folders[folder] = {entry.name: entry for entry in entries}
+                except (FileNotFoundError, NotADirectoryError):
+                    self.folders[folder] = None
+            return self.folders[folder]
+
+    def scan_tree(self, root_folder: Path) -> None:
+        """List every folder below root_folder, including root_folder itself.
+
+        Symbolic links to folders are not followed.
+        Args:
+            root_folder (Path): path of the root folder
+        """
+        folders_to_list = [root_folder]
+        while folders_to_list:
+            entries = self.list_folder(folders_to_list.pop())
+            for entry in (entries or {}).values():
+                if entry.is_dir(follow_symlinks=False):
+                    folders_to_list.append(Path(entry.path))
+
+    def forget_tree(self, root_folder: Path) -> None:
+        """Forget the listing of every folder below root_folder, including root_folder itself, to list them again.
+
+        Args:
+            root_folder (Path): path of the root folder
+        """
+        with self.lock:
+            for folder in [folder for folder in self.folders if folder.is_relative_to(root_folder)]:
+                del self.folders[folder]
+
+    def get_folders_below(self, root_folder: Path) -> Dict[Path, Dict[str, os.DirEntry]]:
+        """Get the listed folders below root_folder, including root_folder itself.
+
+        Args:
+            root_folder (Path): path of the root folder
+        Returns:
+            Dict[Path, Dict[str, os.DirEntry]]: entries by name of each existing listed folder
+        """
+        with self.lock:
+            return {
+                folder: entries
+                for folder, entries in self.folders.items()
+                if entries is not None and folder.is_relative_to(root_folder)
+            }
+
+    def has_folder(self, folder: Path) -> bool:
+        """Return true if the folder was listed and exists.
+
+        Args:
+            folder (Path): path of the folder
+        Returns:
+            bool: True if the folder is known to exist
+        """
+        with self.lock:
+            return self.folders.get(folder) is not None
+
+    def stat(self, file_path: Path) -> Optional[os.stat_result]:
+        """Get the stat of a file, listing its parent folder if needed.
+
+        Args:
+            file_path (Path): path of the file
+        Returns:
+            Optional[os.stat_result]: stat of the file, None if the file does not exist
+        """
+        entry = (self.list_folder(file_path.parent) or {}).get(file_path.name)
+        if entry is None:
+            return None
+        try:
+            return entry.stat()
+        except FileNotFoundError:
+            return None
+
+    def get_inode(self, file_path: Path) -> int:
+        """Get the inode number of a file from the listing of its parent folder, without a stat call.
+
+        Args:
+            file_path (Path): path of the file
+        Returns:
+            int: inode number of the file, 0 if the file does not exist
+        """
+        entry = (self.list_folder(file_path.parent) or {}).get(file_path.name)
+        return 0 if entry is None else entry.inode()
+
+    def exists(self, file_path: Path) -> bool:
+        """Return true if the file exists, listing its parent folder if needed.
+
+        Args:
+            file_path (Path): path of the file
+        Returns:
+            bool: True if the file exists
+        """
+        return file_path.name in (self.list_folder(file_path.parent) or {})
+
+    def find_files(self, root_folder: Path, suffixes: Iterable[str]) -> List[Path]:
+        """List every file below root_folder having one of the given suffixes.
+
+        Args:
+            root_folder (Path): path of the root folder
+            suffixes (Iterable[str]): accepted file suffixes, including the leading dot
+        Returns:
+            List[Path]: sorted path of the matching files
+        """
+        self.scan_tree(root_folder)
+        suffixes = tuple(suffixes)
+        return sorted(
+            folder / name
+            for folder, entries in self.get_folders_below(root_folder).items()
+            for name, entry in entries.items()
+            if name.endswith(suffixes) and entry.is_file()
+        )
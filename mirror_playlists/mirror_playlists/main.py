@@ -2,9 +2,143 @@
 """Main script."""
 
 import argparse
+import json
+import logging
+import math
 from pathlib import Path
 
+from .archive import ARCHIVE_FORMATS, mirror_all_playlist_to_archive
+from .change_detection import COMPARISON_STRATEGIES, EXISTS
+from .destination_profiles import DESTINATION_PROFILES, POSIX
+from .fan_out import mirror_all_playlist_to_destinations
+from .mirror_options import (
+    ENGINES,
+    THREADS,
+    CopyScheduling,
+    InFlightLimits,
+    MirrorOptions,
+    PruneSettings,
+    SongSelection,
+    SyncSettings,
+    TranscodeSettings,
+)
 from .mirror_playlists_utils import mirror_all_playlist
+from .scheduling import COPY_ORDERS, LOCALITY
+from .transfer import COPY, LINK_MODES
+from .watch import DEBOUNCE_SECONDS, watch_and_mirror
+
+SIZE_SUFFIXES = {"K": 1000, "M": 1000**2, "G": 1000**3, "T": 1000**4}
+
+
+def positive_int(value: str) -> int:
+    """Parse a strictly positive integer command line argument.
+
+    Args:
+        value (str): value given on the command line
+    Returns:
+        int: parsed value
+    Raises:
+        ArgumentTypeError: if the value is not a strictly positive integer
+    """
+    try:
+        number = int(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"{value} is not an integer") from error
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} must be at least 1")
+    return number
+
+
+def positive_seconds(value: str) -> float:
+    """Parse a finite and strictly positive duration command line argument, in seconds.
+
+    Args:
+        value (str): value given on the command line
+    Returns:
+        float: parsed number of seconds
+    Raises:
+        ArgumentTypeError: if the value is not a finite and strictly positive number
+    """
+    try:
+        seconds = float(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"{value} is not a number") from error
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise argparse.ArgumentTypeError(f"{value} must be a finite number above 0")
+    return seconds
+
+
+def size_in_bytes(value: str) -> int:
+    """Parse a strictly positive size command line argument, in bytes or with a K, M, G or T suffix.
+
+    Suffixes are powers of 1000, as the capacities of devices.
+    Args:
+        value (str): value given on the command line, as 16G
+    Returns:
+        int: parsed size in bytes
+    Raises:
+        ArgumentTypeError: if the value is not a finite and strictly positive size
+    """
+    multiplier = SIZE_SUFFIXES.get(value[-1:].upper(), 1)
+    number_text = value[:-1] if value[-1:].upper() in SIZE_SUFFIXES else value
+    try:
+        number = float(number_text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"{value} is not a size") from error
+    if not math.isfinite(number * multiplier):
+        raise argparse.ArgumentTypeError(f"{value} is not a finite size")
+    size = int(number * multiplier)
+    if size < 1:
+        raise argparse.ArgumentTypeError(f"{value} must be at least 1 byte")
+    return size
+
+
+def run_mirror(args: argparse.Namespace, options: MirrorOptions) -> None:
+    """Mirror the playlists to the destinations of the command line, once or in watch mode.
+
+    Args:
+        args (argparse.Namespace): parsed command line
+        options (MirrorOptions): options of the mirror
+    """
+    if args.watch:
+        try:
+            watch_and_mirror(
+                Path(args.music_folder),
+                Path(args.playlist_root),
+                [Path(destination) for destination in args.destination],
+                options,
+                args.watch_debounce,
+            )
+        except KeyboardInterrupt:
+            logging.info("Stopped watching")
+        return
+    if args.archive:
+        report = mirror_all_playlist_to_archive(
+            Path(args.music_folder), Path(args.playlist_root), Path(args.destination[0]), options, args.archive
+        )
+        if args.report:
+            report.write_json(Path(args.report))
+        return
+    if len(args.destination) == 1:
+        report = mirror_all_playlist(
+            Path(args.music_folder), Path(args.playlist_root), Path(args.destination[0]), options
+        )
+        if report.plan is not None:
+            print(json.dumps(report.plan.to_dict(), indent=2))
+        if args.report:
+            report.write_json(Path(args.report))
+        return
+    reports = mirror_all_playlist_to_destinations(
+        Path(args.music_folder),
+        Path(args.playlist_root),
+        [Path(destination) for destination in args.destination],
+        options,
+    )
+    if options.dry_run:
+        print(json.dumps({str(path): report.plan.to_dict() for path, report in reports.items()}, indent=2))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            json.dump({str(path): report.to_dict() for path, report in reports.items()}, report_file, indent=2)
 
 
 # pylint: disable=(unused-argument)
@@ -18,9 +152,199 @@ def main():
         required=True,
     )
     parser.add_argument("-p", "--playlist-root", help="Root folder of where playlist are located", required=True)
-    parser.add_argument("-d", "--destination", help="destination where the music should be mirrored", required=True)
+    parser.add_argument(
+        "-d",
+        "--destination",
+        help="destination where the music should be mirrored. Repeat it to mirror to several destinations in one run, "
+        "reading each song once",
+        action="append",
+        required=True,
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="number of songs copied concurrently. Default is 4", type=positive_int, default=4
+    )
+    parser.add_argument(
+        "--jobs-per-destination",
+        help="maximum number of concurrent copies to a single destination device. Default is no extra limit",
+        type=positive_int,
+    )
+    parser.add_argument(
+        "--state-file",
+        help="sync state database (created if needed). Unchanged playlists and songs are skipped on later runs",
+    )
+    parser.add_argument(
+        "--compare",
+        help="how to decide that a song on destination is up to date. Default is exists",
+        choices=COMPARISON_STRATEGIES,
+        default=EXISTS,
+    )
+    parser.add_argument(
+        "--prune",
+        help="remove destination files no longer referenced by any playlist, and the folders left empty",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--prune-dry-run",
+        help="only list the files --prune would remove, with the total bytes reclaimed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--dry-run",
+        help="write nothing, print the plan of the run as JSON: songs to copy, update and skip, playlists to write, "
+        "files to prune, with byte totals and the free space of the destination",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--transcode-to",
+        help="transcode lossless songs (flac, wav, aiff) to this format with ffmpeg, for example opus or mp3",
+    )
+    parser.add_argument("--transcode-bitrate", help="bitrate of the transcoded songs. Default is 128k", default="128k")
+    parser.add_argument(
+        "--transcode-cache",
+        help="folder keeping the transcoded songs between runs. Default is ~/.cache/mirror_playlists/transcoded",
+        default=str(Path.home() / ".cache" / "mirror_playlists" / "transcoded"),
+    )
+    parser.add_argument("--encoder", help="ffmpeg executable used to transcode. Default is ffmpeg", default="ffmpeg")
+    parser.add_argument(
+        "--transcode-jobs", help="number of encoder processes. Default is the CPU count", type=positive_int
+    )
+    parser.add_argument(
+        "--engine",
+        help="engine copying songs and writing playlists. asyncio overlaps every blocking operation, for network "
+        "destinations with a high latency. Default is threads",
+        choices=ENGINES,
+        default=THREADS,
+    )
+    parser.add_argument(
+        "--in-flight-stats",
+        help="maximum number of song comparisons in flight with the asyncio engine. Default is 32",
+        type=positive_int,
+        default=InFlightLimits.stats,
+    )
+    parser.add_argument(
+        "--in-flight-mkdirs",
+        help="maximum number of folder creations in flight with the asyncio engine. Default is 8",
+        type=positive_int,
+        default=InFlightLimits.mkdirs,
+    )
+    parser.add_argument(
+        "--in-flight-writes",
+        help="maximum number of playlist writes and journal commits in flight with the asyncio engine. Default is 8",
+        type=positive_int,
+        default=InFlightLimits.writes,
+    )
+    parser.add_argument(
+        "--link-mode",
+        help="how songs are transferred: hardlink or reflink (clone) when source and destination share a file "
+        "system, auto (clone, else copy in the kernel), or copy. Unsupported links fall back to a copy. "
+        "Default is copy",
+        choices=LINK_MODES,
+        default=COPY,
+    )
+    parser.add_argument(
+        "--copy-order",
+        help="order songs are copied in: locality groups them by source folder and inode, then by destination "
+        "folder, so that reads and writes are sequential, playlist follows the playlists. Default is locality",
+        choices=COPY_ORDERS,
+        default=LOCALITY,
+    )
+    parser.add_argument(
+        "--bandwidth-limit",
+        help="maximum bytes copied per second by all copies together, as 20M, so that a background sync does not "
+        "starve the machine. Hard links and clones are not limited. Default is no limit",
+        type=size_in_bytes,
+    )
+    parser.add_argument(
+        "--destination-profile",
+        help="file system of the destination: fat or exfat give songs and playlists legal names, unique ignoring "
+        "case, and keep them from one run to the next. Default is posix, names are kept as they are",
+        choices=DESTINATION_PROFILES,
+        default=POSIX,
+    )
+    parser.add_argument(
+        "--capacity",
+        help="fill at most this size on destination, as 16G: the songs referenced by the most playlists, then by the "
+        "first playlists, then the most recent are selected, the others are left out of the mirrored playlists",
+        type=size_in_bytes,
+    )
+    parser.add_argument(
+        "--resolve-missing",
+        help="replace songs missing after folders were reorganized or files renamed with the song of the same name, or "
+        "of the same name ignoring case, accents, track number and punctuation, found in the music folder",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--resolver-cache",
+        help="JSON file caching the index of the music folder for --resolve-missing, only the folders that changed "
+        "since the previous run are listed again",
+    )
+    parser.add_argument(
+        "--deduplicate",
+        help="mirror songs of identical content once: the other paths are hard links to the first copy, or with the "
+        "fat and exfat profiles the playlists reference the first copy",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--archive",
+        help="stream songs and playlists into an archive of this format instead of a folder: the destination is the "
+        "archive file, - to write it to the standard output",
+        choices=ARCHIVE_FORMATS,
+    )
+    parser.add_argument(
+        "--watch",
+        help="after mirroring, keep running and mirror the playlists again as soon as they or their songs change",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch-debounce",
+        help=f"seconds without changes ending a burst of changes in watch mode. Default is {DEBOUNCE_SECONDS:g}",
+        type=positive_seconds,
+        default=DEBOUNCE_SECONDS,
+    )
+    parser.add_argument("--report", help="write the metrics of each phase of the run to this JSON file")
+    parser.add_argument("-v", "--verbose", help="log every mirrored song and playlist", action="store_true")
     args = parser.parse_args()
-    mirror_all_playlist(Path(args.music_folder), Path(args.playlist_root), Path(args.destination))
+    if args.watch and args.dry_run:
+        parser.error("--watch cannot be combined with --dry-run")
+    if len({Path(destination).resolve() for destination in args.destination}) < len(args.destination):
+        parser.error("-d/--destination is given several times the same folder")
+    if args.archive and (args.watch or args.dry_run or len(args.destination) > 1):
+        parser.error("--archive cannot be combined with --watch, --dry-run or several destinations")
+    if args.deduplicate and (args.archive or args.watch or len(args.destination) > 1):
+        parser.error("--deduplicate cannot be combined with --archive, --watch or several destinations")
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    transcode_settings = None
+    if args.transcode_to:
+        transcode_settings = TranscodeSettings(
+            Path(args.transcode_cache),
+            target_suffix=f".{args.transcode_to.lstrip('.')}",
+            bitrate=args.transcode_bitrate,
+            encoder=args.encoder,
+            jobs=args.transcode_jobs,
+        )
+    options = MirrorOptions(
+        dry_run=args.dry_run,
+        sync=SyncSettings(state_file_path=Path(args.state_file) if args.state_file else None, comparison=args.compare),
+        scheduling=CopyScheduling(
+            jobs=args.jobs,
+            jobs_per_destination=args.jobs_per_destination,
+            engine=args.engine,
+            in_flight=InFlightLimits(args.in_flight_stats, args.in_flight_mkdirs, args.in_flight_writes),
+            link_mode=args.link_mode,
+            copy_order=args.copy_order,
+            bandwidth_limit=args.bandwidth_limit,
+        ),
+        transcode=transcode_settings,
+        destination_profile=args.destination_profile,
+        selection=SongSelection(
+            capacity_bytes=args.capacity,
+            resolve_missing=args.resolve_missing,
+            resolver_cache_path=Path(args.resolver_cache) if args.resolver_cache else None,
+            deduplicate=args.deduplicate,
+        ),
+        pruning=PruneSettings(prune=args.prune, dry_run=args.prune_dry_run),
+    )
+    run_mirror(args, options)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+"""Options of a mirror run."""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .change_detection import EXISTS
+from .destination_profiles import POSIX
+from .scheduling import LOCALITY
+from .transfer import COPY
+
+LOSSLESS_SUFFIXES = (".flac", ".wav", ".aiff")
+
+# a thread pool runs whole song copies, the asyncio engine overlaps every blocking operation of a copy
+THREADS = "threads"
+ASYNCIO = "asyncio"
+ENGINES = (THREADS, ASYNCIO)
+
+
+@dataclass(frozen=True)
+class InFlightLimits:
+    """Maximum number of blocking operations of each type the asyncio engine runs at the same time.
+
+    Songs copied at the same time are limited by CopyScheduling.jobs.
+    Attributes:
+        stats (int): comparisons of songs with their destination, stat or digest of both files
+        mkdirs (int): creations of destination folders
+        writes (int): playlist writes and journal commits
+    """
+
+    stats: int = 32
+    mkdirs: int = 8
+    writes: int = 8
+
+
+@dataclass(frozen=True)
+class TranscodeSettings:
+    """Settings of the transcode stage, converting lossless songs for devices that cannot hold them.
+
+    Attributes:
+        cache_folder (Path): folder keeping the transcoded songs, keyed by source digest and encoder settings
+        target_suffix (str): suffix of the transcoded songs, the encoder picks the codec from it
+        bitrate (str): bitrate given to the encoder
+        source_suffixes (Tuple[str, ...]): suffixes of the songs to transcode, other songs are copied as they are
+        encoder (str): ffmpeg compatible encoder executable
+        jobs (Optional[int]): number of encoder processes, the CPU count if None
+    """
+
+    cache_folder: Path
+    target_suffix: str = ".opus"
+    bitrate: str = "128k"
+    source_suffixes: Tuple[str, ...] = LOSSLESS_SUFFIXES
+    encoder: str = "ffmpeg"
+    jobs: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class SyncSettings:
+    """How a run finds the songs that changed since they were mirrored.
+
+    Attributes:
+        state_file_path (Optional[Path]): sync state database. When given, unchanged playlists are not parsed again
+            and songs whose source did not change since they were mirrored are not checked on destination.
+        comparison (str): strategy deciding whether a mirrored song is up to date, see COMPARISON_STRATEGIES
+    """
+
+    state_file_path: Optional[Path] = None
+    comparison: str = EXISTS
+
+
+@dataclass(frozen=True)
+class CopyScheduling:
+    """How many songs are copied at the same time, by which engine, how, in which order and how fast.
+
+    Attributes:
+        jobs (int): number of songs copied concurrently
+        jobs_per_destination (Optional[int]): maximum number of concurrent copies to a single destination device
+        engine (str): engine copying songs and writing playlists, see ENGINES
+        in_flight (InFlightLimits): limits of the operations in flight, only used by the asyncio engine
+        link_mode (str): how songs are transferred to destination, hard link, clone or copy, see LINK_MODES
+        copy_order (str): order songs are copied in, grouped by source folder and inode or in the order of the
+            playlists, see COPY_ORDERS
+        bandwidth_limit (Optional[int]): maximum number of bytes copied per second by all the copies together, no
+            limit if None. Hard links and clones, which do not transfer data, are not limited.
+    """
+
+    jobs: int = 1
+    jobs_per_destination: Optional[int] = None
+    engine: str = THREADS
+    in_flight: InFlightLimits = field(default_factory=InFlightLimits)
+    link_mode: str = COPY
+    copy_order: str = LOCALITY
+    bandwidth_limit: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class SongSelection:
+    """Which songs of the playlists are mirrored, and from which source path.
+
+    Attributes:
+        capacity_bytes (Optional[int]): maximum size of the mirrored songs, the highest priority songs are selected and
+            the others are left out of the playlists. Every song is mirrored if None.
+        resolve_missing (bool): replace missing songs with the song of the same name found in the music root, when
+            they were moved or renamed
+        resolver_cache_path (Optional[Path]): JSON file caching the index of the music root between runs, only used
+            when resolving missing songs
+        deduplicate (bool): mirror the content of songs found at several paths once, the other paths are hard links
+            to it, or are replaced with it in the playlists on destinations without hard links
+    """
+
+    capacity_bytes: Optional[int] = None
+    resolve_missing: bool = False
+    resolver_cache_path: Optional[Path] = None
+    deduplicate: bool = False
+
+
+@dataclass(frozen=True)
+class PruneSettings:
+    """Removal of the destination files no longer referenced by any playlist.
+
+    Attributes:
+        prune (bool): remove destination files no longer referenced by any playlist, and the folders left empty
+        dry_run (bool): only list the files pruning would remove, with the total bytes reclaimed
+    """
+
+    prune: bool = False
+    dry_run: bool = False
+
+
+@dataclass
+class MirrorOptions:
+    """Options tuning how playlists and songs are mirrored.
+
+    Attributes:
+        dry_run (bool): only plan the run, nothing is written on destination nor in the state file
+        sync (SyncSettings): state file and comparison finding the songs to copy again
+        scheduling (CopyScheduling): concurrency, engine, link mode, order and bandwidth of the copies
+        transcode (Optional[TranscodeSettings]): transcode lossless songs, copied as they are if None
+        destination_profile (str): file system of the destination, songs and playlists get names legal on it, see
+            DESTINATION_PROFILES
+        selection (SongSelection): capacity, resolution of missing songs and deduplication of the mirrored songs
+        pruning (PruneSettings): removal of the files no longer referenced on destination
+    """
+
+    dry_run: bool = False
+    sync: SyncSettings = field(default_factory=SyncSettings)
+    scheduling: CopyScheduling = field(default_factory=CopyScheduling)
+    transcode: Optional[TranscodeSettings] = None
+    destination_profile: str = POSIX
+    selection: SongSelection = field(default_factory=SongSelection)
+    pruning: PruneSettings = field(default_factory=PruneSettings)
+
+    def get_transcoded_suffixes(self) -> Dict[str, str]:
+        """Get the suffix the transcoded songs get on destination, by suffix of their source.
+
+        Returns:
+            Dict[str, str]: target suffix by lower case source suffix, empty if nothing is transcoded
+        """
+        if self.transcode is None:
+            return {}
+        return dict.fromkeys(self.transcode.source_suffixes, self.transcode.target_suffix)
@@ -1,12 +1,50 @@
 """Utility to mirror content of playlist with playlist file themselves a new destination."""
 
+import functools
 import logging
 import os
 import shutil
-from pathlib import Path
-from typing import List
-
-logging.basicConfig(level=logging.INFO)
+from dataclasses import replace
+from pathlib import Path, PurePath
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .budget import select_songs_within_budget
+from .change_detection import EXISTS, DigestCache, get_file_stat
+from .copy_engine import JOURNAL_FILE_NAME, CopyJob, CopyJournal, copy_file_atomically
+from .deduplication import (
+    DeduplicationReport,
+    deduplicate_playlists,
+    get_copy_jobs_of_originals,
+    link_duplicate_songs,
+    plan_linked_songs,
+)
+from .destination_profiles import PATH_INDEX_FILE_NAME, PathIndex, load_path_index
+from .inventory import DirectoryInventory
+from .mirror_options import ASYNCIO, MirrorOptions, TranscodeSettings
+from .path_store import PathStore
+from .planning import MirrorPlan, PlannedFile, plan_copy_jobs
+from .playlist_formats import (
+    PLAYLIST_READERS,
+    PlaylistEntry,
+    SongInfo,
+    parse_m3u,
+    read_playlist,
+)
+from .playlist_writer import (
+    get_data_of_playlist,
+    write_changed_playlist_files,
+    write_playlist_file,
+)
+from .pruning import PruneReport, get_state_files, prune_destination
+from .run_report import RunReport
+from .song_copy import copy_songs, copy_songs_not_mirrored_yet, get_changed_copy_jobs
+from .song_resolver import SongResolver, create_song_resolver
+from .sync_state import SyncState, open_sync_state
+from .transcoding import get_planned_copy_jobs, get_transcoded_path
+
+PLAYLIST_SUFFIXES = tuple(PLAYLIST_READERS)
+# playlists of other formats are mirrored as m3u8 playlists
+M3U_SUFFIXES = (".m3u", ".m3u8")
 
 
 def is_folder_existing(path: Path) -> bool:
@@ -19,55 +57,354 @@ def is_folder_existing(path: Path) -> bool:
     return path.is_dir()
 
 
-def get_all_playlist_files(playlist_root_path: Path) -> List[Path]:
-    """List all .m3u files stored under the playlist root path.
+def get_all_playlist_files(playlist_root_path: Path, inventory: Optional[DirectoryInventory] = None) -> List[Path]:
+    """List all playlist files (m3u, m3u8, pls and xspf) stored under the playlist root path.
 
+    The playlist root is walked once with os.scandir.
     Args:
         playlist_root_path (Path): path of where all files are located
+        inventory (Optional[DirectoryInventory]): inventory the listed folders are recorded in
     Returns:
         List[Path]: list of path to all files
     """
-    playlist_files = list(playlist_root_path.glob("**/*.m3u"))
-    return playlist_files
+    if inventory is None:
+        inventory = DirectoryInventory()
+    return inventory.find_files(playlist_root_path, PLAYLIST_SUFFIXES)
+
+
+def is_song_existing(song_path: Path, inventory: Optional[DirectoryInventory] = None) -> bool:
+    """Return true if the song file exists.
+
+    When an inventory is given, the folder of the song is listed once and shared by all songs of that folder, even
+    if they are referenced by many playlists.
+    Args:
+        song_path (Path): resolved path of the song
+        inventory (Optional[DirectoryInventory]): inventory of the source folders
+    Returns:
+        bool: True if the song file exists
+    """
+    if inventory is None:
+        return song_path.exists()
+    return inventory.exists(song_path)
 
 
-def get_list_of_song_path_from_playlist_content(content: List[str], playlist_path: Path) -> List[Path]:
-    """Get a list of song path contained in the playlist content.
+def resolve_playlist_entries(
+    entries: Iterable[PlaylistEntry],
+    playlist_path: Path,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    path_store: Optional[PathStore] = None,
+) -> List[Path]:
+    """Resolve the path of every song of the playlist entries, existing or not.
 
+    Entries are consumed as they are parsed. Entries that are URLs of remote streams are skipped. Metadata of an entry
+    replaces the metadata of its song read from a previous playlist: the last playlist parsed wins.
     Args:
-        content (List[str]): content of the playlist file
+        entries (Iterable[PlaylistEntry]): entries of the playlist file
         playlist_path (Path): path to a given playlist file
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, completed with the metadata of the entries
+        path_store (Optional[PathStore]): store of the song paths shared with other playlists, a new one if None
     Return:
         List[Path]: list of resolved song path
     """
+    if path_store is None:
+        path_store = PathStore()
     file_paths = []
-    for line in content:
-        line = line.strip()
-        if line and not line.startswith("#"):
-            file_path = Path(line)
-            if not file_path.is_absolute():
-                file_path = Path(playlist_path.parent) / Path(file_path)
-                file_path = file_path.resolve()
-            if not file_path.exists():
-                logging.warning("Song file %s does not exist", file_path)
-            else:
-                file_paths.append(file_path)
+    for entry in entries:
+        file_path = path_store.resolve(entry.location, playlist_path.parent)
+        if file_path is None:
+            logging.warning("Remote entry %s of %s is not mirrored", entry.location, playlist_path)
+            continue
+        if song_info is not None and entry.info is not None:
+            song_info[file_path] = entry.info
+        file_paths.append(file_path)
     return file_paths
 
 
-def parse_playlist(playlist_path: Path) -> List[Path]:
-    """Parse a playlist file.
+def resolve_song_path_from_playlist_content(
+    content: Iterable[str], playlist_path: Path, song_info: Optional[Dict[Path, SongInfo]] = None
+) -> List[Path]:
+    """Resolve the path of every song contained in the m3u playlist content, existing or not.
 
     Args:
+        content (Iterable[str]): content of the playlist file
         playlist_path (Path): path to a given playlist file
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, completed with the #EXTINF lines
+    Return:
+        List[Path]: list of resolved song path
+    """
+    return resolve_playlist_entries(parse_m3u(content), playlist_path, song_info)
+
+
+def get_existing_songs(
+    song_paths: List[Path],
+    inventory: Optional[DirectoryInventory] = None,
+    resolver: Optional[SongResolver] = None,
+) -> List[Path]:
+    """Get the songs that exist, warning about the others.
+
+    Args:
+        song_paths (List[Path]): resolved song path
+        inventory (Optional[DirectoryInventory]): inventory of the source folders
+        resolver (Optional[SongResolver]): resolver replacing missing songs with their new path when they were moved
+    Return:
+        List[Path]: existing song path, in the same order
+    """
+    file_paths = []
+    for file_path in song_paths:
+        if resolver is not None and not is_song_existing(file_path, inventory):
+            file_path = resolver.resolve(file_path) or file_path
+        if not is_song_existing(file_path, inventory):
+            logging.warning("Song file %s does not exist", file_path)
+        else:
+            file_paths.append(file_path)
+    return file_paths
+
+
+def get_list_of_song_path_from_playlist_content(
+    content: Iterable[str], playlist_path: Path, inventory: Optional[DirectoryInventory] = None
+) -> List[Path]:
+    """Get a list of song path contained in the m3u playlist content.
+
+    Args:
+        content (Iterable[str]): content of the playlist file
+        playlist_path (Path): path to a given playlist file
+        inventory (Optional[DirectoryInventory]): inventory of the source folders
+    Return:
+        List[Path]: list of resolved song path
+    """
+    return get_existing_songs(resolve_song_path_from_playlist_content(content, playlist_path), inventory)
+
+
+def parse_playlist(
+    playlist_path: Path,
+    inventory: Optional[DirectoryInventory] = None,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    resolver: Optional[SongResolver] = None,
+    path_store: Optional[PathStore] = None,
+) -> List[Path]:
+    """Parse a playlist file with the parser of its format.
+
+    Args:
+        playlist_path (Path): path to a given playlist file
+        inventory (Optional[DirectoryInventory]): inventory of the source folders
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, completed with the metadata of the playlist
+        resolver (Optional[SongResolver]): resolver replacing missing songs with their new path when they were moved
+        path_store (Optional[PathStore]): store of the song paths shared with other playlists, a new one if None
     Returns:
-        List[Path]: list of file contains in the m3u file
+        List[Path]: list of file contains in the playlist file
     """
     if not playlist_path.exists():
         logging.warning("Playlist file %s does not exist", playlist_path)
         return []
-    with open(playlist_path, "r", encoding="utf-8") as content:
-        return get_list_of_song_path_from_playlist_content(content, playlist_path)
+    return get_existing_songs(
+        resolve_playlist_entries(read_playlist(playlist_path), playlist_path, song_info, path_store),
+        inventory,
+        resolver,
+    )
+
+
+def parse_all_playlists(
+    playlist_files: List[Path],
+    inventory: Optional[DirectoryInventory] = None,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    resolver: Optional[SongResolver] = None,
+) -> Dict[Path, List[Path]]:
+    """Parse every playlist file exactly once.
+
+    Existence of songs is checked from an inventory, listing each source folder once. Playlists share the Path object
+    of each song.
+    Args:
+        playlist_files (List[Path]): path to all playlist files
+        inventory (Optional[DirectoryInventory]): inventory of the source folders, a new one if None
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, completed with the metadata of the playlists
+        resolver (Optional[SongResolver]): resolver replacing missing songs with their new path when they were moved
+    Returns:
+        Dict[Path, List[Path]]: resolved list of song path for each playlist file
+    """
+    if inventory is None:
+        inventory = DirectoryInventory()
+    path_store = PathStore()
+    return {
+        playlist_file: parse_playlist(playlist_file, inventory, song_info, resolver, path_store)
+        for playlist_file in playlist_files
+    }
+
+
+def get_all_songs_of_playlists(playlists: Dict[Path, List[Path]]) -> List[Path]:
+    """Get the deduplicated list of songs referenced by all playlists.
+
+    Songs are kept in the order of their first appearance.
+    Args:
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+    Returns:
+        List[Path]: list of unique song path
+    """
+    unique_songs: Dict[Path, None] = {}
+    for list_of_song_path in playlists.values():
+        unique_songs.update(dict.fromkeys(list_of_song_path))
+    return list(unique_songs)
+
+
+def get_stats_of_songs(
+    song_paths: List[Path], inventory: DirectoryInventory, resolver: Optional[SongResolver] = None
+) -> Tuple[Dict[Path, os.stat_result], Dict[Path, Path]]:
+    """Get the stat of every existing song, warning about the others.
+
+    Args:
+        song_paths (List[Path]): resolved song path
+        inventory (DirectoryInventory): inventory of the source folders
+        resolver (Optional[SongResolver]): resolver replacing missing songs with their new path when they were moved
+    Returns:
+        Tuple[Dict[Path, os.stat_result], Dict[Path, Path]]: stat of each existing song, and existing path of each
+            song, its new path for relocated songs
+    """
+    song_stats = {}
+    existing_paths = {}
+    for song_path in song_paths:
+        existing_path = song_path
+        song_stat = inventory.stat(song_path)
+        if song_stat is None and resolver is not None:
+            existing_path = resolver.resolve(song_path) or song_path
+            song_stat = inventory.stat(existing_path)
+        if song_stat is None:
+            logging.warning("Song file %s does not exist", song_path)
+        else:
+            song_stats[existing_path] = song_stat
+            existing_paths[song_path] = existing_path
+    return song_stats, existing_paths
+
+
+def read_playlist_with_sync_state(
+    playlist_file: Path,
+    playlist_stat: os.stat_result,
+    sync_state: SyncState,
+    song_info: Optional[Dict[Path, SongInfo]],
+    path_store: PathStore,
+) -> List[Path]:
+    """Get the songs of a playlist recorded in the sync state, or parse and record them if the playlist changed.
+
+    Args:
+        playlist_file (Path): path of the playlist file
+        playlist_stat (os.stat_result): current stat of the playlist file
+        sync_state (SyncState): state of previous runs
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, completed with the metadata of the playlist
+        path_store (PathStore): store of the song paths shared with other playlists
+    Returns:
+        List[Path]: resolved song path, existing or not
+    """
+    songs = sync_state.get_playlist_songs(playlist_file, playlist_stat, song_info, path_store)
+    if songs is None:
+        playlist_song_info: Dict[Path, SongInfo] = {}
+        songs = resolve_playlist_entries(read_playlist(playlist_file), playlist_file, playlist_song_info, path_store)
+        sync_state.set_playlist_songs(playlist_file, playlist_stat, songs, playlist_song_info)
+        if song_info is not None:
+            song_info.update(playlist_song_info)
+    return songs
+
+
+def parse_all_playlists_with_sync_state(
+    playlist_files: List[Path],
+    sync_state: SyncState,
+    inventory: DirectoryInventory,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    resolver: Optional[SongResolver] = None,
+) -> Tuple[Dict[Path, List[Path]], Dict[Path, os.stat_result]]:
+    """Parse every playlist file, reusing the songs recorded in the sync state for unchanged playlists.
+
+    Stats of playlists and songs are read from the inventory, missing songs are removed from the playlists. Playlists
+    share the Path object of each song.
+    Args:
+        playlist_files (List[Path]): path to all playlist files
+        sync_state (SyncState): state of previous runs
+        inventory (DirectoryInventory): inventory of the source folders
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, completed with the metadata of the playlists
+        resolver (Optional[SongResolver]): resolver replacing missing songs with their new path when they were moved
+    Returns:
+        Tuple[Dict[Path, List[Path]], Dict[Path, os.stat_result]]: resolved list of existing song path for each
+            playlist file and stat of each existing song
+    """
+    resolved_playlists = {}
+    path_store = PathStore()
+    for playlist_file in playlist_files:
+        playlist_stat = inventory.stat(playlist_file)
+        if playlist_stat is None:
+            logging.warning("Playlist file %s does not exist", playlist_file)
+            resolved_playlists[playlist_file] = []
+            continue
+        resolved_playlists[playlist_file] = read_playlist_with_sync_state(
+            playlist_file, playlist_stat, sync_state, song_info, path_store
+        )
+    song_stats, existing_paths = get_stats_of_songs(get_all_songs_of_playlists(resolved_playlists), inventory, resolver)
+    playlists = {
+        playlist_file: [existing_paths[song_path] for song_path in songs if song_path in existing_paths]
+        for playlist_file, songs in resolved_playlists.items()
+    }
+    return playlists, song_stats
+
+
+def select_songs_of_playlists(
+    report: RunReport,
+    playlists: Dict[Path, List[Path]],
+    inventory: DirectoryInventory,
+    options: MirrorOptions,
+    song_stats: Optional[Dict[Path, os.stat_result]] = None,
+) -> Dict[Path, List[Path]]:
+    """Keep in the playlists only the songs fitting in the capacity of the destination, when it is limited.
+
+    Args:
+        report (RunReport): report of the run, completed with the songs selected and left out
+        playlists (Dict[Path, List[Path]]): resolved list of existing song path for each playlist file
+        inventory (DirectoryInventory): inventory of the source folders, answering the stat of songs already listed
+        options (MirrorOptions): options of the mirror
+        song_stats (Optional[Dict[Path, os.stat_result]]): stat of each song, read from the inventory if None
+    Returns:
+        Dict[Path, List[Path]]: playlists with the selected songs only, unchanged without capacity
+    """
+    if options.selection.capacity_bytes is None:
+        return playlists
+    if song_stats is None:
+        song_stats = {song_path: inventory.stat(song_path) for song_path in get_all_songs_of_playlists(playlists)}
+    playlists, report.budget_report = select_songs_within_budget(
+        playlists, song_stats, options.selection.capacity_bytes
+    )
+    report.budget_report.log_summary()
+    return playlists
+
+
+def parse_and_select_playlists(
+    report: RunReport,
+    playlist_files: List[Path],
+    inventory: DirectoryInventory,
+    sync_state: Optional[SyncState],
+    song_info: Dict[Path, SongInfo],
+    resolver: Optional[SongResolver],
+    options: MirrorOptions,
+) -> Tuple[Dict[Path, List[Path]], Dict[Path, os.stat_result]]:
+    """Parse the playlists, resolving missing songs when enabled, then select the songs fitting in the capacity.
+
+    Args:
+        report (RunReport): report of the run, completed with the relocated and missing songs, and the songs
+            selected and left out
+        playlist_files (List[Path]): list of playlist files
+        inventory (DirectoryInventory): inventory of the source folders
+        sync_state (Optional[SyncState]): state of previous runs, unchanged playlists are not parsed again
+        song_info (Dict[Path, SongInfo]): metadata of each song, completed from the parsed playlists
+        resolver (Optional[SongResolver]): resolver of missing songs, missing songs are skipped if None
+        options (MirrorOptions): options of the mirror
+    Returns:
+        Tuple[Dict[Path, List[Path]], Dict[Path, os.stat_result]]: resolved list of song path for each playlist file,
+            and stat of each source song with a sync state
+    """
+    song_stats: Dict[Path, os.stat_result] = {}
+    if sync_state is None:
+        playlists = parse_all_playlists(playlist_files, inventory, song_info, resolver)
+    else:
+        playlists, song_stats = parse_all_playlists_with_sync_state(
+            playlist_files, sync_state, inventory, song_info, resolver
+        )
+    if resolver is not None:
+        report.resolver_report = resolver.finish(song_info, options.dry_run)
+    return select_songs_of_playlists(report, playlists, inventory, options, song_stats or None), song_stats
 
 
 def create_destination_file(
@@ -93,24 +430,100 @@ def create_destination_file(
     return destination_path
 
 
+def get_copy_jobs(
+    playlists: Dict[Path, List[Path]],
+    music_root_folder_path: Path,
+    destination_folder_path: Path,
+    transcode_settings: Optional[TranscodeSettings] = None,
+    path_index: Optional[PathIndex] = None,
+) -> List[CopyJob]:
+    """Get the source and destination path of every song referenced by the playlists, once per song.
+
+    Args:
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        music_root_folder_path (Path): path of the root of music collection
+        destination_folder_path (Path): path of mirroring destination
+        transcode_settings (Optional[TranscodeSettings]): the destination of transcoded songs gets their new suffix
+        path_index (Optional[PathIndex]): songs are mirrored to the paths mapped by the index, unchanged if None
+    Returns:
+        List[CopyJob]: pairs of source and destination song path
+    """
+    return [
+        (
+            song_path,
+            get_transcoded_path(
+                create_destination_file(
+                    song_path if path_index is None else path_index.map_path(song_path),
+                    music_root_folder_path,
+                    destination_folder_path,
+                ),
+                transcode_settings,
+            ),
+        )
+        for song_path in get_all_songs_of_playlists(playlists)
+    ]
+
+
 def copy_song_file_if_not_existing_and_create_necessary_parent_folder(
     source_song_path: Path, destination_song_path: Path
 ):
     """Copy source_song_path into destination_song_path if destination_song_path does not already exist.
 
-    If necessary, create parent folders of the destination_song_path.
+    If necessary, create parent folders of the destination_song_path. The song is copied atomically, as by the copy
+    engine.
     Args:
         source_song_path (Path): Path to the source song file.
         destination_song_path (Path): Path to the destination song file.
     """
     if not destination_song_path.exists():
         destination_song_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(source_song_path, destination_song_path)
+        copy_file_atomically(source_song_path, destination_song_path)
         logging.info("New file %s copied on mirror side", str(destination_song_path))
     else:
         logging.info("File %s already exist on mirror side", str(destination_song_path))
 
 
+@functools.lru_cache(maxsize=4096)
+def get_relative_path_between_folders(from_folder_path: PurePath, to_folder_path: PurePath) -> str:
+    """Get the POSIX relative path from a folder to another, memoized for folders shared by many songs.
+
+    Args:
+        from_folder_path (PurePath): folder the path is relative to
+        to_folder_path (PurePath): folder to reach
+    Returns:
+        str: relative path ending with a slash, empty if both folders are identical
+    """
+    from_parts = from_folder_path.parts
+    to_parts = to_folder_path.parts
+    common_part_count = len(os.path.commonprefix([from_parts, to_parts]))
+    relative_parts = [".."] * (len(from_parts) - common_part_count) + list(to_parts[common_part_count:])
+    return "".join(f"{part}/" for part in relative_parts)
+
+
+def get_relative_paths_to_songs_from_playlist_file(
+    playlist_file_path: Path, song_file_paths: Iterable[Path]
+) -> List[str]:
+    """Get the relative path to each song from the playlist file, always with POSIX separators.
+
+    The relative path between the playlist folder and each distinct song folder is only computed once.
+    Args:
+        playlist_file_path (Path): path of the playlist file that we want to mirror
+        song_file_paths (Iterable[Path]): path to the song files
+    Return:
+        List[str]: relative path to reach each song file from the playlist file
+    Raises:
+        ValueError: if a song file is the playlist file itself
+    """
+    playlist_folder_path = playlist_file_path.parent
+    relative_paths = []
+    for song_file_path in song_file_paths:
+        if song_file_path == playlist_file_path:
+            raise ValueError(f"Song file and playlist file identical {song_file_path}")
+        relative_folder = get_relative_path_between_folders(playlist_folder_path, song_file_path.parent)
+        relative_paths.append(relative_folder + song_file_path.name)
+    return relative_paths
+
+
 def get_relative_path_to_song_from_playlist_file(playlist_file_path: Path, song_file_path: Path) -> str:
     """Get the reatlive path to the song from the playlist file.
 
@@ -122,44 +535,55 @@ def get_relative_path_to_song_from_playlist_file(playlist_file_path: Path, song_
         playlist_file_path (Path): path of the playlist file that we want to mirror
         song_file_path (Path): path to the song file
     Return:
-        str: relative path to reacht the song file from the playlist file
+        str: relative path to reacht the song file from the playlist file, with POSIX separators
     """
-    if playlist_file_path == song_file_path:
-        raise ValueError("Song file and playlist file identical {song_file}")
-    playlist_file_path_list = list(playlist_file_path.parts)
-    song_file_path_list = list(song_file_path.parts)
+    return get_relative_paths_to_songs_from_playlist_file(playlist_file_path, [song_file_path])[0]
 
-    common_part_index = 0
-    while common_part_index < len(playlist_file_path_list) and common_part_index < len(song_file_path_list):
-        if playlist_file_path_list[common_part_index] != song_file_path_list[common_part_index]:
-            break
-        common_part_index = common_part_index + 1
 
-    number_of_subfolder_remaining_to_playlist_file = len(playlist_file_path_list) - 1 - common_part_index
-    relative_path_list = []
-    relative_path_list = relative_path_list + ["../" for i in range(0, number_of_subfolder_remaining_to_playlist_file)]
-    relative_path_list = relative_path_list + song_file_path_list[common_part_index:]
-    return os.path.join(*relative_path_list)
-
-
-def get_new_content_of_playlist_file(playlist_file_path: Path) -> List[str]:
+def get_new_content_of_playlist_file(
+    playlist_file_path: Path,
+    list_of_song_path: Optional[List[Path]] = None,
+    transcode_settings: Optional[TranscodeSettings] = None,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    path_index: Optional[PathIndex] = None,
+) -> List[str]:
     """Return the new content of the playlist that should be written on destination device.
 
-    All song path are relative to the playlist file
+    All song path are relative to the playlist file. Songs with metadata are preceded by their #EXTINF line.
     Args:
         playlist_file_path (Path): path of the playlist file that we want to mirror
+        list_of_song_path (Optional[List[Path]]): already parsed songs of the playlist. Parsed from file if None.
+        transcode_settings (Optional[TranscodeSettings]): transcoded songs are referenced with their new suffix
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song. Parsed with the songs if None.
+        path_index (Optional[PathIndex]): playlist and songs are referenced by the paths mapped by the index
     Return:
         List[str]: line by line content of the new file
     """
-    list_of_song_path = parse_playlist(playlist_file_path)
+    if song_info is None:
+        song_info = {}
+    if list_of_song_path is None:
+        list_of_song_path = parse_playlist(playlist_file_path, None, song_info)
+    mapped_song_paths: Iterable[Path] = list_of_song_path
+    if path_index is not None:
+        playlist_file_path = path_index.map_path(playlist_file_path)
+        mapped_song_paths = (path_index.map_path(song_path) for song_path in list_of_song_path)
+    relative_paths = get_relative_paths_to_songs_from_playlist_file(
+        playlist_file_path, (get_transcoded_path(song_path, transcode_settings) for song_path in mapped_song_paths)
+    )
     content = ["#EXTM3U"]
-    for song_path in list_of_song_path:
-        content.append(get_relative_path_to_song_from_playlist_file(playlist_file_path, song_path))
+    for song_path, relative_path in zip(list_of_song_path, relative_paths):
+        info = song_info.get(song_path)
+        if info is not None:
+            content.append(info.to_extinf())
+        content.append(relative_path)
     return content
 
 
 def get_destination_path_of_playlist_file(
-    music_root_folder_path: Path, playlist_file_path: Path, destination_folder_path: Path
+    music_root_folder_path: Path,
+    playlist_file_path: Path,
+    destination_folder_path: Path,
+    path_index: Optional[PathIndex] = None,
 ) -> Path:
     """Get the path of the new playlist (on destination device).
 
@@ -168,35 +592,189 @@ def get_destination_path_of_playlist_file(
         playlist_file_path = /home/foo/Music/Playlists/playlist.m3u
         destination_folder_path = /mnt/Music
     The function will return /mnt/Music/Playlists/playlist.m3u
+    Playlists of other formats than m3u are mirrored with the m3u8 suffix.
     Args:
         music_root_folder_path (Path): root folder of the music repository to be mirror
         playlist_file_path (Path): path of the playlist file
         destination_folder_path (Path): destination where we should mirror files
+        path_index (Optional[PathIndex]): the playlist is mirrored to the path mapped by the index, unchanged if None
     Return
         Path: path of the playlist file where the new playlist shall be saved
     """
+    if path_index is not None:
+        playlist_file_path = path_index.map_path(playlist_file_path)
     relative_path = playlist_file_path.relative_to(music_root_folder_path)
+    if relative_path.suffix.lower() not in M3U_SUFFIXES:
+        relative_path = relative_path.with_suffix(".m3u8")
     return destination_folder_path / relative_path
 
 
 def write_content_of_playlist_to_file(content: List[str], new_playlist_file_path: Path) -> None:
     """Write the content of the playlist into the new file.
 
-    If needed, parent directory will be created.
+    If needed, parent directory will be created. The file is replaced atomically.
     Args:
         content (List[str]): List of string line by line of the new content of playlist
         new_playlist_file_path (Path): path of the playlist file (absolute path, in destination folder)
     """
     new_playlist_file_path.parent.mkdir(parents=True, exist_ok=True)
+    write_playlist_file(get_data_of_playlist(content), new_playlist_file_path)
+
+
+def write_all_playlists(
+    playlists: Dict[Path, List[Path]],
+    music_root_folder_path: Path,
+    destination_folder_path: Path,
+    transcode_settings: Optional[TranscodeSettings] = None,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    write_limit: Optional[int] = None,
+    path_index: Optional[PathIndex] = None,
+    inventory: Optional[DirectoryInventory] = None,
+    digest_cache: Optional[DigestCache] = None,
+) -> List[Path]:
+    """Write the mirrored version of every playlist on destination.
+
+    Playlists whose file on destination already has the mirrored content are not written again. The folders of the
+    other playlists are created once per folder, then each playlist is written atomically. With a write limit,
+    playlists are written concurrently from an event loop, as the asyncio engine does.
+    Args:
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        destination_folder_path (Path): destination where we should mirror files
+        transcode_settings (Optional[TranscodeSettings]): transcoded songs are referenced with their new suffix
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, written as #EXTINF lines
+        write_limit (Optional[int]): maximum number of playlists written at the same time, one at a time if None
+        path_index (Optional[PathIndex]): playlists and songs are mirrored to the paths mapped by the index
+        inventory (Optional[DirectoryInventory]): inventory answering stat of the destination files
+        digest_cache (Optional[DigestCache]): digests of the playlist files written by previous runs, completed with
+            the digests of the written files
+    Returns:
+        List[Path]: path of the mirrored playlist files on destination, written or unchanged
+    """
+    playlist_files = {}
+    for playlist_file, list_of_song_path in playlists.items():
+        logging.debug("Mirroring: %s", str(playlist_file))
+        new_content = get_new_content_of_playlist_file(
+            playlist_file, list_of_song_path, transcode_settings, song_info or {}, path_index
+        )
+        new_playlist_file_path = get_destination_path_of_playlist_file(
+            music_root_folder_path, playlist_file, destination_folder_path, path_index
+        )
+        playlist_files[new_playlist_file_path] = get_data_of_playlist(new_content)
+    write_changed_playlist_files(playlist_files, write_limit, inventory, digest_cache)
+    return list(playlist_files)
+
+
+def plan_all_playlists(
+    playlists: Dict[Path, List[Path]],
+    music_root_folder_path: Path,
+    destination_folder_path: Path,
+    inventory: DirectoryInventory,
+    transcode_settings: Optional[TranscodeSettings] = None,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    path_index: Optional[PathIndex] = None,
+) -> List[PlannedFile]:
+    """Plan the writing of the mirrored version of every playlist, without writing them.
 
-    with open(new_playlist_file_path, "w", encoding="utf-8") as new_file:
-        new_file.write("\n".join(content))
+    Args:
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        destination_folder_path (Path): destination where we should mirror files
+        inventory (DirectoryInventory): inventory answering stat of the destination files
+        transcode_settings (Optional[TranscodeSettings]): transcoded songs are referenced with their new suffix
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, written as #EXTINF lines
+        path_index (Optional[PathIndex]): playlists and songs are mirrored to the paths mapped by the index
+    Returns:
+        List[PlannedFile]: destination path and size of each playlist file, and size of the file it replaces
+    """
+    planned_playlists = []
+    for playlist_file, list_of_song_path in playlists.items():
+        new_content = get_new_content_of_playlist_file(
+            playlist_file, list_of_song_path, transcode_settings, song_info or {}, path_index
+        )
+        new_playlist_file_path = get_destination_path_of_playlist_file(
+            music_root_folder_path, playlist_file, destination_folder_path, path_index
+        )
+        replaced_stat = get_file_stat(new_playlist_file_path, inventory)
+        planned_playlists.append(
+            PlannedFile(
+                new_playlist_file_path,
+                len("\n".join(new_content).encode("utf-8")),
+                0 if replaced_stat is None else replaced_stat.st_size,
+                playlist_file,
+            )
+        )
+    return planned_playlists
+
+
+def plan_mirror(
+    playlists: Dict[Path, List[Path]],
+    copy_jobs: List[CopyJob],
+    changed_copy_jobs: List[CopyJob],
+    digest_cache: DigestCache,
+    music_root_folder_path: Path,
+    destination_folder_path: Path,
+    inventory: DirectoryInventory,
+    options: MirrorOptions,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    path_index: Optional[PathIndex] = None,
+) -> MirrorPlan:
+    """Plan the copy, playlist writing and pruning phases of a mirror run, without writing anything.
+
+    Transcoded songs are compared with their destination through their cached version, as the copy phase does.
+    Args:
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        changed_copy_jobs (List[CopyJob]): jobs whose source changed since last mirrored, per the sync state
+        digest_cache (DigestCache): cache of digests, used by the hash comparison and the transcode cache
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        destination_folder_path (Path): destination where we should mirror files
+        inventory (DirectoryInventory): inventory of the source and destination folders
+        options (MirrorOptions): options of the mirror
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, written as #EXTINF lines
+        path_index (Optional[PathIndex]): playlists and songs are mirrored to the paths mapped by the index
+    Returns:
+        MirrorPlan: every action the run would take, with the free space of the destination
+    """
+    planned_copy_jobs, transcode_failures = get_planned_copy_jobs(
+        copy_jobs, options.transcode, digest_cache, options.sync.comparison == EXISTS, inventory
+    )
+    plan = plan_copy_jobs(
+        planned_copy_jobs,
+        changed_copy_jobs,
+        options.sync.comparison,
+        digest_cache,
+        CopyJournal(destination_folder_path / JOURNAL_FILE_NAME),
+        inventory,
+    )
+    plan.failures.update(transcode_failures)
+    plan.written_playlists = plan_all_playlists(
+        playlists,
+        music_root_folder_path,
+        destination_folder_path,
+        inventory,
+        options.transcode,
+        song_info,
+        path_index,
+    )
+    if options.pruning.prune or options.pruning.dry_run:
+        referenced_files = {destination for _, destination in copy_jobs}.union(
+            planned_playlist.destination for planned_playlist in plan.written_playlists
+        )
+        plan.prune_report = prune_unreferenced_files(
+            destination_folder_path,
+            referenced_files,
+            inventory,
+            replace(options, pruning=replace(options.pruning, dry_run=True)),
+        )
+    plan.free_bytes = shutil.disk_usage(destination_folder_path).free
+    return plan
 
 
-def mirror_all_playlist(
+def check_mirror_folders(
     music_root_folder_path: Path, playlist_root_folder_path: Path, destination_folder_path: Path
 ) -> None:
-    """Mirror all playlist and there content to the given destination.
+    """Check that the folders of a mirror run exist and that the destination is writable.
 
     Args:
         music_root_folder_path (Path): root folder of the music repository to be mirror
@@ -215,15 +793,205 @@ def mirror_all_playlist(
     if not os.access(str(destination_folder_path), os.W_OK):
         raise PermissionError("No write access to {destination_folder_path}")
 
-    playlist_files = get_all_playlist_files(playlist_root_folder_path)
-    for playlist_file in playlist_files:
-        logging.info("Mirroring: %s", str(playlist_file))
-        list_of_song_path = parse_playlist(playlist_file)
-        for song_path in list_of_song_path:
-            destination_path = create_destination_file(song_path, music_root_folder_path, destination_folder_path)
-            copy_song_file_if_not_existing_and_create_necessary_parent_folder(song_path, destination_path)
-        new_content = get_new_content_of_playlist_file(playlist_file)
-        new_playlist_file_path = get_destination_path_of_playlist_file(
-            music_root_folder_path, playlist_file, destination_folder_path
+
+def prune_unreferenced_files(
+    destination_folder_path: Path,
+    referenced_files: Set[Path],
+    inventory: DirectoryInventory,
+    options: MirrorOptions,
+    sync_state: Optional[SyncState] = None,
+) -> PruneReport:
+    """Remove (or list in dry run) the destination files that are neither mirrored songs nor mirrored playlists.
+
+    The destination is listed again, as songs and playlists were written since it was listed. The sync state database
+    and its side files are kept when stored in the destination, as is the index of mapped paths. Removed files are
+    forgotten by the sync state, so that a song referenced again later is copied again.
+    Args:
+        destination_folder_path (Path): destination where we should mirror files
+        referenced_files (Set[Path]): destination path of every mirrored song and playlist
+        inventory (DirectoryInventory): inventory of the destination
+        options (MirrorOptions): options of the mirror
+        sync_state (Optional[SyncState]): state recording the mirrored songs
+    Returns:
+        PruneReport: removed files and folders
+    """
+    referenced_files = set(referenced_files)
+    referenced_files.add(destination_folder_path / PATH_INDEX_FILE_NAME)
+    inventory.forget_tree(destination_folder_path)
+    if options.sync.state_file_path is not None:
+        referenced_files.update(get_state_files(destination_folder_path, options.sync.state_file_path, inventory))
+    prune_report = prune_destination(destination_folder_path, referenced_files, inventory, options.pruning.dry_run)
+    if sync_state is not None and not prune_report.dry_run:
+        sync_state.forget_songs_mirrored(
+            file_path for file_path in prune_report.removed_files if file_path not in prune_report.failures
+        )
+    prune_report.log_summary()
+    return prune_report
+
+
+def write_playlists_and_prune(
+    report: RunReport,
+    playlists: Dict[Path, List[Path]],
+    copy_jobs: List[CopyJob],
+    music_root_folder_path: Path,
+    destination_folder_path: Path,
+    inventory: DirectoryInventory,
+    options: MirrorOptions,
+    song_info: Optional[Dict[Path, SongInfo]] = None,
+    path_index: Optional[PathIndex] = None,
+    sync_state: Optional[SyncState] = None,
+) -> None:
+    """Write the playlists on destination, then prune the files they do not reference when enabled.
+
+    With a sync state, the digests of the playlist files are recorded in it, so that the next run compares the
+    playlists without reading the files.
+    Args:
+        report (RunReport): report of the run, completed with the write and prune phases
+        playlists (Dict[Path, List[Path]]): resolved list of song path for each playlist file
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        destination_folder_path (Path): destination where we should mirror files
+        inventory (DirectoryInventory): inventory of the source and destination folders
+        options (MirrorOptions): options of the mirror
+        song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, written as #EXTINF lines
+        path_index (Optional[PathIndex]): playlists are mirrored to the paths mapped by the index, saved once written
+        sync_state (Optional[SyncState]): state recording the digests of the playlist files between runs, and
+            forgetting the pruned songs
+    """
+    digest_cache = None if sync_state is None else DigestCache(sync_state.get_digests())
+    with report.measure_phase("write") as phase:
+        new_playlist_file_paths = write_all_playlists(
+            playlists,
+            music_root_folder_path,
+            destination_folder_path,
+            options.transcode,
+            song_info,
+            options.scheduling.in_flight.writes if options.scheduling.engine == ASYNCIO else None,
+            path_index,
+            inventory,
+            digest_cache,
+        )
+        phase.items = len(new_playlist_file_paths)
+    if sync_state is not None and digest_cache is not None:
+        sync_state.set_digests(digest_cache.get_new_digests())
+    if path_index is not None:
+        path_index.save(destination_folder_path)
+    if options.pruning.prune or options.pruning.dry_run:
+        with report.measure_phase("prune") as phase:
+            referenced_files = {destination for _, destination in copy_jobs}.union(new_playlist_file_paths)
+            report.prune_report = prune_unreferenced_files(
+                destination_folder_path, referenced_files, inventory, options, sync_state
+            )
+            phase.items = len(report.prune_report.removed_files)
+
+
+def mirror_all_playlist(
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    destination_folder_path: Path,
+    options: Optional[MirrorOptions] = None,
+) -> RunReport:
+    """Mirror all playlist and there content to the given destination.
+
+    In dry run, playlists are discovered and parsed as in a real run, then the plan of the run is reported instead
+    of writing anything on destination.
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        destination_folder_path (Path): destination where we should mirror files
+        options (Optional[MirrorOptions]): options of the mirror, default options if None
+    Returns:
+        RunReport: wall time of each phase, and reports of the copy and pruning phases, or plan of the run in dry run
+    Raises:
+        FileNotFoundError: if the music folder or the playlist root or the destination folder does not exist.
+        PermissionError: if no write permission to destination.
+    """
+    if options is None:
+        options = MirrorOptions()
+    check_mirror_folders(music_root_folder_path, playlist_root_folder_path, destination_folder_path)
+    path_index = load_path_index(
+        music_root_folder_path, destination_folder_path, options.destination_profile, options.get_transcoded_suffixes()
+    )
+    resolver = create_song_resolver(music_root_folder_path, options)
+    report = RunReport()
+    inventory = DirectoryInventory()
+    song_info: Dict[Path, SongInfo] = {}
+    with report.measure_phase("discovery") as phase:
+        playlist_files = get_all_playlist_files(playlist_root_folder_path, inventory)
+        phase.items = len(playlist_files)
+    with open_sync_state(options.sync.state_file_path, options.dry_run) as sync_state:
+        # with a state, destination folders are listed lazily, only when a song changed since it was last mirrored
+        if sync_state is None:
+            with report.measure_phase("stat") as phase:
+                inventory.scan_tree(destination_folder_path)
+                phase.items = len(inventory.get_folders_below(destination_folder_path))
+        with report.measure_phase("parse") as phase:
+            playlists, song_stats = parse_and_select_playlists(
+                report, playlist_files, inventory, sync_state, song_info, resolver, options
+            )
+            phase.items = len(playlists)
+        if options.selection.deduplicate:
+            with report.measure_phase("deduplicate") as phase:
+                report.deduplication_report = DeduplicationReport()
+                playlists = deduplicate_playlists(
+                    report.deduplication_report, playlists, inventory, sync_state, song_info, options
+                )
+                phase.items = len(report.deduplication_report.duplicates)
+        with report.measure_phase("jobs") as phase:
+            copy_jobs = get_copy_jobs(
+                playlists, music_root_folder_path, destination_folder_path, options.transcode, path_index
+            )
+            phase.items = len(copy_jobs)
+        if options.dry_run:
+            with report.measure_phase("plan"):
+                report.plan = plan_mirror(
+                    playlists,
+                    copy_jobs,
+                    get_copy_jobs_of_originals(
+                        get_changed_copy_jobs(copy_jobs, song_stats, sync_state, inventory), report.deduplication_report
+                    ),
+                    DigestCache() if sync_state is None else DigestCache(sync_state.get_digests()),
+                    music_root_folder_path,
+                    destination_folder_path,
+                    inventory,
+                    options,
+                    song_info,
+                    path_index,
+                )
+                plan_linked_songs(report.plan, copy_jobs, report.deduplication_report, inventory)
+            return report
+        with report.measure_phase("copy") as phase:
+            # duplicate songs are linked to the copy of their original instead of being copied
+            if sync_state is None:
+                report.copy_report = copy_songs(
+                    get_copy_jobs_of_originals(copy_jobs, report.deduplication_report),
+                    options,
+                    destination_folder_path,
+                    inventory,
+                )
+            else:
+                report.copy_report = copy_songs_not_mirrored_yet(
+                    get_copy_jobs_of_originals(copy_jobs, report.deduplication_report),
+                    song_stats,
+                    sync_state,
+                    options,
+                    destination_folder_path,
+                    inventory,
+                )
+            link_duplicate_songs(copy_jobs, report.deduplication_report, report.copy_report, inventory)
+            phase.items = report.copy_report.copied_files
+        report.copy_report.log_summary()
+        write_playlists_and_prune(
+            report,
+            playlists,
+            copy_jobs,
+            music_root_folder_path,
+            destination_folder_path,
+            inventory,
+            options,
+            song_info,
+            path_index,
+            sync_state,
         )
-        write_content_of_playlist_to_file(new_content, new_playlist_file_path)
+    report.log_summary()
+    return report
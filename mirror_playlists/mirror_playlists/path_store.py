@@ -0,0 +1,53 @@
+"""Interned song paths, shared by all the playlists of a run."""
+
+from pathlib import Path
+from typing import Dict, Optional
+
+from .playlist_formats import get_location_path
+
+
+class PathStore:
+    """Store of the song paths of a run, holding a single Path object for each distinct song.
+
+    The playlists of a large library reference the same songs many times. Each entry refers to the interned path of
+    its song instead of its own Path object, so the playlists, the copy jobs and the rewritten playlists built from
+    them cost a reference per entry. Only the interned paths are held, nothing is kept per entry or per location.
+    """
+
+    def __init__(self):
+        """Create an empty store."""
+        self.paths: Dict[Path, Path] = {}
+
+    def __len__(self) -> int:
+        """Get the number of distinct paths.
+
+        Returns:
+            int: number of interned paths
+        """
+        return len(self.paths)
+
+    def intern(self, path: Path) -> Path:
+        """Get the interned path equal to a path, interning it the first time.
+
+        Args:
+            path (Path): path of a song
+        Returns:
+            Path: path held by the store
+        """
+        return self.paths.setdefault(path, path)
+
+    def resolve(self, location: str, playlist_folder_path: Path) -> Optional[Path]:
+        """Get the interned absolute path of a playlist location.
+
+        Args:
+            location (str): path, relative to the playlist folder or absolute, or URL of the entry
+            playlist_folder_path (Path): folder of the playlist file
+        Returns:
+            Optional[Path]: resolved path, None if the location is the URL of a remote stream
+        """
+        file_path = get_location_path(location)
+        if file_path is None:
+            return None
+        if not file_path.is_absolute():
+            file_path = (playlist_folder_path / file_path).resolve()
+        return self.intern(file_path)
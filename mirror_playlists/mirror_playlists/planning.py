@@ -0,0 +1,150 @@
+"""Plan of a mirror run, computed without writing anything on destination."""
+
+from dataclasses import dataclass, field
+from itertools import chain
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .change_detection import DigestCache, get_file_stat, is_destination_up_to_date
+from .copy_engine import CopyJob, CopyJournal
+from .inventory import DirectoryInventory
+from .pruning import PruneReport
+
+
+@dataclass
+class PlannedFile:
+    """File a mirror run would write on destination."""
+
+    destination: Path
+    size: int
+    replaced_size: int = 0
+    source: Optional[Path] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the planned file to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: source and destination path, size and size of the destination file it replaces
+        """
+        return {
+            "source": None if self.source is None else str(self.source),
+            "destination": str(self.destination),
+            "bytes": self.size,
+            "replaced_bytes": self.replaced_size,
+        }
+
+
+@dataclass
+class MirrorPlan:
+    """Every action a mirror run would take, with the destination space it needs."""
+
+    copied_songs: List[PlannedFile] = field(default_factory=list)
+    updated_songs: List[PlannedFile] = field(default_factory=list)
+    skipped_songs: List[CopyJob] = field(default_factory=list)
+    written_playlists: List[PlannedFile] = field(default_factory=list)
+    prune_report: Optional[PruneReport] = None
+    free_bytes: int = 0
+    failures: Dict[Path, str] = field(default_factory=dict)
+
+    def get_required_bytes(self) -> int:
+        """Get the destination space the run needs.
+
+        Pruning runs once songs and playlists are written, the space it reclaims is not available to them.
+        Returns:
+            int: bytes written minus bytes of the destination files they replace, 0 if the run frees space
+        """
+        return max(
+            sum(
+                planned_file.size - planned_file.replaced_size
+                for planned_file in chain(self.copied_songs, self.updated_songs, self.written_playlists)
+            ),
+            0,
+        )
+
+    def fits(self) -> bool:
+        """Return true if the destination has enough free space for the run.
+
+        Returns:
+            bool: True if the required bytes do not exceed the free bytes of the destination
+        """
+        return self.get_required_bytes() <= self.free_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the plan to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: every planned action followed by the totals
+        """
+        pruned_files = [] if self.prune_report is None else self.prune_report.removed_files
+        pruned_folders = [] if self.prune_report is None else self.prune_report.removed_folders
+        return {
+            "copy": [planned_file.to_dict() for planned_file in self.copied_songs],
+            "update": [planned_file.to_dict() for planned_file in self.updated_songs],
+            "skip": [
+                {"source": str(source), "destination": str(destination)} for source, destination in self.skipped_songs
+            ],
+            "playlists": [planned_file.to_dict() for planned_file in self.written_playlists],
+            "prune": {"files": list(map(str, pruned_files)), "folders": list(map(str, pruned_folders))},
+            "failures": {str(path): error for path, error in self.failures.items()},
+            "totals": {
+                "copy_files": len(self.copied_songs),
+                "copy_bytes": sum(planned_file.size for planned_file in self.copied_songs),
+                "update_files": len(self.updated_songs),
+                "update_bytes": sum(planned_file.size for planned_file in self.updated_songs),
+                "skip_files": len(self.skipped_songs),
+                "playlist_files": len(self.written_playlists),
+                "prune_files": len(pruned_files),
+                "prune_bytes": 0 if self.prune_report is None else self.prune_report.reclaimed_bytes,
+                "required_bytes": self.get_required_bytes(),
+                "free_bytes": self.free_bytes,
+                "fits": self.fits(),
+            },
+        }
+
+
+def plan_copy_jobs(
+    copy_jobs: List[CopyJob],
+    changed_copy_jobs: List[CopyJob],
+    comparison: str,
+    digest_cache: DigestCache,
+    journal: CopyJournal,
+    inventory: DirectoryInventory,
+) -> MirrorPlan:
+    """Sort the copy jobs into songs to copy, to update and to skip, as the copy phase would decide.
+
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        changed_copy_jobs (List[CopyJob]): jobs whose source changed since last mirrored, per the sync state
+        comparison (str): strategy deciding whether the destination is up to date, see COMPARISON_STRATEGIES
+        digest_cache (DigestCache): cache of digests, only used by the hash comparison
+        journal (CopyJournal): journal of the songs committed by an interrupted copy phase
+        inventory (DirectoryInventory): inventory answering stat of source and destination files
+    Returns:
+        MirrorPlan: plan of the copy phase
+    """
+    plan = MirrorPlan()
+    changed_destinations = {destination for _, destination in changed_copy_jobs}
+    for source, destination in copy_jobs:
+        if destination not in changed_destinations or journal.is_committed(destination):
+            plan.skipped_songs.append((source, destination))
+            continue
+        try:
+            destination_stat = get_file_stat(destination, inventory)
+            if destination_stat is not None and is_destination_up_to_date(
+                source, destination, comparison, digest_cache, inventory
+            ):
+                plan.skipped_songs.append((source, destination))
+                continue
+            source_stat = get_file_stat(source, inventory)
+            if source_stat is None:
+                raise FileNotFoundError(f"Song file {source} does not exist")
+        except OSError as error:
+            plan.failures[destination] = str(error)
+            continue
+        if destination_stat is None:
+            plan.copied_songs.append(PlannedFile(destination, source_stat.st_size, source=source))
+        else:
+            plan.updated_songs.append(
+                PlannedFile(destination, source_stat.st_size, destination_stat.st_size, source=source)
+            )
+    return plan
@@ -0,0 +1,246 @@
+"""Streaming parsers of the playlist file formats, yielding entries with their metadata."""
+
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional
+from urllib.parse import unquote, urlparse
+from urllib.request import url2pathname
+from xml.etree import ElementTree
+
+EXTINF_PREFIX = "#EXTINF:"
+# a scheme of a single letter is a windows drive
+URL_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9+.-]+://")
+PLS_KEY_PATTERN = re.compile(r"^(File|Title|Length)(\d+)$", re.IGNORECASE)
+# a title written on an #EXTINF line must not break it
+LINE_BREAK_PATTERN = re.compile(r"\s*[\r\n]+\s*")
+
+
+@dataclass(frozen=True)
+class SongInfo:
+    """Metadata of a playlist entry, as written in #EXTINF lines.
+
+    Attributes:
+        duration (int): duration in seconds, -1 if unknown
+        title (str): title displayed by players, empty if unknown
+    """
+
+    duration: int = -1
+    title: str = ""
+
+    def to_extinf(self) -> str:
+        """Format the metadata as an #EXTINF line, the line breaks of the title are replaced by spaces.
+
+        Returns:
+            str: #EXTINF line
+        """
+        return f"{EXTINF_PREFIX}{self.duration},{LINE_BREAK_PATTERN.sub(' ', self.title)}"
+
+
+@dataclass(frozen=True)
+class PlaylistEntry:
+    """Entry of a playlist file.
+
+    Attributes:
+        location (str): path of the song as written in the playlist, or file URL
+        info (Optional[SongInfo]): metadata of the song, None if the playlist has none
+    """
+
+    location: str
+    info: Optional[SongInfo] = None
+
+
+def parse_duration(text: str) -> int:
+    """Parse a duration in seconds.
+
+    Args:
+        text (str): duration, possibly fractional
+    Returns:
+        int: rounded duration, -1 if the text is not a number
+    """
+    try:
+        return round(float(text))
+    except ValueError:
+        return -1
+
+
+def parse_extinf(line: str) -> SongInfo:
+    """Parse an #EXTINF line.
+
+    Attributes following the duration, as in #EXTINF:123 tvg-id="x",Title, are ignored.
+    Args:
+        line (str): #EXTINF line
+    Returns:
+        SongInfo: duration and title of the entry
+    """
+    duration, _, title = line[len(EXTINF_PREFIX) :].partition(",")
+    duration_fields = duration.split()
+    return SongInfo(parse_duration(duration_fields[0]) if duration_fields else -1, title.strip())
+
+
+def parse_m3u(lines: Iterable[str]) -> Iterator[PlaylistEntry]:
+    """Parse the lines of a m3u or m3u8 playlist.
+
+    Args:
+        lines (Iterable[str]): lines of the playlist
+    Yields:
+        PlaylistEntry: each entry with the #EXTINF line preceding it
+    """
+    info = None
+    for line in lines:
+        line = line.strip().lstrip("\ufeff")
+        if line.startswith(EXTINF_PREFIX):
+            info = parse_extinf(line)
+        elif line and not line.startswith("#"):
+            yield PlaylistEntry(line, info)
+            info = None
+
+
+def parse_pls(lines: Iterable[str]) -> Iterator[PlaylistEntry]:
+    """Parse the lines of a pls playlist.
+
+    The FileN, TitleN and LengthN keys of an entry are expected next to each other.
+    Args:
+        lines (Iterable[str]): lines of the playlist
+    Yields:
+        PlaylistEntry: each entry with its title and length
+    """
+    fields: Dict[str, str] = {}
+    index = None
+    for line in lines:
+        key, _, value = line.strip().partition("=")
+        match = PLS_KEY_PATTERN.match(key.strip())
+        if match is None:
+            continue
+        if match.group(2) != index:
+            if "file" in fields:
+                yield get_pls_entry(fields)
+            fields = {}
+            index = match.group(2)
+        fields[match.group(1).lower()] = value.strip()
+    if "file" in fields:
+        yield get_pls_entry(fields)
+
+
+def get_pls_entry(fields: Dict[str, str]) -> PlaylistEntry:
+    """Get the entry of a pls playlist from its keys.
+
+    Args:
+        fields (Dict[str, str]): value of the file key, and of the title and length keys if any
+    Returns:
+        PlaylistEntry: entry, without metadata if it has neither title nor length
+    """
+    if "title" not in fields and "length" not in fields:
+        return PlaylistEntry(fields["file"])
+    return PlaylistEntry(fields["file"], SongInfo(parse_duration(fields.get("length", "-1")), fields.get("title", "")))
+
+
+def get_local_name(tag: str) -> str:
+    """Get the name of an XML tag without its namespace.
+
+    Args:
+        tag (str): tag, as {namespace}name
+    Returns:
+        str: name of the tag
+    """
+    return tag.rpartition("}")[2]
+
+
+def read_xspf(playlist_path: Path) -> Iterator[PlaylistEntry]:
+    """Parse a xspf playlist incrementally, releasing each track once parsed.
+
+    Locations are URIs: relative ones are percent-decoded, file URLs are kept as they are. Each track is removed from
+    the tree once yielded, so memory does not grow with the playlist. A malformed playlist is read up to its first
+    error, which is logged as a warning.
+    Args:
+        playlist_path (Path): path of the playlist file
+    Yields:
+        PlaylistEntry: each track with a location, with its title and duration
+    """
+    parents = []
+    try:
+        for event, element in ElementTree.iterparse(playlist_path, events=("start", "end")):
+            if event == "start":
+                parents.append(element)
+                continue
+            parents.pop()
+            if get_local_name(element.tag) != "track":
+                continue
+            children = {get_local_name(child.tag): (child.text or "").strip() for child in reversed(element)}
+            if parents:
+                parents[-1].remove(element)
+            location = children.get("location")
+            if not location:
+                continue
+            if not URL_PATTERN.match(location):
+                location = unquote(location)
+            info = None
+            if "title" in children or "duration" in children:
+                duration = parse_duration(children.get("duration", ""))
+                info = SongInfo(round(duration / 1000) if duration > 0 else -1, children.get("title", ""))
+            yield PlaylistEntry(location, info)
+    except ElementTree.ParseError as error:
+        logging.warning("Playlist file %s is not a valid xspf playlist, read up to: %s", str(playlist_path), error)
+
+
+def read_m3u(playlist_path: Path) -> Iterator[PlaylistEntry]:
+    """Parse a m3u or m3u8 playlist file line by line.
+
+    Args:
+        playlist_path (Path): path of the playlist file
+    Yields:
+        PlaylistEntry: each entry of the playlist
+    """
+    with open(playlist_path, "r", encoding="utf-8") as content:
+        yield from parse_m3u(content)
+
+
+def read_pls(playlist_path: Path) -> Iterator[PlaylistEntry]:
+    """Parse a pls playlist file line by line.
+
+    Args:
+        playlist_path (Path): path of the playlist file
+    Yields:
+        PlaylistEntry: each entry of the playlist
+    """
+    with open(playlist_path, "r", encoding="utf-8") as content:
+        yield from parse_pls(content)
+
+
+PlaylistReader = Callable[[Path], Iterator[PlaylistEntry]]
+
+# reader of each playlist suffix, new formats are supported by adding their reader
+PLAYLIST_READERS: Dict[str, PlaylistReader] = {
+    ".m3u": read_m3u,
+    ".m3u8": read_m3u,
+    ".pls": read_pls,
+    ".xspf": read_xspf,
+}
+
+
+def read_playlist(playlist_path: Path) -> Iterator[PlaylistEntry]:
+    """Parse a playlist file with the reader of its suffix.
+
+    Args:
+        playlist_path (Path): path of the playlist file
+    Returns:
+        Iterator[PlaylistEntry]: entries of the playlist, parsed as they are consumed
+    """
+    return PLAYLIST_READERS.get(playlist_path.suffix.lower(), read_m3u)(playlist_path)
+
+
+def get_location_path(location: str) -> Optional[Path]:
+    """Get the path of a playlist location.
+
+    Args:
+        location (str): path, or URL such as file:///home/foo/My%20Song.mp3
+    Returns:
+        Optional[Path]: decoded path, None if the location is the URL of a remote stream
+    """
+    if not URL_PATTERN.match(location):
+        return Path(location)
+    url = urlparse(location)
+    if url.scheme.lower() != "file" or url.netloc not in ("", "localhost"):
+        return None
+    return Path(url2pathname(url.path))
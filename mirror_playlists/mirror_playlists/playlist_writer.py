@@ -0,0 +1,106 @@
+"""Writing of the mirrored playlist files, skipping the playlists whose file already has the mirrored content."""
+
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .async_engine import run_concurrently
+from .change_detection import DigestCache, compute_content_digest, get_file_stat
+from .copy_engine import create_parent_folders, get_partial_file_path
+from .inventory import DirectoryInventory
+
+
+def get_data_of_playlist(content: List[str]) -> bytes:
+    """Encode the content of a playlist as written in the playlist file.
+
+    Args:
+        content (List[str]): List of string line by line of the new content of playlist
+    Returns:
+        bytes: UTF-8 content of the playlist file
+    """
+    return "\n".join(content).encode("utf-8")
+
+
+def is_playlist_file_unchanged(
+    data: bytes,
+    playlist_file_path: Path,
+    inventory: Optional[DirectoryInventory] = None,
+    digest_cache: Optional[DigestCache] = None,
+) -> bool:
+    """Tell whether a playlist file on destination already has the given content.
+
+    Files of another size differ without being read. Otherwise the digest cached by the previous run is compared
+    when a cache is given, the file is only read if it changed since it was written.
+    Args:
+        data (bytes): new content of the playlist file
+        playlist_file_path (Path): path of the playlist file (absolute path, in destination folder)
+        inventory (Optional[DirectoryInventory]): inventory answering stat of the destination files
+        digest_cache (Optional[DigestCache]): digests of the playlist files written by previous runs
+    Returns:
+        bool: True if the playlist file exists with this content
+    """
+    file_stat = get_file_stat(playlist_file_path, inventory)
+    if file_stat is None or file_stat.st_size != len(data):
+        return False
+    if digest_cache is not None:
+        return digest_cache.get_digest(playlist_file_path, file_stat) == compute_content_digest(data)
+    with open(playlist_file_path, "rb") as playlist_file:
+        return playlist_file.read() == data
+
+
+def write_playlist_file(data: bytes, playlist_file_path: Path, digest_cache: Optional[DigestCache] = None) -> None:
+    """Write a playlist file under a temporary name, then rename it over the previous one.
+
+    Players never read a truncated playlist, even if the run is interrupted.
+    Args:
+        data (bytes): new content of the playlist file
+        playlist_file_path (Path): path of the playlist file (absolute path, in destination folder)
+        digest_cache (Optional[DigestCache]): the digest of the written file is recorded in it for the next run
+    """
+    partial_file_path = get_partial_file_path(playlist_file_path)
+    try:
+        with open(partial_file_path, "wb") as partial_file:
+            partial_file.write(data)
+        os.replace(partial_file_path, playlist_file_path)
+    except BaseException:
+        partial_file_path.unlink(missing_ok=True)
+        raise
+    if digest_cache is not None:
+        digest_cache.set_digest(playlist_file_path, playlist_file_path.stat(), compute_content_digest(data))
+
+
+def write_changed_playlist_files(
+    playlist_files: Dict[Path, bytes],
+    write_limit: Optional[int] = None,
+    inventory: Optional[DirectoryInventory] = None,
+    digest_cache: Optional[DigestCache] = None,
+) -> None:
+    """Write the playlist files whose content changed, creating their folders once per folder.
+
+    Playlists whose folder could not be created are logged and skipped.
+    Args:
+        playlist_files (Dict[Path, bytes]): new content of each playlist file on destination
+        write_limit (Optional[int]): maximum number of playlists written at the same time, one at a time if None
+        inventory (Optional[DirectoryInventory]): inventory answering stat of the destination files
+        digest_cache (Optional[DigestCache]): digests of the playlist files written by previous runs, completed with
+            the digests of the written files
+    """
+    changed_playlist_files = [
+        playlist_file_path
+        for playlist_file_path, data in playlist_files.items()
+        if not is_playlist_file_unchanged(data, playlist_file_path, inventory, digest_cache)
+    ]
+    failed_folders = create_parent_folders(changed_playlist_files, inventory)
+    writes = []
+    for playlist_file_path in changed_playlist_files:
+        if playlist_file_path.parent in failed_folders:
+            logging.error("Failed to write %s: %s", str(playlist_file_path), failed_folders[playlist_file_path.parent])
+        else:
+            writes.append((write_playlist_file, (playlist_files[playlist_file_path], playlist_file_path, digest_cache)))
+    if write_limit is None:
+        for write, arguments in writes:
+            write(*arguments)
+    elif writes:
+        run_concurrently(writes, write_limit)
+    logging.info("Wrote %d playlists, %d unchanged", len(writes), len(playlist_files) - len(changed_playlist_files))
@@ -0,0 +1,141 @@
+"""Removal of destination files that are no longer referenced by any playlist."""
+
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from .inventory import DirectoryInventory
+
+
+@dataclass
+class PruneReport:
+    """Files and folders removed (or that would be removed) from the destination."""
+
+    dry_run: bool = False
+    removed_files: List[Path] = field(default_factory=list)
+    removed_folders: List[Path] = field(default_factory=list)
+    reclaimed_bytes: int = 0
+    failures: Dict[Path, str] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the report to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: removed files and folders, reclaimed bytes and failures
+        """
+        return {
+            "dry_run": self.dry_run,
+            "removed_files": list(map(str, self.removed_files)),
+            "removed_folders": list(map(str, self.removed_folders)),
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "failures": {str(path): error for path, error in self.failures.items()},
+        }
+
+    def log_summary(self) -> None:
+        """Log the summary of the pruning, listing every file in dry run."""
+        if self.dry_run:
+            for file_path in self.removed_files:
+                logging.info("Would remove %s", str(file_path))
+        logging.info(
+            "%s %d orphaned files and %d empty folders, %d bytes reclaimed",
+            "Would remove" if self.dry_run else "Removed",
+            len(self.removed_files),
+            len(self.removed_folders),
+            self.reclaimed_bytes,
+        )
+        for path, error in self.failures.items():
+            logging.error("Failed to remove %s: %s", str(path), error)
+
+
+def get_state_files(destination_folder_path: Path, state_file_path: Path, inventory: DirectoryInventory) -> Set[Path]:
+    """Get the sync state database and its SQLite side files, when the database is stored in the destination.
+
+    Side files (rollback journal, write-ahead log, shared memory) are named after the database followed by a dash,
+    they are matched by that prefix.
+    Args:
+        destination_folder_path (Path): destination where files are mirrored
+        state_file_path (Path): path of the sync state database
+        inventory (DirectoryInventory): inventory of the destination
+    Returns:
+        Set[Path]: destination path of the database and of its side files, empty if stored outside the destination
+    """
+    state_file_path = state_file_path.absolute()
+    if not state_file_path.is_relative_to(destination_folder_path.absolute()):
+        return set()
+    state_file_path = destination_folder_path / state_file_path.relative_to(destination_folder_path.absolute())
+    side_file_prefix = f"{state_file_path.name}-"
+    return {state_file_path}.union(
+        state_file_path.parent / name
+        for name in inventory.list_folder(state_file_path.parent) or {}
+        if name.startswith(side_file_prefix)
+    )
+
+
+def find_orphans(
+    destination_folder_path: Path, referenced_files: Set[Path], inventory: DirectoryInventory
+) -> PruneReport:
+    """Find the files and folders of the destination that are not referenced, walking the destination once.
+
+    A folder is orphaned when everything it contains is orphaned and no referenced file is expected in it. The
+    destination folder itself is never orphaned.
+    Args:
+        destination_folder_path (Path): destination where files are mirrored
+        referenced_files (Set[Path]): destination path of every file that must be kept
+        inventory (DirectoryInventory): inventory of the destination
+    Returns:
+        PruneReport: orphaned files and folders, with the total size of the orphaned files
+    """
+    inventory.scan_tree(destination_folder_path)
+    folders = inventory.get_folders_below(destination_folder_path)
+    report = PruneReport(dry_run=True)
+    kept_folders = {folder for file_path in referenced_files for folder in file_path.parents}
+    orphaned_folders: Set[Path] = set()
+    # deepest folders first, so that sub folders are known to be orphaned before their parent
+    for folder in sorted(folders, key=lambda folder: len(folder.parts), reverse=True):
+        kept_entries = 0
+        for name, entry in folders[folder].items():
+            entry_path = folder / name
+            if entry.is_dir(follow_symlinks=False):
+                kept_entries += entry_path not in orphaned_folders
+            elif entry_path in referenced_files:
+                kept_entries += 1
+            else:
+                report.removed_files.append(entry_path)
+                report.reclaimed_bytes += entry.stat(follow_symlinks=False).st_size
+        if kept_entries == 0 and folder not in kept_folders and folder != destination_folder_path:
+            orphaned_folders.add(folder)
+            report.removed_folders.append(folder)
+    report.removed_files.sort()
+    return report
+
+
+def prune_destination(
+    destination_folder_path: Path, referenced_files: Set[Path], inventory: DirectoryInventory, dry_run: bool = False
+) -> PruneReport:
+    """Remove every file of the destination not referenced, then the folders left empty.
+
+    Args:
+        destination_folder_path (Path): destination where files are mirrored
+        referenced_files (Set[Path]): destination path of every file that must be kept
+        inventory (DirectoryInventory): inventory of the destination
+        dry_run (bool): only report what would be removed
+    Returns:
+        PruneReport: removed files and folders, with the total size of the removed files
+    """
+    report = find_orphans(destination_folder_path, referenced_files, inventory)
+    report.dry_run = dry_run
+    if dry_run:
+        return report
+    for file_path in report.removed_files:
+        try:
+            file_path.unlink()
+        except OSError as error:
+            report.failures[file_path] = str(error)
+    # removed_folders is ordered deepest first
+    for folder in report.removed_folders:
+        try:
+            folder.rmdir()
+        except OSError as error:
+            report.failures[folder] = str(error)
+    return report
@@ -0,0 +1,95 @@
+"""Structured report of a mirror run, with the wall time of each phase."""
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from .budget import BudgetReport
+from .copy_engine import CopyReport
+from .deduplication import DeduplicationReport
+from .planning import MirrorPlan
+from .pruning import PruneReport
+from .song_resolver import ResolverReport
+
+
+@dataclass
+class PhaseMetrics:
+    """Wall time and number of items processed by a phase of the run."""
+
+    seconds: float = 0.0
+    items: int = 0
+
+
+@dataclass
+class RunReport:
+    """Metrics of each phase of a mirror run, with the reports of its other steps and its plan.
+
+    Steps are the resolution of missing songs, the selection of songs, the deduplication, the copy and the pruning.
+    """
+
+    phases: Dict[str, PhaseMetrics] = field(default_factory=dict)
+    copy_report: Optional[CopyReport] = None
+    prune_report: Optional[PruneReport] = None
+    plan: Optional[MirrorPlan] = None
+    budget_report: Optional[BudgetReport] = None
+    resolver_report: Optional[ResolverReport] = None
+    deduplication_report: Optional[DeduplicationReport] = None
+
+    @contextmanager
+    def measure_phase(self, name: str) -> Iterator[PhaseMetrics]:
+        """Measure the wall time of a phase, added to the time already spent in a phase of the same name.
+
+        Args:
+            name (str): name of the phase
+        Yields:
+            PhaseMetrics: metrics of the phase, to record the number of processed items
+        """
+        metrics = self.phases.setdefault(name, PhaseMetrics())
+        start_time = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            metrics.seconds += time.perf_counter() - start_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the report to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: metrics of each phase, and reports of the resolution, selection, deduplication, copy,
+                pruning and planning
+        """
+        return {
+            "phases": {name: {"seconds": phase.seconds, "items": phase.items} for name, phase in self.phases.items()},
+            "copy": None if self.copy_report is None else self.copy_report.to_dict(),
+            "prune": None if self.prune_report is None else self.prune_report.to_dict(),
+            "plan": None if self.plan is None else self.plan.to_dict(),
+            "budget": None if self.budget_report is None else self.budget_report.to_dict(),
+            "resolver": None if self.resolver_report is None else self.resolver_report.to_dict(),
+            "deduplication": None if self.deduplication_report is None else self.deduplication_report.to_dict(),
+        }
+
+    def write_json(self, report_file_path: Path) -> None:
+        """Write the report as JSON.
+
+        Args:
+            report_file_path (Path): path of the JSON file
+        """
+        with open(report_file_path, "w", encoding="utf-8") as report_file:
+            json.dump(self.to_dict(), report_file, indent=2)
+
+    def log_summary(self) -> None:
+        """Log the wall time of each phase, the copy throughput and the slowest copied songs."""
+        for name, phase in self.phases.items():
+            logging.info("Phase %s: %.3f s, %d items", name, phase.seconds, phase.items)
+        if self.copy_report is not None:
+            logging.info(
+                "Copy throughput: %.2f MiB/s, %.1f songs/s",
+                self.copy_report.throughput() / (1024 * 1024),
+                self.copy_report.file_throughput(),
+            )
+            for seconds, destination_song_path in self.copy_report.get_slowest_files():
+                logging.debug("Slow song %s: %.3f s", str(destination_song_path), seconds)
@@ -0,0 +1,116 @@
+"""Scheduling of the copies: the order songs are dispatched in, and the bandwidth they may use.
+
+Songs are dispatched in the order of their source folder and inode, then of their destination, instead of the order
+of the playlists. Songs of the same album are read one after the other, which on a spinning disk or a network share
+turns scattered reads into sequential ones, and are written to the same destination folder in a row.
+"""
+
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .inventory import DirectoryInventory
+
+# songs are dispatched grouped by source folder and inode, or in the order of the playlists
+LOCALITY = "locality"
+PLAYLIST_ORDER = "playlist"
+COPY_ORDERS = (LOCALITY, PLAYLIST_ORDER)
+# seconds worth of bytes the copies may transfer ahead of the bandwidth limit, so that short bursts are not slowed down
+BANDWIDTH_BURST_SECONDS = 0.5
+
+
+def get_locality_key(
+    source_song_path: Path, destination_song_path: Path, inventory: DirectoryInventory
+) -> Tuple[str, int, str]:
+    """Get the key ordering a copy by the location of its source on disk, then by its destination.
+
+    Args:
+        source_song_path (Path): path of the source song file
+        destination_song_path (Path): path of the destination song file
+        inventory (DirectoryInventory): inventory giving the inode of the source from its folder listing
+    Returns:
+        Tuple[str, int, str]: source folder, source inode and destination of the copy
+    """
+    return str(source_song_path.parent), inventory.get_inode(source_song_path), str(destination_song_path)
+
+
+def order_copy_jobs(
+    copy_jobs: List[Tuple[Path, Path]], copy_order: str = LOCALITY, inventory: Optional[DirectoryInventory] = None
+) -> List[Tuple[Path, Path]]:
+    """Order the copy jobs before they are dispatched.
+
+    Args:
+        copy_jobs (List[Tuple[Path, Path]]): pairs of source and destination song path, in the order of the playlists
+        copy_order (str): order of the copies, see COPY_ORDERS
+        inventory (Optional[DirectoryInventory]): inventory of the source folders, a new one if None
+    Returns:
+        List[Tuple[Path, Path]]: copy jobs in the order they are dispatched
+    Raises:
+        ValueError: if the copy order is unknown
+    """
+    if copy_order not in COPY_ORDERS:
+        raise ValueError(f"Unknown copy order {copy_order}")
+    if copy_order == PLAYLIST_ORDER:
+        return list(copy_jobs)
+    if inventory is None:
+        inventory = DirectoryInventory()
+    return sorted(copy_jobs, key=lambda copy_job: get_locality_key(*copy_job, inventory))
+
+
+class BandwidthLimiter:
+    """Limit of the bytes transferred per second, shared by all the copies of a run.
+
+    Each transfer books the time its bytes take at the limit, after the transfers booked before it, and waits until
+    then. The copies together never exceed the limit by more than BANDWIDTH_BURST_SECONDS worth of bytes.
+    """
+
+    def __init__(self, bytes_per_second: int):
+        """Create a limiter.
+
+        Args:
+            bytes_per_second (int): maximum number of bytes transferred per second
+        Raises:
+            ValueError: if the limit is lower than 1
+        """
+        if bytes_per_second < 1:
+            raise ValueError(f"Bandwidth limit must be at least 1 byte per second, got {bytes_per_second}")
+        self.bytes_per_second = bytes_per_second
+        self.available_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, byte_count: int) -> float:
+        """Book the time byte_count more bytes take at the limit, after the bytes booked before.
+
+        Args:
+            byte_count (int): number of bytes about to be transferred, or just transferred
+        Returns:
+            float: seconds to wait before transferring more bytes, 0 within the allowed burst
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.available_time = max(self.available_time, now) + byte_count / self.bytes_per_second
+            return max(self.available_time - now - BANDWIDTH_BURST_SECONDS, 0.0)
+
+    def consume(self, byte_count: int) -> None:
+        """Wait until byte_count more bytes can be transferred within the limit.
+
+        Args:
+            byte_count (int): number of bytes about to be transferred, or just transferred
+        """
+        delay = self.reserve(byte_count)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def create_bandwidth_limiter(bytes_per_second: Optional[int]) -> Optional[BandwidthLimiter]:
+    """Create the limiter shared by the copies of a run.
+
+    Args:
+        bytes_per_second (Optional[int]): maximum number of bytes transferred per second, no limit if None
+    Returns:
+        Optional[BandwidthLimiter]: limiter of the copies, None if there is no limit
+    """
+    if bytes_per_second is None:
+        return None
+    return BandwidthLimiter(bytes_per_second)
@@ -0,0 +1,127 @@
+"""Copy of the songs of a mirror run to a single destination, with the engine selected in the options.
+
+Lossless songs are transcoded first when enabled. With a sync state, only the songs whose source changed since they
+were last mirrored are copied.
+"""
+
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .async_engine import copy_all_songs_async
+from .change_detection import EXISTS, HASH, DigestCache
+from .copy_engine import (
+    JOURNAL_FILE_NAME,
+    CopyJob,
+    CopyJournal,
+    CopyReport,
+    copy_all_songs,
+)
+from .inventory import DirectoryInventory
+from .mirror_options import ASYNCIO, MirrorOptions
+from .sync_state import SyncState
+from .transcoding import transcode_copy_jobs
+
+
+def get_changed_copy_jobs(
+    copy_jobs: List[CopyJob],
+    song_stats: Dict[Path, os.stat_result],
+    sync_state: Optional[SyncState],
+    inventory: Optional[DirectoryInventory] = None,
+) -> List[CopyJob]:
+    """Get the copy jobs whose source changed since they were last mirrored, or whose destination was deleted.
+
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        song_stats (Dict[Path, os.stat_result]): stat of each source song
+        sync_state (Optional[SyncState]): state of previous runs, every job is changed if None
+        inventory (Optional[DirectoryInventory]): inventory of the destination folders
+    Returns:
+        List[CopyJob]: jobs not recorded as mirrored with the current source stat, or missing on destination
+    """
+    if sync_state is None:
+        return copy_jobs
+    return [
+        (source, destination)
+        for source, destination in copy_jobs
+        if not sync_state.is_song_mirrored(source, destination, song_stats[source], inventory)
+    ]
+
+
+def get_copy_function(options: MirrorOptions) -> Callable[..., CopyReport]:
+    """Get the function copying songs with the engine selected in the options.
+
+    Both engines take the same arguments and give the same result.
+    Args:
+        options (MirrorOptions): options of the copy
+    Returns:
+        Callable[..., CopyReport]: copy_all_songs_async for the asyncio engine, copy_all_songs otherwise
+    """
+    if options.scheduling.engine == ASYNCIO:
+        return copy_all_songs_async
+    return copy_all_songs
+
+
+def copy_songs(
+    copy_jobs: List[CopyJob], options: MirrorOptions, destination_folder_path: Path, inventory: DirectoryInventory
+) -> CopyReport:
+    """Copy the songs that are not up to date on destination, transcoding lossless songs first when enabled.
+
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        options (MirrorOptions): options of the copy
+        destination_folder_path (Path): destination where we should mirror files, holding the copy journal
+        inventory (DirectoryInventory): inventory of the source and destination folders
+    Returns:
+        CopyReport: aggregated result of the copy
+    """
+    runnable_copy_jobs, transcode_failures = transcode_copy_jobs(
+        copy_jobs, options.transcode, skip_existing=options.sync.comparison == EXISTS, inventory=inventory
+    )
+    with CopyJournal(destination_folder_path / JOURNAL_FILE_NAME) as journal:
+        copy_report = get_copy_function(options)(runnable_copy_jobs, options, journal=journal, inventory=inventory)
+    copy_report.failures.update(transcode_failures)
+    return copy_report
+
+
+def copy_songs_not_mirrored_yet(
+    copy_jobs: List[CopyJob],
+    song_stats: Dict[Path, os.stat_result],
+    sync_state: SyncState,
+    options: MirrorOptions,
+    destination_folder_path: Path,
+    inventory: DirectoryInventory,
+) -> CopyReport:
+    """Copy the songs whose source changed since they were last mirrored, and record them in the sync state.
+
+    Lossless songs are transcoded first when enabled. Digests computed by the hash comparison or for the transcode
+    cache are recorded in the sync state as well.
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        song_stats (Dict[Path, os.stat_result]): stat of each source song
+        sync_state (SyncState): state of previous runs
+        options (MirrorOptions): options of the copy
+        destination_folder_path (Path): destination where we should mirror files, holding the copy journal
+        inventory (DirectoryInventory): inventory of the source and destination folders
+    Returns:
+        CopyReport: aggregated result of the copy
+    """
+    changed_copy_jobs = get_changed_copy_jobs(copy_jobs, song_stats, sync_state, inventory)
+    digest_cache = None
+    if options.sync.comparison == HASH or options.transcode is not None:
+        digest_cache = DigestCache(sync_state.get_digests())
+    runnable_copy_jobs, transcode_failures = transcode_copy_jobs(
+        changed_copy_jobs, options.transcode, digest_cache, options.sync.comparison == EXISTS, inventory
+    )
+    with CopyJournal(destination_folder_path / JOURNAL_FILE_NAME) as journal:
+        copy_report = get_copy_function(options)(runnable_copy_jobs, options, digest_cache, journal, inventory)
+    copy_report.failures.update(transcode_failures)
+    copy_report.skipped_files += len(copy_jobs) - len(changed_copy_jobs)
+    sync_state.set_songs_mirrored(
+        (source, destination, song_stats[source])
+        for source, destination in changed_copy_jobs
+        if destination not in copy_report.failures
+    )
+    if digest_cache is not None:
+        sync_state.set_digests(digest_cache.get_new_digests())
+    return copy_report
@@ -0,0 +1,291 @@
+"""Repair of playlist entries whose song was moved or renamed in the music root.
+
+The music root is indexed once per run, the first time a song is missing, by file name and by normalized name. The
+listing of each folder is cached between runs with the modification time of the folder, so that only the folders
+that changed since the previous run are listed again.
+"""
+
+import json
+import logging
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, List, Optional
+
+from .mirror_options import MirrorOptions
+from .playlist_formats import SongInfo
+
+# leading track number of a file name, as "01 - ", "1." or "07_"
+TRACK_NUMBER = re.compile(r"^\d{1,3}[\s._-]+")
+NON_ALPHANUMERIC = re.compile(r"\W+|_")
+
+
+@dataclass
+class ResolverReport:
+    """Missing songs relocated in the music root, and songs that are truly missing."""
+
+    relocated_songs: Dict[Path, Path] = field(default_factory=dict)
+    missing_songs: List[Path] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the report to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: new path of each relocated song, and songs that are truly missing
+        """
+        return {
+            "relocated": {str(old_path): str(new_path) for old_path, new_path in self.relocated_songs.items()},
+            "missing": list(map(str, self.missing_songs)),
+        }
+
+    def log_summary(self) -> None:
+        """Log the summary of the resolution."""
+        logging.info(
+            "Relocated %d missing songs, %d songs are truly missing",
+            len(self.relocated_songs),
+            len(self.missing_songs),
+        )
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a file name, to match songs renamed by tagging tools.
+
+    Case, accents, a leading track number, punctuation and spacing are ignored, the suffix is kept.
+    Args:
+        name (str): file name
+    Returns:
+        str: normalized file name
+    """
+    path = PurePosixPath(name)
+    stem = unicodedata.normalize("NFKD", path.stem.casefold())
+    stem = "".join(character for character in stem if not unicodedata.combining(character))
+    return NON_ALPHANUMERIC.sub("", TRACK_NUMBER.sub("", stem)) + path.suffix.lower()
+
+
+def list_music_folders(
+    music_root_folder_path: Path, cached_folders: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    """List every folder below the music root, reusing the cached listing of unchanged folders.
+
+    A folder is unchanged when its modification time is the one cached. Renaming, adding or removing a file changes
+    the modification time of its folder, while rewriting a file does not, so cached sizes may be outdated.
+    Args:
+        music_root_folder_path (Path): root folder of the music repository
+        cached_folders (Dict[str, Dict[str, Any]]): cached listing of each folder by path relative to the music root,
+            with its modification time, the size of its files and its subfolders
+    Returns:
+        Dict[str, Dict[str, Any]]: listing of each existing folder, in the format of the cache
+    """
+    folders: Dict[str, Dict[str, Any]] = {}
+    folders_to_list = [PurePosixPath()]
+    while folders_to_list:
+        relative_folder = folders_to_list.pop()
+        folder = music_root_folder_path / relative_folder
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+            listing = cached_folders.get(str(relative_folder))
+            if listing is None or listing["mtime_ns"] != mtime_ns:
+                listing = {"mtime_ns": mtime_ns, "files": {}, "folders": []}
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            listing["folders"].append(entry.name)
+                        elif entry.is_file():
+                            listing["files"][entry.name] = entry.stat().st_size
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        folders[str(relative_folder)] = listing
+        folders_to_list.extend(relative_folder / name for name in listing["folders"])
+    return folders
+
+
+def is_folder_listing(listing: Any) -> bool:
+    """Tell whether a cached listing of a folder has the format written by the resolver.
+
+    Args:
+        listing (Any): listing read from the cache file
+    Returns:
+        bool: True if the listing has a modification time, the size of its files and its subfolders
+    """
+    return (
+        isinstance(listing, dict)
+        and isinstance(listing.get("mtime_ns"), int)
+        and isinstance(listing.get("files"), dict)
+        and all(isinstance(size, int) for size in listing["files"].values())
+        and isinstance(listing.get("folders"), list)
+        and all(isinstance(name, str) for name in listing["folders"])
+    )
+
+
+def read_cached_folders(cache_file_path: Path, music_root_folder_path: Path) -> Dict[str, Dict[str, Any]]:
+    """Read the listing of the music folders cached by the previous run.
+
+    A cache that cannot be read or is malformed is ignored with a warning, the index is then built from scratch and
+    the cache written again.
+    Args:
+        cache_file_path (Path): JSON file caching the listing of the music folders
+        music_root_folder_path (Path): root folder of the music repository
+    Returns:
+        Dict[str, Dict[str, Any]]: cached listing of each folder, empty if not cached for this music root
+    """
+    try:
+        with open(cache_file_path, "r", encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as error:
+        logging.warning("Ignoring the unreadable index cache %s: %s", str(cache_file_path), error)
+        return {}
+    folders = cache.get("folders") if isinstance(cache, dict) else None
+    if not isinstance(folders, dict) or not all(map(is_folder_listing, folders.values())):
+        logging.warning("Ignoring the malformed index cache %s", str(cache_file_path))
+        return {}
+    return folders if cache.get("music_root") == str(music_root_folder_path) else {}
+
+
+class SongResolver:
+    """Index of the songs of the music root, finding the new path of songs that were moved or renamed.
+
+    A missing song is relocated when a single song of the music root has the same file name, or else the same
+    normalized name. Among several candidates, the one with the size the missing song had in the previous index is
+    picked, then the one in a folder of the same name. Songs with no candidate, or with several remaining, are
+    reported as missing.
+    """
+
+    def __init__(self, music_root_folder_path: Path, cache_file_path: Optional[Path] = None):
+        """Create the resolver, the index is built the first time a song is missing.
+
+        Args:
+            music_root_folder_path (Path): root folder of the music repository
+            cache_file_path (Optional[Path]): JSON file caching the listing of the music folders between runs,
+                nothing is cached if None
+        """
+        self.music_root_folder_path = music_root_folder_path
+        self.cache_file_path = cache_file_path
+        self.cached_folders: Dict[str, Dict[str, Any]] = (
+            {} if cache_file_path is None else read_cached_folders(cache_file_path, music_root_folder_path)
+        )
+        self.folders: Optional[Dict[str, Dict[str, Any]]] = None
+        self.songs_by_name: Dict[str, List[Path]] = {}
+        self.songs_by_normalized_name: Dict[str, List[Path]] = {}
+        self.report = ResolverReport()
+
+    def build_index(self) -> None:
+        """List the music root, reusing the cached listing of unchanged folders, and index its songs by name."""
+        self.folders = list_music_folders(self.music_root_folder_path, self.cached_folders)
+        for relative_folder, listing in self.folders.items():
+            for name in listing["files"]:
+                song_path = self.music_root_folder_path / relative_folder / name
+                self.songs_by_name.setdefault(name, []).append(song_path)
+                self.songs_by_normalized_name.setdefault(normalize_name(name), []).append(song_path)
+        logging.info("Indexed %d folders of %s", len(self.folders), str(self.music_root_folder_path))
+
+    def get_listed_size(self, song_path: Path, folders: Dict[str, Dict[str, Any]]) -> Optional[int]:
+        """Get the size of a song in a listing of the music folders.
+
+        Args:
+            song_path (Path): path of the song
+            folders (Dict[str, Dict[str, Any]]): listing of the music folders, cached by the previous run or current
+        Returns:
+            Optional[int]: listed size, None if the song is not in the listing
+        """
+        if not song_path.is_relative_to(self.music_root_folder_path):
+            return None
+        relative_path = PurePosixPath(song_path.relative_to(self.music_root_folder_path).as_posix())
+        listing = folders.get(str(relative_path.parent), {})
+        return listing.get("files", {}).get(relative_path.name)
+
+    def pick_candidate(self, song_path: Path, candidates: List[Path]) -> Optional[Path]:
+        """Pick the new path of a missing song among songs of the same name.
+
+        Args:
+            song_path (Path): path of the missing song
+            candidates (List[Path]): indexed songs of the same file name or normalized name
+        Returns:
+            Optional[Path]: new path of the song, None if no candidate or several candidates remain
+        """
+        previous_size = self.get_listed_size(song_path, self.cached_folders)
+        if len(candidates) > 1 and previous_size is not None:
+            candidates = [
+                candidate
+                for candidate in candidates
+                if self.get_listed_size(candidate, self.folders or {}) == previous_size
+            ] or candidates
+        if len(candidates) > 1:
+            candidates = [
+                candidate for candidate in candidates if candidate.parent.name == song_path.parent.name
+            ] or candidates
+        return candidates[0] if len(candidates) == 1 else None
+
+    def resolve(self, song_path: Path) -> Optional[Path]:
+        """Find the new path of a missing song, building the index the first time.
+
+        Args:
+            song_path (Path): path of the missing song
+        Returns:
+            Optional[Path]: new path of the song, None if it is truly missing
+        """
+        if song_path in self.report.relocated_songs:
+            return self.report.relocated_songs[song_path]
+        if self.folders is None:
+            self.build_index()
+        new_path = self.pick_candidate(song_path, self.songs_by_name.get(song_path.name, [])) or self.pick_candidate(
+            song_path, self.songs_by_normalized_name.get(normalize_name(song_path.name), [])
+        )
+        if new_path is None:
+            if song_path not in self.report.missing_songs:
+                self.report.missing_songs.append(song_path)
+        else:
+            logging.info("Song file %s does not exist, relocated to %s", str(song_path), str(new_path))
+            self.report.relocated_songs[song_path] = new_path
+        return new_path
+
+    def relocate_song_info(self, song_info: Dict[Path, SongInfo]) -> None:
+        """Give the relocated songs the metadata of the playlist entries referencing their previous path.
+
+        Args:
+            song_info (Dict[Path, SongInfo]): metadata of each song, completed for the relocated songs
+        """
+        for old_path, new_path in self.report.relocated_songs.items():
+            if old_path in song_info:
+                song_info.setdefault(new_path, song_info[old_path])
+
+    def finish(self, song_info: Dict[Path, SongInfo], dry_run: bool = False) -> ResolverReport:
+        """Complete the metadata of the relocated songs once playlists are parsed, and cache the index.
+
+        Args:
+            song_info (Dict[Path, SongInfo]): metadata of each song, completed for the relocated songs
+            dry_run (bool): do not write the cache file
+        Returns:
+            ResolverReport: relocated and truly missing songs
+        """
+        self.relocate_song_info(song_info)
+        self.report.log_summary()
+        if not dry_run:
+            self.save()
+        return self.report
+
+    def save(self) -> None:
+        """Write the listing of the music folders to the cache file, if the index was built."""
+        if self.cache_file_path is None or self.folders is None:
+            return
+        partial_file_path = self.cache_file_path.with_name(f"{self.cache_file_path.name}.partial")
+        with open(partial_file_path, "w", encoding="utf-8") as cache_file:
+            json.dump({"music_root": str(self.music_root_folder_path), "folders": self.folders}, cache_file)
+        os.replace(partial_file_path, self.cache_file_path)
+
+
+def create_song_resolver(music_root_folder_path: Path, options: MirrorOptions) -> Optional[SongResolver]:
+    """Create the resolver of missing songs, when enabled.
+
+    Args:
+        music_root_folder_path (Path): root folder of the music repository
+        options (MirrorOptions): options of the mirror
+    Returns:
+        Optional[SongResolver]: resolver of missing songs, None if missing songs are not resolved
+    """
+    if not options.selection.resolve_missing:
+        return None
+    return SongResolver(music_root_folder_path, options.selection.resolver_cache_path)
@@ -0,0 +1,236 @@
+"""Persistent state of previous mirror runs, used to skip work on unchanged files."""
+
+import contextlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import ContextManager, Dict, Iterable, List, Optional, Tuple
+
+from .inventory import DirectoryInventory
+from .path_store import PathStore
+from .playlist_formats import SongInfo
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlists (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    songs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mirrored_songs (
+    destination TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS digests (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+"""
+
+
+class SyncState:
+    """SQLite backed record of parsed playlists, mirrored songs and file digests.
+
+    Playlists are identified by their path, size and modification time. Mirrored songs are identified by their
+    destination path and the size and modification time their source file had when it was mirrored. Digests are
+    valid as long as the size and modification time of the hashed file did not change.
+    """
+
+    def __init__(self, database_path: Path, dry_run: bool = False):
+        """Open (and create if needed) the state database.
+
+        Args:
+            database_path (Path): path of the SQLite database file
+            dry_run (bool): never write the database file. A missing database is not created and changes are
+                rolled back on close.
+        """
+        self.dry_run = dry_run
+        if dry_run and not database_path.exists():
+            self.connection = sqlite3.connect(":memory:")
+        else:
+            self.connection = sqlite3.connect(str(database_path))
+        self.connection.executescript(SCHEMA)
+        self.mirrored_songs: Dict[str, Tuple[str, int, int]] = {
+            destination: (source, size, mtime_ns)
+            for destination, source, size, mtime_ns in self.connection.execute(
+                "SELECT destination, source, size, mtime_ns FROM mirrored_songs"
+            )
+        }
+
+    def __enter__(self) -> "SyncState":
+        """Enter the context.
+
+        Returns:
+            SyncState: this state
+        """
+        return self
+
+    def __exit__(self, *_) -> None:
+        """Commit and close the database when leaving the context."""
+        self.close()
+
+    def close(self) -> None:
+        """Commit pending changes, or roll them back in dry run, and close the database."""
+        if self.dry_run:
+            self.connection.rollback()
+        else:
+            self.connection.commit()
+        self.connection.close()
+
+    def get_playlist_songs(
+        self,
+        playlist_path: Path,
+        playlist_stat: os.stat_result,
+        song_info: Optional[Dict[Path, SongInfo]] = None,
+        path_store: Optional[PathStore] = None,
+    ) -> Optional[List[Path]]:
+        """Get the resolved songs of a playlist as recorded by a previous run.
+
+        Args:
+            playlist_path (Path): path of the playlist file
+            playlist_stat (os.stat_result): current stat of the playlist file
+            song_info (Optional[Dict[Path, SongInfo]]): metadata of each song, completed with the recorded metadata
+            path_store (Optional[PathStore]): store the song paths are interned in, shared with other playlists
+        Returns:
+            Optional[List[Path]]: resolved song path, None if the playlist is unknown, changed since or recorded in
+                the format of an older version
+        """
+        row = self.connection.execute(
+            "SELECT songs FROM playlists WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (str(playlist_path), playlist_stat.st_size, playlist_stat.st_mtime_ns),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            entries = json.loads(row[0])
+        except json.JSONDecodeError:
+            return None
+        if path_store is None:
+            path_store = PathStore()
+        songs = []
+        # each song is recorded as its path, followed by its duration and title when it has metadata
+        for song, *info in entries:
+            songs.append(path_store.intern(Path(song)))
+            if info and song_info is not None:
+                song_info[songs[-1]] = SongInfo(*info)
+        return songs
+
+    def set_playlist_songs(
+        self,
+        playlist_path: Path,
+        playlist_stat: os.stat_result,
+        songs: List[Path],
+        song_info: Optional[Dict[Path, SongInfo]] = None,
+    ) -> None:
+        """Record the resolved songs of a playlist.
+
+        Args:
+            playlist_path (Path): path of the playlist file
+            playlist_stat (os.stat_result): stat of the playlist file the songs were parsed from
+            songs (List[Path]): resolved song path
+            song_info (Optional[Dict[Path, SongInfo]]): metadata of the songs of the playlist
+        """
+        entries = []
+        for song in songs:
+            info = (song_info or {}).get(song)
+            entries.append([str(song)] if info is None else [str(song), info.duration, info.title])
+        self.connection.execute(
+            "INSERT OR REPLACE INTO playlists (path, size, mtime_ns, songs) VALUES (?, ?, ?, ?)",
+            (str(playlist_path), playlist_stat.st_size, playlist_stat.st_mtime_ns, json.dumps(entries)),
+        )
+
+    def is_song_mirrored(
+        self,
+        source_song_path: Path,
+        destination_song_path: Path,
+        source_song_stat: os.stat_result,
+        inventory: Optional[DirectoryInventory] = None,
+    ) -> bool:
+        """Return true if the song was mirrored by a previous run, its source did not change since and it still exists.
+
+        A destination song deleted since it was recorded, by hand or by another tool, is not trusted to be mirrored.
+        Args:
+            source_song_path (Path): path of the source song file
+            destination_song_path (Path): path of the destination song file
+            source_song_stat (os.stat_result): current stat of the source song file
+            inventory (Optional[DirectoryInventory]): inventory of the destination folders, checking that the
+                destination song exists without a stat per song, the file system is asked if None
+        Returns:
+            bool: True if the destination is up to date according to the state
+        """
+        if self.mirrored_songs.get(str(destination_song_path)) != (
+            str(source_song_path),
+            source_song_stat.st_size,
+            source_song_stat.st_mtime_ns,
+        ):
+            return False
+        if inventory is None:
+            return destination_song_path.exists()
+        return inventory.exists(destination_song_path)
+
+    def set_songs_mirrored(self, mirrored_songs: Iterable[Tuple[Path, Path, os.stat_result]]) -> None:
+        """Record songs as mirrored.
+
+        Args:
+            mirrored_songs (Iterable[Tuple[Path, Path, os.stat_result]]): source path, destination path and source
+                stat of each mirrored song
+        """
+        rows = [
+            (str(destination), str(source), stat.st_size, stat.st_mtime_ns)
+            for source, destination, stat in mirrored_songs
+        ]
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO mirrored_songs (destination, source, size, mtime_ns) VALUES (?, ?, ?, ?)", rows
+        )
+        for destination, source, size, mtime_ns in rows:
+            self.mirrored_songs[destination] = (source, size, mtime_ns)
+
+    def forget_songs_mirrored(self, destination_song_paths: Iterable[Path]) -> None:
+        """Forget songs removed from destination, so that they are copied again if a playlist references them again.
+
+        Args:
+            destination_song_paths (Iterable[Path]): destination path of each removed song
+        """
+        destinations = [str(destination) for destination in destination_song_paths]
+        self.connection.executemany(
+            "DELETE FROM mirrored_songs WHERE destination = ?", [(destination,) for destination in destinations]
+        )
+        for destination in destinations:
+            self.mirrored_songs.pop(destination, None)
+
+    def get_digests(self) -> List[Tuple[str, int, int, str]]:
+        """Get the file digests recorded by previous runs.
+
+        Returns:
+            List[Tuple[str, int, int, str]]: path, size, modification time and digest of hashed files
+        """
+        return self.connection.execute("SELECT path, size, mtime_ns, digest FROM digests").fetchall()
+
+    def set_digests(self, digests: Iterable[Tuple[str, int, int, str]]) -> None:
+        """Record file digests.
+
+        Args:
+            digests (Iterable[Tuple[str, int, int, str]]): path, size, modification time and digest of hashed files
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO digests (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)", digests
+        )
+
+
+def open_sync_state(database_path: Optional[Path], dry_run: bool = False) -> ContextManager[Optional[SyncState]]:
+    """Open the state database as a context, if a path is given.
+
+    Args:
+        database_path (Optional[Path]): path of the SQLite database file, no state is kept if None
+        dry_run (bool): never write the database file
+    Returns:
+        ContextManager[Optional[SyncState]]: context of the state, entering None without a database path
+    """
+    if database_path is None:
+        return contextlib.nullcontext()
+    return SyncState(database_path, dry_run)
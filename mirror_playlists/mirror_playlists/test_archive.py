@@ -0,0 +1,182 @@
+"""Unit test of the streaming of the mirror into an archive"""
+
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from .archive import (
+    STANDARD_OUTPUT,
+    TAR,
+    ZIP,
+    ArchiveWriter,
+    BoundedReader,
+    mirror_all_playlist_to_archive,
+)
+from .mirror_options import MirrorOptions, SyncSettings
+
+
+class TestBoundedReader(unittest.TestCase):
+    @parameterized.expand([[b"grown", b"gro", 0], [b"one", b"one\0\0", 2]])
+    def test_file_is_read_up_to_the_size(self, content, read_content, padded_bytes):
+        reader = BoundedReader(io.BytesIO(content), len(read_content))
+
+        self.assertTrue(reader.readable())
+        self.assertEqual(read_content, reader.read())
+        self.assertEqual(b"", reader.read())
+        self.assertEqual(padded_bytes, reader.padded_bytes)
+
+
+class TestArchiveWriter(unittest.TestCase):
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ArchiveWriter(io.BytesIO(), "rar")
+
+    def test_tar_stream_does_not_keep_its_members(self):
+        with ArchiveWriter(io.BytesIO()) as archive:
+            archive.add_data(b"#EXTM3U", "first.m3u")
+            archive.add_data(b"#EXTM3U", "second.m3u")
+            self.assertEqual([], archive.tar_file.members)
+
+    def test_zip_members_older_than_zip_epoch_are_dated_at_the_epoch(self):
+        stream = io.BytesIO()
+        with ArchiveWriter(stream, ZIP) as archive:
+            archive.add_member("old.mp3", io.BytesIO(b"old"), 3, 0.0)
+        with zipfile.ZipFile(stream) as zip_file:
+            self.assertEqual((1980, 1, 1, 0, 0, 0), zip_file.getinfo("old.mp3").date_time)
+
+    @parameterized.expand([[TAR, b"grown", b"gro", 3], [TAR, b"one", b"one\0\0", 3], [ZIP, b"one", b"one\0\0", 3]])
+    def test_members_have_exactly_their_given_size(self, archive_format, content, archived_content, read_bytes):
+        stream = io.BytesIO()
+        with ArchiveWriter(stream, archive_format) as archive:
+            self.assertEqual(
+                read_bytes, archive.add_member("song.mp3", io.BytesIO(content), len(archived_content), 0.0)
+            )
+            archive.add_data(b"#EXTM3U", "first.m3u")
+        stream.seek(0)
+        if archive_format == TAR:
+            with tarfile.open(fileobj=stream, mode="r|") as tar_file:
+                members = {member.name: tar_file.extractfile(member).read() for member in tar_file}
+        else:
+            with zipfile.ZipFile(stream) as zip_file:
+                members = {name: zip_file.read(name) for name in zip_file.namelist()}
+        self.assertEqual({"song.mp3": archived_content, "first.m3u": b"#EXTM3U"}, members)
+
+
+class TestMirrorAllPlaylistToArchive(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        root = Path(self.temporary_directory.name)
+        self.music = root / "Music"
+        self.archive = root / "mirror.tar"
+        (self.music / "Artist").mkdir(parents=True)
+        (self.music / "Playlists").mkdir()
+        (self.music / "Artist/one.mp3").write_bytes(b"one")
+        (self.music / "Artist/two.mp3").write_bytes(b"two")
+        (self.music / "Playlists/first.m3u").write_text("../Artist/one.mp3\n../Artist/two.mp3\n", encoding="utf-8")
+        (self.music / "Playlists/second.pls").write_text("[playlist]\nFile1=../Artist/two.mp3\n", encoding="utf-8")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def read_archive(self, stream, archive_format):
+        """Read the content of each member of an archive"""
+        if archive_format == TAR:
+            with tarfile.open(fileobj=stream, mode="r|") as tar_file:
+                return {member.name: tar_file.extractfile(member).read() for member in tar_file}
+        with zipfile.ZipFile(stream) as zip_file:
+            return {name: zip_file.read(name) for name in zip_file.namelist()}
+
+    @parameterized.expand([[TAR], [ZIP]])
+    def test_songs_and_playlists_are_streamed_into_the_archive(self, archive_format):
+        report = mirror_all_playlist_to_archive(
+            self.music, self.music / "Playlists", self.archive, MirrorOptions(), archive_format
+        )
+
+        with open(self.archive, "rb") as archive_file:
+            members = self.read_archive(archive_file, archive_format)
+        self.assertEqual(
+            {
+                "Artist/one.mp3": b"one",
+                "Artist/two.mp3": b"two",
+                "Playlists/first.m3u": b"#EXTM3U\n../Artist/one.mp3\n../Artist/two.mp3",
+                "Playlists/second.m3u8": b"#EXTM3U\n../Artist/two.mp3",
+            },
+            members,
+        )
+        self.assertEqual(2, report.copy_report.copied_files)
+        self.assertEqual(6, report.copy_report.copied_bytes)
+        self.assertEqual(2, report.phases["write"].items)
+
+    def test_archive_is_written_to_the_standard_output(self):
+        stdout = io.TextIOWrapper(io.BytesIO())
+        with patch("sys.stdout", stdout):
+            mirror_all_playlist_to_archive(self.music, self.music / "Playlists", STANDARD_OUTPUT)
+
+        stdout.buffer.seek(0)
+        self.assertIn("Artist/one.mp3", self.read_archive(stdout.buffer, TAR))
+        self.assertFalse(self.archive.exists())
+
+    def open_song(self, path, mode):
+        """Open a song of the library, failing for the first song"""
+        if path == self.music / "Artist/one.mp3":
+            raise PermissionError("denied")
+        return open(path, mode)  # pylint: disable=(consider-using-with,unspecified-encoding)
+
+    def test_songs_that_cannot_be_read_are_reported(self):
+        with patch("mirror_playlists.mirror_playlists.archive.open", create=True, side_effect=self.open_song):
+            with self.assertLogs(level="ERROR"):
+                report = mirror_all_playlist_to_archive(self.music, self.music / "Playlists", self.archive)
+
+        self.assertEqual({Path("Artist/one.mp3"): "denied"}, report.copy_report.failures)
+        self.assertEqual(1, report.copy_report.copied_files)
+
+    def test_songs_shrinking_while_archived_are_reported(self):
+        fstat = os.fstat
+
+        def fstat_before_truncation(file_descriptor):
+            """Stat a song as it was before it lost two bytes"""
+            file_stat = list(fstat(file_descriptor))
+            file_stat[6] += 2
+            return os.stat_result(file_stat)
+
+        with patch("mirror_playlists.mirror_playlists.archive.os.fstat", side_effect=fstat_before_truncation):
+            with self.assertLogs(level="ERROR"):
+                report = mirror_all_playlist_to_archive(self.music, self.music / "Playlists", self.archive)
+
+        self.assertEqual(
+            {
+                Path("Artist/one.mp3"): "Shrank by 2 bytes while archived",
+                Path("Artist/two.mp3"): "Shrank by 2 bytes while archived",
+            },
+            report.copy_report.failures,
+        )
+        with open(self.archive, "rb") as archive_file:
+            self.assertEqual(b"two\0\0", self.read_archive(archive_file, TAR)["Artist/two.mp3"])
+
+    def test_sync_state_is_not_written(self):
+        state_file = self.archive.with_name("state.db")
+
+        mirror_all_playlist_to_archive(
+            self.music, self.music / "Playlists", self.archive, MirrorOptions(sync=SyncSettings(state_file))
+        )
+
+        self.assertFalse(state_file.exists())
+        self.assertTrue(self.archive.exists())
+
+    def test_partial_archive_is_removed_when_mirroring_fails(self):
+        with patch("mirror_playlists.mirror_playlists.archive.add_songs_to_archive", side_effect=OSError("full")):
+            with self.assertRaises(OSError):
+                mirror_all_playlist_to_archive(self.music, self.music / "Playlists", self.archive)
+
+        self.assertEqual([self.music], list(self.archive.parent.iterdir()))
+
+    def test_missing_music_folder_is_rejected(self):
+        with self.assertRaises(FileNotFoundError):
+            mirror_all_playlist_to_archive(self.music / "missing", self.music / "Playlists", self.archive)
@@ -0,0 +1,121 @@
+"""Unit test of the asyncio engine"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from .async_engine import copy_all_songs_async, run_concurrently
+from .copy_engine import CopyJournal, copy_all_songs
+from .inventory import DirectoryInventory
+from .mirror_options import CopyScheduling, InFlightLimits, MirrorOptions, SyncSettings
+from .mirror_playlists_utils import mirror_all_playlist
+from .test_mirror_playlists_utils import MirroredLibraryTestCase
+
+
+class TestCopyAllSongsAsync(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        root = Path(self.temporary_directory.name)
+        self.source = root / "source"
+        self.source.mkdir()
+        for name in ["one.mp3", "two.mp3", "three.mp3", "same.mp3"]:
+            (self.source / name).write_bytes(name.encode())
+        (root / "blocked").write_bytes(b"a file where a folder is expected")
+        self.destinations = {engine: root / engine for engine in ["threads", "asyncio"]}
+        for destination in self.destinations.values():
+            (destination / "Album").mkdir(parents=True)
+            (destination / "Album/same.mp3").write_bytes(b"same")
+        self.copy_jobs = {
+            engine: [
+                (self.source / "one.mp3", destination / "Album/one.mp3"),
+                (self.source / "two.mp3", destination / "Other/Nested/two.mp3"),
+                (self.source / "same.mp3", destination / "Album/same.mp3"),
+                (self.source / "missing.mp3", destination / "Album/missing.mp3"),
+                (self.source / "three.mp3", root / "blocked/three.mp3"),
+            ]
+            for engine, destination in self.destinations.items()
+        }
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    @parameterized.expand([["no device limit", None], ["device limit", 1]])
+    # pylint: disable=(unused-argument)
+    def test_result_is_identical_to_the_thread_pool(self, name, jobs_per_destination):
+        options = MirrorOptions(
+            scheduling=CopyScheduling(
+                jobs=2, jobs_per_destination=jobs_per_destination, in_flight=InFlightLimits(1, 1, 1)
+            )
+        )
+        thread_report = copy_all_songs(self.copy_jobs["threads"], options)
+
+        async_report = copy_all_songs_async(self.copy_jobs["asyncio"], options, inventory=DirectoryInventory())
+
+        for report in (thread_report, async_report):
+            self.assertEqual((2, 1, 14), (report.copied_files, report.skipped_files, report.copied_bytes))
+        self.assertEqual(
+            {(path.name, "No such file" in error) for path, error in thread_report.failures.items()},
+            {(path.name, "No such file" in error) for path, error in async_report.failures.items()},
+        )
+        self.assertEqual(
+            {path.relative_to(self.destinations["threads"]) for path in self.destinations["threads"].rglob("*")},
+            {path.relative_to(self.destinations["asyncio"]) for path in self.destinations["asyncio"].rglob("*")},
+        )
+        self.assertEqual(b"two.mp3", (self.destinations["asyncio"] / "Other/Nested/two.mp3").read_bytes())
+
+    def test_committed_songs_are_skipped_and_copied_songs_committed(self):
+        journal_path = self.destinations["asyncio"] / "journal"
+        journal_path.write_text(f"{self.copy_jobs['asyncio'][0][1]}\n", encoding="utf-8")
+
+        with CopyJournal(journal_path) as journal:
+            report = copy_all_songs_async(self.copy_jobs["asyncio"][:3], MirrorOptions(), journal=journal)
+            committed_songs = journal_path.read_text(encoding="utf-8").splitlines()
+
+        self.assertEqual((1, 2), (report.copied_files, report.skipped_files))
+        self.assertFalse((self.destinations["asyncio"] / "Album/one.mp3").exists())
+        self.assertEqual({str(destination) for _, destination in self.copy_jobs["asyncio"][:3]}, set(committed_songs))
+
+    def test_progress_is_logged(self):
+        with patch("mirror_playlists.mirror_playlists.async_engine.PROGRESS_INTERVAL_SECONDS", 0.0):
+            with self.assertLogs(level="INFO") as logs:
+                copy_all_songs_async(self.copy_jobs["asyncio"][:2], MirrorOptions())
+        self.assertIn("Examined 2 of 2 songs, copied 14 bytes", logs.output[-1])
+
+    def test_invalid_number_of_jobs(self):
+        with self.assertRaises(ValueError):
+            copy_all_songs_async(self.copy_jobs["asyncio"], MirrorOptions(scheduling=CopyScheduling(jobs=0)))
+
+
+class TestRunConcurrently(unittest.TestCase):
+    def test_results_keep_the_order_of_the_calls(self):
+        self.assertEqual([3, 1, 2], run_concurrently([(len, ("abc",)), (abs, (-1,)), (max, (1, 2))], 2))
+
+
+class TestMirrorAllPlaylistWithAsyncioEngine(MirroredLibraryTestCase):
+    @parameterized.expand([["without sync state", False], ["with sync state", True]])
+    # pylint: disable=(unused-argument)
+    def test_asyncio_engine_mirrors_as_the_thread_pool(self, name, use_sync_state):
+        destinations = {}
+        for engine in ["threads", "asyncio"]:
+            destinations[engine] = self.destination / engine
+            destinations[engine].mkdir()
+            options = MirrorOptions(
+                sync=SyncSettings(state_file_path=self.state_file.with_name(engine) if use_sync_state else None),
+                scheduling=CopyScheduling(jobs=2, engine=engine),
+            )
+            report = mirror_all_playlist(self.music, self.music / "Playlists", destinations[engine], options)
+            self.assertEqual((2, 6), (report.copy_report.copied_files, report.copy_report.copied_bytes))
+
+        self.assertEqual(
+            {
+                path.relative_to(destinations["threads"]): path.read_bytes()
+                for path in destinations["threads"].rglob("*.*")
+            },
+            {
+                path.relative_to(destinations["asyncio"]): path.read_bytes()
+                for path in destinations["asyncio"].rglob("*.*")
+            },
+        )
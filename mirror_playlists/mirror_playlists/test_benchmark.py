@@ -0,0 +1,71 @@
+"""Unit test of the benchmark"""
+
+import io
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .benchmark import (
+    LibraryShape,
+    PlaylistShape,
+    generate_library,
+    main,
+    run_benchmark,
+)
+from .mirror_playlists_utils import parse_all_playlists
+
+SMALL_SHAPE = LibraryShape(artists=2, albums_per_artist=2, tracks_per_album=3, track_size=16)
+SMALL_PLAYLIST_SHAPE = PlaylistShape(playlists=3, tracks_per_playlist=10)
+
+
+class TestGenerateLibrary(unittest.TestCase):
+    def test_playlists_reference_library_with_relative_paths(self):
+        with tempfile.TemporaryDirectory() as folder:
+            music, playlist_root = generate_library(
+                Path(folder), SMALL_SHAPE, PlaylistShape(**{**vars(SMALL_PLAYLIST_SHAPE), "missing": 0.3})
+            )
+
+            songs = list(music.rglob("*.mp3"))
+            playlist_files = sorted(playlist_root.rglob("*.m3u"))
+            playlists = parse_all_playlists(playlist_files)
+
+            self.assertEqual(12, len(songs))
+            self.assertEqual(3, len(playlist_files))
+            self.assertEqual(playlist_root / "level 0/level 1", playlist_files[0].parent)
+            self.assertTrue(all(line.startswith("../../../") for line in playlist_files[0].read_text().splitlines()))
+            parsed_entries = sum(len(playlist) for playlist in playlists.values())
+            self.assertLess(0, parsed_entries)
+            self.assertLess(parsed_entries, 30)
+
+
+class TestRunBenchmark(unittest.TestCase):
+    def test_every_phase_is_timed(self):
+        with tempfile.TemporaryDirectory() as folder:
+            result = run_benchmark(Path(folder), SMALL_SHAPE, SMALL_PLAYLIST_SHAPE, jobs=2, repeat=2)
+
+            self.assertTrue((Path(folder) / "mirror 1/Playlists").is_dir())
+        self.assertEqual(
+            ["discovery", "parsing", "path_rewriting", "copying", "playlist_writing"], list(result["phases"])
+        )
+        self.assertEqual(3, result["phases"]["discovery"]["items"])
+        self.assertEqual(16 * result["phases"]["copying"]["items"], result["phases"]["copying"]["bytes"])
+        self.assertIn("bytes_per_second", result["phases"]["copying"])
+        self.assertEqual(2, result["shape"]["artists"])
+        self.assertLess(result["memory"]["shared_paths_bytes"], result["memory"]["separate_paths_bytes"])
+
+    def test_main_writes_json(self):
+        arguments = ["benchmark.py", "--artists", "1", "--tracks-per-album", "2", "--playlists", "1", "--depth", "0"]
+        with tempfile.TemporaryDirectory() as folder:
+            output = Path(folder) / "result.json"
+            sys.argv = arguments + ["--root", folder, "-o", str(output)]
+            main()
+            self.assertEqual(1, json.loads(output.read_text())["phases"]["discovery"]["items"])
+
+            sys.argv = arguments + ["--root", folder, "--overlap", "0", "--copy-order", "playlist"]
+            with patch("sys.stdout", new_callable=io.StringIO) as mock_stdout:
+                main()
+        self.assertEqual(0.0, json.loads(mock_stdout.getvalue())["shape"]["overlap"])
+        self.assertEqual("playlist", json.loads(mock_stdout.getvalue())["copy_order"])
@@ -0,0 +1,89 @@
+"""Unit test of the selection of songs fitting in the capacity of the destination"""
+
+import os
+import unittest
+from pathlib import Path
+
+from parameterized import parameterized
+
+from .budget import BudgetReport, rank_songs, select_songs_within_budget
+from .mirror_options import MirrorOptions, SongSelection, SyncSettings
+from .mirror_playlists_utils import mirror_all_playlist
+from .test_mirror_playlists_utils import MirroredLibraryTestCase
+
+
+def make_stat(size, mtime=0):
+    """Make the stat of a song of a given size and modification time"""
+    return os.stat_result((0o100644, 0, 0, 1, 0, 0, size, 0, mtime, 0))
+
+
+class TestRankSongs(unittest.TestCase):
+    def test_songs_are_ranked_by_playlists_then_playlist_order_then_recency(self):
+        playlists = {
+            Path("/first.m3u"): [Path("/old.mp3"), Path("/new.mp3"), Path("/old.mp3")],
+            Path("/second.m3u"): [Path("/shared.mp3"), Path("/other.mp3")],
+            Path("/third.m3u"): [Path("/shared.mp3")],
+        }
+        song_stats = {
+            Path("/old.mp3"): make_stat(1, mtime=1),
+            Path("/new.mp3"): make_stat(1, mtime=2),
+            Path("/shared.mp3"): make_stat(1, mtime=0),
+            Path("/other.mp3"): make_stat(1, mtime=3),
+        }
+        self.assertEqual(
+            [Path("/shared.mp3"), Path("/new.mp3"), Path("/old.mp3"), Path("/other.mp3")],
+            rank_songs(playlists, song_stats),
+        )
+
+
+class TestSelectSongsWithinBudget(unittest.TestCase):
+    def test_smaller_songs_fill_the_capacity_left_by_songs_that_do_not_fit(self):
+        playlists = {
+            Path("/first.m3u"): [Path("/a.mp3"), Path("/big.mp3"), Path("/b.mp3")],
+            Path("/second.m3u"): [Path("/big.mp3"), Path("/c.mp3")],
+        }
+        song_stats = {
+            Path("/a.mp3"): make_stat(4),
+            Path("/big.mp3"): make_stat(20),
+            Path("/b.mp3"): make_stat(5),
+            Path("/c.mp3"): make_stat(2),
+        }
+
+        selected_playlists, report = select_songs_within_budget(playlists, song_stats, 10)
+
+        self.assertEqual(
+            {Path("/first.m3u"): [Path("/a.mp3"), Path("/b.mp3")], Path("/second.m3u"): []}, selected_playlists
+        )
+        self.assertEqual(
+            {
+                "capacity_bytes": 10,
+                "selected_songs": 2,
+                "selected_bytes": 9,
+                "left_out_songs": ["/big.mp3", "/c.mp3"],
+                "left_out_bytes": 22,
+            },
+            report.to_dict(),
+        )
+
+    def test_summary_is_logged(self):
+        with self.assertLogs(level="INFO") as logs:
+            BudgetReport(10, 1, 8, [Path("/big.mp3")], 20).log_summary()
+        self.assertIn("Selected 1 songs, 8 of 10 bytes, left out 1 songs, 20 bytes", logs.output[0])
+
+
+class TestMirrorAllPlaylistWithCapacity(MirroredLibraryTestCase):
+    @parameterized.expand([["without sync state", False], ["with sync state", True]])
+    # pylint: disable=(unused-argument)
+    def test_songs_of_most_playlists_are_mirrored_first(self, name, use_sync_state):
+        (self.music / "Artist/one.mp3").write_bytes(b"one, longer")
+        options = MirrorOptions(
+            sync=SyncSettings(state_file_path=self.state_file if use_sync_state else None),
+            selection=SongSelection(capacity_bytes=10),
+        )
+
+        report = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertEqual([str(self.music / "Artist/one.mp3")], report.to_dict()["budget"]["left_out_songs"])
+        self.assertFalse((self.destination / "Artist/one.mp3").exists())
+        self.assertEqual("#EXTM3U\n../Artist/two.mp3", (self.destination / "Playlists/first.m3u").read_text())
+        self.assertEqual("#EXTM3U\n../Artist/two.mp3", (self.destination / "Playlists/second.m3u").read_text())
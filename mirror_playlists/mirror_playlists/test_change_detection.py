@@ -0,0 +1,88 @@
+"""Unit test of the change detection strategies"""
+
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from .change_detection import (
+    DigestCache,
+    compute_file_digest,
+    is_destination_up_to_date,
+)
+from .inventory import DirectoryInventory
+
+
+class TestComputeFileDigest(unittest.TestCase):
+    @patch("mirror_playlists.mirror_playlists.change_detection.DIGEST_CHUNK_SIZE", 2)
+    def test_compute_file_digest_reads_by_chunks(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = Path(folder) / "song.mp3"
+            file_path.write_bytes(b"hello world")
+            self.assertEqual(hashlib.blake2b(b"hello world").hexdigest(), compute_file_digest(file_path))
+
+
+class TestDigestCache(unittest.TestCase):
+    @patch("mirror_playlists.mirror_playlists.change_detection.compute_file_digest")
+    def test_digest_is_computed_again_only_if_file_changed(self, mock_compute_file_digest):
+        mock_compute_file_digest.return_value = "new"
+        digest_cache = DigestCache([("/music/a.mp3", 3, 10, "old")])
+
+        self.assertEqual(
+            "old", digest_cache.get_digest(Path("/music/a.mp3"), SimpleNamespace(st_size=3, st_mtime_ns=10))
+        )
+        self.assertEqual([], digest_cache.get_new_digests())
+        mock_compute_file_digest.assert_not_called()
+
+        self.assertEqual(
+            "new", digest_cache.get_digest(Path("/music/a.mp3"), SimpleNamespace(st_size=3, st_mtime_ns=11))
+        )
+        self.assertEqual([("/music/a.mp3", 3, 11, "new")], digest_cache.get_new_digests())
+
+
+class TestIsDestinationUpToDate(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.source = Path(self.temporary_directory.name) / "source.mp3"
+        self.destination = Path(self.temporary_directory.name) / "destination.mp3"
+        self.source.write_bytes(b"abc")
+        os.utime(self.source, ns=(0, 10_000_000_000))
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    @parameterized.expand([["exists"], ["size-mtime"], ["hash"]])
+    def test_missing_destination_is_not_up_to_date(self, comparison):
+        self.assertFalse(is_destination_up_to_date(self.source, self.destination, comparison))
+
+    @parameterized.expand(
+        [
+            ["same file", b"abc", 10, {"exists": True, "size-mtime": True, "hash": True}],
+            ["other size", b"abcd", 10, {"exists": True, "size-mtime": False, "hash": False}],
+            ["fat mtime resolution", b"abc", 11, {"exists": True, "size-mtime": True, "hash": True}],
+            ["other mtime", b"abc", 20, {"exists": True, "size-mtime": False, "hash": True}],
+            ["other content", b"abd", 10, {"exists": True, "size-mtime": True, "hash": False}],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_comparison_strategies(self, name, content, mtime_seconds, expected):
+        self.destination.write_bytes(content)
+        os.utime(self.destination, ns=(0, mtime_seconds * 1_000_000_000))
+        for comparison, up_to_date in expected.items():
+            self.assertEqual(up_to_date, is_destination_up_to_date(self.source, self.destination, comparison))
+
+    def test_missing_source_with_inventory(self):
+        self.destination.write_bytes(b"abc")
+        with self.assertRaises(FileNotFoundError):
+            is_destination_up_to_date(
+                self.source.with_name("missing.mp3"), self.destination, "size-mtime", inventory=DirectoryInventory()
+            )
+
+    def test_unknown_comparison_strategy(self):
+        with self.assertRaises(ValueError):
+            is_destination_up_to_date(self.source, self.destination, "checksum")
@@ -0,0 +1,316 @@
+"""Unit test of the copy engine"""
+
+import builtins
+import errno
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from .copy_engine import (
+    CopyJournal,
+    CopyReport,
+    copy_all_songs,
+    copy_file_atomically,
+    copy_song_file_if_changed,
+    create_parent_folders,
+    get_device_semaphores,
+    get_partial_file_path,
+    tee_song_file_if_changed,
+)
+from .inventory import DirectoryInventory
+from .mirror_options import CopyScheduling, MirrorOptions, SyncSettings
+from .scheduling import BandwidthLimiter
+
+
+class TestCopyReport(unittest.TestCase):
+    def test_throughput(self):
+        self.assertEqual(0.0, CopyReport(copied_bytes=100).throughput())
+        self.assertEqual(50.0, CopyReport(copied_bytes=100, elapsed_seconds=2.0).throughput())
+
+    def test_slowest_files_are_kept(self):
+        report = CopyReport()
+        for index in range(15):
+            report.add_copy_result(Path(f"/mnt/{index}.mp3"), index, float(index % 12))
+
+        self.assertEqual([(11.0, Path("/mnt/11.mp3")), (10.0, Path("/mnt/10.mp3"))], report.get_slowest_files()[:2])
+        self.assertEqual(10, len(report.get_slowest_files()))
+        self.assertEqual({"path": "/mnt/11.mp3", "seconds": 11.0}, report.to_dict()["slowest_files"][0])
+        self.assertEqual(15, report.to_dict()["copied_files"])
+
+    def test_log_summary_reports_failures(self):
+        report = CopyReport(copied_files=1, copied_bytes=10, elapsed_seconds=1.0)
+        report.failures[Path("/mnt/foo.mp3")] = "disk full"
+        with self.assertLogs(level="ERROR") as logs:
+            report.log_summary()
+        self.assertIn("disk full", logs.output[0])
+
+
+class TestCopyJournal(unittest.TestCase):
+    def test_journal_is_kept_when_copy_is_interrupted_and_removed_once_finished(self):
+        with tempfile.TemporaryDirectory() as folder:
+            journal_path = Path(folder) / "journal"
+            with self.assertRaises(KeyboardInterrupt), CopyJournal(journal_path) as journal:
+                journal.commit(Path("/mnt/one.mp3"))
+                raise KeyboardInterrupt
+
+            with CopyJournal(journal_path) as journal:
+                self.assertTrue(journal.is_committed(Path("/mnt/one.mp3")))
+                self.assertFalse(journal.is_committed(Path("/mnt/two.mp3")))
+            self.assertFalse(journal_path.exists())
+
+
+class TestCopyFileAtomically(unittest.TestCase):
+    def test_interrupted_copy_leaves_no_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source_song_path = Path(folder) / "foo.mp3"
+            source_song_path.write_bytes(b"12345")
+            destination_song_path = Path(folder) / "bar.mp3"
+
+            def interrupted_copy(_, partial_file_path):
+                Path(partial_file_path).write_bytes(b"12")
+                raise KeyboardInterrupt
+
+            with patch("shutil.copy2", side_effect=interrupted_copy), self.assertRaises(KeyboardInterrupt):
+                copy_file_atomically(source_song_path, destination_song_path)
+            self.assertEqual([source_song_path], list(Path(folder).iterdir()))
+
+            copy_file_atomically(source_song_path, destination_song_path)
+            self.assertEqual(b"12345", destination_song_path.read_bytes())
+            self.assertEqual({source_song_path, destination_song_path}, set(Path(folder).iterdir()))
+
+
+class TestCreateParentFolders(unittest.TestCase):
+    @patch("pathlib.Path.mkdir")
+    def test_create_parent_folders_once_per_folder(self, mock_mkdir):
+        paths = [Path("/mnt/Artist/one.mp3"), Path("/mnt/Artist/two.mp3"), Path("/mnt/Other/three.mp3")]
+        self.assertEqual({}, create_parent_folders(paths))
+        self.assertEqual(mock_mkdir.call_count, 2)
+
+    @patch("pathlib.Path.mkdir")
+    def test_create_parent_folders_collects_errors(self, mock_mkdir):
+        mock_mkdir.side_effect = PermissionError("denied")
+        self.assertEqual({Path("/mnt/Artist"): "denied"}, create_parent_folders([Path("/mnt/Artist/one.mp3")]))
+
+
+class TestCopySongFileIfChanged(unittest.TestCase):
+    @patch("shutil.copy2")
+    @patch("mirror_playlists.mirror_playlists.copy_engine.is_destination_up_to_date")
+    def test_copy_song_file_if_changed_when_file_is_up_to_date(self, mock_up_to_date, mock_copy):
+        mock_up_to_date.return_value = True
+        self.assertIsNone(copy_song_file_if_changed(Path("/music/foo.mp3"), Path("/mnt/foo.mp3")))
+        mock_copy.assert_not_called()
+
+    def test_copy_song_file_if_changed_when_file_does_not_exist(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source_song_path = Path(folder) / "foo.mp3"
+            source_song_path.write_bytes(b"12345")
+            destination_song_path = Path(folder) / "bar.mp3"
+            self.assertEqual(5, copy_song_file_if_changed(source_song_path, destination_song_path))
+            self.assertEqual(b"12345", destination_song_path.read_bytes())
+
+    def test_copy_song_file_if_changed_with_hardlink(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source_song_path = Path(folder) / "foo.mp3"
+            source_song_path.write_bytes(b"12345")
+            destination_song_path = Path(folder) / "bar.mp3"
+            self.assertEqual(
+                5, copy_song_file_if_changed(source_song_path, destination_song_path, link_mode="hardlink")
+            )
+            self.assertTrue(destination_song_path.samefile(source_song_path))
+            self.assertEqual({source_song_path, destination_song_path}, set(Path(folder).iterdir()))
+
+
+class TestTeeSongFileIfChanged(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.root = Path(self.temporary_directory.name)
+        self.source_song_path = self.root / "foo.mp3"
+        self.source_song_path.write_bytes(b"12345")
+        self.destination_song_paths = [self.root / f"mirror{index}/foo.mp3" for index in range(3)]
+        for destination_song_path in self.destination_song_paths:
+            destination_song_path.parent.mkdir()
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_source_is_read_once_for_all_changed_destinations(self):
+        self.destination_song_paths[0].write_bytes(b"old")
+        with patch("builtins.open", wraps=open) as mock_open:
+            results = tee_song_file_if_changed(
+                self.source_song_path, self.destination_song_paths, "size-mtime", None, None
+            )
+        self.assertEqual(1, [call.args[0] for call in mock_open.call_args_list].count(self.source_song_path))
+        self.assertEqual({5}, {copied_bytes for copied_bytes, _ in results.values()})
+        for destination_song_path in self.destination_song_paths:
+            self.assertEqual(b"12345", destination_song_path.read_bytes())
+            self.assertEqual({destination_song_path}, set(destination_song_path.parent.iterdir()))
+
+    def test_reads_are_paced_by_the_bandwidth_limiter(self):
+        limiter = Mock()
+        tee_song_file_if_changed(
+            self.source_song_path, self.destination_song_paths, "exists", None, None, limiter=limiter
+        )
+        limiter.consume.assert_called_once_with(5)
+
+    def test_failing_destination_does_not_abort_the_others(self):
+        self.destination_song_paths[0].mkdir()
+        self.destination_song_paths[1].parent.rmdir()
+        full_partial_file_path = get_partial_file_path(self.destination_song_paths[2])
+        real_open = builtins.open
+
+        def open_on_full_device(path, *args, **kwargs):
+            if path == full_partial_file_path:
+                partial_file = Mock()
+                partial_file.write.side_effect = OSError(errno.ENOSPC, "No space left on device")
+                return partial_file
+            return real_open(path, *args, **kwargs)
+
+        with patch("builtins.open", side_effect=open_on_full_device):
+            results = tee_song_file_if_changed(
+                self.source_song_path, self.destination_song_paths, "size-mtime", None, None
+            )
+        self.assertIsInstance(results[self.destination_song_paths[0]], IsADirectoryError)
+        self.assertEqual([self.destination_song_paths[0]], list(self.destination_song_paths[0].parent.iterdir()))
+        self.assertIsInstance(results[self.destination_song_paths[1]], FileNotFoundError)
+        self.assertEqual(errno.ENOSPC, results[self.destination_song_paths[2]].errno)
+        self.assertEqual([], list(self.destination_song_paths[2].parent.iterdir()))
+
+    def test_unreadable_source_fails_every_changed_destination(self):
+        self.destination_song_paths[0].write_bytes(b"old")
+        self.source_song_path.unlink()
+        results = tee_song_file_if_changed(self.source_song_path, self.destination_song_paths, "size-mtime", None, None)
+        self.assertEqual({FileNotFoundError}, {type(error) for error in results.values()})
+
+    def test_interrupted_tee_leaves_no_file(self):
+        with patch("shutil.copystat", side_effect=KeyboardInterrupt), self.assertRaises(KeyboardInterrupt):
+            tee_song_file_if_changed(self.source_song_path, self.destination_song_paths, "exists", None, None)
+        for destination_song_path in self.destination_song_paths:
+            self.assertEqual([], list(destination_song_path.parent.iterdir()))
+
+    def test_destinations_are_linked_one_by_one_with_a_link_mode(self):
+        self.destination_song_paths[0].write_bytes(b"old")
+        self.destination_song_paths[1].parent.rmdir()
+        results = tee_song_file_if_changed(
+            self.source_song_path, self.destination_song_paths, "exists", None, None, "hardlink"
+        )
+        self.assertIsNone(results[self.destination_song_paths[0]][0])
+        self.assertIsInstance(results[self.destination_song_paths[1]], FileNotFoundError)
+        self.assertEqual(5, results[self.destination_song_paths[2]][0])
+        self.assertTrue(self.destination_song_paths[2].samefile(self.source_song_path))
+
+
+class TestGetDeviceSemaphores(unittest.TestCase):
+    def test_folders_on_same_device_share_a_semaphore(self):
+        with tempfile.TemporaryDirectory() as folder:
+            (Path(folder) / "one").mkdir()
+            (Path(folder) / "two").mkdir()
+            semaphores = get_device_semaphores([Path(folder) / "one/a.mp3", Path(folder) / "two/b.mp3"], 2)
+            self.assertIs(semaphores[Path(folder) / "one"], semaphores[Path(folder) / "two"])
+
+
+class TestCopyAllSongs(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.root = Path(self.temporary_directory.name)
+        self.music = self.root / "music"
+        self.mirror = self.root / "mirror"
+        self.copy_jobs = []
+        for index in range(6):
+            source_song_path = self.music / f"Artist{index % 2}" / f"song{index}.mp3"
+            source_song_path.parent.mkdir(parents=True, exist_ok=True)
+            source_song_path.write_bytes(b"x" * index)
+            self.copy_jobs.append((source_song_path, self.mirror / source_song_path.relative_to(self.music)))
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_copy_all_songs(self):
+        report = copy_all_songs(
+            self.copy_jobs, MirrorOptions(scheduling=CopyScheduling(jobs=3, jobs_per_destination=2))
+        )
+        self.assertEqual(6, report.copied_files)
+        self.assertEqual(15, report.copied_bytes)
+        self.assertEqual({}, report.failures)
+        for source_song_path, destination_song_path in self.copy_jobs:
+            self.assertEqual(source_song_path.read_bytes(), destination_song_path.read_bytes())
+
+        with patch("mirror_playlists.mirror_playlists.copy_engine.PROGRESS_INTERVAL_SECONDS", 0.0):
+            with self.assertLogs(level="INFO") as logs:
+                report = copy_all_songs(self.copy_jobs, MirrorOptions(scheduling=CopyScheduling(jobs=3)))
+        self.assertEqual(0, report.copied_files)
+        self.assertEqual(6, report.skipped_files)
+        self.assertIn("Examined 6 of 6 songs", logs.output[-1])
+
+    def test_copy_all_songs_dispatches_songs_by_source_folder_and_inode(self):
+        with patch(
+            "mirror_playlists.mirror_playlists.copy_engine.copy_file_atomically", wraps=copy_file_atomically
+        ) as mock_copy:
+            copy_all_songs(self.copy_jobs, MirrorOptions(scheduling=CopyScheduling(bandwidth_limit=1000)))
+
+        expected_jobs = sorted(self.copy_jobs, key=lambda job: (str(job[0].parent), job[0].stat().st_ino))
+        self.assertEqual(expected_jobs, [call.args[:2] for call in mock_copy.call_args_list])
+        self.assertIsInstance(mock_copy.call_args.args[3], BandwidthLimiter)
+
+        self.copy_jobs[5][1].unlink()
+        self.copy_jobs[0][1].unlink()
+        with patch(
+            "mirror_playlists.mirror_playlists.copy_engine.copy_file_atomically", wraps=copy_file_atomically
+        ) as mock_copy:
+            copy_all_songs(self.copy_jobs[::-1], MirrorOptions(scheduling=CopyScheduling(copy_order="playlist")))
+
+        self.assertEqual([self.copy_jobs[5], self.copy_jobs[0]], [call.args[:2] for call in mock_copy.call_args_list])
+        self.assertIsNone(mock_copy.call_args.args[3])
+
+    def test_copy_all_songs_with_inventory(self):
+        copy_all_songs(self.copy_jobs[:2], MirrorOptions())
+        inventory = DirectoryInventory()
+        inventory.scan_tree(self.root)
+
+        with patch("pathlib.Path.mkdir") as mock_mkdir:
+            report = copy_all_songs(
+                self.copy_jobs[:2], MirrorOptions(sync=SyncSettings(comparison="size-mtime")), inventory=inventory
+            )
+
+        mock_mkdir.assert_not_called()
+        self.assertEqual(2, report.skipped_files)
+
+    def test_copy_all_songs_resumes_from_journal(self):
+        journal_path = self.root / "journal"
+        journal_path.write_text(f"{self.copy_jobs[0][1]}\n{self.copy_jobs[1][1]}\n", encoding="utf-8")
+
+        with CopyJournal(journal_path) as journal:
+            report = copy_all_songs(self.copy_jobs, MirrorOptions(), journal=journal)
+            self.assertEqual({job[1] for job in self.copy_jobs}, set(map(Path, journal_path.read_text().split())))
+
+        self.assertEqual(4, report.copied_files)
+        self.assertEqual(2, report.skipped_files)
+        self.assertFalse(self.copy_jobs[0][1].exists())
+
+    def test_copy_all_songs_replaces_truncated_files_when_comparing_size(self):
+        copy_all_songs(self.copy_jobs, MirrorOptions())
+        self.copy_jobs[5][1].write_bytes(b"x")
+
+        report = copy_all_songs(self.copy_jobs, MirrorOptions(sync=SyncSettings(comparison="size-mtime")))
+
+        self.assertEqual(1, report.copied_files)
+        self.assertEqual(self.copy_jobs[5][0].read_bytes(), self.copy_jobs[5][1].read_bytes())
+
+    def test_copy_all_songs_continues_after_failures(self):
+        self.copy_jobs[0][0].unlink()
+        self.mirror.mkdir()
+        (self.mirror / "Artist1").write_text("not a folder")
+
+        report = copy_all_songs(self.copy_jobs, MirrorOptions(scheduling=CopyScheduling(jobs=2)))
+
+        self.assertEqual(2, report.copied_files)
+        self.assertEqual(
+            {self.copy_jobs[index][1] for index in [0, 1, 3, 5]},
+            set(report.failures),
+        )
+
+    def test_copy_all_songs_throws_if_jobs_is_invalid(self):
+        with self.assertRaises(ValueError):
+            copy_all_songs(self.copy_jobs, MirrorOptions(scheduling=CopyScheduling(jobs=0)))
+        with self.assertRaises(ValueError):
+            copy_all_songs(self.copy_jobs, MirrorOptions(scheduling=CopyScheduling(jobs_per_destination=0)))
@@ -0,0 +1,202 @@
+"""Unit test of the deduplication of songs"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from .change_detection import DigestCache
+from .copy_engine import CopyReport
+from .deduplication import (
+    DeduplicationReport,
+    deduplicate_playlists,
+    find_duplicate_songs,
+    get_copy_jobs_of_originals,
+    link_duplicate_songs,
+    plan_linked_songs,
+)
+from .inventory import DirectoryInventory
+from .mirror_options import MirrorOptions, SongSelection, SyncSettings
+from .mirror_playlists_utils import mirror_all_playlist
+from .planning import MirrorPlan, PlannedFile
+from .playlist_formats import SongInfo
+from .test_mirror_playlists_utils import MirroredLibraryTestCase
+
+
+class DeduplicationTestCase(unittest.TestCase):
+    """Test case creating songs of identical and different contents"""
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.root = Path(self.temporary_directory.name)
+        self.songs = {name: self.root / f"{name}.mp3" for name in ["original", "duplicate", "other", "short"]}
+        self.songs["original"].write_bytes(b"same")
+        self.songs["duplicate"].write_bytes(b"same")
+        self.songs["other"].write_bytes(b"diff")
+        self.songs["short"].write_bytes(b"one")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+
+class TestFindDuplicateSongs(DeduplicationTestCase):
+    def test_only_songs_of_the_same_size_are_digested(self):
+        digest_cache = DigestCache()
+
+        duplicates, duplicate_bytes = find_duplicate_songs(
+            [*self.songs.values(), self.root / "missing.mp3"], DirectoryInventory(), digest_cache
+        )
+
+        self.assertEqual({self.songs["duplicate"]: self.songs["original"]}, duplicates)
+        self.assertEqual(4, duplicate_bytes)
+        self.assertEqual(
+            {str(self.songs[name]) for name in ["original", "duplicate", "other"]},
+            {path for path, _, _, _ in digest_cache.get_new_digests()},
+        )
+
+    @patch.object(DigestCache, "get_digest")
+    def test_songs_that_cannot_be_digested_are_not_duplicates(self, mock_get_digest):
+        mock_get_digest.side_effect = OSError("unreadable")
+
+        with self.assertLogs(level="WARNING"):
+            duplicates, _ = find_duplicate_songs(self.songs.values(), DirectoryInventory(), DigestCache())
+
+        self.assertEqual({}, duplicates)
+
+
+class TestDeduplicatePlaylists(DeduplicationTestCase):
+    def test_playlists_reference_the_original_songs_with_the_metadata_of_their_duplicates(self):
+        report = DeduplicationReport()
+        song_info = {self.songs["duplicate"]: SongInfo(42, "Duplicate")}
+        playlists = {self.root / "list.m3u": [self.songs["original"], self.songs["other"], self.songs["duplicate"]]}
+
+        playlists = deduplicate_playlists(
+            report, playlists, DirectoryInventory(), None, song_info, MirrorOptions(destination_profile="exfat")
+        )
+
+        self.assertTrue(report.rewritten)
+        self.assertEqual({self.songs["duplicate"]: self.songs["original"]}, report.duplicates)
+        self.assertEqual(
+            {self.root / "list.m3u": [self.songs["original"], self.songs["other"], self.songs["original"]]}, playlists
+        )
+        self.assertEqual(SongInfo(42, "Duplicate"), song_info[self.songs["original"]])
+
+
+class TestLinkDuplicateSongs(DeduplicationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.report = DeduplicationReport(duplicates={self.songs["duplicate"]: self.songs["original"]})
+        self.copy_jobs = [
+            (self.songs["original"], self.root / "mirror/original.mp3"),
+            (self.songs["duplicate"], self.root / "mirror/Compilation/duplicate.mp3"),
+        ]
+
+    def test_every_song_is_copied_without_deduplication(self):
+        self.assertEqual(self.copy_jobs, get_copy_jobs_of_originals(self.copy_jobs, None))
+        self.assertEqual(self.copy_jobs[:1], get_copy_jobs_of_originals(self.copy_jobs, self.report))
+
+    def test_duplicate_replacing_another_file_is_planned_as_an_update_of_no_bytes(self):
+        (self.root / "mirror/Compilation").mkdir(parents=True)
+        (self.root / "mirror/Compilation/duplicate.mp3").write_bytes(b"previous")
+        plan = MirrorPlan(skipped_songs=self.copy_jobs[1:])
+
+        plan_linked_songs(plan, self.copy_jobs, self.report)
+
+        self.assertEqual(
+            [PlannedFile(self.root / "mirror/Compilation/duplicate.mp3", 0, 8, self.songs["duplicate"])],
+            plan.updated_songs,
+        )
+        self.assertEqual([], plan.skipped_songs)
+
+    def test_duplicate_fails_with_its_original(self):
+        copy_report = CopyReport(failures={self.root / "mirror/original.mp3": "No space left on device"})
+
+        link_duplicate_songs(self.copy_jobs, self.report, copy_report)
+
+        self.assertEqual(
+            "No space left on device", copy_report.failures[self.root / "mirror/Compilation/duplicate.mp3"]
+        )
+        self.assertEqual(0, self.report.linked_files)
+
+    def test_duplicate_fails_if_it_cannot_be_linked(self):
+        copy_report = CopyReport()
+
+        link_duplicate_songs(self.copy_jobs, self.report, copy_report)
+
+        self.assertIn(self.root / "mirror/Compilation/duplicate.mp3", copy_report.failures)
+        self.assertEqual(0, self.report.linked_files)
+
+
+class TestMirrorAllPlaylistWithDeduplication(MirroredLibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        (self.music / "Compilation").mkdir()
+        (self.music / "Compilation/one.mp3").write_bytes(b"one")
+        (self.music / "Playlists/second.m3u").write_text(
+            "../Compilation/one.mp3\n../Artist/two.mp3\n", encoding="utf-8"
+        )
+
+    @parameterized.expand([["without sync state", False], ["with sync state", True]])
+    # pylint: disable=(unused-argument)
+    def test_duplicate_songs_are_hard_linked_to_their_copy(self, name, use_sync_state):
+        options = MirrorOptions(
+            sync=SyncSettings(state_file_path=self.state_file if use_sync_state else None),
+            selection=SongSelection(deduplicate=True),
+        )
+
+        report = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertEqual(
+            {
+                "duplicates": {str(self.music / "Compilation/one.mp3"): str(self.music / "Artist/one.mp3")},
+                "duplicate_bytes": 3,
+                "rewritten": False,
+                "linked_files": 1,
+            },
+            report.to_dict()["deduplication"],
+        )
+        self.assertEqual(1, report.phases["deduplicate"].items)
+        self.assertTrue((self.destination / "Compilation/one.mp3").samefile(self.destination / "Artist/one.mp3"))
+        self.assertEqual(
+            "#EXTM3U\n../Compilation/one.mp3\n../Artist/two.mp3",
+            (self.destination / "Playlists/second.m3u").read_text(),
+        )
+        with patch("shutil.copy2") as mock_copy:
+            report = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        mock_copy.assert_not_called()
+        self.assertEqual(0, report.deduplication_report.linked_files)
+
+    def test_playlists_reference_the_original_song_on_fat_destination(self):
+        options = MirrorOptions(destination_profile="fat", selection=SongSelection(deduplicate=True))
+
+        report = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertTrue(report.deduplication_report.rewritten)
+        self.assertFalse((self.destination / "Compilation").exists())
+        self.assertEqual(
+            "#EXTM3U\n../Artist/one.mp3\n../Artist/two.mp3", (self.destination / "Playlists/second.m3u").read_text()
+        )
+
+    def test_dry_run_plans_duplicate_songs_as_links_of_no_bytes(self):
+        options = MirrorOptions(dry_run=True, selection=SongSelection(deduplicate=True))
+
+        plan = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options).plan
+
+        self.assertEqual(
+            [
+                PlannedFile(self.destination / "Artist/one.mp3", 3, source=self.music / "Artist/one.mp3"),
+                PlannedFile(self.destination / "Artist/two.mp3", 3, source=self.music / "Artist/two.mp3"),
+                PlannedFile(self.destination / "Compilation/one.mp3", 0, source=self.music / "Compilation/one.mp3"),
+            ],
+            plan.copied_songs,
+        )
+        self.assertEqual([], plan.skipped_songs)
+
+        options.dry_run = False
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        options.dry_run = True
+        plan = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options).plan
+
+        self.assertEqual(([], [], 3), (plan.copied_songs, plan.updated_songs, len(plan.skipped_songs)))
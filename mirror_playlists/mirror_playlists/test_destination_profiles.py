@@ -0,0 +1,202 @@
+"""Unit test of the destination profiles"""
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from .destination_profiles import (
+    EXFAT,
+    FAT,
+    PATH_INDEX_FILE_NAME,
+    POSIX,
+    PathIndex,
+    get_name_length,
+    load_path_index,
+    sanitize_name,
+)
+from .mirror_options import MirrorOptions, PruneSettings, TranscodeSettings
+from .mirror_playlists_utils import mirror_all_playlist
+from .test_mirror_playlists_utils import MirroredLibraryTestCase
+from .test_transcoding import create_stub_encoder
+
+
+class TestSanitizeName(unittest.TestCase):
+    @parameterized.expand(
+        [
+            ["legal", "Song.mp3", "Song.mp3"],
+            ["invalid characters", 'What? "Live": A|B*.mp3', "What_ _Live__ A_B_.mp3"],
+            ["control characters", "one\ttwo.mp3", "one_two.mp3"],
+            ["trailing dots and spaces", "Vol. 1. ", "Vol. 1"],
+            ["only dots", "...", "_"],
+            ["reserved name", "con.mp3", "_con.mp3"],
+            ["reserved name without suffix", "LPT1", "_LPT1"],
+            ["reserved prefix", "Console.mp3", "Console.mp3"],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_name_is_legal(self, name, source_name, expected_name):
+        self.assertEqual(expected_name, sanitize_name(source_name))
+
+    def test_long_name_is_truncated_keeping_its_suffix(self):
+        sanitized_name = sanitize_name("a" * 300 + ".flac")
+        self.assertEqual(255, get_name_length(sanitized_name))
+        self.assertTrue(sanitized_name.endswith("a.flac"))
+
+    def test_length_counts_utf16_code_units(self):
+        sanitized_name = sanitize_name("\U0001f3b5" * 200 + ".mp3")
+        self.assertEqual(254, get_name_length(sanitized_name))
+        self.assertTrue(sanitized_name.endswith("\U0001f3b5.mp3"))
+
+    def test_long_suffix_is_truncated_with_the_name(self):
+        self.assertEqual("a" * 10 + "." + "a" * 244, sanitize_name("a" * 10 + "." + "a" * 300))
+
+
+class TestPathIndex(unittest.TestCase):
+    def setUp(self):
+        self.music = Path("/home/foo/Music")
+
+    def test_posix_paths_are_not_changed(self):
+        index = PathIndex(self.music, POSIX)
+        self.assertEqual(self.music / "A:B/song?.mp3", index.map_path(self.music / "A:B/song?.mp3"))
+        self.assertEqual({}, index.mappings)
+
+    @parameterized.expand([["fat", FAT], ["exfat", EXFAT]])
+    # pylint: disable=(unused-argument)
+    def test_colliding_paths_get_unique_names(self, name, profile):
+        index = PathIndex(self.music, profile)
+        mapped_paths = [
+            index.map_path(self.music / path)
+            for path in [
+                "Artist/Song.mp3",
+                "artist/song.mp3",
+                "Artist/Song?.mp3",
+                "ARTIST/Song_.mp3",
+                "Artist/Song.mp3",
+            ]
+        ]
+        self.assertEqual(
+            [
+                self.music / "Artist/Song.mp3",
+                self.music / "Artist/song (2).mp3",
+                self.music / "Artist/Song_.mp3",
+                self.music / "Artist/Song_ (2).mp3",
+                self.music / "Artist/Song.mp3",
+            ],
+            mapped_paths,
+        )
+
+    @parameterized.expand([["fat", FAT], ["exfat", EXFAT]])
+    # pylint: disable=(unused-argument)
+    def test_paths_colliding_once_transcoded_get_unique_names(self, name, profile):
+        index = PathIndex(self.music, profile, transcoded_suffixes={".flac": ".mp3"})
+        self.assertEqual(self.music / "A/x.flac", index.map_path(self.music / "A/x.flac"))
+        self.assertEqual(self.music / "A/X (2).mp3", index.map_path(self.music / "A/X.mp3"))
+        self.assertEqual(self.music / "A/y.mp3", index.map_path(self.music / "A/y.mp3"))
+        self.assertEqual(self.music / "A/y (2).FLAC", index.map_path(self.music / "A/y.FLAC"))
+
+    def test_only_fat_limits_the_length_of_paths(self):
+        song_path = self.music / ("a" * 150) / ("b" * 150 + ".flac")
+        fat_path = PathIndex(self.music, FAT, transcoded_suffixes={".flac": ".opus"}).map_path(song_path)
+        exfat_path = PathIndex(self.music, EXFAT).map_path(song_path)
+
+        self.assertEqual(255, get_name_length(str(fat_path.relative_to(self.music).with_suffix(".opus"))))
+        self.assertTrue(fat_path.name.endswith("b.flac"))
+        self.assertEqual(song_path, exfat_path)
+
+    def test_names_of_deep_folders_keep_a_minimum_length(self):
+        song_path = self.music / ("a" * 250) / ("b" * 100 + ".mp3")
+        self.assertEqual("b" * 28 + ".mp3", PathIndex(self.music, FAT).map_path(song_path).name)
+
+    def test_files_do_not_collide_with_folders(self):
+        index = PathIndex(self.music, FAT)
+        index.map_path(self.music / "Live/song.mp3")
+        self.assertEqual(self.music / "live (2)", index.map_path(self.music / "live"))
+
+    def test_unknown_profile_throws(self):
+        with self.assertRaises(ValueError):
+            PathIndex(self.music, "ntfs")
+
+
+class TestLoadPathIndex(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.destination = Path(self.temporary_directory.name)
+        self.music = Path("/home/foo/Music")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_mapped_paths_are_kept_from_one_run_to_the_next(self):
+        index = load_path_index(self.music, self.destination, FAT)
+        index.map_path(self.music / "artist/song.mp3")
+        index.save(self.destination)
+
+        index = load_path_index(self.music, self.destination, FAT)
+        self.assertEqual(self.music / "artist/Song (2).mp3", index.map_path(self.music / "Artist/Song.mp3"))
+        self.assertEqual(self.music / "artist/song.mp3", index.map_path(self.music / "artist/song.mp3"))
+        index.save(self.destination)
+
+        with open(self.destination / PATH_INDEX_FILE_NAME, "r", encoding="utf-8") as index_file:
+            self.assertEqual(
+                {"Artist/Song.mp3": "artist/Song (2).mp3", "artist/song.mp3": "artist/song.mp3"}, json.load(index_file)
+            )
+
+    def test_mappings_colliding_once_transcoded_are_mapped_again(self):
+        (self.destination / PATH_INDEX_FILE_NAME).write_text(
+            '{"A/x.flac": "A/x.flac", "A/x.mp3": "A/x.mp3"}', encoding="utf-8"
+        )
+        index = load_path_index(self.music, self.destination, FAT, {".flac": ".mp3"})
+
+        self.assertEqual(self.music / "A/x (2).mp3", index.map_path(self.music / "A/x.mp3"))
+        self.assertTrue(index.changed)
+
+    def test_unchanged_index_is_not_written(self):
+        load_path_index(self.music, self.destination, FAT).save(self.destination)
+        self.assertFalse((self.destination / PATH_INDEX_FILE_NAME).exists())
+
+    def test_index_is_ignored_with_posix_profile(self):
+        (self.destination / PATH_INDEX_FILE_NAME).write_text('{"a.mp3": "b.mp3"}', encoding="utf-8")
+        self.assertEqual({}, load_path_index(self.music, self.destination).mappings)
+
+
+class TestMirrorAllPlaylistWithDestinationProfile(MirroredLibraryTestCase):
+    def test_songs_and_playlists_get_legal_unique_names_kept_between_runs(self):
+        (self.music / "artist").mkdir()
+        (self.music / "artist/ONE.mp3").write_bytes(b"other one")
+        (self.music / "Artist/what?.mp3").write_bytes(b"what")
+        (self.music / "Playlists/best: of.m3u").write_text(
+            "../Artist/one.mp3\n../artist/ONE.mp3\n../Artist/what?.mp3\n", encoding="utf-8"
+        )
+        options = MirrorOptions(destination_profile="fat", pruning=PruneSettings(prune=True))
+
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertEqual(b"other one", (self.destination / "Artist/ONE (2).mp3").read_bytes())
+        self.assertEqual(b"what", (self.destination / "Artist/what_.mp3").read_bytes())
+        self.assertEqual(
+            "#EXTM3U\n../Artist/one.mp3\n../Artist/ONE (2).mp3\n../Artist/what_.mp3",
+            (self.destination / "Playlists/best_ of.m3u").read_text(),
+        )
+        with patch("shutil.copy2") as mock_copy:
+            mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        mock_copy.assert_not_called()
+        self.assertTrue((self.destination / ".mirror_playlists.paths.json").exists())
+
+    def test_transcoded_song_does_not_overwrite_a_song_of_the_target_suffix(self):
+        (self.music / "Artist/one.flac").write_bytes(b"lossless one")
+        (self.music / "Playlists/first.m3u").write_text("../Artist/one.flac\n../Artist/one.mp3\n", encoding="utf-8")
+        root = Path(self.temporary_directory.name)
+        transcode = TranscodeSettings(root / "cache", target_suffix=".mp3", encoder=str(create_stub_encoder(root)))
+        options = MirrorOptions(transcode=transcode, destination_profile="exfat")
+
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertEqual(b"one", (self.destination / "Artist/one (2).mp3").read_bytes())
+        self.assertNotEqual(b"one", (self.destination / "Artist/one.mp3").read_bytes())
+        self.assertEqual(
+            "#EXTM3U\n../Artist/one.mp3\n../Artist/one (2).mp3", (self.destination / "Playlists/first.m3u").read_text()
+        )
@@ -0,0 +1,148 @@
+"""Unit test of the mirror to several destinations"""
+
+from pathlib import Path
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from .fan_out import mirror_all_playlist_to_destinations
+from .mirror_options import (
+    CopyScheduling,
+    MirrorOptions,
+    PruneSettings,
+    SongSelection,
+    SyncSettings,
+)
+from .mirror_playlists_utils import mirror_all_playlist
+from .test_mirror_playlists_utils import MirroredLibraryTestCase
+
+
+def get_mirrored_files(destination_folder_path: Path):
+    """Get the content of each file mirrored to a destination, by relative path"""
+    return {
+        path.relative_to(destination_folder_path): path.read_bytes()
+        for path in destination_folder_path.rglob("*")
+        if path.is_file()
+    }
+
+
+class TestMirrorAllPlaylistToDestinations(MirroredLibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.destinations = [self.destination / "first", self.destination / "second"]
+        for destination in self.destinations:
+            destination.mkdir()
+
+    def mirror(self, **options):
+        """Mirror the test library to both destinations"""
+        return mirror_all_playlist_to_destinations(
+            self.music,
+            self.music / "Playlists",
+            self.destinations,
+            MirrorOptions(scheduling=CopyScheduling(jobs=2), **options),
+        )
+
+    @parameterized.expand([["without sync state", False], ["with sync state", True]])
+    # pylint: disable=(unused-argument)
+    def test_songs_are_read_once_and_mirrored_as_to_a_single_destination(self, name, use_sync_state):
+        state_file_path = self.state_file if use_sync_state else None
+        single_destination = self.destination / "single"
+        single_destination.mkdir()
+        mirror_all_playlist(
+            self.music,
+            self.music / "Playlists",
+            single_destination,
+            MirrorOptions(sync=SyncSettings(state_file_path=state_file_path)),
+        )
+
+        with patch("builtins.open", wraps=open) as mock_open:
+            reports = self.mirror(sync=SyncSettings(state_file_path=state_file_path))
+
+        opened_files = [call.args[0] for call in mock_open.call_args_list]
+        self.assertEqual(1, opened_files.count(self.music / "Artist/one.mp3"))
+        self.assertEqual(1, opened_files.count(self.music / "Artist/two.mp3"))
+        for destination in self.destinations:
+            self.assertEqual(
+                (2, 6), (reports[destination].copy_report.copied_files, reports[destination].copy_report.copied_bytes)
+            )
+            self.assertEqual(2, reports[destination].phases["discovery"].items)
+            self.assertEqual(
+                (2, 2), (reports[destination].phases["parse"].items, reports[destination].phases["jobs"].items)
+            )
+            self.assertEqual(get_mirrored_files(single_destination), get_mirrored_files(destination))
+
+    def test_second_run_with_sync_state_copies_nothing(self):
+        self.mirror(sync=SyncSettings(state_file_path=self.state_file))
+        with patch("shutil.copy2") as mock_copy, patch("builtins.open", wraps=open) as mock_open:
+            reports = self.mirror(sync=SyncSettings(state_file_path=self.state_file))
+        mock_copy.assert_not_called()
+        self.assertNotIn(self.music / "Artist/one.mp3", [call.args[0] for call in mock_open.call_args_list])
+        self.assertEqual(2, reports[self.destinations[1]].copy_report.skipped_files)
+
+    def test_second_run_with_sync_state_does_not_read_nor_rewrite_unchanged_playlists(self):
+        self.mirror(sync=SyncSettings(state_file_path=self.state_file))
+        with patch("builtins.open", wraps=open) as mock_open:
+            self.mirror(sync=SyncSettings(state_file_path=self.state_file))
+        opened_files = [Path(call.args[0]) for call in mock_open.call_args_list]
+        for destination in self.destinations:
+            self.assertNotIn(destination / "Playlists/first.m3u", opened_files)
+            self.assertNotIn(destination / "Playlists/.first.m3u.partial", opened_files)
+
+    def test_failing_destination_does_not_abort_the_others(self):
+        (self.destinations[1] / "Artist/one.mp3").mkdir(parents=True)
+
+        reports = self.mirror(sync=SyncSettings(comparison="size-mtime"), pruning=PruneSettings(prune=True))
+
+        self.assertEqual({}, reports[self.destinations[0]].copy_report.failures)
+        self.assertEqual(
+            [self.destinations[1] / "Artist/one.mp3"], list(reports[self.destinations[1]].copy_report.failures)
+        )
+        self.assertEqual(b"two", (self.destinations[1] / "Artist/two.mp3").read_bytes())
+        self.assertEqual(b"two", (self.destinations[0] / "Artist/two.mp3").read_bytes())
+        self.assertTrue((self.destinations[1] / "Playlists/first.m3u").exists())
+
+    def test_journal_failures_are_reported_per_destination(self):
+        with patch("mirror_playlists.mirror_playlists.fan_out.CopyJournal.commit", side_effect=OSError("read-only")):
+            reports = self.mirror()
+        self.assertEqual({"read-only"}, set(reports[self.destinations[0]].copy_report.failures.values()))
+
+    def test_progress_is_logged_per_destination(self):
+        with patch("mirror_playlists.mirror_playlists.fan_out.PROGRESS_INTERVAL_SECONDS", 0), self.assertLogs(
+            level="INFO"
+        ) as logs:
+            self.mirror()
+        self.assertTrue(any(f"{self.destinations[1]}: examined 2 of 2 songs" in line for line in logs.output))
+
+    @parameterized.expand([["without sync state", False], ["with sync state", True]])
+    # pylint: disable=(unused-argument)
+    def test_dry_run_plans_each_destination(self, name, use_sync_state):
+        (self.destinations[0] / "Artist").mkdir()
+        (self.destinations[0] / "Artist/one.mp3").write_bytes(b"one")
+
+        reports = self.mirror(
+            dry_run=True, sync=SyncSettings(state_file_path=self.state_file if use_sync_state else None)
+        )
+
+        self.assertEqual(1, len(reports[self.destinations[0]].plan.copied_songs))
+        self.assertEqual(2, len(reports[self.destinations[1]].plan.copied_songs))
+        self.assertEqual([], list((self.destinations[1]).iterdir()))
+
+    def test_songs_fitting_in_the_capacity_are_selected_once_for_all_destinations(self):
+        reports = self.mirror(selection=SongSelection(capacity_bytes=3))
+        for destination in self.destinations:
+            self.assertEqual([self.music / "Artist/one.mp3"], reports[destination].budget_report.left_out_songs)
+            self.assertFalse((destination / "Artist/one.mp3").exists())
+
+    def test_missing_songs_are_resolved_once_for_all_destinations(self):
+        (self.music / "Moved").mkdir()
+        (self.music / "Moved/gone.mp3").write_bytes(b"gone")
+        reports = self.mirror(selection=SongSelection(resolve_missing=True))
+        for destination in self.destinations:
+            self.assertEqual(1, len(reports[destination].resolver_report.relocated_songs))
+            self.assertEqual(b"gone", (destination / "Moved/gone.mp3").read_bytes())
+
+    def test_missing_destination_throws(self):
+        with self.assertRaises(FileNotFoundError):
+            mirror_all_playlist_to_destinations(
+                self.music, self.music / "Playlists", [*self.destinations, self.destination / "missing"]
+            )
@@ -0,0 +1,73 @@
+"""Unit test of the directory inventory"""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .inventory import DirectoryInventory
+
+
+class TestDirectoryInventory(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.root = Path(self.temporary_directory.name)
+        (self.root / "Artist/Album").mkdir(parents=True)
+        (self.root / "Artist/Album/one.mp3").write_bytes(b"1")
+        (self.root / "Artist/Album/two.mp3").write_bytes(b"22")
+        (self.root / "Artist/list.m3u").write_text("")
+        self.inventory = DirectoryInventory()
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_folder_is_listed_once(self):
+        with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+            self.assertTrue(self.inventory.exists(self.root / "Artist/Album/one.mp3"))
+            self.assertEqual(2, self.inventory.stat(self.root / "Artist/Album/two.mp3").st_size)
+            self.assertFalse(self.inventory.exists(self.root / "Artist/Album/three.mp3"))
+            self.assertIsNone(self.inventory.stat(self.root / "Artist/Album/three.mp3"))
+        mock_scandir.assert_called_once_with(self.root / "Artist/Album")
+
+    def test_missing_folder(self):
+        self.assertFalse(self.inventory.exists(self.root / "Other/one.mp3"))
+        self.assertFalse(self.inventory.exists(self.root / "Artist/list.m3u/one.mp3"))
+        self.assertFalse(self.inventory.has_folder(self.root / "Other"))
+
+    def test_file_removed_after_listing(self):
+        self.assertTrue(self.inventory.exists(self.root / "Artist/Album/one.mp3"))
+        (self.root / "Artist/Album/one.mp3").unlink()
+        self.assertIsNone(self.inventory.stat(self.root / "Artist/Album/one.mp3"))
+
+    def test_scan_tree(self):
+        self.inventory.scan_tree(self.root)
+        with patch("os.scandir") as mock_scandir:
+            self.assertTrue(self.inventory.has_folder(self.root / "Artist/Album"))
+            self.assertTrue(self.inventory.exists(self.root / "Artist/Album/one.mp3"))
+        mock_scandir.assert_not_called()
+
+    def test_find_files(self):
+        self.inventory.list_folder(self.root.parent)
+        self.assertEqual(
+            [self.root / "Artist/Album/one.mp3", self.root / "Artist/Album/two.mp3"],
+            self.inventory.find_files(self.root, [".mp3"]),
+        )
+        self.assertEqual([self.root / "Artist/list.m3u"], self.inventory.find_files(self.root / "Artist", [".m3u"]))
+
+    def test_inode_is_read_from_the_folder_listing(self):
+        one = self.root / "Artist/Album/one.mp3"
+        self.assertEqual(one.stat().st_ino, self.inventory.get_inode(one))
+        with patch("os.scandir") as mock_scandir:
+            self.assertEqual(0, self.inventory.get_inode(self.root / "Artist/Album/three.mp3"))
+        mock_scandir.assert_not_called()
+
+    def test_forgotten_folders_are_listed_again(self):
+        self.inventory.scan_tree(self.root.parent)
+        (self.root / "Artist/Album/three.mp3").write_bytes(b"333")
+
+        self.inventory.forget_tree(self.root / "Artist")
+
+        self.assertTrue(self.inventory.has_folder(self.root))
+        self.assertFalse(self.inventory.has_folder(self.root / "Artist/Album"))
+        self.assertTrue(self.inventory.exists(self.root / "Artist/Album/three.mp3"))
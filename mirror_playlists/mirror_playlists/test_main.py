@@ -0,0 +1,57 @@
+"""Unit test of the command line arguments"""
+
+import argparse
+import unittest
+
+from parameterized import parameterized
+
+from .main import positive_seconds, size_in_bytes
+
+
+class TestPositiveSeconds(unittest.TestCase):
+    def test_seconds_are_parsed(self):
+        self.assertEqual(0.5, positive_seconds("0.5"))
+
+    @parameterized.expand(
+        [
+            ["not a number", "soon"],
+            ["zero", "0"],
+            ["negative", "-1"],
+            ["infinite", "inf"],
+            ["not a number float", "nan"],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_invalid_seconds_are_rejected(self, name, value):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            positive_seconds(value)
+
+
+class TestSizeInBytes(unittest.TestCase):
+    @parameterized.expand(
+        [
+            ["bytes", "512", 512],
+            ["suffix", "16G", 16 * 1000**3],
+            ["lowercase fractional suffix", "1.5k", 1500],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_size_is_parsed(self, name, value, expected_size):
+        self.assertEqual(expected_size, size_in_bytes(value))
+
+    @parameterized.expand(
+        [
+            ["not a number", "big"],
+            ["empty", ""],
+            ["zero", "0"],
+            ["below one byte", "0.5"],
+            ["infinite", "inf"],
+            ["overflowing float", "1e400"],
+            ["overflowing with suffix", "1e306T"],
+            ["not a number float", "nan"],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_invalid_size_is_rejected(self, name, value):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            size_in_bytes(value)
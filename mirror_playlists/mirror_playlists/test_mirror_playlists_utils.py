@@ -1,28 +1,53 @@
 """Unit test ofr mirror_playlists"""
 
+import io
+import json
 import os
 import sys
+import tempfile
 import unittest
-from pathlib import Path
+from pathlib import Path, PureWindowsPath
 from typing import List
-from unittest.mock import patch
+from unittest.mock import ANY, Mock, patch
 
 from parameterized import parameterized
 
+from .copy_engine import CopyReport
+from .inventory import DirectoryInventory
 from .main import main
+from .mirror_options import (
+    CopyScheduling,
+    InFlightLimits,
+    MirrorOptions,
+    PruneSettings,
+    SongSelection,
+    SyncSettings,
+    TranscodeSettings,
+)
 from .mirror_playlists_utils import (
     copy_song_file_if_not_existing_and_create_necessary_parent_folder,
     create_destination_file,
     get_all_playlist_files,
+    get_all_songs_of_playlists,
     get_destination_path_of_playlist_file,
     get_list_of_song_path_from_playlist_content,
     get_new_content_of_playlist_file,
+    get_relative_path_between_folders,
     get_relative_path_to_song_from_playlist_file,
+    get_relative_paths_to_songs_from_playlist_file,
     is_folder_existing,
+    is_song_existing,
     mirror_all_playlist,
+    parse_all_playlists,
+    parse_all_playlists_with_sync_state,
     parse_playlist,
+    prune_unreferenced_files,
     write_content_of_playlist_to_file,
 )
+from .planning import MirrorPlan
+from .run_report import RunReport
+from .sync_state import SyncState
+from .test_transcoding import create_stub_encoder
 
 
 class TestMain(unittest.TestCase):
@@ -43,7 +68,7 @@ class TestMain(unittest.TestCase):
 
     @patch("mirror_playlists.mirror_playlists.main.mirror_all_playlist")
     def test_main_call_mirror_all_playlist_with_correct_arguments(self, mock_mirror_all_playlist):
-        mock_mirror_all_playlist.return_value = None
+        mock_mirror_all_playlist.return_value = RunReport()
         sys.argv = [
             "mirror_all_playlist.py",
             "-m",
@@ -58,9 +83,185 @@ class TestMain(unittest.TestCase):
         destination_folder_path = Path(sys.argv[6])
         main()
         mock_mirror_all_playlist.assert_called_once_with(
-            music_folder_path, playlist_folder_path, destination_folder_path
+            music_folder_path,
+            playlist_folder_path,
+            destination_folder_path,
+            MirrorOptions(scheduling=CopyScheduling(jobs=4)),
         )
 
+    @patch("mirror_playlists.mirror_playlists.main.mirror_all_playlist")
+    def test_main_forwards_options(self, mock_mirror_all_playlist):
+        mock_mirror_all_playlist.return_value = RunReport()
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "/mnt/bar", "-j", "8"]
+        sys.argv += ["--jobs-per-destination", "2", "--state-file", "/var/cache/state.sqlite", "--compare", "hash"]
+        sys.argv += ["--prune", "--prune-dry-run", "--transcode-to", "mp3", "--transcode-cache", "/var/cache/mp3"]
+        sys.argv += ["--transcode-bitrate", "192k", "--encoder", "/opt/ffmpeg", "--transcode-jobs", "3"]
+        sys.argv += [
+            "--engine",
+            "asyncio",
+            "--in-flight-stats",
+            "64",
+            "--in-flight-mkdirs",
+            "4",
+            "--in-flight-writes",
+            "2",
+        ]
+        sys.argv += ["--link-mode", "hardlink", "--destination-profile", "fat", "--capacity", "1.5G"]
+        sys.argv += ["--resolve-missing", "--resolver-cache", "/var/cache/index.json"]
+        sys.argv += ["--copy-order", "playlist", "--bandwidth-limit", "20M", "--deduplicate"]
+        main()
+        mock_mirror_all_playlist.assert_called_once_with(
+            Path("/music"),
+            Path("/music/playlists"),
+            Path("/mnt/bar"),
+            MirrorOptions(
+                sync=SyncSettings(state_file_path=Path("/var/cache/state.sqlite"), comparison="hash"),
+                scheduling=CopyScheduling(
+                    jobs=8,
+                    jobs_per_destination=2,
+                    engine="asyncio",
+                    in_flight=InFlightLimits(stats=64, mkdirs=4, writes=2),
+                    link_mode="hardlink",
+                    copy_order="playlist",
+                    bandwidth_limit=20000000,
+                ),
+                transcode=TranscodeSettings(
+                    Path("/var/cache/mp3"), target_suffix=".mp3", bitrate="192k", encoder="/opt/ffmpeg", jobs=3
+                ),
+                destination_profile="fat",
+                selection=SongSelection(
+                    capacity_bytes=1500000000,
+                    resolve_missing=True,
+                    resolver_cache_path=Path("/var/cache/index.json"),
+                    deduplicate=True,
+                ),
+                pruning=PruneSettings(prune=True, dry_run=True),
+            ),
+        )
+
+    @patch("mirror_playlists.mirror_playlists.main.mirror_all_playlist")
+    def test_main_prints_plan_in_dry_run(self, mock_mirror_all_playlist):
+        mock_mirror_all_playlist.return_value = RunReport(plan=MirrorPlan(free_bytes=5))
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "/mnt/bar", "--dry-run"]
+        with patch("sys.stdout", new_callable=io.StringIO) as mock_stdout:
+            main()
+        self.assertEqual(
+            MirrorOptions(dry_run=True, scheduling=CopyScheduling(jobs=4)), mock_mirror_all_playlist.call_args.args[3]
+        )
+        self.assertTrue(json.loads(mock_stdout.getvalue())["totals"]["fits"])
+
+    @patch("mirror_playlists.mirror_playlists.main.mirror_all_playlist")
+    def test_main_writes_report(self, mock_mirror_all_playlist):
+        mock_mirror_all_playlist.return_value = RunReport(copy_report=CopyReport(copied_files=3))
+        with tempfile.TemporaryDirectory() as folder:
+            report_path = Path(folder) / "report.json"
+            sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "/mnt/bar", "-v"]
+            sys.argv += ["--report", str(report_path)]
+            main()
+            self.assertEqual(3, json.loads(report_path.read_text())["copy"]["copied_files"])
+
+    @patch("mirror_playlists.mirror_playlists.main.mirror_all_playlist_to_destinations")
+    def test_main_mirrors_to_several_destinations(self, mock_mirror_all_playlist_to_destinations):
+        mock_mirror_all_playlist_to_destinations.return_value = {
+            Path("/mnt/bar"): RunReport(plan=MirrorPlan(free_bytes=5)),
+            Path("/mnt/baz"): RunReport(plan=MirrorPlan()),
+        }
+        with tempfile.TemporaryDirectory() as folder:
+            report_path = Path(folder) / "report.json"
+            sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "/mnt/bar"]
+            sys.argv += ["-d", "/mnt/baz", "--dry-run", "--report", str(report_path)]
+            with patch("sys.stdout", new_callable=io.StringIO) as mock_stdout:
+                main()
+            self.assertEqual(["/mnt/bar", "/mnt/baz"], list(json.loads(report_path.read_text())))
+        mock_mirror_all_playlist_to_destinations.assert_called_once_with(
+            Path("/music"),
+            Path("/music/playlists"),
+            [Path("/mnt/bar"), Path("/mnt/baz")],
+            MirrorOptions(dry_run=True, scheduling=CopyScheduling(jobs=4)),
+        )
+        self.assertTrue(json.loads(mock_stdout.getvalue())["/mnt/bar"]["totals"]["fits"])
+
+    @patch("mirror_playlists.mirror_playlists.main.mirror_all_playlist_to_archive")
+    def test_main_streams_mirror_into_archive(self, mock_mirror_all_playlist_to_archive):
+        mock_mirror_all_playlist_to_archive.return_value = RunReport(copy_report=CopyReport(copied_files=3))
+        with tempfile.TemporaryDirectory() as folder:
+            report_path = Path(folder) / "report.json"
+            sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "-"]
+            sys.argv += ["--archive", "zip", "--report", str(report_path)]
+            main()
+            self.assertEqual(3, json.loads(report_path.read_text())["copy"]["copied_files"])
+        mock_mirror_all_playlist_to_archive.assert_called_once_with(
+            Path("/music"), Path("/music/playlists"), Path("-"), MirrorOptions(scheduling=CopyScheduling(jobs=4)), "zip"
+        )
+
+    @parameterized.expand(
+        [
+            ["same path", "/mnt/bar", "/mnt/bar"],
+            ["trailing slash", "/mnt/bar", "/mnt/bar/"],
+            ["parent folder", "/mnt/bar", "/mnt/foo/../bar"],
+            ["relative path", "bar", os.path.join(os.getcwd(), "bar")],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_main_throws_if_destination_is_repeated(self, name, destination, other_destination):
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", destination]
+        sys.argv += ["-d", other_destination]
+        with self.assertRaises(SystemExit):
+            main()
+
+    @parameterized.expand([["watch", ["--watch"]], ["dry run", ["--dry-run"]], ["several destinations", ["-d", "b"]]])
+    # pylint: disable=(unused-argument)
+    def test_main_throws_if_archive_and_other_destination_options(self, name, arguments):
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "a.tar", "--archive"]
+        sys.argv += ["tar", *arguments]
+        with self.assertRaises(SystemExit):
+            main()
+
+    @parameterized.expand(
+        [["archive", ["--archive", "tar"]], ["watch", ["--watch"]], ["several destinations", ["-d", "b"]]]
+    )
+    # pylint: disable=(unused-argument)
+    def test_main_throws_if_deduplicate_and_other_destination_options(self, name, arguments):
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "a", "--deduplicate"]
+        sys.argv += arguments
+        with self.assertRaises(SystemExit):
+            main()
+
+    @patch("mirror_playlists.mirror_playlists.main.watch_and_mirror")
+    def test_main_watches_until_interrupted(self, mock_watch_and_mirror):
+        mock_watch_and_mirror.side_effect = KeyboardInterrupt
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "/mnt/bar", "--watch"]
+        sys.argv += ["--watch-debounce", "0.5"]
+        main()
+        mock_watch_and_mirror.assert_called_once_with(
+            Path("/music"),
+            Path("/music/playlists"),
+            [Path("/mnt/bar")],
+            MirrorOptions(scheduling=CopyScheduling(jobs=4)),
+            0.5,
+        )
+
+    def test_main_throws_if_watch_and_dry_run(self):
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "/mnt/bar", "--watch"]
+        sys.argv += ["--dry-run"]
+        with self.assertRaises(SystemExit):
+            main()
+
+    @parameterized.expand([["not a number", "many"], ["zero", "0"]])
+    # pylint: disable=(unused-argument)
+    def test_main_throws_if_jobs_is_invalid(self, name, jobs):
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "/mnt/bar", "-j", jobs]
+        with self.assertRaises(SystemExit):
+            main()
+
+    @parameterized.expand([["not a size", "16GB"], ["zero", "0K"]])
+    # pylint: disable=(unused-argument)
+    def test_main_throws_if_capacity_is_invalid(self, name, capacity):
+        sys.argv = ["mirror_all_playlist.py", "-m", "/music", "-p", "/music/playlists", "-d", "/mnt/bar"]
+        sys.argv += ["--capacity", capacity]
+        with self.assertRaises(SystemExit):
+            main()
+
 
 class TestMirrorAllPlaylist(unittest.TestCase):
     def setUp(self):
@@ -127,13 +328,10 @@ class TestMirrorAllPlaylist(unittest.TestCase):
 
     @patch("os.access")
     @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.is_folder_existing")
-    @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.write_content_of_playlist_to_file")
+    @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.write_changed_playlist_files")
     @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.get_destination_path_of_playlist_file")
     @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.get_new_content_of_playlist_file")
-    # pylint: disable=(line-too-long)
-    @patch(
-        "mirror_playlists.mirror_playlists.mirror_playlists_utils.copy_song_file_if_not_existing_and_create_necessary_parent_folder"
-    )
+    @patch("mirror_playlists.mirror_playlists.song_copy.copy_all_songs")
     @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.create_destination_file")
     @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.parse_playlist")
     @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.get_all_playlist_files")
@@ -145,7 +343,7 @@ class TestMirrorAllPlaylist(unittest.TestCase):
         mock_copy_song,
         mock_get_new_content,
         mock_get_destination,
-        mock_write_content,
+        mock_write_playlists,
         mock_is_folder_exist,
         mock_os_access,
     ):
@@ -154,22 +352,353 @@ class TestMirrorAllPlaylist(unittest.TestCase):
             Path("/home/foo/Music/Playlists/two.m3u"),
         ]
         mock_parse_playlist.return_value = [Path("/home/foo/Music/song_one.mp3"), Path("/home/foo/Music/song_two.mp3")]
-        mock_copy_song.return_value = True
         mock_create_file.return_value = Path("/mnt/foo/playlist.m3u")
         mock_get_new_content.return_value = ["#EXTM3U", "/home/foo/bar.mp3"]
         mock_get_destination.return_value = Path("/mnt/foo/playlist.m3u")
-        mock_write_content.return_value = True
         mock_is_folder_exist.return_value = True
         mock_os_access.return_value = True
 
-        mirror_all_playlist(Path("/home/foo/Music"), Path("/home/foo/Music/Playlists"), Path("/mnt/foo"))
+        with patch("mirror_playlists.mirror_playlists.song_copy.CopyJournal") as mock_journal:
+            mirror_all_playlist(Path("/home/foo/Music"), Path("/home/foo/Music/Playlists"), Path("/mnt/foo"))
 
+        mock_journal.assert_called_once_with(Path("/mnt/foo/.mirror_playlists.journal"))
         self.assertEqual(mock_get_all_playlist.call_count, 1)
-        self.assertEqual(mock_create_file.call_count, 4)
+        self.assertEqual(mock_create_file.call_count, 2)
+        mock_copy_song.assert_called_once_with(
+            [
+                (Path("/home/foo/Music/song_one.mp3"), Path("/mnt/foo/playlist.m3u")),
+                (Path("/home/foo/Music/song_two.mp3"), Path("/mnt/foo/playlist.m3u")),
+            ],
+            MirrorOptions(),
+            journal=mock_journal.return_value.__enter__.return_value,
+            inventory=ANY,
+        )
         self.assertEqual(mock_parse_playlist.call_count, 2)
         self.assertEqual(mock_get_new_content.call_count, 2)
+        mock_get_new_content.assert_called_with(
+            Path("/home/foo/Music/Playlists/two.m3u"), mock_parse_playlist.return_value, None, {}, ANY
+        )
         self.assertEqual(mock_get_destination.call_count, 2)
-        self.assertEqual(mock_write_content.call_count, 2)
+        mock_write_playlists.assert_called_once_with(
+            {Path("/mnt/foo/playlist.m3u"): b"#EXTM3U\n/home/foo/bar.mp3"}, None, ANY, None
+        )
+
+
+class MirroredLibraryTestCase(unittest.TestCase):
+    """Test case creating a small music library and an empty destination"""
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        root = Path(self.temporary_directory.name)
+        self.music = root / "Music"
+        self.destination = root / "mirror"
+        self.state_file = root / "state.sqlite"
+        self.comparison = "exists"
+        (self.music / "Artist").mkdir(parents=True)
+        (self.music / "Playlists").mkdir()
+        self.destination.mkdir()
+        (self.music / "Artist/one.mp3").write_bytes(b"one")
+        (self.music / "Artist/two.mp3").write_bytes(b"two")
+        (self.music / "Playlists/first.m3u").write_text("../Artist/one.mp3\n../Artist/two.mp3\n", encoding="utf-8")
+        (self.music / "Playlists/second.m3u").write_text("../Artist/two.mp3\n../Artist/gone.mp3\n", encoding="utf-8")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+
+class TestMirrorAllPlaylistWithSyncState(MirroredLibraryTestCase):
+    def mirror(self):
+        """Mirror the test library using the sync state"""
+        options = MirrorOptions(sync=SyncSettings(state_file_path=self.state_file, comparison=self.comparison))
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+    def test_second_run_does_not_parse_nor_copy_unchanged_files(self):
+        self.mirror()
+        self.assertEqual(b"one", (self.destination / "Artist/one.mp3").read_bytes())
+        self.assertEqual("#EXTM3U\n../Artist/two.mp3", (self.destination / "Playlists/second.m3u").read_text())
+
+        with patch("builtins.open", wraps=open) as mock_open, patch("shutil.copy2") as mock_copy:
+            self.mirror()
+        opened_files = [call.args[0] for call in mock_open.call_args_list]
+        self.assertNotIn(self.music / "Playlists/first.m3u", opened_files)
+        self.assertNotIn(self.destination / "Playlists/first.m3u", opened_files)
+        self.assertNotIn(self.destination / "Playlists/.first.m3u.partial", opened_files)
+        mock_copy.assert_not_called()
+
+    def test_changed_files_are_parsed_and_copied_again(self):
+        self.mirror()
+        (self.music / "Artist/gone.mp3").write_bytes(b"back")
+        (self.music / "Artist/one.mp3").write_bytes(b"new one")
+        (self.destination / "Artist/one.mp3").unlink()
+        (self.music / "Playlists/first.m3u").write_text("../Artist/one.mp3\n", encoding="utf-8")
+
+        self.mirror()
+
+        self.assertEqual(b"new one", (self.destination / "Artist/one.mp3").read_bytes())
+        self.assertEqual(b"back", (self.destination / "Artist/gone.mp3").read_bytes())
+        self.assertEqual("#EXTM3U\n../Artist/one.mp3", (self.destination / "Playlists/first.m3u").read_text())
+
+    def test_songs_deleted_from_destination_are_copied_again(self):
+        self.mirror()
+        (self.destination / "Artist/two.mp3").unlink()
+
+        self.mirror()
+
+        self.assertEqual(b"two", (self.destination / "Artist/two.mp3").read_bytes())
+
+    def test_hash_comparison_updates_retagged_songs_and_caches_digests(self):
+        self.comparison = "hash"
+        self.mirror()
+        (self.music / "Artist/one.mp3").write_bytes(b"ONE")
+
+        self.mirror()
+
+        self.assertEqual(b"ONE", (self.destination / "Artist/one.mp3").read_bytes())
+        with SyncState(self.state_file) as sync_state:
+            hashed_files = {path for path, _, _, _ in sync_state.get_digests()}
+        self.assertEqual(
+            {
+                str(self.music / "Artist/one.mp3"),
+                str(self.destination / "Artist/one.mp3"),
+                str(self.destination / "Playlists/first.m3u"),
+                str(self.destination / "Playlists/second.m3u"),
+            },
+            hashed_files,
+        )
+
+
+class TestMirrorAllPlaylistFormats(MirroredLibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        (self.music / "Playlists/first.m3u").unlink()
+        (self.music / "Playlists/second.m3u").unlink()
+        (self.music / "Playlists/tagged.m3u8").write_text(
+            f"#EXTM3U\n#EXTINF:215,Artist - One\n../Artist/one.mp3\n{(self.music / 'Artist/two.mp3').as_uri()}\n"
+            "http://radio.example/stream\n",
+            encoding="utf-8",
+        )
+        (self.music / "Playlists/radio.pls").write_text(
+            "[playlist]\nFile1=../Artist/two.mp3\nTitle1=Artist - Two\nLength1=42\n", encoding="utf-8"
+        )
+        (self.music / "Playlists/list.xspf").write_text(
+            '<playlist xmlns="http://xspf.org/ns/0/"><trackList>'
+            "<track><location>../Artist/one.mp3</location></track></trackList></playlist>",
+            encoding="utf-8",
+        )
+
+    @parameterized.expand([["without sync state", False], ["with sync state", True]])
+    # pylint: disable=(unused-argument)
+    def test_all_formats_are_mirrored_as_m3u_with_their_metadata(self, name, use_sync_state):
+        options = MirrorOptions(sync=SyncSettings(state_file_path=self.state_file if use_sync_state else None))
+        for _ in range(2):
+            mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertEqual(
+            "#EXTM3U\n#EXTINF:215,Artist - One\n../Artist/one.mp3\n#EXTINF:42,Artist - Two\n../Artist/two.mp3",
+            (self.destination / "Playlists/tagged.m3u8").read_text(encoding="utf-8"),
+        )
+        self.assertEqual(
+            "#EXTM3U\n#EXTINF:42,Artist - Two\n../Artist/two.mp3",
+            (self.destination / "Playlists/radio.m3u8").read_text(encoding="utf-8"),
+        )
+        self.assertEqual(
+            "#EXTM3U\n#EXTINF:215,Artist - One\n../Artist/one.mp3",
+            (self.destination / "Playlists/list.m3u8").read_text(encoding="utf-8"),
+        )
+        self.assertEqual(b"two", (self.destination / "Artist/two.mp3").read_bytes())
+
+
+class TestMirrorAllPlaylistWithoutSyncState(MirroredLibraryTestCase):
+    def mirror(self):
+        """Mirror the test library without sync state"""
+        mirror_all_playlist(
+            self.music, self.music / "Playlists", self.destination, MirrorOptions(scheduling=CopyScheduling(jobs=2))
+        )
+
+    def test_mirror_reports_each_phase(self):
+        report = mirror_all_playlist(self.music, self.music / "Playlists", self.destination)
+
+        self.assertEqual(["discovery", "stat", "parse", "jobs", "copy", "write"], list(report.phases))
+        self.assertEqual(2, report.phases["discovery"].items)
+        self.assertEqual(2, report.phases["parse"].items)
+        self.assertEqual(2, report.phases["jobs"].items)
+        self.assertEqual(2, report.phases["copy"].items)
+        self.assertEqual(6, report.copy_report.copied_bytes)
+        self.assertEqual(
+            {self.destination / "Artist/one.mp3", self.destination / "Artist/two.mp3"},
+            {path for _, path in report.copy_report.get_slowest_files()},
+        )
+
+    def test_mirror_twice(self):
+        self.mirror()
+        (self.music / "Artist/two.mp3").write_bytes(b"changed")
+        with patch("shutil.copy2") as mock_copy:
+            self.mirror()
+        mock_copy.assert_not_called()
+        self.assertEqual(b"two", (self.destination / "Artist/two.mp3").read_bytes())
+        self.assertEqual(
+            "#EXTM3U\n../Artist/one.mp3\n../Artist/two.mp3", (self.destination / "Playlists/first.m3u").read_text()
+        )
+
+
+class TestMirrorAllPlaylistWithPruning(MirroredLibraryTestCase):
+    def test_prune_keeps_mirrored_files_and_state(self):
+        self.state_file = self.destination / "state/mirror.sqlite"
+        self.state_file.parent.mkdir()
+        for side_file_name in ["mirror.sqlite-wal", "mirror.sqlite-shm", "mirror.sqlite.bak"]:
+            (self.state_file.parent / side_file_name).write_bytes(b"")
+        (self.destination / "Old").mkdir()
+        (self.destination / "Old/removed.mp3").write_bytes(b"old")
+        options = MirrorOptions(sync=SyncSettings(state_file_path=self.state_file), pruning=PruneSettings(dry_run=True))
+
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        self.assertTrue((self.destination / "Old/removed.mp3").exists())
+
+        options.pruning = PruneSettings(prune=True)
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        remaining = {path.relative_to(self.destination).as_posix() for path in self.destination.rglob("*")}
+        self.assertEqual(
+            {
+                "Artist",
+                "Artist/one.mp3",
+                "Artist/two.mp3",
+                "Playlists",
+                "Playlists/first.m3u",
+                "Playlists/second.m3u",
+                "state",
+                "state/mirror.sqlite",
+                "state/mirror.sqlite-wal",
+                "state/mirror.sqlite-shm",
+            },
+            remaining,
+        )
+
+    def test_prune_lists_the_destination_again(self):
+        inventory = DirectoryInventory()
+        inventory.scan_tree(self.destination)
+        (self.destination / "Artist").mkdir()
+        (self.destination / "Artist/one.mp3").write_bytes(b"one")
+        (self.destination / "Artist/orphan.mp3").write_bytes(b"orphan")
+
+        report = prune_unreferenced_files(
+            self.destination, {self.destination / "Artist/one.mp3"}, inventory, MirrorOptions()
+        )
+
+        self.assertEqual([self.destination / "Artist/orphan.mp3"], report.removed_files)
+        self.assertTrue((self.destination / "Artist/one.mp3").exists())
+
+    def test_pruned_song_is_copied_again_when_referenced_again(self):
+        options = MirrorOptions(sync=SyncSettings(state_file_path=self.state_file), pruning=PruneSettings(prune=True))
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        (self.music / "Playlists/first.m3u").write_text("../Artist/one.mp3\n", encoding="utf-8")
+        (self.music / "Playlists/second.m3u").write_text("../Artist/gone.mp3\n", encoding="utf-8")
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        self.assertFalse((self.destination / "Artist/two.mp3").exists())
+
+        (self.music / "Playlists/first.m3u").write_text("../Artist/one.mp3\n../Artist/two.mp3\n", encoding="utf-8")
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertEqual(b"two", (self.destination / "Artist/two.mp3").read_bytes())
+        self.assertEqual(
+            "#EXTM3U\n../Artist/one.mp3\n../Artist/two.mp3", (self.destination / "Playlists/first.m3u").read_text()
+        )
+
+
+class TestMirrorAllPlaylistWithTranscoding(MirroredLibraryTestCase):
+    def test_lossless_songs_are_transcoded_once(self):
+        (self.music / "Artist/one.mp3").rename(self.music / "Artist/one.flac")
+        (self.music / "Playlists/first.m3u").write_text("../Artist/one.flac\n../Artist/two.mp3\n", encoding="utf-8")
+        root = Path(self.temporary_directory.name)
+        options = MirrorOptions(
+            sync=SyncSettings(state_file_path=self.state_file),
+            transcode=TranscodeSettings(root / "cache", encoder=str(create_stub_encoder(root))),
+            pruning=PruneSettings(prune=True),
+        )
+
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertEqual(b"128k:one", (self.destination / "Artist/one.opus").read_bytes())
+        self.assertFalse((self.destination / "Artist/one.flac").exists())
+        self.assertEqual(
+            "#EXTM3U\n../Artist/one.opus\n../Artist/two.mp3", (self.destination / "Playlists/first.m3u").read_text()
+        )
+        (self.destination / "Artist/one.opus").unlink()
+        options.sync = SyncSettings()
+        with patch("mirror_playlists.mirror_playlists.transcoding.encode_songs") as mock_encode_songs:
+            mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        mock_encode_songs.assert_not_called()
+        self.assertEqual(b"128k:one", (self.destination / "Artist/one.opus").read_bytes())
+
+
+class TestMirrorAllPlaylistDryRun(MirroredLibraryTestCase):
+    def list_destination(self):
+        """List every file and folder of the destination with its content"""
+        return {
+            path.relative_to(self.destination).as_posix(): path.is_file() and path.read_bytes()
+            for path in self.destination.rglob("*")
+        }
+
+    def test_plan_without_sync_state_writes_nothing(self):
+        (self.destination / "Artist").mkdir()
+        (self.destination / "Artist/one.mp3").write_bytes(b"o")
+        (self.destination / "Artist/orphan.mp3").write_bytes(b"orphan")
+        destination_before = self.list_destination()
+        options = MirrorOptions(
+            dry_run=True, sync=SyncSettings(comparison="size-mtime"), pruning=PruneSettings(prune=True)
+        )
+
+        plan = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options).plan.to_dict()
+
+        self.assertEqual(destination_before, self.list_destination())
+        self.assertEqual([str(self.destination / "Artist/two.mp3")], [song["destination"] for song in plan["copy"]])
+        self.assertEqual([str(self.destination / "Artist/one.mp3")], [song["destination"] for song in plan["update"]])
+        self.assertEqual([str(self.destination / "Artist/orphan.mp3")], plan["prune"]["files"])
+        self.assertEqual([43, 25], [playlist["bytes"] for playlist in plan["playlists"]])
+        self.assertEqual(3 + 3 - 1 + 43 + 25, plan["totals"]["required_bytes"])
+
+        options.dry_run = False
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        self.assertEqual(43, (self.destination / "Playlists/first.m3u").stat().st_size)
+
+    def test_plan_with_sync_state_writes_nothing(self):
+        options = MirrorOptions(
+            dry_run=True, sync=SyncSettings(state_file_path=self.state_file, comparison="size-mtime")
+        )
+        plan = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options).plan.to_dict()
+        self.assertEqual(2, plan["totals"]["copy_files"])
+        self.assertEqual({}, self.list_destination())
+        self.assertFalse(self.state_file.exists())
+
+        options.dry_run = False
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        (self.music / "Artist/one.mp3").write_bytes(b"longer")
+        state_before = self.state_file.read_bytes()
+        options.dry_run = True
+        plan = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options).plan.to_dict()
+
+        self.assertEqual(state_before, self.state_file.read_bytes())
+        self.assertEqual(
+            [
+                {
+                    "source": str(self.music / "Artist/one.mp3"),
+                    "destination": str(self.destination / "Artist/one.mp3"),
+                    "bytes": 6,
+                    "replaced_bytes": 3,
+                }
+            ],
+            plan["update"],
+        )
+        self.assertEqual(1, plan["totals"]["skip_files"])
+
+
+class TestParseAllPlaylistsWithSyncState(unittest.TestCase):
+    def test_missing_playlist_has_no_song(self):
+        with tempfile.TemporaryDirectory() as folder, SyncState(Path(folder) / "state.sqlite") as sync_state:
+            playlist_file = Path(folder) / "missing.m3u"
+            self.assertEqual(
+                ({playlist_file: []}, {}),
+                parse_all_playlists_with_sync_state([playlist_file], sync_state, DirectoryInventory()),
+            )
 
 
 class TestIsfolderExisting(unittest.TestCase):
@@ -182,18 +711,23 @@ class TestIsfolderExisting(unittest.TestCase):
 
 
 class TestGetAllPlaylistFiles(unittest.TestCase):
-    @patch("pathlib.Path.glob")
-    def test_get_all_playlist_files(self, mock_glob):
-        mock_glob.return_value = [Path("/home/foo/bar.mp3"), Path("/home/foo/bar2.mp3")]
-        all_file_path = get_all_playlist_files(Path("/home/foo"))
-        expected_files_list = [Path("/home/foo/bar.mp3"), Path("/home/foo/bar2.mp3")]
-        self.assertEqual(expected_files_list, all_file_path)
+    def test_get_all_playlist_files(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = Path(folder)
+            (root / "Sub/Deeper").mkdir(parents=True)
+            for file_name in ["bar.m3u", "Sub/Deeper/bar2.m3u", "Sub/song.mp3", "Sub/folder.m3u/song.mp3"]:
+                (root / file_name).parent.mkdir(parents=True, exist_ok=True)
+                (root / file_name).write_text("")
+            all_file_path = get_all_playlist_files(root)
+            expected_files_list = [root / "Sub/Deeper/bar2.m3u", root / "bar.m3u"]
+            self.assertEqual(expected_files_list, all_file_path)
 
 
 class TestWriteContentOfPlaylist(unittest.TestCase):
+    @patch("os.replace")
     @patch("builtins.open", new_callable=unittest.mock.mock_open)
     @patch("pathlib.Path.mkdir")
-    def test_write_content_of_playlist_to_file(self, mock_mkdir, mock_open):
+    def test_write_content_of_playlist_to_file(self, mock_mkdir, mock_open, mock_replace):
         # Prepare mock content
         content = ["song1.mp3", "song2.mp3", "song3.mp3"]
         new_playlist_file_path = Path("/path/to/playlist.m3u")
@@ -204,11 +738,10 @@ class TestWriteContentOfPlaylist(unittest.TestCase):
         # Assert that mkdir was called with the correct arguments
         mock_mkdir.assert_called_once_with(parents=True, exist_ok=True)
 
-        # Assert that open was called with the correct arguments
-        mock_open.assert_called_once_with(new_playlist_file_path, "w", encoding="utf-8")
-
-        # Assert that write was called with the correct content
-        mock_open().write.assert_called_once_with("\n".join(content))
+        # Assert that the content was written to a partial file, renamed over the playlist file
+        mock_open.assert_called_once_with(Path("/path/to/.playlist.m3u.partial"), "wb")
+        mock_open().write.assert_called_once_with("\n".join(content).encode("utf-8"))
+        mock_replace.assert_called_once_with(Path("/path/to/.playlist.m3u.partial"), new_playlist_file_path)
 
 
 class TestCreateDestinationFile(unittest.TestCase):
@@ -257,6 +790,29 @@ class TestGetRelativePathToSongFromPlaylistFile(unittest.TestCase):
         with self.assertRaises(ValueError):
             get_relative_path_to_song_from_playlist_file(path, path)
 
+    def test_get_relative_paths_computes_each_song_folder_once(self):
+        playlist_file = Path("/home/foo/music/Playlists/myplaylist.m3u")
+        song_files = [
+            Path("/home/foo/music/Artist1/one.mp3"),
+            Path("/home/foo/music/Playlists/two.mp3"),
+            Path("/home/foo/music/Artist1/three.mp3"),
+        ]
+        get_relative_path_between_folders.cache_clear()
+
+        relative_paths = get_relative_paths_to_songs_from_playlist_file(playlist_file, song_files)
+
+        self.assertEqual(["../Artist1/one.mp3", "two.mp3", "../Artist1/three.mp3"], relative_paths)
+        cache_info = get_relative_path_between_folders.cache_info()  # pylint: disable=(no-value-for-parameter)
+        self.assertEqual(2, cache_info.misses)
+
+    def test_get_relative_paths_uses_posix_separators(self):
+        self.assertEqual(
+            ["../Artist1/bar.mp3"],
+            get_relative_paths_to_songs_from_playlist_file(
+                PureWindowsPath("C:/music/Playlists/myplaylist.m3u"), [PureWindowsPath("C:/music/Artist1/bar.mp3")]
+            ),
+        )
+
 
 class TestParsePlaylist(unittest.TestCase):
     @patch("pathlib.Path.exists")
@@ -278,7 +834,7 @@ class TestParsePlaylist(unittest.TestCase):
 
 
 class TestGetNewContentOfPlaylistFile(unittest.TestCase):
-    def mock_parse_playlist(self, _) -> List[Path]:
+    def mock_parse_playlist(self, *_) -> List[Path]:
         """mock the parse playlist function"""
         return [Path("/home/foo/Music/bar.mp3"), Path("/home/foo/Music/Artist1/bar1.mp3")]
 
@@ -291,6 +847,73 @@ class TestGetNewContentOfPlaylistFile(unittest.TestCase):
 
         self.assertEqual(expected_content, get_new_content_of_playlist_file(playlist_path))
 
+    @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.parse_playlist")
+    def test_get_new_content_of_playlist_file_does_not_parse_again_when_songs_are_given(self, patch_parse_playlist):
+        playlist_path = Path("/home/foo/Music/Playlist/playlist.m3u")
+        list_of_song_path = self.mock_parse_playlist(playlist_path)
+        expected_content = ["#EXTM3U", "../bar.mp3", "../Artist1/bar1.mp3"]
+
+        self.assertEqual(expected_content, get_new_content_of_playlist_file(playlist_path, list_of_song_path))
+        patch_parse_playlist.assert_not_called()
+
+    def test_get_new_content_of_playlist_file_rewrites_suffix_of_transcoded_songs(self):
+        playlist_path = Path("/home/foo/Music/Playlist/playlist.m3u")
+        list_of_song_path = [Path("/home/foo/Music/bar.mp3"), Path("/home/foo/Music/Artist1/bar1.FLAC")]
+        transcode_settings = TranscodeSettings(Path("/var/cache/transcoded"), target_suffix=".opus")
+
+        self.assertEqual(
+            ["#EXTM3U", "../bar.mp3", "../Artist1/bar1.opus"],
+            get_new_content_of_playlist_file(playlist_path, list_of_song_path, transcode_settings),
+        )
+
+
+class TestParseAllPlaylists(unittest.TestCase):
+    def test_parse_all_playlists_lists_each_song_folder_once(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = Path(folder).resolve()
+            (root / "Artist").mkdir()
+            (root / "Artist/song1.mp3").write_bytes(b"")
+            (root / "Artist/song2.mp3").write_bytes(b"")
+            playlist_files = [root / "one.m3u", root / "two.m3u"]
+            for playlist_file in playlist_files:
+                playlist_file.write_text("Artist/song1.mp3\nArtist/song2.mp3\nArtist/missing.mp3\n")
+
+            with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+                playlists = parse_all_playlists(playlist_files)
+
+            expected_songs = [root / "Artist/song1.mp3", root / "Artist/song2.mp3"]
+            self.assertEqual({playlist_file: expected_songs for playlist_file in playlist_files}, playlists)
+            mock_scandir.assert_called_once_with(root / "Artist")
+
+
+class TestGetAllSongsOfPlaylists(unittest.TestCase):
+    def test_get_all_songs_of_playlists_removes_duplicates_and_keeps_order(self):
+        playlists = {
+            Path("/home/foo/one.m3u"): [Path("/home/foo/b.mp3"), Path("/home/foo/a.mp3")],
+            Path("/home/foo/two.m3u"): [Path("/home/foo/a.mp3"), Path("/home/foo/c.mp3"), Path("/home/foo/b.mp3")],
+        }
+        self.assertEqual(
+            [Path("/home/foo/b.mp3"), Path("/home/foo/a.mp3"), Path("/home/foo/c.mp3")],
+            get_all_songs_of_playlists(playlists),
+        )
+
+
+class TestIsSongExisting(unittest.TestCase):
+    @patch("pathlib.Path.exists")
+    def test_is_song_existing_without_inventory(self, mock_exists):
+        mock_exists.return_value = True
+        self.assertTrue(is_song_existing(Path("/home/foo/bar.mp3")))
+        self.assertTrue(is_song_existing(Path("/home/foo/bar.mp3")))
+        self.assertEqual(mock_exists.call_count, 2)
+
+    @patch("pathlib.Path.exists")
+    def test_is_song_existing_with_inventory(self, mock_exists):
+        inventory = Mock()
+        inventory.exists.return_value = False
+        self.assertFalse(is_song_existing(Path("/home/foo/bar.mp3"), inventory))
+        inventory.exists.assert_called_once_with(Path("/home/foo/bar.mp3"))
+        mock_exists.assert_not_called()
+
 
 class TestGetDestinationPathOfPlaylistFile(unittest.TestCase):
     def test_get_destination_path_of_playlist_file(self):
@@ -320,7 +943,7 @@ class TestGetListOfSongPathFromPlaylistContent(unittest.TestCase):
 
 class TestCopySongFileIfNotExistingAndCreateNecessaryParentFolder(unittest.TestCase):
     @patch("pathlib.Path.mkdir")
-    @patch("shutil.copy2")
+    @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.copy_file_atomically")
     @patch("pathlib.Path.exists")
     def test_copy_song_file_if_not_existing_and_create_necessary_parent_folder_when_file_does_not_exist(
         self, mock_exists, mock_copy, mock_mkdir
@@ -337,7 +960,7 @@ class TestCopySongFileIfNotExistingAndCreateNecessaryParentFolder(unittest.TestC
         mock_mkdir.assert_called_once()
 
     @patch("pathlib.Path.mkdir")
-    @patch("shutil.copy2")
+    @patch("mirror_playlists.mirror_playlists.mirror_playlists_utils.copy_file_atomically")
     @patch("pathlib.Path.exists")
     def test_copy_song_file_if_not_existing_and_create_necessary_parent_folder_when_file_exists(
         self, mock_exists, mock_copy, mock_mkdir
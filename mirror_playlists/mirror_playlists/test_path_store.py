@@ -0,0 +1,26 @@
+"""Unit test of the store of song paths"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from .path_store import PathStore
+
+
+class TestPathStore(unittest.TestCase):
+    def test_equal_paths_are_interned_once(self):
+        store = PathStore()
+        first = store.intern(Path("/music/Artist/one.mp3"))
+        self.assertIs(first, store.intern(Path("/music/Artist/one.mp3")))
+        self.assertEqual(1, len(store))
+
+    def test_locations_resolve_to_interned_paths(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = Path(folder).resolve()
+            store = PathStore()
+            song = store.resolve("../Artist/one.mp3", root / "Playlists")
+            self.assertEqual(root / "Artist/one.mp3", song)
+            self.assertIs(song, store.resolve(f"{root}/Artist/one.mp3", Path("/elsewhere")))
+            self.assertIs(song, store.resolve("../Artist/one.mp3", root / "Playlists"))
+        self.assertIsNone(store.resolve("http://radio.example.com/stream", root))
+        self.assertEqual(1, len(store))
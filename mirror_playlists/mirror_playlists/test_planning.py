@@ -0,0 +1,146 @@
+"""Unit test of the mirror planning"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from .change_detection import DigestCache
+from .copy_engine import CopyJournal
+from .inventory import DirectoryInventory
+from .mirror_options import MirrorOptions, SyncSettings, TranscodeSettings
+from .mirror_playlists_utils import mirror_all_playlist
+from .planning import MirrorPlan, PlannedFile, plan_copy_jobs
+from .pruning import PruneReport
+from .test_mirror_playlists_utils import MirroredLibraryTestCase
+from .test_transcoding import create_stub_encoder
+
+
+class TestPlanCopyJobs(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        root = Path(self.temporary_directory.name)
+        self.source = root / "source"
+        self.destination = root / "destination"
+        self.source.mkdir()
+        self.destination.mkdir()
+        for name, content in [("new.mp3", b"new"), ("same.mp3", b"same"), ("changed.mp3", b"changed")]:
+            (self.source / name).write_bytes(content)
+        (self.destination / "same.mp3").write_bytes(b"same")
+        (self.destination / "changed.mp3").write_bytes(b"old")
+        (self.destination / "committed.mp3").write_bytes(b"partial")
+        (self.destination / "unchanged.mp3").write_bytes(b"unchanged")
+        self.journal_path = root / "journal"
+        self.journal_path.write_text(f"{self.destination / 'committed.mp3'}\n", encoding="utf-8")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def get_copy_job(self, name: str):
+        """Get the copy job of a song of the test library"""
+        return (self.source / name, self.destination / name)
+
+    def test_jobs_are_sorted_as_the_copy_phase_would(self):
+        copy_jobs = [
+            self.get_copy_job(name)
+            for name in ["new.mp3", "same.mp3", "changed.mp3", "committed.mp3", "unchanged.mp3", "missing.mp3"]
+        ]
+
+        plan = plan_copy_jobs(
+            copy_jobs,
+            [job for job in copy_jobs if job[0].name != "unchanged.mp3"],
+            "size-mtime",
+            DigestCache(),
+            CopyJournal(self.journal_path),
+            DirectoryInventory(),
+        )
+
+        self.assertEqual(
+            [PlannedFile(self.destination / "new.mp3", 3, source=self.source / "new.mp3")], plan.copied_songs
+        )
+        self.assertEqual(
+            [PlannedFile(self.destination / "changed.mp3", 7, 3, self.source / "changed.mp3")], plan.updated_songs
+        )
+        self.assertEqual(
+            [self.get_copy_job(name) for name in ["same.mp3", "committed.mp3", "unchanged.mp3"]], plan.skipped_songs
+        )
+        self.assertEqual([self.destination / "missing.mp3"], list(plan.failures))
+        self.assertTrue(self.journal_path.exists())
+
+
+class TestMirrorPlan(unittest.TestCase):
+    def test_to_dict(self):
+        plan = MirrorPlan(
+            copied_songs=[PlannedFile(Path("/mnt/a.mp3"), 10, source=Path("/music/a.mp3"))],
+            updated_songs=[PlannedFile(Path("/mnt/b.mp3"), 10, 4, Path("/music/b.mp3"))],
+            skipped_songs=[(Path("/music/c.mp3"), Path("/mnt/c.mp3"))],
+            written_playlists=[PlannedFile(Path("/mnt/list.m3u"), 20, 20, Path("/music/list.m3u"))],
+            free_bytes=16,
+        )
+
+        self.assertEqual(
+            {
+                "copy_files": 1,
+                "copy_bytes": 10,
+                "update_files": 1,
+                "update_bytes": 10,
+                "skip_files": 1,
+                "playlist_files": 1,
+                "prune_files": 0,
+                "prune_bytes": 0,
+                "required_bytes": 16,
+                "free_bytes": 16,
+                "fits": True,
+            },
+            plan.to_dict()["totals"],
+        )
+        self.assertEqual(
+            {"source": "/music/b.mp3", "destination": "/mnt/b.mp3", "bytes": 10, "replaced_bytes": 4},
+            plan.to_dict()["update"][0],
+        )
+
+    def test_pruning_does_not_free_space_for_copies(self):
+        plan = MirrorPlan(
+            copied_songs=[PlannedFile(Path("/mnt/a.mp3"), 10)],
+            prune_report=PruneReport(dry_run=True, removed_files=[Path("/mnt/old.mp3")], reclaimed_bytes=100),
+            free_bytes=9,
+        )
+
+        self.assertFalse(plan.fits())
+        self.assertEqual({"files": ["/mnt/old.mp3"], "folders": []}, plan.to_dict()["prune"])
+        self.assertEqual(100, plan.to_dict()["totals"]["prune_bytes"])
+
+    def test_required_bytes_are_never_negative(self):
+        plan = MirrorPlan(updated_songs=[PlannedFile(Path("/mnt/a.mp3"), 5, 10)])
+
+        self.assertEqual(0, plan.get_required_bytes())
+        self.assertTrue(plan.fits())
+
+
+class TestMirrorAllPlaylistDryRunWithTranscoding(MirroredLibraryTestCase):
+    def test_transcoded_songs_are_compared_through_their_cached_version(self):
+        (self.music / "Artist/one.mp3").unlink()
+        (self.music / "Artist/one.flac").write_bytes(b"lossless one")
+        (self.music / "Playlists/first.m3u").write_text("../Artist/one.flac\n../Artist/two.mp3\n", encoding="utf-8")
+        root = Path(self.temporary_directory.name)
+        options = MirrorOptions(
+            dry_run=True,
+            sync=SyncSettings(comparison="size-mtime"),
+            transcode=TranscodeSettings(root / "cache", encoder=str(create_stub_encoder(root))),
+        )
+
+        plan = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options).plan.to_dict()
+        self.assertEqual(
+            [str(self.music / "Artist/one.flac"), str(self.music / "Artist/two.mp3")],
+            [song["source"] for song in plan["copy"]],
+        )
+        self.assertFalse((root / "cache").exists())
+
+        options.dry_run = False
+        mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+        options.dry_run = True
+        plan = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options).plan.to_dict()
+
+        self.assertEqual(
+            (0, 0, 2, 0),
+            tuple(plan["totals"][total] for total in ["copy_files", "update_files", "skip_files", "required_bytes"]),
+        )
@@ -0,0 +1,145 @@
+"""Unit test of the playlist parsers"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from parameterized import parameterized
+
+from .playlist_formats import (
+    PlaylistEntry,
+    SongInfo,
+    get_location_path,
+    parse_extinf,
+    parse_m3u,
+    parse_pls,
+    read_playlist,
+)
+
+
+class TestParseM3u(unittest.TestCase):
+    def test_extinf_is_attached_to_the_next_entry(self):
+        lines = [
+            "\ufeff#EXTM3U\n",
+            "#EXTINF:215,Artist - One\n",
+            "#EXTALB:Album\n",
+            "Artist/one.mp3\n",
+            "\n",
+            "Artist/two.mp3\n",
+        ]
+        self.assertEqual(
+            [PlaylistEntry("Artist/one.mp3", SongInfo(215, "Artist - One")), PlaylistEntry("Artist/two.mp3")],
+            list(parse_m3u(lines)),
+        )
+
+    @parameterized.expand(
+        [
+            ["plain", "#EXTINF:215,Artist - One", SongInfo(215, "Artist - One")],
+            ["attributes", '#EXTINF:-1 tvg-id="one",Artist, One', SongInfo(-1, "Artist, One")],
+            ["fractional", "#EXTINF:215.6,", SongInfo(216, "")],
+            ["no duration", "#EXTINF:,One", SongInfo(-1, "One")],
+            ["invalid duration", "#EXTINF:abc,One", SongInfo(-1, "One")],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_parse_extinf(self, name, line, expected_info):
+        self.assertEqual(expected_info, parse_extinf(line))
+        self.assertEqual(expected_info, parse_extinf(expected_info.to_extinf()))
+
+
+class TestSongInfo(unittest.TestCase):
+    @parameterized.expand(
+        [
+            ["one line", "Artist - One", "#EXTINF:215,Artist - One"],
+            ["line feed", "Artist -\nOne", "#EXTINF:215,Artist - One"],
+            ["carriage return and blank lines", "Artist - \r\n\r\n One\r", "#EXTINF:215,Artist - One "],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_title_is_written_on_a_single_line(self, name, title, expected_line):
+        self.assertEqual(expected_line, SongInfo(215, title).to_extinf())
+
+
+class TestParsePls(unittest.TestCase):
+    def test_entries_are_grouped_by_index(self):
+        lines = [
+            "[playlist]",
+            "File1=Artist/one.mp3",
+            "Title1=Artist - One",
+            "Length1=215",
+            "File2=Artist/two.mp3",
+            "Length3=10",
+            "File3=http://radio.example/stream",
+            "NumberOfEntries=3",
+            "Version=2",
+        ]
+        self.assertEqual(
+            [
+                PlaylistEntry("Artist/one.mp3", SongInfo(215, "Artist - One")),
+                PlaylistEntry("Artist/two.mp3"),
+                PlaylistEntry("http://radio.example/stream", SongInfo(10, "")),
+            ],
+            list(parse_pls(lines)),
+        )
+
+
+class TestReadPlaylist(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.root = Path(self.temporary_directory.name)
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_read_xspf(self):
+        playlist_path = self.root / "list.xspf"
+        playlist_path.write_text(
+            """<?xml version="1.0" encoding="UTF-8"?>
+<playlist version="1" xmlns="http://xspf.org/ns/0/">
+  <trackList>
+    <track><location>Artist/My%20Song.mp3</location><title>My Song</title><duration>215400</duration></track>
+    <track><location>file:///music/two.mp3</location></track>
+    <track><title>No location</title></track>
+  </trackList>
+</playlist>
+""",
+            encoding="utf-8",
+        )
+        self.assertEqual(
+            [PlaylistEntry("Artist/My Song.mp3", SongInfo(215, "My Song")), PlaylistEntry("file:///music/two.mp3")],
+            list(read_playlist(playlist_path)),
+        )
+
+    def test_malformed_xspf_is_read_up_to_its_error(self):
+        playlist_path = self.root / "list.xspf"
+        playlist_path.write_text(
+            "<playlist><trackList><track><location>one.mp3</location></track><track><location>two.mp3",
+            encoding="utf-8",
+        )
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual([PlaylistEntry("one.mp3")], list(read_playlist(playlist_path)))
+
+    @parameterized.expand([["m3u8", "list.m3u8"], ["unknown suffix", "list.txt"], ["pls", "list.PLS"]])
+    # pylint: disable=(unused-argument)
+    def test_reader_is_chosen_by_suffix(self, name, file_name):
+        playlist_path = self.root / file_name
+        content = "File1=one.mp3\n" if file_name.endswith("PLS") else "#EXTM3U\none.mp3\n"
+        playlist_path.write_text(content, encoding="utf-8")
+        self.assertEqual([PlaylistEntry("one.mp3")], list(read_playlist(playlist_path)))
+
+
+class TestGetLocationPath(unittest.TestCase):
+    @parameterized.expand(
+        [
+            ["relative path", "../Artist/one.mp3", Path("../Artist/one.mp3")],
+            ["percent sign in path", "100%25.mp3", Path("100%25.mp3")],
+            ["windows drive", "C://Music/one.mp3", Path("C://Music/one.mp3")],
+            ["file url", "file:///home/foo/My%20Song.mp3", Path("/home/foo/My Song.mp3")],
+            ["localhost file url", "file://localhost/home/foo/one.mp3", Path("/home/foo/one.mp3")],
+            ["remote file url", "file://server/home/foo/one.mp3", None],
+            ["stream", "https://radio.example/stream", None],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_get_location_path(self, name, location, expected_path):
+        self.assertEqual(expected_path, get_location_path(location))
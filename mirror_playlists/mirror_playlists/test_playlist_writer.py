@@ -0,0 +1,66 @@
+"""Unit test of the writing of the mirrored playlist files"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .change_detection import DigestCache
+from .inventory import DirectoryInventory
+from .playlist_writer import (
+    is_playlist_file_unchanged,
+    write_changed_playlist_files,
+    write_playlist_file,
+)
+
+
+class TestWriteChangedPlaylistFiles(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.destination = Path(self.temporary_directory.name)
+        self.first = self.destination / "Playlists/first.m3u"
+        self.second = self.destination / "Playlists/Sub/second.m3u"
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_only_changed_playlists_are_written(self):
+        write_changed_playlist_files({self.first: b"#EXTM3U\none.mp3", self.second: b"#EXTM3U\ntwo.mp3"})
+        first_mtime_ns = self.first.stat().st_mtime_ns
+
+        with patch("mirror_playlists.mirror_playlists.playlist_writer.os.replace") as mock_replace, self.assertLogs(
+            level="INFO"
+        ) as logs:
+            write_changed_playlist_files(
+                {self.first: b"#EXTM3U\none.mp3", self.second: b"#EXTM3U\nTWO.mp3"}, 2, DirectoryInventory()
+            )
+
+        mock_replace.assert_called_once_with(self.second.with_name(".second.m3u.partial"), self.second)
+        self.assertEqual(first_mtime_ns, self.first.stat().st_mtime_ns)
+        self.assertIn("Wrote 1 playlists, 1 unchanged", logs.output[-1])
+
+    def test_cached_digests_are_compared_instead_of_reading_playlists(self):
+        digest_cache = DigestCache()
+        write_changed_playlist_files({self.first: b"#EXTM3U\none.mp3"}, digest_cache=digest_cache)
+        digest_cache = DigestCache(digest_cache.get_new_digests())
+
+        with patch("builtins.open", wraps=open) as mock_open:
+            self.assertTrue(is_playlist_file_unchanged(b"#EXTM3U\none.mp3", self.first, digest_cache=digest_cache))
+            self.assertFalse(is_playlist_file_unchanged(b"#EXTM3U\nONE.mp3", self.first, digest_cache=digest_cache))
+            self.assertFalse(is_playlist_file_unchanged(b"#EXTM3U\n", self.first, digest_cache=digest_cache))
+        mock_open.assert_not_called()
+
+    def test_playlists_whose_folder_cannot_be_created_are_skipped(self):
+        with patch("pathlib.Path.mkdir", side_effect=OSError("read-only")), self.assertLogs(level="ERROR") as logs:
+            write_changed_playlist_files({self.first: b"#EXTM3U\none.mp3"})
+
+        self.assertIn(f"Failed to write {self.first}: read-only", logs.output[0])
+        self.assertFalse(self.first.exists())
+
+    def test_partial_file_is_removed_when_writing_fails(self):
+        self.first.parent.mkdir()
+
+        with patch("os.replace", side_effect=OSError("read-only")), self.assertRaises(OSError):
+            write_playlist_file(b"#EXTM3U\none.mp3", self.first)
+
+        self.assertEqual([], list(self.first.parent.iterdir()))
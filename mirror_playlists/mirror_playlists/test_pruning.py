@@ -0,0 +1,121 @@
+"""Unit test of the destination pruning"""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .inventory import DirectoryInventory
+from .pruning import PruneReport, get_state_files, prune_destination
+
+
+class TestPruneDestination(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.destination = Path(self.temporary_directory.name)
+        for file_name, content in [
+            ("Artist/Album/kept.mp3", b"1"),
+            ("Artist/Album/stale.mp3", b"22"),
+            ("Old/Album/stale.mp3", b"333"),
+            ("Playlists/list.m3u", b""),
+            ("stale.txt", b"4444"),
+        ]:
+            (self.destination / file_name).parent.mkdir(parents=True, exist_ok=True)
+            (self.destination / file_name).write_bytes(content)
+        (self.destination / "Empty").mkdir()
+        (self.destination / "New").mkdir()
+        self.referenced_files = {
+            self.destination / "Artist/Album/kept.mp3",
+            self.destination / "Playlists/list.m3u",
+            self.destination / "New/not_copied_yet.mp3",
+        }
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_dry_run_removes_nothing(self):
+        report = prune_destination(self.destination, self.referenced_files, DirectoryInventory(), dry_run=True)
+
+        self.assertEqual(
+            [
+                self.destination / "Artist/Album/stale.mp3",
+                self.destination / "Old/Album/stale.mp3",
+                self.destination / "stale.txt",
+            ],
+            report.removed_files,
+        )
+        self.assertEqual(
+            {self.destination / "Old/Album", self.destination / "Old", self.destination / "Empty"},
+            set(report.removed_folders),
+        )
+        self.assertEqual(9, report.reclaimed_bytes)
+        self.assertTrue((self.destination / "Old/Album/stale.mp3").exists())
+        with self.assertLogs(level="INFO") as logs:
+            report.log_summary()
+        self.assertEqual(4, len(logs.output))
+
+    def test_prune_walks_destination_once_and_removes_orphans(self):
+        with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+            report = prune_destination(self.destination, self.referenced_files, DirectoryInventory())
+
+        self.assertEqual(8, mock_scandir.call_count)
+        self.assertEqual({}, report.failures)
+        remaining = {path.relative_to(self.destination).as_posix() for path in self.destination.rglob("*")}
+        self.assertEqual(
+            {"Artist", "Artist/Album", "Artist/Album/kept.mp3", "Playlists", "Playlists/list.m3u", "New"}, remaining
+        )
+
+    @patch("pathlib.Path.rmdir")
+    @patch("pathlib.Path.unlink")
+    def test_prune_collects_failures(self, mock_unlink, mock_rmdir):
+        mock_unlink.side_effect = PermissionError("read only")
+        mock_rmdir.side_effect = PermissionError("read only")
+
+        report = prune_destination(self.destination, self.referenced_files, DirectoryInventory())
+
+        self.assertEqual(6, len(report.failures))
+        with self.assertLogs(level="ERROR"):
+            report.log_summary()
+
+
+class TestGetStateFiles(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.destination = Path(self.temporary_directory.name)
+        for file_name in ["state.db", "state.db-wal", "state.db-shm", "state.db-journal", "state.dbx", "other.db-wal"]:
+            (self.destination / file_name).write_bytes(b"")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_database_and_side_files_in_destination(self):
+        self.assertEqual(
+            {self.destination / name for name in ["state.db", "state.db-wal", "state.db-shm", "state.db-journal"]},
+            get_state_files(self.destination, self.destination / "state.db", DirectoryInventory()),
+        )
+
+    def test_database_outside_destination(self):
+        self.assertEqual(
+            set(), get_state_files(self.destination / "Music", self.destination / "state.db", DirectoryInventory())
+        )
+
+
+class TestPruneReport(unittest.TestCase):
+    def test_log_summary(self):
+        with self.assertLogs(level="INFO") as logs:
+            PruneReport(removed_files=[Path("/mnt/a.mp3")], reclaimed_bytes=3).log_summary()
+        self.assertIn("Removed 1 orphaned files", logs.output[0])
+
+    def test_to_dict(self):
+        report = PruneReport(removed_folders=[Path("/mnt/Old")], failures={Path("/mnt/Old"): "busy"})
+        self.assertEqual(
+            {
+                "dry_run": False,
+                "removed_files": [],
+                "removed_folders": ["/mnt/Old"],
+                "reclaimed_bytes": 0,
+                "failures": {"/mnt/Old": "busy"},
+            },
+            report.to_dict(),
+        )
@@ -0,0 +1,49 @@
+"""Unit test of the run report"""
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .copy_engine import CopyReport
+from .run_report import RunReport
+
+
+class TestRunReport(unittest.TestCase):
+    @patch("time.perf_counter")
+    def test_phases_are_measured(self, mock_perf_counter):
+        mock_perf_counter.side_effect = [1.0, 3.0, 10.0, 10.5]
+        report = RunReport()
+        with report.measure_phase("copy") as phase:
+            phase.items = 4
+        with report.measure_phase("copy"):
+            pass
+
+        self.assertEqual(2.5, report.phases["copy"].seconds)
+        self.assertEqual({"copy": {"seconds": 2.5, "items": 4}}, report.to_dict()["phases"])
+
+    def test_write_json(self):
+        report = RunReport(copy_report=CopyReport(copied_files=1))
+        report.copy_report.add_copy_result(Path("/mnt/one.mp3"), 5, 0.25)
+        with report.measure_phase("discovery"):
+            pass
+        with tempfile.TemporaryDirectory() as folder:
+            report.write_json(Path(folder) / "report.json")
+            written_report = json.loads((Path(folder) / "report.json").read_text())
+
+        self.assertEqual(["discovery"], list(written_report["phases"]))
+        self.assertEqual(2, written_report["copy"]["copied_files"])
+        self.assertIsNone(written_report["prune"])
+        self.assertIsNone(written_report["plan"])
+
+    def test_log_summary(self):
+        report = RunReport(copy_report=CopyReport())
+        report.copy_report.add_copy_result(Path("/mnt/one.mp3"), None, 1.5)
+        with report.measure_phase("copy"):
+            pass
+        with self.assertLogs(level="DEBUG") as logs:
+            report.log_summary()
+        self.assertIn("Phase copy", logs.output[0])
+        self.assertIn("Copy throughput: 0.00 MiB/s", logs.output[1])
+        self.assertIn("Slow song /mnt/one.mp3", logs.output[2])
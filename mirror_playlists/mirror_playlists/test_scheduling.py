@@ -0,0 +1,69 @@
+"""Unit test of the scheduling of the copies"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .scheduling import (
+    BANDWIDTH_BURST_SECONDS,
+    PLAYLIST_ORDER,
+    BandwidthLimiter,
+    create_bandwidth_limiter,
+    order_copy_jobs,
+)
+
+
+class TestOrderCopyJobs(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.music = Path(self.temporary_directory.name)
+        for name in ["B/one.mp3", "A/two.mp3", "A/one.mp3"]:
+            (self.music / name).parent.mkdir(exist_ok=True)
+            (self.music / name).write_bytes(b"")
+        self.copy_jobs = [
+            (self.music / "B/one.mp3", Path("/mnt/Z/one.mp3")),
+            (self.music / "A/one.mp3", Path("/mnt/Y/one.mp3")),
+            (self.music / "A/two.mp3", Path("/mnt/Y/two.mp3")),
+            (self.music / "A/two.mp3", Path("/mnt/X/two.mp3")),
+        ]
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_jobs_are_ordered_by_source_folder_inode_then_destination(self):
+        first, second = sorted(self.copy_jobs[1:3], key=lambda job: job[0].stat().st_ino)
+        twos = [self.copy_jobs[3], self.copy_jobs[2]]
+        expected_jobs = [first] + twos if first == self.copy_jobs[1] else twos + [second]
+        self.assertEqual(expected_jobs + [self.copy_jobs[0]], order_copy_jobs(self.copy_jobs))
+
+    def test_jobs_are_kept_in_the_order_of_the_playlists(self):
+        self.assertEqual(self.copy_jobs, order_copy_jobs(self.copy_jobs, PLAYLIST_ORDER))
+
+    def test_unknown_order_is_rejected(self):
+        with self.assertRaises(ValueError):
+            order_copy_jobs(self.copy_jobs, "random")
+
+
+class TestBandwidthLimiter(unittest.TestCase):
+    @patch("time.monotonic", return_value=100.0)
+    def test_bytes_beyond_the_burst_wait_for_their_turn(self, _):
+        limiter = BandwidthLimiter(1000)
+        self.assertEqual(0.0, limiter.reserve(int(1000 * BANDWIDTH_BURST_SECONDS)))
+        self.assertAlmostEqual(2.0, limiter.reserve(2000))
+
+    @patch("time.sleep")
+    def test_consume_sleeps_only_beyond_the_burst(self, mock_sleep):
+        limiter = BandwidthLimiter(1000)
+        limiter.consume(1)
+        mock_sleep.assert_not_called()
+        limiter.consume(10000)
+        self.assertGreater(mock_sleep.call_args.args[0], 9.0)
+
+    def test_limit_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            BandwidthLimiter(0)
+
+    def test_no_limiter_without_limit(self):
+        self.assertIsNone(create_bandwidth_limiter(None))
+        self.assertEqual(5, create_bandwidth_limiter(5).bytes_per_second)
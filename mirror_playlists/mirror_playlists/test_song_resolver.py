@@ -0,0 +1,164 @@
+"""Unit test of the resolver of missing songs"""
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from .mirror_options import MirrorOptions, SongSelection, SyncSettings
+from .mirror_playlists_utils import mirror_all_playlist
+from .playlist_formats import SongInfo
+from .song_resolver import SongResolver, list_music_folders, normalize_name
+from .test_mirror_playlists_utils import MirroredLibraryTestCase
+
+
+class TestNormalizeName(unittest.TestCase):
+    @parameterized.expand(
+        [
+            ["case and spacing", "My Song.MP3", "mysong.mp3"],
+            ["track number", "01 - My Song.mp3", "mysong.mp3"],
+            ["accents and punctuation", "Café, (Live)!.mp3", "cafelive.mp3"],
+            ["underscores", "my_song.mp3", "mysong.mp3"],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_name_is_normalized(self, name, file_name, expected_name):
+        self.assertEqual(expected_name, normalize_name(file_name))
+
+
+class TestSongResolver(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        root = Path(self.temporary_directory.name)
+        self.music = root / "Music"
+        self.cache_file = root / "index.json"
+        (self.music / "Artist/Album").mkdir(parents=True)
+        (self.music / "Artist/Album/one.mp3").write_bytes(b"one")
+        (self.music / "Artist/Album/02 Two Song.mp3").write_bytes(b"two")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_missing_songs_are_relocated_by_name_then_normalized_name(self):
+        resolver = SongResolver(self.music)
+        self.assertEqual(self.music / "Artist/Album/one.mp3", resolver.resolve(self.music / "Old/one.mp3"))
+        self.assertEqual(self.music / "Artist/Album/02 Two Song.mp3", resolver.resolve(self.music / "two_song.mp3"))
+        self.assertIsNone(resolver.resolve(self.music / "three.mp3"))
+        self.assertIsNone(resolver.resolve(self.music / "three.mp3"))
+        self.assertEqual(self.music / "Artist/Album/one.mp3", resolver.resolve(self.music / "Old/one.mp3"))
+        self.assertEqual(
+            {
+                "relocated": {
+                    str(self.music / "Old/one.mp3"): str(self.music / "Artist/Album/one.mp3"),
+                    str(self.music / "two_song.mp3"): str(self.music / "Artist/Album/02 Two Song.mp3"),
+                },
+                "missing": [str(self.music / "three.mp3")],
+            },
+            resolver.report.to_dict(),
+        )
+
+    def test_songs_of_several_candidates_are_picked_by_previous_size_then_folder(self):
+        resolver = SongResolver(self.music, self.cache_file)
+        resolver.resolve(self.music / "missing.mp3")
+        resolver.save()
+        (self.music / "Other/Album").mkdir(parents=True)
+        (self.music / "Other/Album/one.mp3").write_bytes(b"other")
+        (self.music / "Other/two song.mp3").write_bytes(b"two")
+        (self.music / "Artist/Album/one.mp3").rename(self.music / "Artist/one.mp3")
+        (self.music / "Artist/Album/02 Two Song.mp3").rename(self.music / "Artist/two song.mp3")
+
+        resolver = SongResolver(self.music, self.cache_file)
+
+        self.assertEqual(self.music / "Artist/one.mp3", resolver.resolve(self.music / "Artist/Album/one.mp3"))
+        self.assertIsNone(resolver.resolve(self.music / "Artist/Album/02 Two Song.mp3"))
+        self.assertEqual(self.music / "Other/two song.mp3", resolver.resolve(self.music / "Old/Other/two song.mp3"))
+        self.assertEqual(self.music / "Other/Album/one.mp3", resolver.resolve(Path("/elsewhere/Album/one.mp3")))
+
+    def test_unchanged_folders_are_not_listed_again(self):
+        resolver = SongResolver(self.music, self.cache_file)
+        resolver.finish({})
+        resolver.resolve(self.music / "missing.mp3")
+        resolver.finish({}, dry_run=True)
+        self.assertFalse(self.cache_file.exists())
+        resolver.finish({})
+
+        with patch("os.scandir") as mock_scandir:
+            SongResolver(self.music, self.cache_file).resolve(self.music / "one.mp3")
+        mock_scandir.assert_not_called()
+
+    def test_cache_of_another_music_root_is_ignored(self):
+        self.cache_file.write_text(json.dumps({"music_root": "/other", "folders": {}}), encoding="utf-8")
+        self.assertEqual({}, SongResolver(self.music, self.cache_file).cached_folders)
+
+    @parameterized.expand(
+        [
+            ["invalid json", "{"],
+            ["not an object", "[]"],
+            ["missing folders", json.dumps({"music_root": "/music"})],
+            ["listing without mtime", json.dumps({"music_root": "/music", "folders": {".": {"files": {}}}})],
+            [
+                "size of wrong type",
+                json.dumps(
+                    {"music_root": "/music", "folders": {".": {"mtime_ns": 1, "files": {"a": "1"}, "folders": []}}}
+                ),
+            ],
+        ]
+    )
+    # pylint: disable=(unused-argument)
+    def test_malformed_cache_is_ignored_and_written_again(self, name, content):
+        self.cache_file.write_text(content, encoding="utf-8")
+
+        with self.assertLogs(level="WARNING"):
+            resolver = SongResolver(self.music, self.cache_file)
+        self.assertEqual({}, resolver.cached_folders)
+        self.assertEqual(self.music / "Artist/Album/one.mp3", resolver.resolve(self.music / "one.mp3"))
+        resolver.finish({})
+
+        self.assertEqual(str(self.music), json.loads(self.cache_file.read_text(encoding="utf-8"))["music_root"])
+
+    def test_relocated_songs_get_the_metadata_of_their_entries(self):
+        resolver = SongResolver(self.music)
+        resolver.resolve(self.music / "one.mp3")
+        resolver.resolve(self.music / "two_song.mp3")
+        song_info = {self.music / "one.mp3": SongInfo(60, "One")}
+        with self.assertLogs(level="INFO") as logs:
+            resolver.finish(song_info)
+        self.assertEqual(SongInfo(60, "One"), song_info[self.music / "Artist/Album/one.mp3"])
+        self.assertIn("Relocated 2 missing songs, 0 songs are truly missing", logs.output[0])
+
+    def test_folders_deleted_while_listed_are_skipped(self):
+        cached_folders = {".": {"mtime_ns": self.music.stat().st_mtime_ns, "files": {}, "folders": ["Gone"]}}
+        self.assertEqual(["."], list(list_music_folders(self.music, cached_folders)))
+
+
+class TestMirrorAllPlaylistResolvingMissingSongs(MirroredLibraryTestCase):
+    @parameterized.expand([["without sync state", False], ["with sync state", True]])
+    # pylint: disable=(unused-argument)
+    def test_moved_songs_are_relocated_and_others_reported_missing(self, name, use_sync_state):
+        (self.music / "Moved").mkdir()
+        (self.music / "Artist/gone.mp3").write_bytes(b"gone")
+        (self.music / "Playlists/second.m3u").write_text(
+            "#EXTM3U\n#EXTINF:60,Gone\n../Artist/gone.mp3\n../Artist/lost.mp3\n", encoding="utf-8"
+        )
+        (self.music / "Artist/gone.mp3").rename(self.music / "Moved/gone.mp3")
+        options = MirrorOptions(
+            sync=SyncSettings(state_file_path=self.state_file if use_sync_state else None),
+            selection=SongSelection(resolve_missing=True),
+        )
+
+        report = mirror_all_playlist(self.music, self.music / "Playlists", self.destination, options)
+
+        self.assertEqual(
+            {
+                "relocated": {str(self.music / "Artist/gone.mp3"): str(self.music / "Moved/gone.mp3")},
+                "missing": [str(self.music / "Artist/lost.mp3")],
+            },
+            report.to_dict()["resolver"],
+        )
+        self.assertEqual(b"gone", (self.destination / "Moved/gone.mp3").read_bytes())
+        self.assertEqual(
+            "#EXTM3U\n#EXTINF:60,Gone\n../Moved/gone.mp3", (self.destination / "Playlists/second.m3u").read_text()
+        )
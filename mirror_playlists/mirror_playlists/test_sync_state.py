@@ -0,0 +1,110 @@
+"""Unit test of the sync state"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from .inventory import DirectoryInventory
+from .playlist_formats import SongInfo
+from .sync_state import SyncState
+
+
+def make_stat(size: int, mtime_ns: int) -> SimpleNamespace:
+    """Create a stat result with the given size and modification time"""
+    return SimpleNamespace(st_size=size, st_mtime_ns=mtime_ns)
+
+
+class TestSyncState(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.database_path = Path(self.temporary_directory.name) / "state.sqlite"
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_playlist_songs_are_persisted(self):
+        playlist_path = Path("/music/Playlists/one.m3u")
+        songs = [Path("/music/a.mp3"), Path("/music/b.mp3")]
+        with SyncState(self.database_path) as sync_state:
+            self.assertIsNone(sync_state.get_playlist_songs(playlist_path, make_stat(10, 1)))
+            sync_state.set_playlist_songs(playlist_path, make_stat(10, 1), songs)
+            sync_state.set_playlist_songs(Path("/music/Playlists/empty.m3u"), make_stat(0, 1), [])
+
+        with SyncState(self.database_path) as sync_state:
+            self.assertEqual(songs, sync_state.get_playlist_songs(playlist_path, make_stat(10, 1)))
+            self.assertEqual([], sync_state.get_playlist_songs(Path("/music/Playlists/empty.m3u"), make_stat(0, 1)))
+            self.assertIsNone(sync_state.get_playlist_songs(playlist_path, make_stat(10, 2)))
+            self.assertIsNone(sync_state.get_playlist_songs(playlist_path, make_stat(11, 1)))
+
+    def test_song_info_is_persisted_with_playlist_songs(self):
+        playlist_path = Path("/music/Playlists/one.m3u")
+        songs = [Path("/music/a.mp3"), Path("/music/b\n\tc.mp3")]
+        with SyncState(self.database_path) as sync_state:
+            sync_state.set_playlist_songs(
+                playlist_path, make_stat(10, 1), songs, {songs[0]: SongInfo(215, "Artist - A\ttitle\non two lines")}
+            )
+
+        song_info = {}
+        with SyncState(self.database_path) as sync_state:
+            self.assertEqual(songs, sync_state.get_playlist_songs(playlist_path, make_stat(10, 1), song_info))
+        self.assertEqual({songs[0]: SongInfo(215, "Artist - A\ttitle\non two lines")}, song_info)
+
+    def test_playlist_songs_recorded_by_an_older_version_are_parsed_again(self):
+        playlist_path = Path("/music/Playlists/one.m3u")
+        with SyncState(self.database_path) as sync_state:
+            sync_state.connection.execute(
+                "INSERT INTO playlists (path, size, mtime_ns, songs) VALUES (?, 10, 1, ?)",
+                (str(playlist_path), "/music/a.mp3\t215\tArtist - A\n/music/b.mp3"),
+            )
+
+        with SyncState(self.database_path) as sync_state:
+            self.assertIsNone(sync_state.get_playlist_songs(playlist_path, make_stat(10, 1)))
+
+    def test_mirrored_songs_are_persisted(self):
+        source, destination = Path("/music/a.mp3"), self.database_path.with_name("a.mp3")
+        destination.write_bytes(b"a")
+        with SyncState(self.database_path) as sync_state:
+            self.assertFalse(sync_state.is_song_mirrored(source, destination, make_stat(3, 5)))
+            sync_state.set_songs_mirrored([(source, destination, make_stat(3, 5))])
+            self.assertTrue(sync_state.is_song_mirrored(source, destination, make_stat(3, 5)))
+
+        with SyncState(self.database_path) as sync_state:
+            self.assertTrue(sync_state.is_song_mirrored(source, destination, make_stat(3, 5)))
+            self.assertFalse(sync_state.is_song_mirrored(source, destination, make_stat(3, 6)))
+            self.assertFalse(sync_state.is_song_mirrored(Path("/music/b.mp3"), destination, make_stat(3, 5)))
+
+    def test_forgotten_songs_are_no_longer_mirrored(self):
+        source, destination = Path("/music/a.mp3"), Path("/mnt/a.mp3")
+        with SyncState(self.database_path) as sync_state:
+            sync_state.set_songs_mirrored([(source, destination, make_stat(3, 5))])
+            sync_state.forget_songs_mirrored([destination, Path("/mnt/unknown.mp3")])
+            self.assertFalse(sync_state.is_song_mirrored(source, destination, make_stat(3, 5)))
+
+        with SyncState(self.database_path) as sync_state:
+            self.assertFalse(sync_state.is_song_mirrored(source, destination, make_stat(3, 5)))
+
+    def test_deleted_songs_are_no_longer_mirrored(self):
+        source, destination = Path("/music/a.mp3"), self.database_path.with_name("a.mp3")
+        destination.write_bytes(b"a")
+        with SyncState(self.database_path) as sync_state:
+            sync_state.set_songs_mirrored([(source, destination, make_stat(3, 5))])
+            self.assertTrue(sync_state.is_song_mirrored(source, destination, make_stat(3, 5), DirectoryInventory()))
+            destination.unlink()
+            self.assertFalse(sync_state.is_song_mirrored(source, destination, make_stat(3, 5)))
+            self.assertFalse(sync_state.is_song_mirrored(source, destination, make_stat(3, 5), DirectoryInventory()))
+
+    def test_dry_run_does_not_write_database(self):
+        source, destination = Path("/music/a.mp3"), self.database_path.with_name("a.mp3")
+        destination.write_bytes(b"a")
+        with SyncState(self.database_path, dry_run=True) as sync_state:
+            sync_state.set_songs_mirrored([(source, destination, make_stat(3, 5))])
+        self.assertFalse(self.database_path.exists())
+
+        with SyncState(self.database_path) as sync_state:
+            sync_state.set_songs_mirrored([(source, destination, make_stat(3, 5))])
+        with SyncState(self.database_path, dry_run=True) as sync_state:
+            self.assertTrue(sync_state.is_song_mirrored(source, destination, make_stat(3, 5)))
+            sync_state.set_songs_mirrored([(source, destination, make_stat(3, 6))])
+        with SyncState(self.database_path) as sync_state:
+            self.assertTrue(sync_state.is_song_mirrored(source, destination, make_stat(3, 5)))
@@ -0,0 +1,156 @@
+"""Unit test of the transcode stage"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .change_detection import DigestCache
+from .mirror_options import TranscodeSettings
+from .transcoding import (
+    encode_song,
+    get_planned_copy_jobs,
+    get_transcoded_path,
+    transcode_copy_jobs,
+)
+
+STUB_ENCODER = """#!{python}
+import sys
+
+arguments = sys.argv[1:]
+with open(arguments[arguments.index("-i") + 1], "rb") as song:
+    content = song.read()
+if content.startswith(b"corrupt"):
+    sys.exit("cannot decode " + arguments[arguments.index("-i") + 1])
+with open(arguments[-1], "wb") as output:
+    output.write(arguments[arguments.index("-b:a") + 1].encode() + b":" + content)
+"""
+
+
+def create_stub_encoder(folder: Path) -> Path:
+    """Create an executable standing in for ffmpeg, prefixing the bitrate to the content of the song"""
+    encoder_path = folder / "encoder"
+    encoder_path.write_text(STUB_ENCODER.format(python=sys.executable), encoding="utf-8")
+    encoder_path.chmod(0o755)
+    return encoder_path
+
+
+class TestTranscodeCopyJobs(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        root = Path(self.temporary_directory.name)
+        self.music = root / "Music"
+        self.destination = root / "mirror"
+        self.music.mkdir()
+        self.destination.mkdir()
+        self.settings = TranscodeSettings(
+            root / "cache", target_suffix=".opus", bitrate="96k", encoder=str(create_stub_encoder(root)), jobs=2
+        )
+        for name, content in [("one.flac", b"one"), ("copy_of_one.flac", b"one"), ("two.mp3", b"two")]:
+            (self.music / name).write_bytes(content)
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def get_copy_jobs(self, *names: str):
+        """Get the copy jobs of songs of the test library"""
+        return [(self.music / name, get_transcoded_path(self.destination / name, self.settings)) for name in names]
+
+    def test_songs_are_encoded_once_and_cached(self):
+        copy_jobs = self.get_copy_jobs("one.flac", "copy_of_one.flac", "two.mp3")
+
+        transcoded_jobs, failures = transcode_copy_jobs(copy_jobs, self.settings)
+
+        self.assertEqual({}, failures)
+        self.assertEqual(
+            [self.destination / "one.opus", self.destination / "copy_of_one.opus"],
+            [destination for _, destination in transcoded_jobs[:2]],
+        )
+        self.assertEqual(transcoded_jobs[0][0], transcoded_jobs[1][0])
+        self.assertEqual(b"96k:one", transcoded_jobs[0][0].read_bytes())
+        self.assertEqual(copy_jobs[2], transcoded_jobs[2])
+        self.assertEqual([transcoded_jobs[0][0]], list(self.settings.cache_folder.iterdir()))
+
+        with patch("mirror_playlists.mirror_playlists.transcoding.encode_songs") as mock_encode_songs:
+            self.assertEqual((transcoded_jobs, {}), transcode_copy_jobs(copy_jobs, self.settings))
+        mock_encode_songs.assert_not_called()
+
+    def test_changed_settings_encode_again(self):
+        copy_jobs = self.get_copy_jobs("one.flac")
+        transcoded_jobs, _ = transcode_copy_jobs(copy_jobs, self.settings)
+        other_settings = TranscodeSettings(
+            self.settings.cache_folder, target_suffix=".opus", bitrate="160k", encoder=self.settings.encoder
+        )
+
+        other_transcoded_jobs, _ = transcode_copy_jobs(copy_jobs, other_settings)
+
+        self.assertNotEqual(transcoded_jobs[0][0], other_transcoded_jobs[0][0])
+        self.assertEqual(b"160k:one", other_transcoded_jobs[0][0].read_bytes())
+
+    def test_songs_on_destination_are_not_transcoded_with_exists_comparison(self):
+        (self.destination / "one.opus").write_bytes(b"")
+        copy_jobs = self.get_copy_jobs("one.flac")
+
+        self.assertEqual((copy_jobs, {}), transcode_copy_jobs(copy_jobs, self.settings, skip_existing=True))
+        self.assertFalse(self.settings.cache_folder.exists())
+
+    def test_failures_are_collected(self):
+        (self.music / "corrupt.flac").write_bytes(b"corrupt")
+        copy_jobs = self.get_copy_jobs("corrupt.flac", "missing.flac", "two.mp3")
+
+        transcoded_jobs, failures = transcode_copy_jobs(copy_jobs, self.settings)
+
+        self.assertEqual(copy_jobs[2:], transcoded_jobs)
+        self.assertIn("cannot decode", failures[self.destination / "corrupt.opus"])
+        self.assertIn("does not exist", failures[self.destination / "missing.opus"])
+        self.assertEqual([], list(self.settings.cache_folder.iterdir()))
+
+    def test_missing_encoder_is_a_failure(self):
+        settings = TranscodeSettings(self.settings.cache_folder, encoder=str(self.music / "no_encoder"))
+
+        transcoded_jobs, failures = transcode_copy_jobs(self.get_copy_jobs("one.flac"), settings)
+
+        self.assertEqual([], transcoded_jobs)
+        self.assertEqual([self.destination / "one.opus"], list(failures))
+
+    def test_no_settings(self):
+        copy_jobs = self.get_copy_jobs("one.flac")
+        self.assertEqual((copy_jobs, {}), transcode_copy_jobs(copy_jobs, None))
+
+    def test_planned_jobs_take_cached_songs_without_encoding(self):
+        (self.music / "three.flac").write_bytes(b"three")
+        transcode_copy_jobs(self.get_copy_jobs("one.flac"), self.settings)
+        copy_jobs = self.get_copy_jobs("one.flac", "three.flac", "missing.flac", "two.mp3")
+
+        planned_jobs, failures = get_planned_copy_jobs(copy_jobs, self.settings, DigestCache())
+
+        self.assertEqual(b"96k:one", planned_jobs[0][0].read_bytes())
+        self.assertEqual([copy_jobs[1], copy_jobs[3]], planned_jobs[1:])
+        self.assertEqual([self.destination / "missing.opus"], list(failures))
+        self.assertEqual(1, len(list(self.settings.cache_folder.iterdir())))
+        self.assertEqual((copy_jobs, {}), get_planned_copy_jobs(copy_jobs, None, DigestCache()))
+
+
+class TestEncodeSong(unittest.TestCase):
+    def test_encode_song_renames_complete_output(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = Path(folder)
+            (root / "song.flac").write_bytes(b"song")
+            settings = TranscodeSettings(root, bitrate="64k", encoder=str(create_stub_encoder(root)))
+
+            encode_song(root / "song.flac", root / "song.opus", settings)
+
+            self.assertEqual(b"64k:song", (root / "song.opus").read_bytes())
+            self.assertEqual({"encoder", "song.flac", "song.opus"}, {path.name for path in root.iterdir()})
+
+    def test_encode_song_removes_partial_output_on_failure(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = Path(folder)
+            (root / "song.flac").write_bytes(b"song")
+            settings = TranscodeSettings(root, encoder=str(create_stub_encoder(root)))
+
+            with patch("os.replace", side_effect=OSError("disk full")), self.assertRaises(OSError):
+                encode_song(root / "song.flac", root / "song.opus", settings)
+
+            self.assertEqual({"encoder", "song.flac"}, {path.name for path in root.iterdir()})
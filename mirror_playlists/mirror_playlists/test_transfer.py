@@ -0,0 +1,80 @@
+"""Unit test of the file transfer by link or copy"""
+
+import errno
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from parameterized import parameterized
+
+from .transfer import transfer_file
+
+
+class TestTransferFile(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        root = Path(self.temporary_directory.name)
+        self.source = root / "source.mp3"
+        self.source.write_bytes(b"song")
+        os.utime(self.source, ns=(1_000_000_000, 1_000_000_000))
+        self.destination = root / "destination.mp3"
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def assert_copied(self):
+        """Assert the destination is a distinct file with the content and modification time of the source"""
+        self.assertEqual(b"song", self.destination.read_bytes())
+        self.assertEqual(1_000_000_000, self.destination.stat().st_mtime_ns)
+        self.assertFalse(self.destination.samefile(self.source))
+
+    def test_hardlink_replaces_a_stale_file(self):
+        self.destination.write_bytes(b"stale partial copy")
+
+        self.assertEqual("hardlink_file", transfer_file(self.source, self.destination, "hardlink"))
+
+        self.assertTrue(self.destination.samefile(self.source))
+
+    def test_copy(self):
+        self.assertEqual("copy2", transfer_file(self.source, self.destination))
+        self.assert_copied()
+
+    @parameterized.expand([["cross device hardlink", "hardlink", "os.link"], ["reflink", "reflink", "fcntl.ioctl"]])
+    # pylint: disable=(unused-argument)
+    def test_unsupported_link_falls_back_to_copy(self, name, link_mode, link_call):
+        with patch(link_call, side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+            self.assertEqual("copy2", transfer_file(self.source, self.destination, link_mode))
+        self.assert_copied()
+
+    def test_reflink(self):
+        with patch("fcntl.ioctl") as mock_ioctl:
+            self.assertEqual("reflink_file", transfer_file(self.source, self.destination, "reflink"))
+        self.assertEqual(0x40049409, mock_ioctl.call_args.args[1])
+        self.assertEqual(1_000_000_000, self.destination.stat().st_mtime_ns)
+
+    def test_auto_copies_in_the_kernel_without_clone_support(self):
+        with patch("fcntl.ioctl", side_effect=OSError(errno.EOPNOTSUPP, "Operation not supported")):
+            self.assertEqual("copy_file_in_kernel", transfer_file(self.source, self.destination, "auto"))
+        self.assert_copied()
+
+    def test_kernel_copy_stops_at_end_of_file(self):
+        with patch("fcntl.ioctl", side_effect=OSError(errno.ENOTTY, "Inappropriate ioctl")):
+            with patch("os.copy_file_range", return_value=0) as mock_copy_file_range:
+                transfer_file(self.source, self.destination, "auto")
+        mock_copy_file_range.assert_called_once()
+
+    def test_other_errors_are_raised(self):
+        with self.assertRaises(FileNotFoundError):
+            transfer_file(self.source.with_name("missing.mp3"), self.destination, "hardlink")
+        self.assertFalse(self.destination.exists())
+
+    @parameterized.expand([["copy", "copy"], ["auto without clone support", "auto"]])
+    # pylint: disable=(unused-argument)
+    def test_limited_bandwidth_copies_through_user_space(self, name, link_mode):
+        limiter = Mock()
+        with patch("fcntl.ioctl", side_effect=OSError(errno.EOPNOTSUPP, "Operation not supported")):
+            self.assertEqual("copy_file_with_limit", transfer_file(self.source, self.destination, link_mode, limiter))
+        limiter.consume.assert_called_once_with(4)
+        self.assert_copied()
@@ -0,0 +1,322 @@
+"""Unit test of the watch mode"""
+
+import struct
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from parameterized import parameterized
+
+from .mirror_options import MirrorOptions, PruneSettings, SongSelection
+from .mirror_playlists_utils import write_all_playlists
+from .test_mirror_playlists_utils import MirroredLibraryTestCase
+from .watch import (
+    IN_CLOSE_WRITE,
+    IN_IGNORED,
+    IN_Q_OVERFLOW,
+    InotifyWatcher,
+    PollingWatcher,
+    create_watcher,
+    get_affected_playlists,
+    load_inotify,
+    parse_inotify_events,
+    wait_for_changes,
+    watch_and_mirror,
+)
+
+
+def pack_inotify_event(watch_descriptor, mask, name=b""):
+    """Pack an inotify event as the kernel writes it, with a padded name"""
+    padded_name = name.ljust((len(name) // 16 + 1) * 16, b"\0") if name else b""
+    return struct.pack("iIII", watch_descriptor, mask, 0, len(padded_name)) + padded_name
+
+
+class ScriptedWatcher:
+    """Watcher applying a scripted list of changes, one per read, then stopping the watch"""
+
+    def __init__(self, steps, stop_event):
+        """Create the watcher with the functions applying each change"""
+        self.steps = list(steps)
+        self.stop_event = stop_event
+        self.watched_folders = set()
+        self.closed = False
+
+    def watch(self, folders):
+        """Record the watched folders"""
+        self.watched_folders = folders
+
+    def read_changes(self, _):
+        """Apply the next change and report the paths it returns"""
+        if not self.steps:
+            self.stop_event.set()
+            return set()
+        return self.steps.pop(0)()
+
+    def close(self):
+        """Record that the watcher was closed"""
+        self.closed = True
+
+
+class TestParseInotifyEvents(unittest.TestCase):
+    def test_events_are_parsed_with_their_names(self):
+        data = pack_inotify_event(1, IN_CLOSE_WRITE, b"one.mp3") + pack_inotify_event(2, IN_IGNORED)
+        self.assertEqual([(1, IN_CLOSE_WRITE, "one.mp3"), (2, IN_IGNORED, "")], list(parse_inotify_events(data)))
+
+
+class TestInotifyWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=(consider-using-with)
+        self.root = Path(self.temporary_directory.name)
+        self.watcher = InotifyWatcher(load_inotify())
+
+    def tearDown(self):
+        self.watcher.close()
+        self.temporary_directory.cleanup()
+
+    def test_written_files_of_watched_folders_are_reported(self):
+        (self.root / "watched").mkdir()
+        (self.root / "other").mkdir()
+        self.watcher.watch({self.root / "watched", self.root / "other", self.root / "missing"})
+        self.watcher.watch({self.root / "watched", self.root / "missing"})
+        self.assertEqual(set(), self.watcher.read_changes(0))
+
+        (self.root / "watched/one.mp3").write_bytes(b"one")
+        (self.root / "other/two.mp3").write_bytes(b"two")
+
+        self.assertEqual({self.root / "watched/one.mp3"}, self.watcher.read_changes(1))
+
+    def test_deleted_folders_are_watched_again_once_back(self):
+        (self.root / "watched").mkdir()
+        self.watcher.watch({self.root / "watched"})
+        (self.root / "watched").rmdir()
+        self.assertEqual(set(), self.watcher.read_changes(1))
+        self.assertEqual({}, self.watcher.watch_descriptors)
+        self.assertEqual(set(), self.watcher.read_changes(0))
+
+    def test_lost_events_are_reported(self):
+        with patch("os.read", return_value=pack_inotify_event(-1, IN_Q_OVERFLOW)), patch(
+            "select.select", return_value=([self.watcher.file_descriptor], [], [])
+        ):
+            self.assertIsNone(self.watcher.read_changes(1))
+
+    def test_watch_limit_is_logged(self):
+        libc = Mock()
+        libc.inotify_init1.return_value = self.watcher.file_descriptor
+        libc.inotify_add_watch.return_value = -1
+        with patch("ctypes.get_errno", return_value=28), self.assertLogs(level="WARNING"):
+            InotifyWatcher(libc).watch({self.root})
+
+    def test_inotify_errors_fall_back_to_polling(self):
+        libc = Mock()
+        libc.inotify_init1.return_value = -1
+        with patch("mirror_playlists.mirror_playlists.watch.load_inotify", return_value=libc), self.assertLogs(
+            level="WARNING"
+        ):
+            self.assertIsInstance(create_watcher(), PollingWatcher)
+        self.assertIsInstance(create_watcher(), InotifyWatcher)
+
+
+class TestPollingWatcher(unittest.TestCase):
+    def test_changed_files_are_reported_once_the_interval_elapsed(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = Path(folder)
+            (root / "same.mp3").write_bytes(b"same")
+            (root / "changed.mp3").write_bytes(b"old")
+            (root / "deleted.mp3").write_bytes(b"deleted")
+            watcher = PollingWatcher(0)
+            watcher.watch({root, root / "missing"})
+
+            (root / "changed.mp3").write_bytes(b"changed")
+            (root / "deleted.mp3").unlink()
+            (root / "created.mp3").write_bytes(b"created")
+
+            self.assertEqual(
+                {root / "changed.mp3", root / "deleted.mp3", root / "created.mp3"}, watcher.read_changes(1)
+            )
+            self.assertEqual(set(), watcher.read_changes(1))
+            watcher.close()
+
+    def test_folders_are_not_listed_before_the_interval(self):
+        watcher = PollingWatcher(60)
+        watcher.watch({Path("/")})
+        with patch("mirror_playlists.mirror_playlists.watch.get_folder_snapshot") as mock_snapshot:
+            self.assertEqual(set(), watcher.read_changes(0))
+        mock_snapshot.assert_not_called()
+
+
+class TestWaitForChanges(unittest.TestCase):
+    def test_burst_of_changes_is_collected_until_quiet(self):
+        watcher = Mock()
+        watcher.read_changes.side_effect = [set(), {Path("/a")}, {Path("/b")}, set(), {Path("/c")}]
+        self.assertEqual({Path("/a"), Path("/b")}, wait_for_changes(watcher, 2, threading.Event()))
+
+    @parameterized.expand([["while waiting", [None]], ["while debouncing", [{Path("/a")}, None]]])
+    # pylint: disable=(unused-argument)
+    def test_lost_changes_are_reported(self, name, changes):
+        watcher = Mock()
+        watcher.read_changes.side_effect = changes
+        self.assertIsNone(wait_for_changes(watcher, 2, threading.Event()))
+
+
+class TestGetAffectedPlaylists(unittest.TestCase):
+    def test_changed_playlists_and_playlists_of_changed_songs_are_affected(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = Path(folder)
+            (root / "Playlists/new").mkdir(parents=True)
+            (root / "Playlists/new/moved.m3u").write_text("")
+            references = {root / "Playlists/a.m3u": [root / "one.mp3"], root / "Playlists/b.m3u": [root / "two.mp3"]}
+            changed_paths = [
+                root / "Playlists/c.pls",
+                root / "Playlists/new",
+                root / "two.mp3",
+                root / "Playlists/cover.jpg",
+                root / "Playlists/UPPER.M3U",
+                root / "other.m3u",
+            ]
+            self.assertEqual(
+                {root / "Playlists/c.pls", root / "Playlists/new/moved.m3u", root / "Playlists/b.m3u"},
+                get_affected_playlists(changed_paths, root / "Playlists", references),
+            )
+
+
+class TestWatchAndMirror(MirroredLibraryTestCase):
+    def watch(self, steps, options=None, destinations=None):
+        """Watch the test library, applying each scripted change"""
+        stop_event = threading.Event()
+        watcher = ScriptedWatcher(steps, stop_event)
+        watch_and_mirror(
+            self.music,
+            self.music / "Playlists",
+            destinations or [self.destination],
+            options or MirrorOptions(),
+            debounce_seconds=0,
+            watcher=watcher,
+            stop_event=stop_event,
+        )
+        self.assertTrue(watcher.closed)
+        return watcher
+
+    def test_affected_playlists_and_songs_are_mirrored_again(self):
+        def edit_playlist():
+            (self.music / "Playlists/first.m3u").write_text("../Artist/one.mp3\n", encoding="utf-8")
+            return {self.music / "Playlists/first.m3u"}
+
+        def edit_song():
+            (self.music / "Artist/two.mp3").write_bytes(b"new two")
+            return {self.music / "Artist/two.mp3"}
+
+        def create_missing_song():
+            (self.music / "Artist/gone.mp3").write_bytes(b"back")
+            return {self.music / "Artist/gone.mp3"}
+
+        with patch(
+            "mirror_playlists.mirror_playlists.watch.write_all_playlists", wraps=write_all_playlists
+        ) as mock_write:
+            # an empty read ends each burst
+            watcher = self.watch([edit_playlist, set, edit_song, set, create_missing_song])
+
+        self.assertEqual(
+            [
+                [self.music / "Playlists/first.m3u"],
+                [self.music / "Playlists/second.m3u"],
+                [self.music / "Playlists/second.m3u"],
+            ],
+            [list(call.args[0]) for call in mock_write.call_args_list],
+        )
+        self.assertEqual({self.music / "Playlists", self.music / "Artist"}, watcher.watched_folders)
+        self.assertEqual("#EXTM3U\n../Artist/one.mp3", (self.destination / "Playlists/first.m3u").read_text())
+        self.assertEqual(b"new two", (self.destination / "Artist/two.mp3").read_bytes())
+        self.assertEqual(b"back", (self.destination / "Artist/gone.mp3").read_bytes())
+        self.assertEqual(
+            "#EXTM3U\n../Artist/two.mp3\n../Artist/gone.mp3", (self.destination / "Playlists/second.m3u").read_text()
+        )
+
+    def test_songs_are_selected_within_the_capacity_of_every_playlist(self):
+        def edit_second_playlist():
+            (self.music / "Playlists/second.m3u").write_text("../Artist/one.mp3\n", encoding="utf-8")
+            return {self.music / "Playlists/second.m3u"}
+
+        with self.assertLogs(level="INFO"):
+            self.watch([edit_second_playlist], MirrorOptions(selection=SongSelection(capacity_bytes=3)))
+
+        # one song is now referenced by both playlists, the other one no longer fits in the capacity
+        self.assertEqual(b"one", (self.destination / "Artist/one.mp3").read_bytes())
+        self.assertEqual("#EXTM3U\n../Artist/one.mp3", (self.destination / "Playlists/first.m3u").read_text())
+
+    def test_missing_songs_are_resolved(self):
+        def move_song():
+            (self.music / "Moved").mkdir()
+            (self.music / "Moved/three.mp3").write_bytes(b"three")
+            (self.music / "Playlists/second.m3u").write_text("../Artist/three.mp3\n", encoding="utf-8")
+            return {self.music / "Moved", self.music / "Playlists/second.m3u"}
+
+        with self.assertLogs(level="INFO"):
+            self.watch([move_song], MirrorOptions(selection=SongSelection(resolve_missing=True)))
+
+        self.assertEqual(b"three", (self.destination / "Moved/three.mp3").read_bytes())
+        self.assertEqual("#EXTM3U\n../Moved/three.mp3", (self.destination / "Playlists/second.m3u").read_text())
+
+    def test_edited_metadata_replaces_the_metadata_read_before(self):
+        def edit_title(title):
+            (self.music / "Playlists/first.m3u").write_text(
+                f"#EXTM3U\n#EXTINF:60,{title}\n../Artist/one.mp3\n", encoding="utf-8"
+            )
+            return {self.music / "Playlists/first.m3u"}
+
+        self.watch([lambda: edit_title("Old"), set, lambda: edit_title("New")])
+
+        self.assertEqual(
+            "#EXTM3U\n#EXTINF:60,New\n../Artist/one.mp3", (self.destination / "Playlists/first.m3u").read_text()
+        )
+
+    def test_failed_changes_are_logged_and_the_watch_goes_on(self):
+        def edit_playlist():
+            (self.music / "Playlists/first.m3u").write_text("../Artist/one.mp3\n", encoding="utf-8")
+            return {self.music / "Playlists/first.m3u"}
+
+        def edit_song():
+            (self.music / "Artist/two.mp3").write_bytes(b"new two")
+            return {self.music / "Artist/two.mp3"}
+
+        with patch(
+            "mirror_playlists.mirror_playlists.watch.write_all_playlists",
+            side_effect=[OSError("No space left on device"), None],
+        ), self.assertLogs(level="ERROR") as logs:
+            self.watch([edit_playlist, set, edit_song])
+
+        self.assertIn("Failed to mirror changes, waiting for the next ones: No space left on device", logs.output[0])
+        self.assertEqual(b"new two", (self.destination / "Artist/two.mp3").read_bytes())
+
+    def test_deleted_playlists_are_removed_when_pruning(self):
+        def delete_playlist():
+            (self.music / "Playlists/second.m3u").unlink()
+            return {self.music / "Playlists/second.m3u"}
+
+        destinations = [self.destination / "first", self.destination / "second"]
+        for destination in destinations:
+            destination.mkdir()
+        self.watch([delete_playlist], MirrorOptions(pruning=PruneSettings(prune=True)), destinations)
+
+        for destination in destinations:
+            self.assertEqual(["first.m3u"], [path.name for path in (destination / "Playlists").iterdir()])
+
+    def test_everything_is_mirrored_again_when_changes_are_lost(self):
+        def lose_changes():
+            (self.music / "Playlists/third.m3u").write_text("../Artist/one.mp3\n", encoding="utf-8")
+            (self.destination / "Artist/one.mp3").unlink()
+
+        with self.assertLogs(level="WARNING"):
+            self.watch([lose_changes])
+
+        self.assertEqual(b"one", (self.destination / "Artist/one.mp3").read_bytes())
+        self.assertTrue((self.destination / "Playlists/third.m3u").exists())
+
+    def test_watch_runs_until_interrupted_with_default_watcher(self):
+        with patch("mirror_playlists.mirror_playlists.watch.wait_for_changes", side_effect=KeyboardInterrupt), patch(
+            "mirror_playlists.mirror_playlists.watch.create_watcher", return_value=PollingWatcher()
+        ) as mock_create_watcher, self.assertRaises(KeyboardInterrupt):
+            watch_and_mirror(self.music, self.music / "Playlists", [self.destination])
+        mock_create_watcher.assert_called_once_with()
+        self.assertEqual(b"one", (self.destination / "Artist/one.mp3").read_bytes())
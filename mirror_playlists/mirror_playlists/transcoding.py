@@ -0,0 +1,247 @@
+"""Transcoding of lossless songs with an external encoder, before they are copied to the destination."""
+
+import hashlib
+import logging
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .change_detection import DigestCache, get_file_stat
+from .copy_engine import PARTIAL_FILE_SUFFIX, CopyJob
+from .inventory import DirectoryInventory
+from .mirror_options import TranscodeSettings
+
+
+def is_transcoded(song_path: Path, settings: Optional[TranscodeSettings]) -> bool:
+    """Return true if the song is transcoded before being copied.
+
+    Args:
+        song_path (Path): path of the song
+        settings (Optional[TranscodeSettings]): settings of the transcode stage, nothing is transcoded if None
+    Returns:
+        bool: True if the suffix of the song is one of the transcoded suffixes
+    """
+    return settings is not None and song_path.suffix.lower() in settings.source_suffixes
+
+
+def get_transcoded_path(song_path: Path, settings: Optional[TranscodeSettings]) -> Path:
+    """Get the path of a song once transcoded.
+
+    Args:
+        song_path (Path): path of the song
+        settings (Optional[TranscodeSettings]): settings of the transcode stage, nothing is transcoded if None
+    Returns:
+        Path: path with the suffix of the transcoded songs, song_path itself if the song is not transcoded
+    """
+    if is_transcoded(song_path, settings):
+        return song_path.with_suffix(settings.target_suffix)
+    return song_path
+
+
+def get_settings_key(settings: TranscodeSettings) -> str:
+    """Get the key of the settings changing the encoder output.
+
+    Args:
+        settings (TranscodeSettings): settings of the transcode stage
+    Returns:
+        str: hexadecimal digest of the target suffix and bitrate
+    """
+    return hashlib.blake2b(f"{settings.target_suffix}\n{settings.bitrate}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+def get_encoder_command(source_song_path: Path, output_path: Path, settings: TranscodeSettings) -> List[str]:
+    """Get the ffmpeg command line encoding a song.
+
+    Args:
+        source_song_path (Path): path of the lossless song
+        output_path (Path): path of the encoded song, its suffix selects the codec
+        settings (TranscodeSettings): settings of the transcode stage
+    Returns:
+        List[str]: command line arguments
+    """
+    return [
+        settings.encoder,
+        "-nostdin",
+        "-y",
+        "-loglevel",
+        "error",
+        "-i",
+        str(source_song_path),
+        "-vn",
+        "-b:a",
+        settings.bitrate,
+        str(output_path),
+    ]
+
+
+def encode_song(source_song_path: Path, output_path: Path, settings: TranscodeSettings) -> None:
+    """Encode a song into a temporary file renamed to output_path once complete.
+
+    Args:
+        source_song_path (Path): path of the lossless song
+        output_path (Path): path of the encoded song
+        settings (TranscodeSettings): settings of the transcode stage
+    """
+    # the encoder picks the codec from the suffix, which the temporary file keeps
+    partial_file_path = output_path.with_name(f".{output_path.stem}{PARTIAL_FILE_SUFFIX}{output_path.suffix}")
+    try:
+        subprocess.run(
+            get_encoder_command(source_song_path, partial_file_path, settings),
+            check=True,
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+        )
+        os.replace(partial_file_path, output_path)
+    except BaseException:
+        partial_file_path.unlink(missing_ok=True)
+        raise
+
+
+def encode_songs(songs_to_encode: Dict[Path, Path], settings: TranscodeSettings) -> Dict[Path, str]:
+    """Encode songs concurrently with a process pool.
+
+    Args:
+        songs_to_encode (Dict[Path, Path]): source song path of each output path
+        settings (TranscodeSettings): settings of the transcode stage
+    Returns:
+        Dict[Path, str]: error message of each output path that could not be encoded
+    """
+    failures = {}
+    with ProcessPoolExecutor(max_workers=settings.jobs or os.cpu_count()) as executor:
+        futures = {
+            output_path: executor.submit(encode_song, source_song_path, output_path, settings)
+            for output_path, source_song_path in songs_to_encode.items()
+        }
+        for output_path, future in futures.items():
+            try:
+                future.result()
+            except subprocess.CalledProcessError as error:
+                failures[output_path] = f"Encoder failed: {error.stderr.decode('utf-8', 'replace').strip()}"
+            except OSError as error:
+                failures[output_path] = str(error)
+    return failures
+
+
+def get_cached_output_paths(
+    copy_jobs: List[CopyJob],
+    settings: TranscodeSettings,
+    digest_cache: DigestCache,
+    skip_existing: bool,
+    inventory: Optional[DirectoryInventory],
+) -> Tuple[Dict[Path, Path], Dict[Path, str]]:
+    """Get the path of the transcoded version of each song to transcode in the cache folder.
+
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        settings (TranscodeSettings): settings of the transcode stage
+        digest_cache (DigestCache): cache of the source digests
+        skip_existing (bool): leave the songs already on destination as they are, for the exists comparison
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+    Returns:
+        Tuple[Dict[Path, Path], Dict[Path, str]]: cached output path of each destination song path, and error
+            message of each destination song path whose source could not be read
+    """
+    settings_key = get_settings_key(settings)
+    output_paths = {}
+    failures = {}
+    for source, destination in copy_jobs:
+        if not is_transcoded(source, settings) or (skip_existing and get_file_stat(destination, inventory)):
+            continue
+        try:
+            source_stat = get_file_stat(source, inventory)
+            if source_stat is None:
+                raise FileNotFoundError(f"Song file {source} does not exist")
+            source_digest = digest_cache.get_digest(source, source_stat)
+        except OSError as error:
+            failures[destination] = str(error)
+            continue
+        output_paths[destination] = settings.cache_folder / f"{source_digest}-{settings_key}{settings.target_suffix}"
+    return output_paths, failures
+
+
+def get_planned_copy_jobs(
+    copy_jobs: List[CopyJob],
+    settings: Optional[TranscodeSettings],
+    digest_cache: DigestCache,
+    skip_existing: bool = False,
+    inventory: Optional[DirectoryInventory] = None,
+) -> Tuple[List[CopyJob], Dict[Path, str]]:
+    """Replace the source of the songs to transcode by their transcoded version when it is cached, encoding nothing.
+
+    Songs missing from the cache are planned with their lossless source, the encoded song is not known yet.
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        settings (Optional[TranscodeSettings]): settings of the transcode stage, copy jobs are unchanged if None
+        digest_cache (DigestCache): cache of the source digests
+        skip_existing (bool): leave the songs already on destination as they are, for the exists comparison
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+    Returns:
+        Tuple[List[CopyJob], Dict[Path, str]]: copy jobs, in the same order, and error message of each destination
+            song path whose source could not be read
+    """
+    if settings is None:
+        return copy_jobs, {}
+    output_paths, failures = get_cached_output_paths(copy_jobs, settings, digest_cache, skip_existing, inventory)
+    planned_jobs = []
+    for source, destination in copy_jobs:
+        output_path = output_paths.get(destination)
+        if output_path is not None and output_path.exists():
+            planned_jobs.append((output_path, destination))
+        elif destination not in failures:
+            planned_jobs.append((source, destination))
+    return planned_jobs, failures
+
+
+def transcode_copy_jobs(
+    copy_jobs: List[CopyJob],
+    settings: Optional[TranscodeSettings],
+    digest_cache: Optional[DigestCache] = None,
+    skip_existing: bool = False,
+    inventory: Optional[DirectoryInventory] = None,
+) -> Tuple[List[CopyJob], Dict[Path, str]]:
+    """Replace the source of the songs to transcode by their transcoded version, kept in the cache folder.
+
+    Transcoded songs are cached by source digest and encoder settings, only songs missing from the cache are
+    encoded.
+    Args:
+        copy_jobs (List[CopyJob]): pairs of source and destination song path
+        settings (Optional[TranscodeSettings]): settings of the transcode stage, copy jobs are unchanged if None
+        digest_cache (Optional[DigestCache]): cache of the source digests
+        skip_existing (bool): leave the songs already on destination as they are, for the exists comparison
+        inventory (Optional[DirectoryInventory]): inventory answering stat of source and destination files
+    Returns:
+        Tuple[List[CopyJob], Dict[Path, str]]: copy jobs, in the same order, and error message of each destination
+            song path that could not be transcoded
+    """
+    if settings is None:
+        return copy_jobs, {}
+    output_paths, failures = get_cached_output_paths(
+        copy_jobs, settings, digest_cache or DigestCache(), skip_existing, inventory
+    )
+    songs_to_encode: Dict[Path, Path] = {}
+    for source, destination in copy_jobs:
+        output_path = output_paths.get(destination)
+        if output_path is not None and not output_path.exists():
+            songs_to_encode.setdefault(output_path, source)
+    encode_failures = {}
+    if songs_to_encode:
+        settings.cache_folder.mkdir(parents=True, exist_ok=True)
+        encode_failures = encode_songs(songs_to_encode, settings)
+    logging.info(
+        "Transcoded %d songs, %d taken from the cache, %d failed",
+        len(songs_to_encode) - len(encode_failures),
+        len(set(output_paths.values())) - len(songs_to_encode),
+        len(encode_failures),
+    )
+    transcoded_jobs = []
+    for source, destination in copy_jobs:
+        output_path = output_paths.get(destination)
+        if output_path in encode_failures:
+            failures[destination] = encode_failures[output_path]
+        elif output_path is not None:
+            transcoded_jobs.append((output_path, destination))
+        elif destination not in failures:
+            transcoded_jobs.append((source, destination))
+    return transcoded_jobs, failures
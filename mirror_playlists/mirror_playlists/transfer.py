@@ -0,0 +1,145 @@
+"""Transfer of a song file to its destination path, by link or copy."""
+
+import errno
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from .scheduling import BandwidthLimiter
+
+COPY = "copy"
+HARDLINK = "hardlink"
+REFLINK = "reflink"
+AUTO = "auto"
+LINK_MODES = (COPY, HARDLINK, REFLINK, AUTO)
+# Linux ioctl sharing the extents of a file with another, on btrfs, XFS and other copy-on-write file systems
+FICLONE = 0x40049409
+# errors telling that a link or kernel copy is not possible between both files, a regular copy is made instead
+UNSUPPORTED_ERRORS = (
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EMLINK,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.EBADF,
+)
+TRANSFER_BUFFER_SIZE = 1024 * 1024
+
+
+def hardlink_file(source_file_path: Path, destination_file_path: Path) -> None:
+    """Create a hard link to the source file, both must be on the same file system.
+
+    Args:
+        source_file_path (Path): path of the source file
+        destination_file_path (Path): path of the link, an existing file is replaced
+    """
+    destination_file_path.unlink(missing_ok=True)
+    os.link(source_file_path, destination_file_path)
+
+
+def reflink_file(source_file_path: Path, destination_file_path: Path) -> None:
+    """Clone the source file, sharing its data until one of the files is modified.
+
+    Args:
+        source_file_path (Path): path of the source file
+        destination_file_path (Path): path of the clone
+    Raises:
+        OSError: if the platform or the file system does not support cloning
+    """
+    if fcntl is None:  # pragma: no cover
+        raise OSError(errno.ENOSYS, "Cloning files is not supported on this platform")
+    with open(source_file_path, "rb") as source_file, open(destination_file_path, "wb") as destination_file:
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+    shutil.copystat(source_file_path, destination_file_path)
+
+
+def copy_file_in_kernel(source_file_path: Path, destination_file_path: Path) -> None:
+    """Copy the data of the source file without going through user space, with copy_file_range.
+
+    File systems may implement the copy as a clone, NFS and SMB as a copy on the server side.
+    Args:
+        source_file_path (Path): path of the source file
+        destination_file_path (Path): path of the copy
+    Raises:
+        OSError: if the platform or the file systems do not support copy_file_range
+    """
+    if not hasattr(os, "copy_file_range"):  # pragma: no cover
+        raise OSError(errno.ENOSYS, "copy_file_range is not supported on this platform")
+    with open(source_file_path, "rb") as source_file, open(destination_file_path, "wb") as destination_file:
+        remaining_bytes = os.fstat(source_file.fileno()).st_size
+        while remaining_bytes > 0:
+            copied_bytes = os.copy_file_range(source_file.fileno(), destination_file.fileno(), remaining_bytes)
+            if copied_bytes == 0:
+                break
+            remaining_bytes -= copied_bytes
+    shutil.copystat(source_file_path, destination_file_path)
+
+
+def copy_file_with_limit(source_file_path: Path, destination_file_path: Path, limiter: BandwidthLimiter) -> None:
+    """Copy a file through user space, pacing each buffer with the bandwidth limiter.
+
+    Args:
+        source_file_path (Path): path of the source file
+        destination_file_path (Path): path of the copy
+        limiter (BandwidthLimiter): limiter shared by the copies of the run
+    """
+    with open(source_file_path, "rb") as source_file, open(destination_file_path, "wb") as destination_file:
+        while True:
+            chunk = source_file.read(TRANSFER_BUFFER_SIZE)
+            if not chunk:
+                break
+            limiter.consume(len(chunk))
+            destination_file.write(chunk)
+    shutil.copystat(source_file_path, destination_file_path)
+
+
+LINK_FUNCTIONS = {HARDLINK: [hardlink_file], REFLINK: [reflink_file], AUTO: [reflink_file, copy_file_in_kernel]}
+
+
+def transfer_file(
+    source_file_path: Path,
+    destination_file_path: Path,
+    link_mode: str = COPY,
+    limiter: Optional[BandwidthLimiter] = None,
+) -> str:
+    """Transfer a file with the link mode, falling back to a regular copy when it is not possible.
+
+    The auto mode clones the file if the file system supports it, then tries a copy in the kernel. It never creates
+    hard links, which would let a change on destination, such as a player writing tags, alter the source.
+    A regular copy is made with shutil.copy2, which uses sendfile where available, or through user space when the
+    bandwidth is limited. Copies in the kernel cannot be paced, they are not tried when the bandwidth is limited.
+    Args:
+        source_file_path (Path): path of the source file
+        destination_file_path (Path): path of the destination file, must not exist
+        link_mode (str): how the file is transferred, see LINK_MODES
+        limiter (Optional[BandwidthLimiter]): limiter of the bytes copied per second, no limit if None
+    Returns:
+        str: name of the function that transferred the file
+    Raises:
+        OSError: if the file could not be transferred, for another reason than an unsupported link mode
+    """
+    for link_function in LINK_FUNCTIONS.get(link_mode, []):
+        if limiter is not None and link_function is copy_file_in_kernel:
+            continue
+        try:
+            link_function(source_file_path, destination_file_path)
+            return link_function.__name__
+        except OSError as error:
+            if error.errno not in UNSUPPORTED_ERRORS:
+                raise
+            logging.debug("Cannot %s %s: %s", link_function.__name__, str(source_file_path), error)
+            destination_file_path.unlink(missing_ok=True)
+    if limiter is not None:
+        copy_file_with_limit(source_file_path, destination_file_path, limiter)
+        return copy_file_with_limit.__name__
+    shutil.copy2(source_file_path, destination_file_path)
+    return "copy2"
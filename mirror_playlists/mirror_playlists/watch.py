@@ -0,0 +1,547 @@
+"""Watch mode: mirror the playlists and songs as soon as they change.
+
+Folders are watched with inotify where available, and polled otherwise. After an initial full mirror, bursts of
+changes are debounced and only the playlists they affect are mirrored again.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from .change_detection import EXISTS, SIZE_MTIME
+from .destination_profiles import PathIndex, load_path_indexes
+from .fan_out import copy_songs_to_destinations, mirror_all_playlist_to_destinations
+from .inventory import DirectoryInventory
+from .mirror_options import MirrorOptions
+from .mirror_playlists_utils import (
+    PLAYLIST_SUFFIXES,
+    get_all_playlist_files,
+    get_copy_jobs,
+    get_destination_path_of_playlist_file,
+    get_existing_songs,
+    mirror_all_playlist,
+    resolve_playlist_entries,
+    select_songs_of_playlists,
+    write_all_playlists,
+)
+from .path_store import PathStore
+from .playlist_formats import SongInfo, read_playlist
+from .run_report import RunReport
+from .song_resolver import create_song_resolver
+
+DEBOUNCE_SECONDS = 2.0
+POLL_INTERVAL_SECONDS = 5.0
+# how often a watcher waiting for changes checks that it was not stopped
+STOP_CHECK_SECONDS = 1.0
+INOTIFY_READ_SIZE = 64 * 1024
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# watch descriptor, mask, cookie and name length of struct inotify_event, followed by the name
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def load_inotify() -> Optional[ctypes.CDLL]:
+    """Load the C library if it provides inotify.
+
+    Returns:
+        Optional[ctypes.CDLL]: C library, None if inotify is not available on this platform
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:  # pragma: no cover
+        return None
+    if not hasattr(libc, "inotify_init1"):  # pragma: no cover
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def parse_inotify_events(data: bytes) -> Iterator[Tuple[int, int, str]]:
+    """Parse the events read from an inotify file descriptor.
+
+    Args:
+        data (bytes): events, as read from the file descriptor
+    Yields:
+        Tuple[int, int, str]: watch descriptor, mask and file name of each event, the name is empty for events about
+            the watched folder itself
+    """
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+        watch_descriptor, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        yield watch_descriptor, mask, os.fsdecode(data[offset : offset + name_length].rstrip(b"\0"))
+        offset += name_length
+
+
+class InotifyWatcher:
+    """Report the files created, written, moved or deleted in the watched folders, with inotify."""
+
+    def __init__(self, libc: ctypes.CDLL):
+        """Create the inotify instance.
+
+        Args:
+            libc (ctypes.CDLL): C library providing inotify
+        Raises:
+            OSError: if the inotify instance cannot be created
+        """
+        self.libc = libc
+        self.file_descriptor = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.file_descriptor < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.watch_descriptors: Dict[Path, int] = {}
+        self.folders: Dict[int, Path] = {}
+
+    def watch(self, folders: Set[Path]) -> None:
+        """Watch exactly the given folders, not their subfolders.
+
+        Folders that cannot be watched, because they do not exist or because of the limit of watches, are skipped.
+        Args:
+            folders (Set[Path]): folders to watch
+        """
+        for folder in set(self.watch_descriptors) - folders:
+            self.libc.inotify_rm_watch(self.file_descriptor, self.watch_descriptors.pop(folder))
+        for folder in folders - set(self.watch_descriptors):
+            watch_descriptor = self.libc.inotify_add_watch(self.file_descriptor, os.fsencode(folder), WATCH_MASK)
+            if watch_descriptor >= 0:
+                self.watch_descriptors[folder] = watch_descriptor
+            elif ctypes.get_errno() == errno.ENOSPC:
+                logging.warning("Cannot watch %s, raise fs.inotify.max_user_watches", str(folder))
+        self.folders = {watch_descriptor: folder for folder, watch_descriptor in self.watch_descriptors.items()}
+
+    def read_changes(self, timeout: float) -> Optional[Set[Path]]:
+        """Wait for changes in the watched folders.
+
+        Args:
+            timeout (float): maximum number of seconds to wait
+        Returns:
+            Optional[Set[Path]]: changed paths, empty if nothing changed before the timeout, None if the kernel
+                dropped events and anything may have changed
+        """
+        readable, _, _ = select.select([self.file_descriptor], [], [], timeout)
+        if not readable:
+            return set()
+        changes = set()
+        for watch_descriptor, mask, name in parse_inotify_events(os.read(self.file_descriptor, INOTIFY_READ_SIZE)):
+            if mask & IN_Q_OVERFLOW:
+                return None
+            folder = self.folders.get(watch_descriptor)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                # the folder was deleted, it is watched again if it comes back
+                del self.watch_descriptors[folder]
+            elif name:
+                changes.add(folder / name)
+        return changes
+
+    def close(self) -> None:
+        """Close the inotify instance, removing every watch."""
+        os.close(self.file_descriptor)
+
+
+def get_folder_snapshot(folder: Path) -> Dict[str, Tuple[int, int]]:
+    """Get the size and modification time of the entries of a folder.
+
+    Args:
+        folder (Path): path of the folder
+    Returns:
+        Dict[str, Tuple[int, int]]: size and modification time in nanoseconds of each entry, empty if the folder does
+            not exist
+    """
+    try:
+        with os.scandir(folder) as entries:
+            return {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+
+
+class PollingWatcher:
+    """Report the files changed in the watched folders, by listing them every interval."""
+
+    def __init__(self, interval: float = POLL_INTERVAL_SECONDS):
+        """Create a watcher without folders.
+
+        Args:
+            interval (float): seconds between two listings of the watched folders
+        """
+        self.interval = interval
+        self.snapshots: Dict[Path, Dict[str, Tuple[int, int]]] = {}
+        self.next_poll_time = time.monotonic() + interval
+
+    def watch(self, folders: Set[Path]) -> None:
+        """Watch exactly the given folders, not their subfolders.
+
+        Args:
+            folders (Set[Path]): folders to watch
+        """
+        self.snapshots = {
+            folder: self.snapshots[folder] if folder in self.snapshots else get_folder_snapshot(folder)
+            for folder in folders
+        }
+
+    def read_changes(self, timeout: float) -> Optional[Set[Path]]:
+        """Wait for changes in the watched folders, listing them once the interval elapsed.
+
+        Args:
+            timeout (float): maximum number of seconds to wait
+        Returns:
+            Optional[Set[Path]]: changed paths, empty if nothing changed or the folders were not listed before the
+                timeout
+        """
+        wait_seconds = self.next_poll_time - time.monotonic()
+        if wait_seconds > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(wait_seconds, 0))
+        self.next_poll_time = time.monotonic() + self.interval
+        changes = set()
+        for folder, snapshot in self.snapshots.items():
+            new_snapshot = get_folder_snapshot(folder)
+            changes.update(
+                folder / name
+                for name in snapshot.keys() | new_snapshot.keys()
+                if snapshot.get(name) != new_snapshot.get(name)
+            )
+            self.snapshots[folder] = new_snapshot
+        return changes
+
+    def close(self) -> None:
+        """Stop watching every folder."""
+        self.snapshots = {}
+
+
+Watcher = Union[InotifyWatcher, PollingWatcher]
+
+
+def create_watcher(poll_interval: float = POLL_INTERVAL_SECONDS) -> Watcher:
+    """Create an inotify watcher, or a polling watcher where inotify is not available.
+
+    Args:
+        poll_interval (float): seconds between two listings of the watched folders by the polling watcher
+    Returns:
+        Watcher: watcher of the changes in folders
+    """
+    libc = load_inotify()
+    if libc is not None:
+        try:
+            return InotifyWatcher(libc)
+        except OSError as error:
+            logging.warning("Cannot use inotify, polling instead: %s", error)
+    return PollingWatcher(poll_interval)
+
+
+def wait_for_changes(watcher: Watcher, debounce_seconds: float, stop_event: threading.Event) -> Optional[Set[Path]]:
+    """Wait for a burst of changes, until nothing changed for debounce_seconds.
+
+    Args:
+        watcher (Watcher): watcher of the changes in folders
+        debounce_seconds (float): seconds without changes ending a burst
+        stop_event (threading.Event): event stopping the wait
+    Returns:
+        Optional[Set[Path]]: changed paths, empty if stopped, None if changes were lost and anything may have changed
+    """
+    changes: Set[Path] = set()
+    while not changes and not stop_event.is_set():
+        new_changes = watcher.read_changes(STOP_CHECK_SECONDS)
+        if new_changes is None:
+            return None
+        changes.update(new_changes)
+    while changes:
+        new_changes = watcher.read_changes(debounce_seconds)
+        if new_changes is None:
+            return None
+        if not new_changes:
+            break
+        changes.update(new_changes)
+    return changes
+
+
+def get_watched_folders(playlist_root_folder_path: Path, references: Dict[Path, List[Path]]) -> Set[Path]:
+    """Get the folders where a change can affect the mirror: the playlist folders and the folders of their songs.
+
+    Args:
+        playlist_root_folder_path (Path): root folder of the playlist files
+        references (Dict[Path, List[Path]]): resolved list of song path for each playlist file, existing or not
+    Returns:
+        Set[Path]: folders to watch
+    """
+    folders = {Path(folder) for folder, _, _ in os.walk(playlist_root_folder_path)}
+    folders.update(song.parent for songs in references.values() for song in songs)
+    return folders
+
+
+def get_affected_playlists(
+    changed_paths: Iterable[Path], playlist_root_folder_path: Path, references: Dict[Path, List[Path]]
+) -> Set[Path]:
+    """Get the playlists that must be mirrored again after changes.
+
+    Args:
+        changed_paths (Iterable[Path]): paths of the created, written, moved or deleted files and folders
+        playlist_root_folder_path (Path): root folder of the playlist files
+        references (Dict[Path, List[Path]]): resolved list of song path for each playlist file, existing or not
+    Returns:
+        Set[Path]: changed, created or deleted playlists, and playlists referencing a changed song
+    """
+    changed_paths = set(changed_paths)
+    affected_playlists = set()
+    for path in changed_paths:
+        if not path.is_relative_to(playlist_root_folder_path):
+            continue
+        if path.name.endswith(PLAYLIST_SUFFIXES):
+            affected_playlists.add(path)
+        elif path.is_dir():
+            # playlists of a folder created or moved in were not watched yet
+            affected_playlists.update(get_all_playlist_files(path))
+    affected_playlists.update(playlist for playlist, songs in references.items() if not changed_paths.isdisjoint(songs))
+    return affected_playlists
+
+
+def read_references(
+    playlist_files: Iterable[Path], references: Dict[Path, List[Path]], song_info: Dict[Path, SongInfo]
+) -> None:
+    """Parse playlists, recording every song they reference, existing or not, to watch their folders.
+
+    Args:
+        playlist_files (Iterable[Path]): path to the playlist files
+        references (Dict[Path, List[Path]]): resolved list of song path for each playlist file, existing or not,
+            completed with the parsed playlists
+        song_info (Dict[Path, SongInfo]): metadata of each song, completed with the metadata of the playlists
+    """
+    for playlist_file in playlist_files:
+        references[playlist_file] = resolve_playlist_entries(read_playlist(playlist_file), playlist_file, song_info)
+
+
+def read_affected_playlists(
+    playlist_files: Set[Path],
+    music_root_folder_path: Path,
+    options: MirrorOptions,
+    inventory: DirectoryInventory,
+    references: Dict[Path, List[Path]],
+    song_info: Dict[Path, SongInfo],
+) -> Dict[Path, List[Path]]:
+    """Parse the affected playlists once, then select and resolve their existing songs as a full run does.
+
+    Args:
+        playlist_files (Set[Path]): path to the affected playlist files
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        options (MirrorOptions): options of the mirror
+        inventory (DirectoryInventory): inventory of the source folders
+        references (Dict[Path, List[Path]]): resolved list of song path for each playlist file, existing or not,
+            completed with the parsed playlists
+        song_info (Dict[Path, SongInfo]): metadata of each song, completed with the metadata of the playlists
+    Returns:
+        Dict[Path, List[Path]]: resolved list of existing song path for each affected playlist file
+    """
+    read_references(playlist_files, references, song_info)
+    resolver = create_song_resolver(music_root_folder_path, options)
+    report = RunReport()
+    playlists = {
+        playlist_file: get_existing_songs(references[playlist_file], inventory, resolver)
+        for playlist_file in sorted(playlist_files)
+    }
+    if resolver is not None:
+        report.resolver_report = resolver.finish(song_info, options.dry_run)
+    return select_songs_of_playlists(report, playlists, inventory, options)
+
+
+def mirror_everything(
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    destination_folder_paths: List[Path],
+    options: MirrorOptions,
+    song_info: Dict[Path, SongInfo],
+) -> Dict[Path, List[Path]]:
+    """Mirror all playlists as a run without watch mode does, then read the songs they reference.
+
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        destination_folder_paths (List[Path]): destinations where we should mirror files
+        options (MirrorOptions): options of the mirror
+        song_info (Dict[Path, SongInfo]): metadata of each song, completed with the metadata of the playlists
+    Returns:
+        Dict[Path, List[Path]]: resolved list of song path for each playlist file, existing or not
+    """
+    if len(destination_folder_paths) == 1:
+        mirror_all_playlist(music_root_folder_path, playlist_root_folder_path, destination_folder_paths[0], options)
+    else:
+        mirror_all_playlist_to_destinations(
+            music_root_folder_path, playlist_root_folder_path, destination_folder_paths, options
+        )
+    references: Dict[Path, List[Path]] = {}
+    song_info.clear()
+    path_store = PathStore()
+    for playlist_file in get_all_playlist_files(playlist_root_folder_path):
+        references[playlist_file] = resolve_playlist_entries(
+            read_playlist(playlist_file), playlist_file, song_info, path_store
+        )
+    return references
+
+
+def remove_mirrored_playlist(
+    music_root_folder_path: Path, playlist_file_path: Path, path_indexes: Dict[Path, PathIndex]
+) -> None:
+    """Remove the mirrored version of a deleted playlist from every destination.
+
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_file_path (Path): path of the deleted playlist file
+        path_indexes (Dict[Path, PathIndex]): index mapping the paths of playlists on each destination folder
+    """
+    for destination_folder_path, path_index in path_indexes.items():
+        destination_path = get_destination_path_of_playlist_file(
+            music_root_folder_path, playlist_file_path, destination_folder_path, path_index
+        )
+        logging.info("Removing %s", str(destination_path))
+        destination_path.unlink(missing_ok=True)
+
+
+def mirror_changes(
+    changed_paths: Set[Path],
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    destination_folder_paths: List[Path],
+    options: MirrorOptions,
+    references: Dict[Path, List[Path]],
+    song_info: Dict[Path, SongInfo],
+) -> None:
+    """Mirror again the playlists affected by changes, copying their new and changed songs.
+
+    Songs are selected and resolved as a full run does, every playlist being mirrored again with a capacity. Songs
+    are compared by size and modification time at least, so that edited songs are copied again. Mirrored playlists
+    of deleted playlists are removed when pruning, songs no longer referenced are left to the next full run.
+    Args:
+        changed_paths (Set[Path]): paths of the created, written, moved or deleted files and folders
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        destination_folder_paths (List[Path]): destinations where we should mirror files
+        options (MirrorOptions): options of the mirror
+        references (Dict[Path, List[Path]]): resolved list of song path for each playlist file, existing or not,
+            updated with the affected playlists
+        song_info (Dict[Path, SongInfo]): metadata of each song, completed with the metadata of the playlists
+    """
+    path_indexes = load_path_indexes(
+        music_root_folder_path, destination_folder_paths, options.destination_profile, options.get_transcoded_suffixes()
+    )
+    affected_playlists = get_affected_playlists(changed_paths, playlist_root_folder_path, references)
+    for playlist_file in {playlist for playlist in affected_playlists if not playlist.is_file()}:
+        affected_playlists.discard(playlist_file)
+        references.pop(playlist_file, None)
+        if options.pruning.prune:
+            remove_mirrored_playlist(music_root_folder_path, playlist_file, path_indexes)
+    if not affected_playlists:
+        return
+    inventory = DirectoryInventory()
+    if options.selection.capacity_bytes is not None:
+        # the capacity is shared by every playlist, a change may select or leave out songs of any of them
+        affected_playlists.update(get_all_playlist_files(playlist_root_folder_path, inventory))
+    playlists = read_affected_playlists(
+        affected_playlists, music_root_folder_path, options, inventory, references, song_info
+    )
+    if options.sync.comparison == EXISTS:
+        options = replace(options, sync=replace(options.sync, comparison=SIZE_MTIME))
+    copy_reports = copy_songs_to_destinations(
+        {
+            destination_folder_path: get_copy_jobs(
+                playlists,
+                music_root_folder_path,
+                destination_folder_path,
+                options.transcode,
+                path_index=path_indexes[destination_folder_path],
+            )
+            for destination_folder_path in destination_folder_paths
+        },
+        {},
+        None,
+        options,
+        inventory,
+    )
+    for destination_folder_path, copy_report in copy_reports.items():
+        copy_report.log_summary()
+        write_all_playlists(
+            playlists,
+            music_root_folder_path,
+            destination_folder_path,
+            options.transcode,
+            song_info=song_info,
+            path_index=path_indexes[destination_folder_path],
+        )
+        path_indexes[destination_folder_path].save(destination_folder_path)
+    logging.info("Mirrored %d changed playlists", len(playlists))
+
+
+def watch_and_mirror(
+    music_root_folder_path: Path,
+    playlist_root_folder_path: Path,
+    destination_folder_paths: List[Path],
+    options: Optional[MirrorOptions] = None,
+    debounce_seconds: float = DEBOUNCE_SECONDS,
+    watcher: Optional[Watcher] = None,
+    stop_event: Optional[threading.Event] = None,
+) -> None:
+    """Mirror all playlists, then mirror the affected playlists again each time files change, until stopped.
+
+    A burst of changes failing to be mirrored, because a playlist cannot be read or a destination cannot be written, is
+    logged and the watch goes on.
+    Args:
+        music_root_folder_path (Path): root folder of the music repository to be mirror
+        playlist_root_folder_path (Path): root folder of the playlist files
+        destination_folder_paths (List[Path]): destinations where we should mirror files
+        options (Optional[MirrorOptions]): options of the mirror, default options if None
+        debounce_seconds (float): seconds without changes ending a burst of changes
+        watcher (Optional[Watcher]): watcher of the changes in folders, closed once stopped, see create_watcher if
+            None
+        stop_event (Optional[threading.Event]): event stopping the watch, never stopped if None
+    """
+    if options is None:
+        options = MirrorOptions()
+    if watcher is None:
+        watcher = create_watcher()
+    if stop_event is None:
+        stop_event = threading.Event()
+    song_info: Dict[Path, SongInfo] = {}
+    try:
+        references = mirror_everything(
+            music_root_folder_path, playlist_root_folder_path, destination_folder_paths, options, song_info
+        )
+        while not stop_event.is_set():
+            watcher.watch(get_watched_folders(playlist_root_folder_path, references))
+            logging.info("Watching %d playlists for changes", len(references))
+            changed_paths = wait_for_changes(watcher, debounce_seconds, stop_event)
+            try:
+                if changed_paths is None:
+                    logging.warning("Changes were lost, mirroring everything again")
+                    references = mirror_everything(
+                        music_root_folder_path, playlist_root_folder_path, destination_folder_paths, options, song_info
+                    )
+                elif changed_paths:
+                    mirror_changes(
+                        changed_paths,
+                        music_root_folder_path,
+                        playlist_root_folder_path,
+                        destination_folder_paths,
+                        options,
+                        references,
+                        song_info,
+                    )
+            except (OSError, ValueError) as error:
+                logging.error("Failed to mirror changes, waiting for the next ones: %s", error)
+    finally:
+        watcher.close()